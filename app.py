@@ -1,13 +1,29 @@
 import logging
+import math
 import os
 import time
-import threading
-import xml.etree.ElementTree as ET
-from flask import Flask, request
+import requests
+from flask import Flask, Response, request, g
 from pathlib import Path
 from config import config
-from converter import DocumentConverter
-from wecom_api import WeComAPI
+from services import (
+    get_cluster, get_converter, get_rate_limiter, get_result_cache, get_upload_store, get_wecom_api,
+    get_wecom_pipeline, warm_up
+)
+from wecom_callback import handle_message, processed_messages, MESSAGE_CACHE_TTL
+from metrics import metrics
+from preflight import PreflightError, inspect_file, save_stream
+from partial_export import ExportOptions, ExportOptionsError
+from media_cache import file_sha256
+from result_cache import CONTENT_HASH_HEADER, normalize_sha256, result_key
+from upload_session import UploadError, UPLOAD_OFFSET_HEADER
+from deadline import Deadline, DeadlineExceeded
+from cancellation import AbortableSession, ConversionCancelled, REQUEST_TIMEOUT_HEADER, client_socket, watch_request
+from cluster import CLUSTER_FORWARDED_HEADER, CLUSTER_NODE_HEADER, HOP_BY_HOP_HEADERS, PeerUnavailable
+from rate_limit import client_ip
+from scheduler import PRIORITY_INTERACTIVE
+from tracing import tracer, create_exporter, record_proxy_timing, TRACE_ID_HEADER
+from profiler import SamplingProfiler, ContinuousProfiler, ProfilerBusy, token_matches
 
 # 配置日志
 logging.basicConfig(
@@ -16,84 +32,80 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+tracer.configure(
+    service='office-converter',
+    exporter=create_exporter(config.TRACE_EXPORT),
+    sample_rate=config.TRACE_SAMPLE_RATE
+)
+
+# 采样分析：按需采样（/debug/profile）和可选的持续低频采样
+profiler = SamplingProfiler(interval=config.PROFILE_INTERVAL, max_seconds=config.PROFILE_MAX_SECONDS)
+continuous_profiler = ContinuousProfiler(
+    directory=config.PROFILE_CONTINUOUS_DIR,
+    interval=config.PROFILE_CONTINUOUS_INTERVAL,
+    period=config.PROFILE_CONTINUOUS_PERIOD
+)
+
 app = Flask(__name__)
-converter = DocumentConverter()
-wecom_api = WeComAPI()
+# 请求体超过上限时 Werkzeug 在解析表单阶段直接返回413（留1MB给multipart头部）
+app.config['MAX_CONTENT_LENGTH'] = config.MAX_FILE_SIZE + 1024 * 1024
+# 转换器、企业微信客户端和流水线在首次使用时构造（见 services.py），
+# 使用 gunicorn.conf.py 时在 master 中预加载，fork 后各 worker 共享
 
-# 用于防止重复处理的消息缓存
-processed_messages = {}
-MESSAGE_CACHE_TTL = 60  # 缓存60秒
+# 需要追踪的入口：视图函数 -> 根span名称
+TRACED_ENDPOINTS = {
+    'api_convert': 'api_convert',
+    'api_upload_chunk': 'api_upload_chunk',
+    'wecom_handler': 'wecom_handler',
+}
 
 
-def cleanup_message_cache():
-    """清理过期的消息缓存"""
-    current_time = time.time()
-    expired_keys = [
-        k for k, v in processed_messages.items() 
-        if current_time - v > MESSAGE_CACHE_TTL
-    ]
-    for key in expired_keys:
-        del processed_messages[key]
+@app.before_request
+def start_background_threads():
+    # 后台线程在首次请求时才启动（每个 worker 进程各自启动；
+    # 使用 gunicorn.conf.py 时预热已在 post_fork 中启动，这里直接返回）
+    warm_up()
+    continuous_profiler.ensure_started()
 
 
-def create_text_response(to_user: str, from_user: str, content: str) -> str:
-    """创建文本消息回复XML（明文，需要后续加密）"""
-    return f"""<xml>
-<ToUserName><![CDATA[{to_user}]]></ToUserName>
-<FromUserName><![CDATA[{from_user}]]></FromUserName>
-<CreateTime>{int(time.time())}</CreateTime>
-<MsgType><![CDATA[text]]></MsgType>
-<Content><![CDATA[{content}]]></Content>
-</xml>"""
+@app.before_request
+def start_trace():
+    """为转换入口开启根span（上游带 traceparent 时沿用上游的trace）"""
+    name = TRACED_ENDPOINTS.get(request.endpoint)
+    if name is None:
+        return
+    g.trace = tracer.span(name, parent=tracer.extract(request.headers), method=request.method,
+                          content_length=request.content_length or 0)
+    g.trace_span = g.trace.__enter__()
+    record_proxy_timing(request.headers)
 
 
-def process_document_async(from_user: str, media_id: str, file_name: str):
-    """
-    异步处理文档转换
-    
-    由于企业微信要求5秒内回复，而转换可能需要更长时间，
-    所以使用异步处理，通过应用消息接口发送结果
-    """
-    input_file = None
-    output_pdf = None
-    
-    try:
-        # 确定文件扩展名
-        file_ext = Path(file_name).suffix
-        if not file_ext:
-            file_ext = '.docx'  # 默认扩展名
-        
-        # 下载文件
-        timestamp_ms = int(time.time() * 1000)
-        input_file = os.path.join(config.TEMP_DIR, f"input_{timestamp_ms}{file_ext}")
-        wecom_api.download_media(media_id, input_file)
-        
-        # 转换为PDF
-        output_pdf = converter.convert_to_pdf(input_file)
-        
-        # 上传PDF到企业微信
-        pdf_media_id = wecom_api.upload_media(output_pdf, 'file')
-        
-        # 发送PDF文件给用户
-        success = wecom_api.send_file_message(from_user, pdf_media_id)
-        
-        if not success:
-            wecom_api.send_text_message(
-                from_user, 
-                "⚠️ PDF生成成功但发送失败，请稍后重试。"
-            )
-        
-    except Exception as e:
-        logger.error(f"处理文档失败: {str(e)}")
-        error_msg = f"❌ 转换失败: {str(e)}\n\n支持格式: Word(.doc/.docx), Excel(.xls/.xlsx), PPT(.ppt/.pptx)"
-        wecom_api.send_text_message(from_user, error_msg)
-    
-    finally:
-        # 清理临时文件
-        if input_file:
-            converter.cleanup_file(input_file)
-        if output_pdf:
-            converter.cleanup_file(output_pdf)
+@app.after_request
+def add_trace_header(response):
+    if 'trace_span' in g:
+        response.headers[TRACE_ID_HEADER] = g.trace_span.trace_id
+        g.trace_span.set(status_code=response.status_code)
+    return response
+
+
+@app.after_request
+def add_cluster_header(response):
+    # 集群模式：标明处理请求的节点（转发的请求保留负责节点返回的值）
+    cluster = get_cluster()
+    if cluster.enabled and CLUSTER_NODE_HEADER not in response.headers:
+        response.headers[CLUSTER_NODE_HEADER] = cluster.node
+    return response
+
+
+@app.teardown_request
+def end_trace(error=None):
+    if 'trace' in g:
+        trace = g.pop('trace')
+        g.pop('trace_span', None)
+        if error is not None:
+            trace.__exit__(type(error), error, error.__traceback__)
+        else:
+            trace.__exit__(None, None, None)
 
 
 @app.route('/wecom', methods=['GET', 'POST'])
@@ -116,6 +128,7 @@ def wecom_handler():
     msg_signature = request.args.get('msg_signature', '')
     timestamp = request.args.get('timestamp', '')
     nonce = request.args.get('nonce', '')
+    wecom_api = get_wecom_api()
     
     # GET请求：回调URL验证
     if request.method == 'GET':
@@ -130,143 +143,25 @@ def wecom_handler():
             return 'Verification failed', 403
     
     # POST请求：处理消息
-    try:
-        xml_data = request.data.decode('utf-8')
-        
-        # 解析外层XML获取加密内容
-        root = ET.fromstring(xml_data)
-        encrypt_elem = root.find('Encrypt')
-        if encrypt_elem is None:
-            logger.error("[ERROR] 消息中没有Encrypt字段")
-            return 'success'
-        
-        encrypt_msg = encrypt_elem.text
-        
-        # 解密消息
-        decrypted_xml = wecom_api.crypto.decrypt_message(msg_signature, timestamp, nonce, encrypt_msg)
-        
-        # ========== 关键：记录解密后的完整XML ==========
-        logger.info(f"[DEBUG] 解密后完整XML:\n{decrypted_xml}")
-        
-        # 解析解密后的XML
-        msg_root = ET.fromstring(decrypted_xml)
-        
-        # 获取消息类型
-        msg_type_elem = msg_root.find('MsgType')
-        msg_type = msg_type_elem.text if msg_type_elem is not None else 'unknown'
-        
-        logger.info(f"[DEBUG] >>>>>> 消息类型: {msg_type} <<<<<<")
-        
-        from_user = msg_root.find('FromUserName').text  # 用户的userid
-        to_user = msg_root.find('ToUserName').text      # 企业的corpid
-        msg_id = msg_root.find('MsgId')
-        msg_id = msg_id.text if msg_id is not None else str(time.time())
-        
-        logger.info(f"[DEBUG] FromUser={from_user}, ToUser={to_user}, MsgId={msg_id}")
-        
-        # 清理过期缓存
-        cleanup_message_cache()
-        
-        # 检查是否重复消息
-        if msg_id in processed_messages:
-            logger.info(f"[SKIP] 跳过重复消息: {msg_id}")
-            return 'success'
-        
-        # 标记消息已处理
-        processed_messages[msg_id] = time.time()
-        
-        # ========== 处理文件消息 ==========
-        if msg_type == 'file':
-            logger.info("[FILE] 检测到文件类型消息，开始处理...")
-            
-            media_id = msg_root.find('MediaId').text
-            
-            # 企业微信file消息可能用不同的字段名：FileName 或 Title
-            file_name = None
-            for field_name in ['FileName', 'Title', 'Name']:
-                elem = msg_root.find(field_name)
-                if elem is not None and elem.text:
-                    file_name = elem.text
-                    logger.info(f"[FILE] 从字段 {field_name} 获取文件名: {file_name}")
-                    break
-            
-            if not file_name:
-                file_name = 'document.docx'
-                logger.info(f"[FILE] 未找到文件名字段，使用默认: {file_name}")
-            
-            logger.info(f"[FILE] 收到文件: {file_name}, MediaId: {media_id}")
-            
-            # 启动异步处理线程
-            thread = threading.Thread(
-                target=process_document_async,
-                args=(from_user, media_id, file_name)
-            )
-            thread.daemon = True
-            thread.start()
-            
-            # 创建回复消息
-            reply_msg = create_text_response(from_user, to_user, "📄 正在转换您的文档，请稍候...\n预计需要5-15秒")
-            # 加密回复
-            encrypted_reply = wecom_api.crypto.encrypt_message(reply_msg, nonce, timestamp)
-            logger.info("[FILE] 已返回处理中提示，异步线程已启动")
-            return encrypted_reply
-        
-        # ========== 处理文本消息 ==========
-        elif msg_type == 'text':
-            content = msg_root.find('Content').text or ''
-            logger.info(f"[TEXT] 收到文本消息: {content}")
-            
-            if content.strip() in ['帮助', 'help', '?', '？', 'h']:
-                help_text = """📄 作业排版助手使用说明
-
-1️⃣ 直接发送Word/Excel/PPT文件
-2️⃣ 等待5-15秒，自动收到PDF
-3️⃣ 转发PDF给打印机
-
-✅ 支持格式: Word, Excel, PowerPoint
-⏱️ 转换时间: 通常5-15秒
-📱 完美还原Windows排版！"""
-                reply_msg = create_text_response(from_user, to_user, help_text)
-            else:
-                reply_msg = create_text_response(
-                    from_user, to_user, 
-                    "请发送Word/Excel文件，我会帮您转换为PDF 📄\n\n发送「帮助」查看使用说明"
-                )
-            
-            encrypted_reply = wecom_api.crypto.encrypt_message(reply_msg, nonce, timestamp)
-            return encrypted_reply
-        
-        # ========== 处理图片消息（添加日志） ==========
-        elif msg_type == 'image':
-            logger.info(f"[IMAGE] 收到图片消息，MediaId: {msg_root.find('MediaId').text if msg_root.find('MediaId') is not None else 'N/A'}")
-            reply_msg = create_text_response(
-                from_user, to_user, 
-                "请发送Word或Excel文件，我会帮您转换为PDF 📄\n\n（暂不支持图片转换）"
-            )
-            encrypted_reply = wecom_api.crypto.encrypt_message(reply_msg, nonce, timestamp)
-            return encrypted_reply
-        
-        # ========== 其他消息类型 ==========
-        else:
-            logger.info(f"[OTHER] 收到其他类型消息: {msg_type}")
-            reply_msg = create_text_response(
-                from_user, to_user, 
-                "请发送Word或Excel文件，我会帮您转换为PDF 📄"
-            )
-            encrypted_reply = wecom_api.crypto.encrypt_message(reply_msg, nonce, timestamp)
-            return encrypted_reply
-            
-    except Exception as e:
-        logger.error(f"[ERROR] 处理消息异常: {str(e)}", exc_info=True)
-        return 'success'
+    return handle_message(wecom_api, request.data, msg_signature, timestamp, nonce, get_wecom_pipeline().submit,
+                          throttle=get_rate_limiter('wecom').acquire)
 
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """健康检查接口"""
+    cluster = get_cluster()
+    if cluster.enabled:
+        return {'status': 'ok', 'service': 'wecom-doc-converter', 'cluster': cluster.stats()}
     return {'status': 'ok', 'service': 'wecom-doc-converter'}
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """指标接口（Prometheus文本格式，仅供内网抓取）"""
+    return metrics.render_prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
 @app.route('/', methods=['GET'])
 def index():
     """根路径"""
@@ -284,15 +179,238 @@ def debug_recent():
         'processed_messages_count': len(processed_messages),
         'recent_messages': list(processed_messages.keys())[-10:],  # 最近10条
         'cache_ttl': MESSAGE_CACHE_TTL,
+        'wecom_pipeline': get_wecom_pipeline().stats(),
+        'scheduler': get_converter().scheduler.stats(),
         'service_status': 'running'
     }
 
 
+@app.route('/debug/profile', methods=['GET'])
+def debug_profile():
+    """
+    调试接口：对处理本请求的 worker 进程采样 seconds 秒，返回折叠栈
+    
+    需要 X-Debug-Token 请求头与 DEBUG_TOKEN 一致（未配置令牌时关闭）。
+    gunicorn 有多个 worker 时只采样其中一个，响应头 X-Profile-Pid 标明是哪一个。
+    
+    用法:
+        curl -H "X-Debug-Token: $DEBUG_TOKEN" "http://127.0.0.1:5000/debug/profile?seconds=30" > app.folded
+        flamegraph.pl app.folded > app.svg
+    """
+    if not token_matches(config.DEBUG_TOKEN, request.headers.get('X-Debug-Token')):
+        return {'error': 'forbidden'}, 403
+    try:
+        seconds = float(request.args.get('seconds', '10'))
+        interval = float(request.args['interval']) if 'interval' in request.args else None
+    except ValueError:
+        return {'error': 'seconds/interval 必须是数字'}, 400
+    
+    try:
+        collapsed = profiler.profile(seconds, interval)
+    except ProfilerBusy as e:
+        return {'error': str(e)}, 409
+    return collapsed, 200, {
+        'Content-Type': 'text/plain; charset=utf-8',
+        'Content-Disposition': f'attachment; filename=profile-{os.getpid()}.folded',
+        'X-Profile-Pid': str(os.getpid()),
+    }
+
+
 # ========== iOS Shortcuts API ==========
 
 ALLOWED_EXTENSIONS = {'.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx'}
 
-@app.route('/api/convert', methods=['POST'])
+def send_pdf(path: str, etag: str, download_name: str, cache_status: str):
+    """
+    返回PDF：强 ETag（PDF内容的SHA-256），支持 If-None-Match（304）和 Range（206）断点续传
+    """
+    from flask import send_file
+    response = send_file(
+        path,
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=download_name,
+        conditional=True,
+        etag=etag,
+        max_age=0
+    )
+    response.headers['X-Cache'] = cache_status
+    return response
+
+
+def cached_pdf(result_key: str, download_name: str, source: str):
+    """缓存命中时返回PDF响应，否则返回None"""
+    cached = get_result_cache().get(result_key)
+    metrics.inc('conversion_result_cache_total', source=source, outcome='hit' if cached else 'miss')
+    if cached is None:
+        return None
+    logger.info(f"转换结果缓存命中[{source}]: {download_name}, {cached.size} 字节")
+    return send_pdf(str(cached.path), cached.etag, download_name, 'hit')
+
+
+# ========== 集群模式（见 cluster.py） ==========
+
+def request_budget() -> float:
+    """本次请求的截止时间：其他节点转发来的请求不超过转发方剩余的时间"""
+    budget = config.CONVERSION_DEADLINE
+    if request.headers.get(CLUSTER_FORWARDED_HEADER):
+        try:
+            budget = min(budget, float(request.headers.get(REQUEST_TIMEOUT_HEADER, '')))
+        except ValueError:
+            pass
+    return budget
+
+
+class BodyStream:
+    """带长度的请求体（requests 据此发送 Content-Length，而不是分块编码）"""
+
+    def __init__(self, stream, length: int):
+        self.stream = stream
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size: int = -1) -> bytes:
+        return self.stream.read(size)
+
+
+def peer_response(upstream: requests.Response) -> Response:
+    """其他节点的响应原样流式返回（不解压、不缓冲）"""
+    headers = [(name, value) for name, value in upstream.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS]
+    response = Response(upstream.raw.stream(64 * 1024, decode_content=False), status=upstream.status_code,
+                        headers=headers)
+    response.call_on_close(upstream.close)
+    return response
+
+
+def forward_request(node: str, method: str, path: str, key: str, deadline: Deadline, headers: dict = None, **kwargs):
+    """
+    把请求转发给集群中的其他节点，返回其响应的流式代理
+
+    客户端断开或截止时间到期时断开转发的连接，对端随之取消转换。
+
+    Raises:
+        PeerUnavailable: 对端不可用
+        DeadlineExceeded, ConversionCancelled: 见 conversion_error
+    """
+    session = AbortableSession()
+    try:
+        with tracer.span('cluster.forward', node=node, path=path) as span, \
+                watch_request(deadline, client_socket(request.environ)), \
+                deadline.cancel_event.on_set(session.abort):
+            upstream = get_cluster().request(
+                node, method, path, key, session=session,
+                headers={**tracer.inject(headers), REQUEST_TIMEOUT_HEADER: f"{deadline.remaining():.1f}"},
+                # 对端按同样的截止时间返回，多等几秒以便收到它的错误响应
+                read_timeout=deadline.remaining() + 5,
+                **kwargs
+            )
+            span.set(status_code=upstream.status_code)
+    except requests.exceptions.RequestException:
+        session.close()
+        deadline.raise_if_cancelled()
+        raise
+    except PeerUnavailable:
+        session.close()
+        raise
+    response = peer_response(upstream)
+    response.call_on_close(session.close)
+    return response
+
+
+def lookup_result(content_hash: str, options: ExportOptions, download_name: str, source: str):
+    """
+    按文档哈希查转换结果，命中时返回PDF响应，否则返回None
+
+    集群模式下结果缓存在负责该文档的节点上：本节点不负责时向负责节点查询，
+    其响应（含 304/206）原样返回；负责节点不可用时查本节点的缓存。
+    """
+    cluster = get_cluster()
+    node = cluster.route(content_hash, request.headers)
+    if node is not None:
+        params = {'sha256': content_hash, 'filename': download_name, **options.to_form()}
+        headers = {name: request.headers[name] for name in ('If-None-Match', 'Range', 'If-Range')
+                   if name in request.headers}
+        try:
+            with tracer.span('cluster.query', node=node) as span:
+                upstream = cluster.request(node, 'HEAD' if request.method == 'HEAD' else 'GET', '/api/convert',
+                                           content_hash, params=params, headers=tracer.inject(headers), read_timeout=30)
+                span.set(status_code=upstream.status_code)
+        except (PeerUnavailable, requests.exceptions.RequestException) as e:
+            logger.warning(f"向负责节点 {node} 查询转换结果失败，查询本节点缓存: {str(e)}")
+            metrics.inc('cluster_forward_total', action='query', outcome='fallback')
+        else:
+            metrics.inc('cluster_forward_total', action='query', outcome='forwarded')
+            if upstream.status_code in (200, 206, 304, 416):
+                return peer_response(upstream)
+            upstream.close()
+            return None
+    return cached_pdf(result_key(content_hash, options), download_name, source)
+
+
+def forward_conversion(node: str, input_file: str, content_hash: str, options: ExportOptions,
+                       download_name: str, deadline: Deadline):
+    """
+    把已保存的文档转发给负责节点（负责节点查缓存、转换并缓存），返回其响应
+
+    Returns:
+        负责节点的响应；负责节点不可用时返回None，由本节点转换
+
+    Raises:
+        DeadlineExceeded, ConversionCancelled: 见 conversion_error
+    """
+    filename = Path(download_name).stem + Path(input_file).suffix
+    try:
+        with open(input_file, 'rb') as f:
+            response = forward_request(
+                node, 'POST', '/api/convert', content_hash, deadline,
+                headers={CONTENT_HASH_HEADER: content_hash},
+                files={'file': (filename, f, 'application/octet-stream')},
+                data=options.to_form()
+            )
+    except PeerUnavailable as e:
+        logger.warning(f"负责节点不可用，在本节点转换: {str(e)}")
+        metrics.inc('cluster_forward_total', action='convert', outcome='fallback')
+        return None
+    metrics.inc('cluster_forward_total', action='convert', outcome='forwarded')
+    logger.info(f"已由负责节点 {node} 处理: {download_name}, 状态 {response.status_code}")
+    return response
+
+
+def forward_upload(node: str, upload_id: str):
+    """上传会话的数据只在创建它的节点上：会话请求（含分块）原样转发过去"""
+    deadline = Deadline(config.CONVERSION_DEADLINE)
+    headers = {name: request.headers[name] for name in (UPLOAD_OFFSET_HEADER, 'Content-Type', 'If-None-Match',
+                                                        'Range', 'If-Range') if name in request.headers}
+    body = BodyStream(request.stream, request.content_length or 0) if request.method in ('PATCH', 'PUT') else None
+    try:
+        response = forward_request(node, request.method, request.path, upload_id, deadline, headers=headers,
+                                   params=request.args, data=body)
+    except PeerUnavailable:
+        metrics.inc('cluster_forward_total', action='upload', outcome='unavailable')
+        return {'error': '上传会话所在的节点暂时不可用，请稍后重试', 'reason': 'node_unavailable'}, 503
+    except Exception as e:
+        return conversion_error(e, deadline)
+    metrics.inc('cluster_forward_total', action='upload', outcome='forwarded')
+    return response
+
+
+# ========== 限流（见 rate_limit.py） ==========
+
+def rate_limited():
+    """按客户端IP限流：超出时返回429响应，否则返回None（其他节点转发来的请求已在入口节点计数）"""
+    if request.headers.get(CLUSTER_FORWARDED_HEADER):
+        return None
+    wait = get_rate_limiter('api').acquire(client_ip(request.remote_addr, request.headers))
+    if not wait:
+        return None
+    retry_after = math.ceil(wait)
+    return ({'error': f'请求过于频繁，请{retry_after}秒后重试', 'reason': 'rate_limited', 'retry_after': retry_after},
+            429, {'Retry-After': str(retry_after)})
+
+
+@app.route('/api/convert', methods=['GET', 'POST'])
 def api_convert():
     """
     iOS Shortcuts 文档转换接口
@@ -303,24 +421,84 @@ def api_convert():
         - Method: POST
         - Content-Type: multipart/form-data
         - Field: 'file' (required)
+        - Field: 'pages' (可选) 页码范围，如 "1-3,5"
+        - Field: 'sheets' (可选) Excel工作表名称或序号，如 "成绩,2"
+        - Field: 'print_area' (可选) Excel打印区域，如 "A1:H40"
+        - Field: 'profile' (可选) 导出配置: standard / fast_print（更快、文件更小）
+        - Header: 'X-Content-SHA256' 或 Field: 'sha256' (可选) 文档的SHA-256，
+          之前转换过的文档直接返回缓存的PDF
+    
+    只查询缓存（不上传文件）:
+        - GET/HEAD /api/convert?sha256=<文档SHA-256>[&pages=...&sheets=...&print_area=...&profile=...&filename=...]
+        - 或不带 file 字段的 POST（哈希放在请求头或 sha256 字段）
+        - 命中返回PDF，否则404，客户端再上传文件
     
     响应:
-        - 成功: PDF 文件 (Content-Type: application/pdf)
+        - 成功: PDF 文件 (Content-Type: application/pdf)，带强 ETag，
+          支持 If-None-Match（304）和 Range（206，断点续传）；
+          X-Cache: hit/miss，X-Content-SHA256: 文档的SHA-256（重试时可直接查询）
+        - 429: 同一IP请求过于频繁（POST 按 RATE_LIMIT_API_* 限流），Retry-After 为需要等待的秒数
         - 失败: JSON 错误信息
     """
-    from flask import send_file
-    import io
+    # 截止时间从请求到达开始计算（包含上传和预检），保证在nginx超时前返回
+    deadline = Deadline(request_budget())
+    converter = get_converter()
     
     logger.info("=== iOS Shortcuts API 请求 ===")
     logger.info(f"Remote IP: {request.remote_addr}")
     
-    # 检查文件字段
-    if 'file' not in request.files:
+    # 只带哈希的查询：不需要请求体
+    if request.method in ('GET', 'HEAD'):
+        try:
+            claimed_hash = normalize_sha256(request.args.get('sha256'))
+            options = ExportOptions.from_form(request.args)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+        if not claimed_hash:
+            return {'error': '请提供文档的 sha256', 'field': 'sha256'}, 400
+        download_name = Path(request.args.get('filename') or 'document').stem + '.pdf'
+        return lookup_result(claimed_hash, options, download_name, 'query') or (
+            {'error': '没有该文档的转换结果，请上传文件', 'reason': 'not_cached'}, 404
+        )
+    
+    # 限流：在读取请求体之前拒绝
+    response = rate_limited()
+    if response is not None:
+        return response
+    
+    # 声明的长度已超过上限时不读取请求体
+    if request.content_length and request.content_length > app.config['MAX_CONTENT_LENGTH']:
+        logger.error(f"文件过大: {request.content_length} 字节")
+        return {'error': f'文件超过大小限制({config.MAX_FILE_SIZE // (1024 * 1024)}MB)', 'reason': 'too_large'}, 413
+    
+    # 检查文件字段（首次访问 request.files 时 Werkzeug 解析并落盘 multipart 请求体）
+    with tracer.span('upload.parse'):
+        files = request.files
+    
+    # 部分转换参数和客户端提供的文档哈希
+    try:
+        options = ExportOptions.from_form(request.form)
+        claimed_hash = normalize_sha256(request.headers.get(CONTENT_HASH_HEADER) or request.form.get('sha256'))
+    except ValueError as e:
+        logger.error(f"请求参数错误: {str(e)}")
+        return {'error': str(e)}, 400
+    
+    file = files.get('file')
+    filename = file.filename if file else (request.form.get('filename') or 'document')
+    download_name = Path(filename).stem + '.pdf'
+    
+    # 客户端提供了哈希：命中缓存时不再保存、预检和转换
+    if claimed_hash:
+        response = lookup_result(claimed_hash, options, download_name, 'claimed')
+        if response is not None:
+            return response
+    
+    if file is None:
+        if claimed_hash:
+            return {'error': '没有该文档的转换结果，请上传文件', 'reason': 'not_cached'}, 404
         logger.error("请求中没有 'file' 字段")
         return {'error': '请上传文件', 'field': 'file'}, 400
     
-    file = request.files['file']
-    
     if file.filename == '':
         logger.error("文件名为空")
         return {'error': '文件名为空'}, 400
@@ -335,49 +513,285 @@ def api_convert():
         }, 400
     
     input_file = None
-    output_pdf = None
     
     try:
         # 保存上传的文件
         timestamp_ms = int(time.time() * 1000)
         input_file = os.path.join(config.TEMP_DIR, f"api_input_{timestamp_ms}{file_ext}")
-        file.save(input_file)
-        logger.info(f"文件已保存: {input_file}")
+        with tracer.span('upload.save') as span:
+            size, content_hash = save_stream(file.stream, input_file)
+            span.set(size=size)
+        logger.info(f"文件已保存: {input_file}, 大小: {size} 字节")
+        if claimed_hash and claimed_hash != content_hash:
+            logger.warning(f"客户端提供的sha256与文件内容不符: {claimed_hash}")
         
-        # 转换为 PDF
-        logger.info("开始转换...")
-        output_pdf = converter.convert_to_pdf(input_file)
-        logger.info(f"转换完成: {output_pdf}")
-        
-        # 读取 PDF 到内存
-        with open(output_pdf, 'rb') as f:
-            pdf_data = f.read()
-        
-        # 生成输出文件名
-        output_filename = Path(file.filename).stem + '.pdf'
-        
-        logger.info(f"返回 PDF: {output_filename}, 大小: {len(pdf_data)} 字节")
-        
-        # 返回 PDF 流
-        return send_file(
-            io.BytesIO(pdf_data),
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=output_filename
-        )
+        # 重传的文档（客户端没带哈希）：按服务端计算的哈希查缓存
+        return convert_saved(input_file, content_hash, options, download_name, deadline,
+                             lookup_cache=claimed_hash != content_hash)
         
     except Exception as e:
-        logger.error(f"转换失败: {str(e)}", exc_info=True)
-        return {'error': f'转换失败: {str(e)}'}, 500
+        return conversion_error(e, deadline)
         
     finally:
         # 清理临时文件
         if input_file:
             converter.cleanup_file(input_file)
+
+
+def convert_saved(input_file: str, content_hash: str, options: ExportOptions, download_name: str,
+                  deadline: Deadline, lookup_cache: bool = True):
+    """
+    转换已保存的文档并返回PDF（/api/convert 和分块上传共用，调用方负责清理 input_file）
+    
+    Raises:
+        PreflightError, DeadlineExceeded, ConversionCancelled, ExportOptionsError: 见 conversion_error
+    """
+    converter = get_converter()
+    key = result_key(content_hash, options)
+    # 集群模式：由负责该文档的节点查缓存、转换并缓存
+    node = get_cluster().route(content_hash, request.headers)
+    if node is not None:
+        response = forward_conversion(node, input_file, content_hash, options, download_name, deadline)
+        if response is not None:
+            return response
+    if lookup_cache:
+        response = cached_pdf(key, download_name, 'upload')
+        if response is not None:
+            response.headers[CONTENT_HASH_HEADER] = content_hash
+            return response
+    
+    output_pdf = None
+    try:
+        # 预检：识别真实格式、加密和损坏的文件，毫秒级拒绝
+        with tracer.span('preflight') as span:
+            preflight = inspect_file(input_file)
+            span.set(**preflight.to_dict())
+        logger.info(f"预检通过: {preflight.to_dict()}")
+        
+        # 转换为 PDF
+        logger.info(f"开始转换... 部分转换参数: {options.to_dict()}" if not options.is_empty else "开始转换...")
+        # 用户正在等待：按交互优先级调度；转换期间检测客户端断开和截止时间，
+        # 发生时取消排队、终止soffice进程树、断开Windows请求
+        with watch_request(deadline, client_socket(request.environ)):
+            output_pdf = converter.convert_to_pdf(
+                input_file, preflight=preflight, options=options, deadline=deadline, priority=PRIORITY_INTERACTIVE
+            )
+        logger.info(f"转换完成: {output_pdf}")
+        
+        # 存入结果缓存并从缓存返回（缓存关闭或写入失败时直接返回生成的PDF，
+        # send_file 已打开文件，随后清理不影响发送）
+        with tracer.span('result_cache.put'):
+            cached = get_result_cache().put(key, output_pdf)
+        if cached is not None:
+            pdf_path, etag, pdf_size = str(cached.path), cached.etag, cached.size
+        else:
+            pdf_path, etag, pdf_size = output_pdf, file_sha256(output_pdf), os.path.getsize(output_pdf)
+        
+        logger.info(f"返回 PDF: {download_name}, 大小: {pdf_size} 字节")
+        response = send_pdf(pdf_path, etag, download_name, 'miss')
+        response.headers[CONTENT_HASH_HEADER] = content_hash
+        return response
+    finally:
         if output_pdf:
             converter.cleanup_file(output_pdf)
 
 
+def conversion_error(e: Exception, deadline: Deadline):
+    """转换过程中的异常 -> JSON错误响应"""
+    if isinstance(e, PreflightError):
+        return {'error': str(e), 'reason': e.reason}, e.status_code
+    if isinstance(e, DeadlineExceeded):
+        return {'error': str(e), 'reason': 'deadline_exceeded'}, 504
+    if isinstance(e, ConversionCancelled):
+        # 客户端已断开，响应不会被接收（499 与 nginx 的日志约定一致）
+        return {'error': str(e), 'reason': deadline.cancel_reason}, 499
+    if isinstance(e, ExportOptionsError):
+        # 部分转换参数与文档内容不符（如工作表不存在），或可用的引擎无法满足
+        logger.error(f"转换参数错误: {str(e)}")
+        return {'error': str(e)}, e.status_code
+    logger.error(f"转换失败: {str(e)}", exc_info=e)
+    return {'error': f'转换失败: {str(e)}'}, 500
+
+
+def upload_error(e: UploadError):
+    headers = {UPLOAD_OFFSET_HEADER: str(e.offset)} if e.offset is not None else {}
+    return e.to_dict(), e.status_code, headers
+
+
+@app.route('/api/uploads', methods=['POST'])
+def api_upload_create():
+    """
+    创建断点续传上传会话（大文件在移动网络下分块上传，见 upload_session.py）
+    
+    请求（表单、JSON 或查询参数）:
+        - 'filename': 原始文件名（决定文件类型）
+        - 'size': 文件总字节数
+        - 'pages' / 'sheets' / 'print_area' / 'profile' (可选) 部分转换参数和导出配置，同 /api/convert
+        - 'sha256' 或 Header 'X-Content-SHA256' (可选) 文档的SHA-256，
+          之前转换过时直接返回PDF，不创建会话
+    
+    响应:
+        - 201: {upload_id, url, offset, size, chunk_size, expires_in}，Location 头为分块上传地址
+        - 200: 缓存命中时直接返回PDF
+        - 429: 同一IP请求过于频繁（与 /api/convert 共用限额）
+    """
+    response = rate_limited()
+    if response is not None:
+        return response
+    body = request.get_json(silent=True)
+    fields = {**request.values.to_dict(), **(body if isinstance(body, dict) else {})}
+    fields = {key: str(value) for key, value in fields.items() if value is not None}
+    filename = str(fields.get('filename') or '')
+    file_ext = Path(filename).suffix.lower()
+    if file_ext not in ALLOWED_EXTENSIONS:
+        logger.error(f"不支持的文件类型: {file_ext}")
+        return {'error': f'不支持的文件类型: {file_ext}', 'allowed': list(ALLOWED_EXTENSIONS)}, 400
+    try:
+        size = int(fields.get('size') or 0)
+        options = ExportOptions.from_form(fields)
+        claimed_hash = normalize_sha256(request.headers.get(CONTENT_HASH_HEADER) or fields.get('sha256'))
+    except ValueError as e:
+        logger.error(f"请求参数错误: {str(e)}")
+        return {'error': str(e)}, 400
+    
+    if claimed_hash:
+        response = lookup_result(claimed_hash, options, Path(filename).stem + '.pdf', 'claimed')
+        if response is not None:
+            return response
+    
+    try:
+        # 集群模式：会话ID由本节点负责，其他节点收到该会话的分块时转发到这里
+        session = get_upload_store().create(filename, size, {**fields, 'sha256': claimed_hash},
+                                            owns=get_cluster().is_local)
+    except UploadError as e:
+        return upload_error(e)
+    url = f"/api/uploads/{session.upload_id}"
+    return {
+        **session.to_dict(),
+        'url': url,
+        'chunk_size': config.UPLOAD_CHUNK_SIZE_MB * 1024 * 1024,
+        'expires_in': config.UPLOAD_SESSION_TTL,
+    }, 201, {'Location': url, UPLOAD_OFFSET_HEADER: '0'}
+
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'DELETE'])
+def api_upload_status(upload_id: str):
+    """
+    查询上传进度（GET/HEAD，断开后据 offset 续传）或放弃上传（DELETE）
+    """
+    node = get_cluster().route(upload_id, request.headers, fallback=False)
+    if node is not None:
+        return forward_upload(node, upload_id)
+    store = get_upload_store()
+    try:
+        session = store.get(upload_id)
+    except UploadError as e:
+        return upload_error(e)
+    if request.method == 'DELETE':
+        store.delete(upload_id)
+        return '', 204
+    return session.to_dict(), 200, {UPLOAD_OFFSET_HEADER: str(session.offset), 'Cache-Control': 'no-store'}
+
+
+@app.route('/api/uploads/<upload_id>', methods=['PATCH', 'PUT'])
+def api_upload_chunk(upload_id: str):
+    """
+    上传一个分块
+    
+    请求:
+        - Header 'Upload-Offset' 或查询参数 'offset': 分块的起始位置，必须等于已收到的字节数
+        - Body: 分块的原始字节（不是表单）
+    
+    响应:
+        - 未收齐: {upload_id, offset, size, complete: false}
+        - 收齐: 开始转换，返回PDF（同 /api/convert）；转换失败时可以发送一个
+          offset 等于 size 的空分块重试，已转换成功的会话重试时直接返回PDF
+        - 409: 偏移量不符（响应中的 offset 为服务器已收到的字节数），或该会话正在转换（reason 为 busy）
+    """
+    node = get_cluster().route(upload_id, request.headers, fallback=False)
+    if node is not None:
+        return forward_upload(node, upload_id)
+    deadline = Deadline(request_budget())
+    store = get_upload_store()
+    try:
+        offset = int(request.headers.get(UPLOAD_OFFSET_HEADER) or request.args.get('offset') or -1)
+    except ValueError:
+        offset = -1
+    if offset < 0:
+        return {'error': f'请在 {UPLOAD_OFFSET_HEADER} 请求头中提供分块偏移量', 'field': 'offset'}, 400
+    
+    try:
+        session = store.get(upload_id)
+        options = ExportOptions.from_form(session.fields)
+        download_name = Path(session.filename).stem + '.pdf'
+        # 已转换成功的会话（之前的响应没有送达）：从结果缓存返回
+        if session.complete:
+            return completed_upload(session, options, download_name)
+        with tracer.span('upload.chunk', offset=offset) as span:
+            with store.append(upload_id, offset) as writer:
+                for chunk in iter(lambda: request.stream.read(1024 * 1024), b''):
+                    writer.write(chunk)
+            span.set(size=writer.written)
+    except UploadError as e:
+        return upload_error(e)
+    except ExportOptionsError as e:
+        return {'error': str(e)}, e.status_code
+    
+    if writer.offset < session.size:
+        return session.to_dict(), 200, {UPLOAD_OFFSET_HEADER: str(writer.offset)}
+    
+    # 最后一个分块：收齐后开始转换
+    try:
+        with store.converting(upload_id) as session:
+            if session.complete:
+                # 同时提交的另一个请求刚刚转换完成
+                return completed_upload(session, options, download_name)
+            return convert_upload(session, options, download_name, deadline)
+    except UploadError as e:
+        return upload_error(e)
+
+
+def completed_upload(session, options: ExportOptions, download_name: str):
+    """已转换成功的上传会话：从结果缓存返回PDF，已过期时返回410"""
+    response = lookup_result(session.content_hash, options, download_name, 'upload')
+    if response is not None:
+        response.headers[CONTENT_HASH_HEADER] = session.content_hash
+        return response
+    return {'error': '转换结果已过期，请重新上传', 'reason': 'not_cached'}, 410
+
+
+def convert_upload(session, options: ExportOptions, download_name: str, deadline: Deadline):
+    """
+    转换已收齐的上传会话（调用方持有该会话的转换锁）
+
+    每次尝试使用独立的输入文件，清理时不会删掉其他请求正在转换的文件。
+    """
+    logger.info(f"=== 分块上传完成，开始转换: {session.upload_id}, {session.filename} ===")
+    store = get_upload_store()
+    converter = get_converter()
+    timestamp_ms = int(time.time() * 1000)
+    input_file = os.path.join(config.TEMP_DIR,
+                              f"api_upload_{session.upload_id}_{timestamp_ms}{Path(session.filename).suffix.lower()}")
+    try:
+        store.link_data(session, input_file)
+        content_hash = file_sha256(input_file)
+        claimed_hash = session.fields.get('sha256')
+        if claimed_hash and claimed_hash != content_hash:
+            logger.warning(f"客户端提供的sha256与文件内容不符: {claimed_hash}")
+        response = convert_saved(input_file, content_hash, options, download_name, deadline)
+        # 集群模式下由负责节点转换时，失败以错误响应返回：保留会话数据以便重试
+        if response.status_code < 400:
+            store.finish(session, content_hash)
+        return response
+    except PreflightError as e:
+        # 文件本身无法转换，重试没有意义
+        store.delete(session.upload_id, outcome='rejected')
+        return conversion_error(e, deadline)
+    except Exception as e:
+        return conversion_error(e, deadline)
+    finally:
+        converter.cleanup_file(input_file)
+
 if __name__ == '__main__':
     # 确保临时目录存在
     os.makedirs(config.TEMP_DIR, exist_ok=True)
@@ -0,0 +1,803 @@
+"""
+asyncio 服务模式（可选）
+
+Flask 模式（app.py）下每个请求占用一个 gunicorn 线程：2 个 worker × 4 线程
+最多同时处理 8 个请求，手机慢速上传和等待企业微信接口都会占住线程。
+这里用 Starlette 提供同样的接口，请求在事件循环中处理：
+
+- 上传的请求体由事件循环接收，慢速上传不占线程
+- 企业微信接口、Windows 转换服务使用 httpx 异步请求
+- 预检、哈希等阻塞文件操作在有界线程池（ASGI_BLOCKING_THREADS）中运行，
+  LibreOffice 子进程在大小等于调度容量的线程池中运行
+- 集群模式（cluster.py）下转发给其他节点的请求同样使用 httpx 异步请求
+
+依赖见 asgi_requirements.txt。运行:
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi_app:app
+或开发时:
+    uvicorn asgi_app:app --port 5000
+
+Flask 模式不受影响，两种模式共用配置、转换器、调度器和企业微信回调处理逻辑。
+"""
+
+import os
+import math
+import time
+import asyncio
+import logging
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.datastructures import MutableHeaders, UploadFile
+from starlette.middleware import Middleware
+from starlette.requests import ClientDisconnect, Request
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from config import config
+from metrics import metrics
+from preflight import PreflightError, inspect_file, save_stream
+from partial_export import ExportOptions, ExportOptionsError
+from deadline import Deadline, DeadlineExceeded
+from cancellation import ConversionCancelled, CANCEL_CLIENT_DISCONNECTED, CANCEL_DEADLINE, REQUEST_TIMEOUT_HEADER
+from cluster import CLUSTER_FORWARDED_HEADER, CLUSTER_NODE_HEADER, HOP_BY_HOP_HEADERS, PeerUnavailable
+from rate_limit import client_ip
+from scheduler import PRIORITY_INTERACTIVE
+from services import (
+    get_cluster, get_converter, get_rate_limiter, get_result_cache, get_upload_store, get_wecom_api, warm_up
+)
+from media_cache import file_sha256
+from result_cache import CONTENT_HASH_HEADER, etag_matches, normalize_sha256, result_key
+from upload_session import UploadError, UPLOAD_OFFSET_HEADER
+from tracing import tracer, create_exporter, record_proxy_timing, TRACE_ID_HEADER
+from wecom_callback import handle_message
+from async_converter import AsyncConverter, run_blocking
+from wecom_async import AsyncWeComAPI, AsyncWeComPipeline
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+tracer.configure(
+    service='office-converter',
+    exporter=create_exporter(config.TRACE_EXPORT),
+    sample_rate=config.TRACE_SAMPLE_RATE
+)
+
+ALLOWED_EXTENSIONS = {'.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx'}
+MAX_CONTENT_LENGTH = config.MAX_FILE_SIZE + 1024 * 1024
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: Starlette):
+    # 在 worker 进程的事件循环中创建异步客户端和线程池（fork 之后）
+    warm_up()
+    blocking = ThreadPoolExecutor(max_workers=config.ASGI_BLOCKING_THREADS, thread_name_prefix='asgi-blocking')
+    converter = AsyncConverter(get_converter())
+    wecom_api = AsyncWeComAPI(get_wecom_api(), blocking)
+    app.state.blocking = blocking
+    app.state.converter = converter
+    app.state.wecom_api = wecom_api
+    app.state.pipeline = AsyncWeComPipeline(wecom_api, converter, blocking)
+    # 集群模式下转发给其他节点的请求（节点之间复用连接）
+    app.state.peers = httpx.AsyncClient(timeout=None)
+    logger.info(f"asyncio 服务模式已启动: pid {os.getpid()}")
+    try:
+        yield
+    finally:
+        await wecom_api.aclose()
+        await converter.aclose()
+        await app.state.peers.aclose()
+        blocking.shutdown(wait=False)
+
+
+class ClusterNodeHeader:
+    """集群模式：响应头标明处理请求的节点（转发的请求保留负责节点返回的值）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        cluster = get_cluster()
+        if scope['type'] != 'http' or not cluster.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_node(message):
+            if message['type'] == 'http.response.start':
+                headers = MutableHeaders(scope=message)
+                if CLUSTER_NODE_HEADER not in headers:
+                    headers[CLUSTER_NODE_HEADER] = cluster.node
+            await send(message)
+
+        await self.app(scope, receive, send_with_node)
+
+
+@contextlib.contextmanager
+def root_span(request: Request, name: str):
+    """入口的根span（上游带 traceparent 时沿用上游的trace）"""
+    with tracer.span(name, parent=tracer.extract(request.headers), method=request.method,
+                     content_length=int(request.headers.get('content-length') or 0)) as span:
+        record_proxy_timing(request.headers)
+        yield span
+
+
+def traced(response: Response, span) -> Response:
+    span.set(status_code=response.status_code)
+    response.headers[TRACE_ID_HEADER] = span.trace_id
+    return response
+
+
+async def wait_disconnect(request: Request):
+    """请求体读完之后，下一条 ASGI 消息只会是 http.disconnect（客户端断开）"""
+    while (await request.receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def watch_request(request: Request, deadline: Deadline):
+    """等到客户端断开或截止时间到期，取消 deadline"""
+    try:
+        await asyncio.wait_for(wait_disconnect(request), timeout=deadline.remaining())
+    except asyncio.TimeoutError:
+        deadline.cancel(CANCEL_DEADLINE)
+    else:
+        deadline.cancel(CANCEL_CLIENT_DISCONNECTED)
+
+
+async def run_cancellable(request: Request, deadline: Deadline, coro):
+    """
+    运行 coro，客户端断开或截止时间到期时取消它
+
+    Raises:
+        DeadlineExceeded: 截止时间到期
+        ConversionCancelled: 客户端断开
+    """
+    task = asyncio.ensure_future(coro)
+    watcher = asyncio.ensure_future(watch_request(request, deadline))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError, ConversionCancelled, DeadlineExceeded):
+                await task
+    if task.cancelled():
+        deadline.raise_if_cancelled()
+    return task.result()
+
+
+async def health_check(request: Request):
+    """健康检查接口"""
+    cluster = get_cluster()
+    if cluster.enabled:
+        return JSONResponse({'status': 'ok', 'service': 'wecom-doc-converter', 'mode': 'asyncio',
+                             'cluster': cluster.stats()})
+    return JSONResponse({'status': 'ok', 'service': 'wecom-doc-converter', 'mode': 'asyncio'})
+
+
+async def metrics_endpoint(request: Request):
+    """指标接口（Prometheus文本格式，仅供内网抓取）"""
+    return PlainTextResponse(metrics.render_prometheus(), media_type='text/plain; version=0.0.4')
+
+
+async def wecom_handler(request: Request):
+    """企业微信消息处理器（回调处理逻辑见 wecom_callback.py）"""
+    with root_span(request, 'wecom_handler') as span:
+        response = await _wecom_handler(request)
+        return traced(response, span)
+
+
+async def _wecom_handler(request: Request) -> Response:
+    logger.info(f"收到企业微信回调: Method={request.method}, Remote IP: {request.client.host if request.client else ''}")
+    msg_signature = request.query_params.get('msg_signature', '')
+    timestamp = request.query_params.get('timestamp', '')
+    nonce = request.query_params.get('nonce', '')
+    wecom_api = get_wecom_api()
+
+    # GET请求：回调URL验证
+    if request.method == 'GET':
+        echostr = request.query_params.get('echostr', '')
+        try:
+            reply_echostr = wecom_api.crypto.verify_url(msg_signature, timestamp, nonce, echostr)
+            logger.info("[SUCCESS] 企业微信回调URL验证成功")
+            return PlainTextResponse(reply_echostr)
+        except Exception as e:
+            logger.error(f"[ERROR] 企业微信回调URL验证失败: {str(e)}")
+            return PlainTextResponse('Verification failed', status_code=403)
+
+    # POST请求：解密和XML解析只占用少量CPU，在事件循环中直接处理
+    body = await request.body()
+    reply = handle_message(wecom_api, body, msg_signature, timestamp, nonce, request.app.state.pipeline.submit,
+                           throttle=get_rate_limiter('wecom').acquire)
+    return PlainTextResponse(reply)
+
+
+async def api_convert(request: Request):
+    """
+    iOS Shortcuts 文档转换接口（请求和响应格式同 app.py 的 /api/convert）
+    """
+    # 截止时间从请求到达开始计算（包含上传和预检），保证在nginx超时前返回
+    deadline = Deadline(request_budget(request))
+    with root_span(request, 'api_convert') as span:
+        response = await _api_convert(request, deadline)
+        return traced(response, span)
+
+
+def error(message: str, status_code: int, **extra) -> JSONResponse:
+    return JSONResponse({'error': message, **extra}, status_code=status_code)
+
+
+def pdf_response(request: Request, path: str, etag: str, download_name: str, cache_status: str,
+                 headers: dict = None, background: BackgroundTask = None) -> Response:
+    """
+    返回PDF：强 ETag（PDF内容的SHA-256），支持 If-None-Match（304）和 Range（206）断点续传
+    """
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache', 'X-Cache': cache_status, **(headers or {})}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers, background=background)
+    # FileResponse 自行处理 Range / If-Range
+    return FileResponse(path, media_type='application/pdf', filename=download_name,
+                        headers=headers, background=background)
+
+
+async def cached_pdf(request: Request, key: str, download_name: str, source: str,
+                     headers: dict = None, background: BackgroundTask = None) -> Response:
+    """缓存命中时返回PDF响应，否则返回None"""
+    cached = await run_blocking(request.app.state.blocking, get_result_cache().get, key)
+    metrics.inc('conversion_result_cache_total', source=source, outcome='hit' if cached else 'miss')
+    if cached is None:
+        return None
+    logger.info(f"转换结果缓存命中[{source}]: {download_name}, {cached.size} 字节")
+    return pdf_response(request, str(cached.path), cached.etag, download_name, 'hit', headers, background)
+
+
+# ========== 集群模式（见 cluster.py，逻辑同 app.py） ==========
+
+def request_budget(request: Request) -> float:
+    """本次请求的截止时间：其他节点转发来的请求不超过转发方剩余的时间"""
+    budget = config.CONVERSION_DEADLINE
+    if request.headers.get(CLUSTER_FORWARDED_HEADER):
+        try:
+            budget = min(budget, float(request.headers.get(REQUEST_TIMEOUT_HEADER, '')))
+        except ValueError:
+            pass
+    return budget
+
+
+def peer_response(upstream: httpx.Response, headers: dict = None) -> Response:
+    """其他节点的响应原样流式返回（不解压、不缓冲），发送完成后关闭连接"""
+    headers = {**{name: value for name, value in upstream.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS},
+               **(headers or {})}
+    return StreamingResponse(upstream.aiter_raw(64 * 1024), status_code=upstream.status_code, headers=headers,
+                             background=BackgroundTask(upstream.aclose))
+
+
+async def peer_request(request: Request, node: str, method: str, path: str, key: str, read_timeout: float = None,
+                       headers: dict = None, **kwargs) -> httpx.Response:
+    """
+    向其他节点发送请求（流式，同 Cluster.request，调用方负责关闭响应）
+
+    Raises:
+        PeerUnavailable: 连接失败（该节点在 cooldown 秒内不再被选中）
+    """
+    cluster = get_cluster()
+    client = request.app.state.peers
+    upstream_request = client.build_request(
+        method, cluster.url(node, path), headers=cluster.forward_headers(key, headers),
+        timeout=httpx.Timeout(read_timeout, connect=cluster.connect_timeout), **kwargs
+    )
+    try:
+        response = await client.send(upstream_request, stream=True)
+    except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError) as e:
+        raise cluster.peer_failed(node, e) from e
+    cluster.mark_up(node)
+    return response
+
+
+async def forward_request(request: Request, node: str, method: str, path: str, key: str, deadline: Deadline,
+                          headers: dict = None, **kwargs) -> Response:
+    """
+    把请求转发给集群中的其他节点，返回其响应的流式代理
+
+    客户端断开或截止时间到期时取消请求（断开转发的连接），对端随之取消转换。
+    请求体已经读完时才能使用（检测客户端断开需要读取 ASGI 消息）。
+
+    Raises:
+        PeerUnavailable: 对端不可用
+        DeadlineExceeded, ConversionCancelled: 见 conversion_error
+    """
+    with tracer.span('cluster.forward', node=node, path=path) as span:
+        upstream = await run_cancellable(request, deadline, peer_request(
+            request, node, method, path, key,
+            # 对端按同样的截止时间返回，多等几秒以便收到它的错误响应
+            read_timeout=deadline.remaining() + 5,
+            headers={**tracer.inject(headers), REQUEST_TIMEOUT_HEADER: f"{deadline.remaining():.1f}"},
+            **kwargs
+        ))
+        span.set(status_code=upstream.status_code)
+    return peer_response(upstream)
+
+
+async def lookup_result(request: Request, content_hash: str, options: ExportOptions, download_name: str,
+                        source: str, headers: dict = None) -> Response:
+    """
+    按文档哈希查转换结果，命中时返回PDF响应，否则返回None
+
+    集群模式下结果缓存在负责该文档的节点上：本节点不负责时向负责节点查询，
+    其响应（含 304/206）原样返回；负责节点不可用时查本节点的缓存。
+    """
+    cluster = get_cluster()
+    node = cluster.route(content_hash, request.headers)
+    if node is not None:
+        params = {'sha256': content_hash, 'filename': download_name, **options.to_form()}
+        query_headers = {name: request.headers[name] for name in ('If-None-Match', 'Range', 'If-Range')
+                         if name in request.headers}
+        try:
+            with tracer.span('cluster.query', node=node) as span:
+                upstream = await peer_request(request, node, 'HEAD' if request.method == 'HEAD' else 'GET',
+                                              '/api/convert', content_hash, read_timeout=30, params=params,
+                                              headers=tracer.inject(query_headers))
+                span.set(status_code=upstream.status_code)
+        except (PeerUnavailable, httpx.HTTPError) as e:
+            logger.warning(f"向负责节点 {node} 查询转换结果失败，查询本节点缓存: {str(e)}")
+            metrics.inc('cluster_forward_total', action='query', outcome='fallback')
+        else:
+            metrics.inc('cluster_forward_total', action='query', outcome='forwarded')
+            if upstream.status_code in (200, 206, 304, 416):
+                return peer_response(upstream, headers)
+            await upstream.aclose()
+            return None
+    return await cached_pdf(request, result_key(content_hash, options), download_name, source, headers)
+
+
+async def forward_conversion(request: Request, node: str, input_file: str, content_hash: str,
+                             options: ExportOptions, download_name: str, deadline: Deadline) -> Response:
+    """
+    把已保存的文档转发给负责节点（负责节点查缓存、转换并缓存），返回其响应
+
+    Returns:
+        负责节点的响应；负责节点不可用时返回None，由本节点转换
+
+    Raises:
+        DeadlineExceeded, ConversionCancelled: 见 conversion_error
+    """
+    filename = Path(download_name).stem + Path(input_file).suffix
+    try:
+        with open(input_file, 'rb') as f:
+            response = await forward_request(
+                request, node, 'POST', '/api/convert', content_hash, deadline,
+                headers={CONTENT_HASH_HEADER: content_hash},
+                files={'file': (filename, f, 'application/octet-stream')},
+                data=options.to_form()
+            )
+    except PeerUnavailable as e:
+        logger.warning(f"负责节点不可用，在本节点转换: {str(e)}")
+        metrics.inc('cluster_forward_total', action='convert', outcome='fallback')
+        return None
+    metrics.inc('cluster_forward_total', action='convert', outcome='forwarded')
+    logger.info(f"已由负责节点 {node} 处理: {download_name}, 状态 {response.status_code}")
+    return response
+
+
+async def forward_upload(request: Request, node: str, upload_id: str) -> Response:
+    """
+    上传会话的数据只在创建它的节点上：会话请求（含分块）原样转发过去
+
+    分块的请求体边接收边转发；最后一个分块由对端转换，等待期间不检测客户端断开，
+    由对端按转发的截止时间返回。
+    """
+    deadline = Deadline(request_budget(request))
+    headers = {name: request.headers[name] for name in (UPLOAD_OFFSET_HEADER, 'Content-Type', 'Content-Length',
+                                                        'If-None-Match', 'Range', 'If-Range')
+               if name in request.headers}
+    body = request.stream() if request.method in ('PATCH', 'PUT') else None
+    try:
+        with tracer.span('cluster.forward', node=node, path=request.url.path) as span:
+            upstream = await peer_request(
+                request, node, request.method, request.url.path, upload_id,
+                read_timeout=deadline.remaining() + 5,
+                headers={**tracer.inject(headers), REQUEST_TIMEOUT_HEADER: f"{deadline.remaining():.1f}"},
+                params=request.query_params, content=body
+            )
+            span.set(status_code=upstream.status_code)
+    except PeerUnavailable:
+        metrics.inc('cluster_forward_total', action='upload', outcome='unavailable')
+        return error('上传会话所在的节点暂时不可用，请稍后重试', 503, reason='node_unavailable')
+    except ClientDisconnect:
+        return error('客户端已断开', 499, reason=CANCEL_CLIENT_DISCONNECTED)
+    except httpx.TimeoutException:
+        return error(f'转换超时：已用时{deadline.elapsed():.0f}秒', 504, reason='deadline_exceeded')
+    except httpx.HTTPError as e:
+        return conversion_error(e, deadline)
+    metrics.inc('cluster_forward_total', action='upload', outcome='forwarded')
+    return peer_response(upstream)
+
+
+# ========== 限流（见 rate_limit.py） ==========
+
+def rate_limited(request: Request) -> Response:
+    """按客户端IP限流：超出时返回429响应，否则返回None（其他节点转发来的请求已在入口节点计数）"""
+    if request.headers.get(CLUSTER_FORWARDED_HEADER):
+        return None
+    remote_addr = request.client.host if request.client else ''
+    wait = get_rate_limiter('api').acquire(client_ip(remote_addr, request.headers))
+    if not wait:
+        return None
+    retry_after = math.ceil(wait)
+    return JSONResponse({'error': f'请求过于频繁，请{retry_after}秒后重试', 'reason': 'rate_limited',
+                         'retry_after': retry_after}, status_code=429, headers={'Retry-After': str(retry_after)})
+
+
+async def _api_convert(request: Request, deadline: Deadline) -> Response:
+    state = request.app.state
+    logger.info("=== iOS Shortcuts API 请求（asyncio）===")
+
+    # 只带哈希的查询：不需要请求体
+    if request.method in ('GET', 'HEAD'):
+        try:
+            claimed_hash = normalize_sha256(request.query_params.get('sha256'))
+            options = ExportOptions.from_form(request.query_params)
+        except ValueError as e:
+            return error(str(e), 400)
+        if not claimed_hash:
+            return error('请提供文档的 sha256', 400, field='sha256')
+        download_name = Path(request.query_params.get('filename') or 'document').stem + '.pdf'
+        return await lookup_result(request, claimed_hash, options, download_name, 'query') or \
+            error('没有该文档的转换结果，请上传文件', 404, reason='not_cached')
+
+    # 限流：在读取请求体之前拒绝
+    response = rate_limited(request)
+    if response is not None:
+        return response
+
+    # 声明的长度已超过上限时不读取请求体
+    content_length = int(request.headers.get('content-length') or 0)
+    if content_length > MAX_CONTENT_LENGTH:
+        logger.error(f"文件过大: {content_length} 字节")
+        return error(f'文件超过大小限制({config.MAX_FILE_SIZE // (1024 * 1024)}MB)', 413, reason='too_large')
+
+    # 接收并解析 multipart 请求体（大文件由 python-multipart 落盘到临时文件）
+    try:
+        with tracer.span('upload.parse'):
+            form = await request.form(max_files=1)
+    except ClientDisconnect:
+        deadline.cancel(CANCEL_CLIENT_DISCONNECTED)
+        return error('客户端已断开', 499, reason=CANCEL_CLIENT_DISCONNECTED)
+
+    # 部分转换参数和客户端提供的文档哈希
+    try:
+        options = ExportOptions.from_form(form)
+        claimed_hash = normalize_sha256(request.headers.get(CONTENT_HASH_HEADER) or form.get('sha256'))
+    except ValueError as e:
+        logger.error(f"请求参数错误: {str(e)}")
+        return error(str(e), 400)
+
+    file = form.get('file')
+    if not isinstance(file, UploadFile):
+        file = None
+    filename = file.filename if file else (form.get('filename') or 'document')
+    download_name = Path(filename or 'document').stem + '.pdf'
+
+    # 客户端提供了哈希：命中缓存时不再保存、预检和转换
+    if claimed_hash:
+        response = await lookup_result(request, claimed_hash, options, download_name, 'claimed')
+        if response is not None:
+            return response
+
+    if file is None:
+        if claimed_hash:
+            return error('没有该文档的转换结果，请上传文件', 404, reason='not_cached')
+        logger.error("请求中没有 'file' 字段")
+        return error('请上传文件', 400, field='file')
+    if not file.filename:
+        logger.error("文件名为空")
+        return error('文件名为空', 400)
+
+    file_ext = Path(file.filename).suffix.lower()
+    if file_ext not in ALLOWED_EXTENSIONS:
+        logger.error(f"不支持的文件类型: {file_ext}")
+        return error(f'不支持的文件类型: {file_ext}', 400, allowed=list(ALLOWED_EXTENSIONS))
+
+    input_file = None
+    try:
+        timestamp_ms = int(time.time() * 1000)
+        input_file = os.path.join(config.TEMP_DIR, f"api_input_{timestamp_ms}_{id(file)}{file_ext}")
+        with tracer.span('upload.save') as save_span:
+            size, content_hash = await run_blocking(state.blocking, save_stream, file.file, input_file)
+            save_span.set(size=size)
+        logger.info(f"文件已保存: {input_file}, 大小: {size} 字节")
+        if claimed_hash and claimed_hash != content_hash:
+            logger.warning(f"客户端提供的sha256与文件内容不符: {claimed_hash}")
+    except Exception as e:
+        if input_file:
+            state.converter.converter.cleanup_file(input_file)
+        return conversion_error(e, deadline)
+    finally:
+        await file.close()
+
+    # 重传的文档（客户端没带哈希）：按服务端计算的哈希查缓存
+    try:
+        return await convert_saved(request, input_file, content_hash, options, download_name, deadline,
+                                   lookup_cache=claimed_hash != content_hash)
+    except Exception as e:
+        return conversion_error(e, deadline)
+
+
+async def convert_saved(request: Request, input_file: str, content_hash: str, options: ExportOptions,
+                        download_name: str, deadline: Deadline, lookup_cache: bool = True) -> Response:
+    """
+    转换已保存的文档并返回PDF（/api/convert 和分块上传共用）
+
+    input_file 在响应发送完成后（出错时立即）删除。
+
+    Raises:
+        PreflightError, DeadlineExceeded, ConversionCancelled, ExportOptionsError: 见 conversion_error
+    """
+    state = request.app.state
+    converter = state.converter.converter
+    key = result_key(content_hash, options)
+    output_pdf = None
+    try:
+        # 集群模式：由负责该文档的节点查缓存、转换并缓存
+        node = get_cluster().route(content_hash, request.headers)
+        if node is not None:
+            response = await forward_conversion(request, node, input_file, content_hash, options, download_name,
+                                                deadline)
+            if response is not None:
+                converter.cleanup_file(input_file)
+                return response
+        if lookup_cache:
+            response = await cached_pdf(request, key, download_name, 'upload',
+                                        headers={CONTENT_HASH_HEADER: content_hash})
+            if response is not None:
+                converter.cleanup_file(input_file)
+                return response
+
+        # 预检：识别真实格式、加密和损坏的文件，毫秒级拒绝
+        with tracer.span('preflight') as preflight_span:
+            preflight = await run_blocking(state.blocking, inspect_file, input_file)
+            preflight_span.set(**preflight.to_dict())
+        logger.info(f"预检通过: {preflight.to_dict()}")
+
+        # 用户正在等待：按交互优先级调度；客户端断开或截止时间到期时取消转换
+        output_pdf = await run_cancellable(request, deadline, state.converter.convert_to_pdf(
+            input_file, preflight=preflight, options=options, deadline=deadline, priority=PRIORITY_INTERACTIVE
+        ))
+        logger.info(f"转换完成: {output_pdf}")
+
+        # 存入结果缓存并从缓存返回（缓存关闭或写入失败时直接返回生成的PDF）
+        with tracer.span('result_cache.put'):
+            cached = await run_blocking(state.blocking, get_result_cache().put, key, output_pdf)
+        if cached is not None:
+            pdf_path, etag, pdf_size = str(cached.path), cached.etag, cached.size
+        else:
+            etag = await run_blocking(state.blocking, file_sha256, output_pdf)
+            pdf_path, pdf_size = output_pdf, os.path.getsize(output_pdf)
+    except BaseException:
+        converter.cleanup_file(input_file)
+        if output_pdf:
+            converter.cleanup_file(output_pdf)
+        raise
+    logger.info(f"返回 PDF: {download_name}, 大小: {pdf_size} 字节")
+
+    # 发送完成后清理临时文件
+    def cleanup():
+        converter.cleanup_file(input_file)
+        converter.cleanup_file(output_pdf)
+
+    return pdf_response(request, pdf_path, etag, download_name, 'miss',
+                        headers={CONTENT_HASH_HEADER: content_hash}, background=BackgroundTask(cleanup))
+
+
+def conversion_error(e: Exception, deadline: Deadline) -> JSONResponse:
+    """转换过程中的异常 -> JSON错误响应"""
+    if isinstance(e, PreflightError):
+        return error(str(e), e.status_code, reason=e.reason)
+    if isinstance(e, DeadlineExceeded):
+        return error(str(e), 504, reason='deadline_exceeded')
+    if isinstance(e, ConversionCancelled):
+        # 客户端已断开，响应不会被接收（499 与 nginx 的日志约定一致）
+        return error(str(e), 499, reason=deadline.cancel_reason)
+    if isinstance(e, ExportOptionsError):
+        # 部分转换参数与文档内容不符（如工作表不存在），或可用的引擎无法满足
+        logger.error(f"转换参数错误: {str(e)}")
+        return error(str(e), e.status_code)
+    logger.error(f"转换失败: {str(e)}", exc_info=e)
+    return error(f'转换失败: {str(e)}', 500)
+
+
+def upload_error(e: UploadError) -> JSONResponse:
+    headers = {UPLOAD_OFFSET_HEADER: str(e.offset)} if e.offset is not None else None
+    return JSONResponse(e.to_dict(), status_code=e.status_code, headers=headers)
+
+
+async def api_upload_create(request: Request):
+    """创建断点续传上传会话（请求和响应格式同 app.py 的 /api/uploads）"""
+    response = rate_limited(request)
+    if response is not None:
+        return response
+    try:
+        if request.headers.get('content-type', '').startswith('application/json'):
+            body = await request.json()
+        else:
+            body = await request.form()
+    except ClientDisconnect:
+        return error('客户端已断开', 499, reason=CANCEL_CLIENT_DISCONNECTED)
+    except ValueError:
+        body = {}
+    fields = {**request.query_params, **(body if hasattr(body, 'items') else {})}
+    fields = {key: str(value) for key, value in fields.items() if value is not None}
+    filename = fields.get('filename') or ''
+    file_ext = Path(filename).suffix.lower()
+    if file_ext not in ALLOWED_EXTENSIONS:
+        logger.error(f"不支持的文件类型: {file_ext}")
+        return error(f'不支持的文件类型: {file_ext}', 400, allowed=list(ALLOWED_EXTENSIONS))
+    try:
+        size = int(fields.get('size') or 0)
+        options = ExportOptions.from_form(fields)
+        claimed_hash = normalize_sha256(request.headers.get(CONTENT_HASH_HEADER) or fields.get('sha256'))
+    except ValueError as e:
+        logger.error(f"请求参数错误: {str(e)}")
+        return error(str(e), 400)
+
+    if claimed_hash:
+        response = await lookup_result(request, claimed_hash, options, Path(filename).stem + '.pdf', 'claimed')
+        if response is not None:
+            return response
+
+    try:
+        # 集群模式：会话ID由本节点负责，其他节点收到该会话的分块时转发到这里
+        session = await run_blocking(request.app.state.blocking, get_upload_store().create,
+                                     filename, size, {**fields, 'sha256': claimed_hash}, get_cluster().is_local)
+    except UploadError as e:
+        return upload_error(e)
+    url = f"/api/uploads/{session.upload_id}"
+    return JSONResponse({
+        **session.to_dict(),
+        'url': url,
+        'chunk_size': config.UPLOAD_CHUNK_SIZE_MB * 1024 * 1024,
+        'expires_in': config.UPLOAD_SESSION_TTL,
+    }, status_code=201, headers={'Location': url, UPLOAD_OFFSET_HEADER: '0'})
+
+
+async def api_upload(request: Request):
+    """查询上传进度（GET/HEAD）、放弃上传（DELETE）或上传分块（PATCH/PUT）"""
+    upload_id = request.path_params['upload_id']
+    node = get_cluster().route(upload_id, request.headers, fallback=False)
+    if node is not None:
+        return await forward_upload(request, node, upload_id)
+    if request.method in ('PATCH', 'PUT'):
+        with root_span(request, 'api_upload_chunk') as span:
+            response = await _api_upload_chunk(request, Deadline(request_budget(request)))
+            return traced(response, span)
+
+    store = get_upload_store()
+    try:
+        session = await run_blocking(request.app.state.blocking, store.get, upload_id)
+    except UploadError as e:
+        return upload_error(e)
+    if request.method == 'DELETE':
+        await run_blocking(request.app.state.blocking, store.delete, upload_id)
+        return Response(status_code=204)
+    return JSONResponse(session.to_dict(),
+                        headers={UPLOAD_OFFSET_HEADER: str(session.offset), 'Cache-Control': 'no-store'})
+
+
+async def _api_upload_chunk(request: Request, deadline: Deadline) -> Response:
+    state = request.app.state
+    upload_id = request.path_params['upload_id']
+    store = get_upload_store()
+    try:
+        offset = int(request.headers.get(UPLOAD_OFFSET_HEADER) or request.query_params.get('offset') or -1)
+    except ValueError:
+        offset = -1
+    if offset < 0:
+        return error(f'请在 {UPLOAD_OFFSET_HEADER} 请求头中提供分块偏移量', 400, field='offset')
+
+    try:
+        session = await run_blocking(state.blocking, store.get, upload_id)
+        options = ExportOptions.from_form(session.fields)
+        download_name = Path(session.filename).stem + '.pdf'
+        # 已转换成功的会话（之前的响应没有送达）：从结果缓存返回
+        if session.complete:
+            return await completed_upload(request, session, options, download_name)
+        with tracer.span('upload.chunk', offset=offset) as span:
+            with store.append(upload_id, offset) as writer:
+                # 攒够1MB再交给线程池写入
+                buffer = bytearray()
+                async for data in request.stream():
+                    buffer += data
+                    if len(buffer) >= 1024 * 1024:
+                        await run_blocking(state.blocking, writer.write, bytes(buffer))
+                        buffer.clear()
+                if buffer:
+                    await run_blocking(state.blocking, writer.write, bytes(buffer))
+            span.set(size=writer.written)
+    except UploadError as e:
+        return upload_error(e)
+    except ClientDisconnect:
+        return error('客户端已断开', 499, reason=CANCEL_CLIENT_DISCONNECTED)
+    except ExportOptionsError as e:
+        return error(str(e), e.status_code)
+
+    if writer.offset < session.size:
+        return JSONResponse(session.to_dict(), headers={UPLOAD_OFFSET_HEADER: str(writer.offset)})
+
+    # 最后一个分块：收齐后开始转换
+    try:
+        with store.converting(upload_id) as session:
+            if session.complete:
+                # 同时提交的另一个请求刚刚转换完成
+                return await completed_upload(request, session, options, download_name)
+            return await convert_upload(request, session, options, download_name, deadline)
+    except UploadError as e:
+        return upload_error(e)
+
+
+async def completed_upload(request: Request, session, options: ExportOptions, download_name: str) -> Response:
+    """已转换成功的上传会话：从结果缓存返回PDF，已过期时返回410"""
+    response = await lookup_result(request, session.content_hash, options, download_name, 'upload',
+                                   headers={CONTENT_HASH_HEADER: session.content_hash})
+    return response or error('转换结果已过期，请重新上传', 410, reason='not_cached')
+
+
+async def convert_upload(request: Request, session, options: ExportOptions, download_name: str,
+                         deadline: Deadline) -> Response:
+    """
+    转换已收齐的上传会话（调用方持有该会话的转换锁）
+
+    每次尝试使用独立的输入文件，清理时不会删掉其他请求正在转换的文件。
+    """
+    state = request.app.state
+    store = get_upload_store()
+    logger.info(f"=== 分块上传完成，开始转换（asyncio）: {session.upload_id}, {session.filename} ===")
+    timestamp_ms = int(time.time() * 1000)
+    input_file = os.path.join(config.TEMP_DIR,
+                              f"api_upload_{session.upload_id}_{timestamp_ms}{Path(session.filename).suffix.lower()}")
+    try:
+        await run_blocking(state.blocking, store.link_data, session, input_file)
+        content_hash = await run_blocking(state.blocking, file_sha256, input_file)
+        claimed_hash = session.fields.get('sha256')
+        if claimed_hash and claimed_hash != content_hash:
+            logger.warning(f"客户端提供的sha256与文件内容不符: {claimed_hash}")
+        response = await convert_saved(request, input_file, content_hash, options, download_name, deadline)
+        # 集群模式下由负责节点转换时，失败以错误响应返回：保留会话数据以便重试
+        if response.status_code < 400:
+            await run_blocking(state.blocking, store.finish, session, content_hash)
+        return response
+    except PreflightError as e:
+        # 文件本身无法转换，重试没有意义
+        await run_blocking(state.blocking, store.delete, session.upload_id, 'rejected')
+        return conversion_error(e, deadline)
+    except Exception as e:
+        state.converter.converter.cleanup_file(input_file)
+        return conversion_error(e, deadline)
+
+async def index(request: Request):
+    """根路径"""
+    return JSONResponse({
+        'message': 'Enterprise WeChat Document Converter Service',
+        'health': '/health',
+        'wecom': '/wecom'
+    })
+
+
+app = Starlette(
+    routes=[
+        Route('/', index, methods=['GET']),
+        Route('/health', health_check, methods=['GET']),
+        Route('/metrics', metrics_endpoint, methods=['GET']),
+        Route('/wecom', wecom_handler, methods=['GET', 'POST']),
+        Route('/api/convert', api_convert, methods=['GET', 'POST']),
+        Route('/api/uploads', api_upload_create, methods=['POST']),
+        Route('/api/uploads/{upload_id}', api_upload, methods=['GET', 'DELETE', 'PATCH', 'PUT']),
+    ],
+    middleware=[Middleware(ClusterNodeHeader)],
+    lifespan=lifespan
+)
@@ -0,0 +1,444 @@
+"""
+转换前优化 OOXML 文档中的资源
+
+老师的 docx/pptx 里经常直接插入手机拍的1200万像素照片，上传到Windows虚拟机
+和 Office 自身渲染的时间大部分花在这些图片上。转换前复制一份文档并：
+
+- 按图片在页面上的显示尺寸和目标打印分辨率（ASSET_TARGET_DPI）缩小过大的 JPEG/PNG
+  （显示尺寸来自 DrawingML 的 <a:ext>，版式只取决于它，与图片像素数无关，因此版式不变）
+- 删除文档缩略图（docProps/thumbnail.*）
+- 删除没有任何关系（.rels）引用的部件（编辑时删掉的图片常常仍留在包中）
+
+只处理能确定显示尺寸的图片：被组合形状、形状填充、VML 等其他方式引用的图片保持原样。
+缩小图片需要 Pillow，没有安装时只做后两项。
+"""
+
+import io
+import re
+import math
+import time
+import logging
+import posixpath
+import zipfile
+from pathlib import Path
+from urllib.parse import unquote
+import xml.etree.ElementTree as ET
+
+try:
+    from PIL import Image
+except ImportError:  # 可选依赖
+    Image = None
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+OOXML_EXTENSIONS = ('.docx', '.xlsx', '.pptx')
+
+CONTENT_TYPES_PART = '[Content_Types].xml'
+ROOT_RELS_PART = '_rels/.rels'
+
+REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+R_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+THUMBNAIL_REL_TYPE = 'http://schemas.openxmlformats.org/package/2006/relationships/metadata/thumbnail'
+IMAGE_REL_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image'
+
+EMU_PER_INCH = 914400
+# 缩小后仍不小于所需像素的该比例时才处理（避免为很小的收益重新编码）
+MIN_SCALE_GAIN = 0.8
+# 超过该像素数的图片不解码（防止解压炸弹）
+MAX_IMAGE_PIXELS = 120 * 1000 * 1000
+# 解压后总大小超过该值的文档不处理
+MAX_PACKAGE_BYTES = 512 * 1024 * 1024
+
+RESIZABLE_FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG'}
+# 重新编码后颜色不变的像素格式（CMYK 等保持原样）
+RESIZABLE_MODES = ('RGB', 'RGBA', 'L', 'LA', 'P', '1')
+
+ATTRIBUTE_RE = re.compile(r'([\w:]+)="([^"]*)"')
+
+
+class OptimizationReport:
+    """一个文档的优化结果"""
+
+    def __init__(self, original_bytes: int):
+        self.original_bytes = original_bytes
+        self.optimized_bytes = original_bytes
+        self.images_resized = 0
+        self.image_bytes_saved = 0
+        self.parts_removed = []
+        self.seconds = 0.0
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.original_bytes - self.optimized_bytes
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.images_resized or self.parts_removed)
+
+    def to_dict(self) -> dict:
+        return {
+            'original_bytes': self.original_bytes,
+            'optimized_bytes': self.optimized_bytes,
+            'saved_bytes': self.saved_bytes,
+            'images_resized': self.images_resized,
+            'parts_removed': self.parts_removed,
+            'seconds': round(self.seconds, 3),
+        }
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _rels_path(part: str) -> str:
+    """部件对应的关系文件，如 word/document.xml -> word/_rels/document.xml.rels"""
+    directory, name = posixpath.split(part)
+    return posixpath.join(directory, '_rels', f'{name}.rels')
+
+
+def _source_of(rels_part: str) -> str:
+    """关系文件所属的部件（包的根关系返回空字符串）"""
+    directory, name = posixpath.split(rels_part)
+    return posixpath.join(posixpath.dirname(directory), name[:-len('.rels')])
+
+
+def _resolve(source: str, target: str) -> str:
+    """关系的 Target 转成包内的部件名"""
+    target = unquote(target.split('#', 1)[0])
+    if target.startswith('/'):
+        return posixpath.normpath(target[1:])
+    return posixpath.normpath(posixpath.join(posixpath.dirname(source), target))
+
+
+def _read_relationships(zf: zipfile.ZipFile, rels_part: str) -> list:
+    """
+    Returns:
+        list: [(rId, 类型, 目标部件名)]，外部链接除外
+
+    Raises:
+        ET.ParseError: 关系文件格式错误
+    """
+    source = _source_of(rels_part)
+    root = ET.fromstring(zf.read(rels_part))
+    relationships = []
+    for rel in root.iter(f'{{{REL_NS}}}Relationship'):
+        if rel.get('TargetMode') == 'External' or not rel.get('Target'):
+            continue
+        relationships.append((rel.get('Id'), rel.get('Type'), _resolve(source, rel.get('Target'))))
+    return relationships
+
+
+class _Package:
+    """OOXML 包的部件和关系（部件名比较不区分大小写）"""
+
+    def __init__(self, zf: zipfile.ZipFile):
+        self.zf = zf
+        self.names = {info.filename.lower(): info.filename for info in zf.infolist() if not info.is_dir()}
+        # 关系文件 -> [(rId, 类型, 目标)]
+        self.relationships = {}
+        for name in self.names.values():
+            if name.endswith('.rels'):
+                self.relationships[name] = _read_relationships(zf, name)
+
+    def part(self, name: str) -> str:
+        """实际的部件名（不存在时返回None）"""
+        return self.names.get(name.lower())
+
+    def reachable(self, skip: set) -> set:
+        """从包的根关系出发能到达的部件（跳过 skip 中的关系目标）"""
+        seen = set()
+        pending = [ROOT_RELS_PART]
+        while pending:
+            rels_part = self.part(pending.pop())
+            if rels_part is None:
+                continue
+            for _, _, target in self.relationships.get(rels_part, []):
+                part = self.part(target)
+                if part is None or part in seen or part in skip:
+                    continue
+                seen.add(part)
+                pending.append(_rels_path(part))
+        return seen
+
+
+def _display_sizes(package: _Package, parts: set) -> dict:
+    """
+    图片部件 -> 页面上需要的最大显示尺寸（EMU，按裁剪还原到整张图片）
+
+    同一图片只要有一处引用无法确定尺寸（组合形状中、形状填充、VML 等），值为None。
+    """
+    sizes = {}
+    for part in parts:
+        rels = package.relationships.get(package.part(_rels_path(part)) or '', [])
+        images = {rid: package.part(target) for rid, rel_type, target in rels
+                  if rel_type == IMAGE_REL_TYPE and package.part(target)}
+        if not images:
+            continue
+        sized = {}
+        try:
+            root = ET.fromstring(package.zf.read(part))
+        except ET.ParseError:
+            root = None
+        if root is not None:
+            grouped = set()
+            for group in root.iter():
+                if _local(group.tag) in ('grpSp', 'wgp'):
+                    grouped.update(id(element) for element in group.iter() if element is not group)
+            # 每个 rId 被引用的次数（任意元素的任意属性），只有全部引用都来自能确定尺寸的图片时才缩小
+            references = {}
+            for element in root.iter():
+                for value in element.attrib.values():
+                    if value in images:
+                        references[value] = references.get(value, 0) + 1
+            sized_references = {}
+            for pic in root.iter():
+                if _local(pic.tag) != 'pic' or id(pic) in grouped:
+                    continue
+                size = _pic_size(pic)
+                if size is None:
+                    continue
+                rid, cx, cy = size
+                previous = sized.get(rid, (0, 0))
+                sized[rid] = (max(previous[0], cx), max(previous[1], cy))
+                sized_references[rid] = sized_references.get(rid, 0) + 1
+            for rid, count in sized_references.items():
+                if references.get(rid, 0) != count:
+                    sized.pop(rid, None)
+        for rid, image in images.items():
+            if rid not in sized:
+                sizes[image] = None
+            elif image not in sizes or sizes[image] is not None:
+                previous = sizes.get(image) or (0, 0)
+                sizes[image] = (max(previous[0], sized[rid][0]), max(previous[1], sized[rid][1]))
+    return sizes
+
+
+def _pic_size(pic) -> tuple:
+    """图片元素 <*:pic> 引用的 rId 和显示尺寸，无法确定时返回None"""
+    blip = ext = src_rect = None
+    for element in pic.iter():
+        name = _local(element.tag)
+        if name == 'blip' and blip is None:
+            blip = element
+        elif name == 'srcRect' and src_rect is None:
+            src_rect = element
+        elif name == 'ext' and ext is None and element.get('cx') is not None:
+            ext = element
+    if blip is None or ext is None:
+        return None
+    rid = blip.get(f'{{{R_NS}}}embed')
+    try:
+        cx, cy = int(ext.get('cx')), int(ext.get('cy'))
+        if src_rect is not None:
+            # 裁剪比例（1/100000）：显示的只是图片的一部分，整张图片需要的像素更多
+            crop = {key: int(src_rect.get(key, 0)) for key in ('l', 't', 'r', 'b')}
+            visible_x = 1 - (crop['l'] + crop['r']) / 100000
+            visible_y = 1 - (crop['t'] + crop['b']) / 100000
+            if visible_x <= 0 or visible_y <= 0:
+                return None
+            cx, cy = cx / visible_x, cy / visible_y
+    except (TypeError, ValueError):
+        return None
+    if not rid or cx <= 0 or cy <= 0:
+        return None
+    return rid, cx, cy
+
+
+def _downscale(data: bytes, image_format: str, size: tuple, target_dpi: int, jpeg_quality: int) -> bytes:
+    """按显示尺寸缩小图片，不需要缩小或缩小后不更小时返回None"""
+    with Image.open(io.BytesIO(data)) as image:
+        if (image.format != image_format or image.mode not in RESIZABLE_MODES
+                or getattr(image, 'n_frames', 1) > 1):
+            return None
+        width, height = image.size
+        if width * height > MAX_IMAGE_PIXELS:
+            return None
+        need_width = math.ceil(size[0] / EMU_PER_INCH * target_dpi)
+        need_height = math.ceil(size[1] / EMU_PER_INCH * target_dpi)
+        scale = max(need_width / width, need_height / height)
+        if scale > MIN_SCALE_GAIN:
+            return None
+        new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+        params = {}
+        if image.info.get('icc_profile'):
+            params['icc_profile'] = image.info['icc_profile']
+        if image_format == 'JPEG':
+            # 保留 EXIF（包括方向），像素方向不变，渲染结果与原图一致
+            if image.info.get('exif'):
+                params['exif'] = image.info['exif']
+            params.update(quality=jpeg_quality, optimize=True)
+        else:
+            params.update(optimize=True)
+        if image.mode in ('P', '1'):
+            image = image.convert('RGBA')
+        resized = image.resize(new_size, Image.LANCZOS)
+        buffer = io.BytesIO()
+        resized.save(buffer, image_format, **params)
+    result = buffer.getvalue()
+    return result if len(result) < len(data) else None
+
+
+def _remove_elements(data: bytes, tag: str, predicate) -> bytes:
+    """删除XML中满足条件的自闭合元素（只改动这些元素，其余内容原样保留）"""
+    def replace(match):
+        attributes = dict(ATTRIBUTE_RE.findall(match.group(0)))
+        return '' if predicate(attributes) else match.group(0)
+    return re.sub(rf'<{tag}\b[^>]*/>', replace, data.decode('utf-8')).encode('utf-8')
+
+
+def _remove_content_types(data: bytes, removed: set) -> bytes:
+    """从 [Content_Types].xml 中删除已删除部件的 Override"""
+    return _remove_elements(data, 'Override',
+                            lambda attributes: attributes.get('PartName', '').lstrip('/').lower() in removed)
+
+
+def _remove_relationships(data: bytes, rel_type: str) -> bytes:
+    """删除关系文件中指定类型的关系"""
+    return _remove_elements(data, 'Relationship', lambda attributes: attributes.get('Type') == rel_type)
+
+
+def optimize_package(input_path: Path, output_path: Path, target_dpi: int = 200, min_image_bytes: int = 200 * 1024,
+                     jpeg_quality: int = 85) -> OptimizationReport:
+    """
+    生成优化后的文档副本
+
+    Args:
+        input_path: OOXML 文档（docx/xlsx/pptx）
+        output_path: 优化后的副本路径
+        target_dpi: 图片按显示尺寸保留的分辨率
+        min_image_bytes: 小于该大小的图片不处理
+        jpeg_quality: 重新编码 JPEG 的质量
+
+    Returns:
+        OptimizationReport: 没有可优化的内容时 changed 为 False，此时不生成副本
+
+    Raises:
+        zipfile.BadZipFile, ET.ParseError, OSError: 文档无法解析或写入失败
+    """
+    started = time.time()
+    report = OptimizationReport(input_path.stat().st_size)
+    with zipfile.ZipFile(input_path) as zf:
+        infos = [info for info in zf.infolist() if not info.is_dir()]
+        if sum(info.file_size for info in infos) > MAX_PACKAGE_BYTES:
+            logger.info(f"文档解压后过大，跳过资源优化: {input_path.name}")
+            report.seconds = time.time() - started
+            return report
+        package = _Package(zf)
+
+        # 缩略图：从根关系中去掉，部件随后因不可达被删除
+        root_rels = package.part(ROOT_RELS_PART)
+        thumbnails = {package.part(target) for _, rel_type, target in package.relationships.get(root_rels, [])
+                      if rel_type == THUMBNAIL_REL_TYPE and package.part(target)}
+        reachable = package.reachable(skip=thumbnails)
+        keep = set(reachable)
+        keep.add(package.part(CONTENT_TYPES_PART))
+        keep.update(rels for rels in package.relationships if rels == root_rels or _source_of(rels) in reachable)
+        removed = {info.filename for info in infos if info.filename not in keep}
+
+        replacements = {}
+        if Image is not None:
+            for image, size in _display_sizes(package, reachable).items():
+                image_format = RESIZABLE_FORMATS.get(posixpath.splitext(image)[1].lower())
+                info = zf.getinfo(image)
+                if size is None or image_format is None or info.file_size < min_image_bytes:
+                    continue
+                data = zf.read(image)
+                try:
+                    resized = _downscale(data, image_format, size, target_dpi, jpeg_quality)
+                except Exception as e:
+                    logger.warning(f"缩小图片失败，保持原样: {image}: {str(e)}")
+                    continue
+                if resized is not None:
+                    replacements[image] = resized
+                    report.images_resized += 1
+                    report.image_bytes_saved += len(data) - len(resized)
+
+        if removed:
+            replacements[package.part(CONTENT_TYPES_PART)] = _remove_content_types(
+                zf.read(CONTENT_TYPES_PART), {name.lower() for name in removed}
+            )
+            if thumbnails:
+                replacements[root_rels] = _remove_relationships(zf.read(root_rels), THUMBNAIL_REL_TYPE)
+        report.parts_removed = sorted(removed)
+
+        if not report.changed:
+            report.seconds = time.time() - started
+            return report
+
+        # 按原顺序重新打包（[Content_Types].xml 仍在最前），未修改的部件保持原压缩方式
+        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as dst:
+            for info in infos:
+                if info.filename in removed:
+                    continue
+                data = replacements.get(info.filename)
+                if data is None:
+                    data = zf.read(info.filename)
+                target = zipfile.ZipInfo(info.filename, info.date_time)
+                target.compress_type = info.compress_type
+                target.external_attr = info.external_attr
+                dst.writestr(target, data)
+
+    report.optimized_bytes = output_path.stat().st_size
+    report.seconds = time.time() - started
+    return report
+
+
+class AssetOptimizer:
+    """
+    转换前的资源优化阶段
+
+    Args:
+        enabled: 是否启用
+        target_dpi: 图片保留的打印分辨率
+        min_size: 小于该字节数的文档不处理
+        min_image_bytes: 小于该字节数的图片不处理
+        jpeg_quality: 重新编码 JPEG 的质量
+    """
+
+    def __init__(self, enabled: bool = False, target_dpi: int = 200, min_size: int = 1024 * 1024,
+                 min_image_bytes: int = 200 * 1024, jpeg_quality: int = 85):
+        self.enabled = enabled
+        self.target_dpi = target_dpi
+        self.min_size = min_size
+        self.min_image_bytes = min_image_bytes
+        self.jpeg_quality = jpeg_quality
+        if enabled and Image is None:
+            logger.warning("未安装 Pillow，资源优化只删除缩略图和未使用的部件，不缩小图片")
+
+    def applies_to(self, ext: str, size: int) -> bool:
+        return self.enabled and ext in OOXML_EXTENSIONS and size >= self.min_size
+
+    def optimize(self, input_path: Path, output_path: Path) -> OptimizationReport:
+        """
+        生成优化后的副本（失败时不抛出异常，调用方继续使用原文件）
+
+        Returns:
+            OptimizationReport: 生成了副本且更小时返回，否则返回None
+        """
+        try:
+            report = optimize_package(input_path, output_path, self.target_dpi, self.min_image_bytes,
+                                      self.jpeg_quality)
+        except Exception as e:
+            logger.warning(f"资源优化失败，使用原文件: {input_path.name}: {str(e)}")
+            metrics.inc('asset_optimization_total', outcome='failed')
+            output_path.unlink(missing_ok=True)
+            return None
+
+        metrics.observe('asset_optimization_seconds', report.seconds)
+        if not report.changed or report.saved_bytes <= 0:
+            metrics.inc('asset_optimization_total', outcome='unchanged')
+            output_path.unlink(missing_ok=True)
+            return None
+
+        metrics.inc('asset_optimization_total', outcome='optimized')
+        metrics.inc('asset_bytes_saved_total', report.saved_bytes)
+        metrics.inc('asset_images_resized_total', report.images_resized)
+        logger.info(
+            f"资源优化: {input_path.name} {report.original_bytes / 1024:.0f}KB -> "
+            f"{report.optimized_bytes / 1024:.0f}KB（缩小图片 {report.images_resized} 张，"
+            f"删除部件 {len(report.parts_removed)} 个，耗时 {report.seconds:.2f}秒）"
+        )
+        return report
@@ -0,0 +1,278 @@
+"""
+asyncio 模式下的文档转换
+
+同步模式（DocumentConverter.convert_to_pdf）中，一次转换从排队、等待Windows
+服务到LibreOffice运行都占用一个线程。asyncio 模式（asgi_app.py）下：
+
+- 排队：PriorityScheduler.async_slot()，与同步请求共用队列和优先级规则，不占线程
+- Windows 引擎：httpx 异步上传/下载，等待远端 COM 转换期间不占线程
+- LibreOffice 引擎：子进程监管是阻塞的，交给大小等于调度容量的线程池运行；
+  只有拿到槽位的转换才会进入线程池，所以线程池永远不会排队
+
+路由策略、超时预算、引擎统计都复用 DocumentConverter 中的同一份实例。
+对冲模式目前只在同步模式中生效，asyncio 模式按路由顺序依次降级。
+
+取消：调用方取消转换协程（如客户端断开）时，排队的请求退出队列，进行中的
+httpx 请求随之断开；LibreOffice 在线程中运行，由 deadline 的取消信号终止进程树。
+"""
+
+import os
+import time
+import asyncio
+import logging
+import contextlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+
+from engine_router import ENGINE_WINDOWS, ENGINE_LIBREOFFICE
+from deadline import Deadline, DeadlineExceeded
+from cancellation import CancelToken, REQUEST_TIMEOUT_HEADER
+from partial_export import ExportOptions
+from preflight import PreflightResult
+from scheduler import PRIORITY_INTERACTIVE
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+async def run_blocking(executor, func, *args):
+    """在线程池中运行阻塞函数，并带上当前的追踪上下文"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, context.run, func, *args)
+
+
+async def iterate_blocking(iterator):
+    """在线程池中逐块取出阻塞迭代器（读文件、压缩）的内容"""
+    while True:
+        chunk = await run_blocking(None, next, iterator, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+class AsyncWindowsClient:
+    """
+    Windows 转换服务的异步客户端
+
+    httpx 连接池本身复用连接；压缩协商和字节统计与同步模式共用 WindowsTransport。
+
+    Args:
+        base_url: 服务地址，如 http://192.168.1.100:8080
+        transport: 同步转换器的 WindowsTransport
+    """
+
+    def __init__(self, base_url: str, transport):
+        self.base_url = base_url.rstrip('/')
+        self.transport = transport
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # 首次使用时创建（需要在事件循环中）
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=None)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def convert(self, input_path: Path, output_pdf: Path, options: ExportOptions = None,
+                      timeout: float = None) -> str:
+        """
+        上传文档并流式保存返回的PDF
+
+        Returns:
+            str: PDF文件路径，失败返回None
+        """
+        transport = self.transport
+        payload_size = input_path.stat().st_size
+        headers = {
+            **tracer.inject(),
+            REQUEST_TIMEOUT_HEADER: f"{timeout:.1f}",
+            'Accept-Encoding': transport.accept_encoding,
+        }
+        fields = options.to_form() if options else None
+        try:
+            encoding = await run_blocking(None, transport.request_encoding, input_path)
+            with tracer.span('windows.request', encoding=encoding or 'identity') as span:
+                if encoding:
+                    body, body_headers = transport.upload_body(input_path, fields, encoding)
+                    request = self.client.build_request(
+                        'POST', f"{self.base_url}/convert",
+                        content=iterate_blocking(body),
+                        headers={**headers, **body_headers},
+                        timeout=timeout
+                    )
+                    response = await self.client.send(request, stream=True)
+                    wire_size = body.count
+                else:
+                    with open(input_path, 'rb') as f:
+                        files = {'document': (input_path.name, f, 'application/octet-stream')}
+                        request = self.client.build_request(
+                            'POST', f"{self.base_url}/convert",
+                            files=files,
+                            data=fields,
+                            headers=headers,
+                            timeout=timeout
+                        )
+                        response = await self.client.send(request, stream=True)
+                    wire_size = payload_size
+                transport.record('upload', wire_size, payload_size, encoding)
+                span.set(status_code=response.status_code, wire_bytes=wire_size, payload_bytes=payload_size)
+            transport.learn(response.headers)
+
+            try:
+                with tracer.span('windows.download') as span:
+                    if response.status_code != 200:
+                        body = await response.aread()
+                        logger.error(f"Windows服务返回错误: {response.status_code} {body[:500]!r}")
+                        return None
+                    pdf_size = 0
+                    with open(output_pdf, 'wb') as f:
+                        async for chunk in response.aiter_bytes(64 * 1024):
+                            f.write(chunk)
+                            pdf_size += len(chunk)
+                    response_encoding = response.headers.get('Content-Encoding')
+                    transport.record('download', response.num_bytes_downloaded, pdf_size, response_encoding)
+                    span.set(encoding=response_encoding or 'identity', wire_bytes=response.num_bytes_downloaded,
+                             payload_bytes=pdf_size)
+                    profile, timings = transport.record_export(response.headers, input_path.suffix.lower(), pdf_size)
+                    span.set(profile=profile, **{f'{phase}_seconds': round(seconds, 3)
+                                                 for phase, seconds in timings.items()})
+            finally:
+                await response.aclose()
+
+            logger.info(f"Windows转换成功: {output_pdf.name}")
+            return str(output_pdf)
+
+        except httpx.TimeoutException:
+            logger.error(f"Windows服务超时(>{timeout:.0f}秒)")
+            return None
+        except httpx.TransportError as e:
+            logger.error(f"无法连接到Windows服务: {str(e)}")
+            return None
+
+
+class AsyncConverter:
+    """
+    DocumentConverter 的 asyncio 入口
+
+    Args:
+        converter: 同步转换器（提供路由、超时预算、调度器和LibreOffice转换）
+    """
+
+    def __init__(self, converter):
+        self.converter = converter
+        self.windows = (AsyncWindowsClient(converter.windows_url, converter.windows_transport)
+                        if converter.windows_url else None)
+        # 只有持有调度槽位的转换才进入线程池，容量与调度器一致
+        self.executor = ThreadPoolExecutor(
+            max_workers=converter.scheduler.capacity, thread_name_prefix='async-convert'
+        )
+
+    async def aclose(self):
+        if self.windows is not None:
+            await self.windows.aclose()
+        self.executor.shutdown(wait=False)
+
+    async def convert_to_pdf(self, input_file_path: str, preflight: PreflightResult = None,
+                             options: ExportOptions = None, deadline: Deadline = None,
+                             priority: str = PRIORITY_INTERACTIVE) -> str:
+        """
+        将Office文档转换为PDF（参数和异常同 DocumentConverter.convert_to_pdf）
+
+        调用方需要已经在线程池中完成预检并传入 preflight，否则这里会在事件循环中预检。
+        """
+        input_path, preflight, options, deadline = self.converter.prepare(
+            input_file_path, preflight, options, deadline, priority
+        )
+        output_pdf = input_path.parent / f"{input_path.stem}.pdf"
+        ext = preflight.detected_ext
+        queue_timeout, _ = self.converter.queue_limits(deadline)
+
+        with self.converter.detected_type(input_path, ext) as input_path:
+            with tracer.span('convert', ext=ext, size=preflight.size, priority=priority, mode='asyncio'):
+                queued_at = time.time()
+                async with self.converter.scheduler.async_slot(priority, timeout=queue_timeout):
+                    tracer.record('scheduler.wait', queued_at, time.time(), priority=priority)
+                    # 后台请求：排队时间不占用转换的截止时间
+                    deadline = deadline or Deadline(self.converter.deadline_seconds)
+                    source = await run_blocking(self.executor, self.converter.optimize_assets, input_path, ext,
+                                                preflight.size)
+                    try:
+                        return await self._convert_routed(source, output_pdf, ext, options, preflight, deadline)
+                    finally:
+                        self.converter.discard_optimized(input_path, source)
+
+    async def _convert_routed(self, input_path: Path, output_pdf: Path, ext: str, options: ExportOptions,
+                              preflight: PreflightResult, deadline: Deadline) -> str:
+        """按路由策略依次尝试各引擎，失败则降级到下一个"""
+        converter = self.converter
+        plan = converter.plan_engines(ext, options)
+        budgets = converter.timeout_policy.plan_budgets(plan, ext, preflight.size, preflight.hints)
+        last_error = None
+
+        for index, engine in enumerate(plan):
+            deadline.raise_if_cancelled()
+            reserve = converter.timeout_policy.reserve_for(budgets, plan[index + 1:], deadline)
+            try:
+                timeout = converter.timeout_policy.attempt_timeout(budgets[engine], deadline, reserve)
+            except DeadlineExceeded as e:
+                logger.error(f"{str(e)}，放弃剩余引擎: {plan[index:]}")
+                raise
+            logger.info(f"尝试使用{engine}转换...（超时 {timeout:.0f}秒，剩余 {deadline.remaining():.0f}秒）")
+            start = time.time()
+            try:
+                with tracer.span(f'engine.{engine}', timeout=round(timeout, 1)) as span:
+                    result = await self._convert_with(engine, input_path, output_pdf, options, timeout,
+                                                      deadline.cancel_event)
+                    span.set(success=result is not None)
+            except asyncio.CancelledError:
+                converter.record_wasted(engine, start)
+                raise
+            except Exception as e:
+                logger.error(f"{engine}转换异常: {str(e)}")
+                result = None
+                last_error = e
+
+            if deadline.cancelled:
+                converter.record_wasted(engine, start)
+                if result:
+                    converter.cleanup_file(result)
+                deadline.raise_if_cancelled()
+            converter.router.record(engine, ext, result is not None, time.time() - start)
+
+            if result:
+                logger.info(f"✅ {engine}转换成功")
+                return result
+            logger.warning(f"{engine}转换失败，尝试下一个引擎")
+
+        if last_error:
+            raise last_error
+        raise Exception("没有可用的转换引擎" if not plan else "转换失败")
+
+    async def _convert_with(self, engine: str, input_path: Path, output_pdf: Path, options: ExportOptions,
+                            timeout: float, cancel_event: CancelToken) -> str:
+        if engine == ENGINE_WINDOWS:
+            return await self.windows.convert(input_path, output_pdf, options, timeout)
+        if engine == ENGINE_LIBREOFFICE:
+            if output_pdf.exists():
+                os.remove(output_pdf)
+            future = asyncio.ensure_future(run_blocking(
+                self.executor, self.converter._convert_via_libreoffice, input_path, output_pdf, options, timeout,
+                cancel_event
+            ))
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # 取消协程不会停止线程：置位取消信号终止soffice进程树，线程退出后才释放调度槽位
+                cancel_event.set()
+                with contextlib.suppress(Exception):
+                    await future
+                raise
+        raise ValueError(f"未知的转换引擎: {engine}")
@@ -0,0 +1,98 @@
+"""
+转换前资源优化的效果：每个文档节省的字节数和转换时间
+
+对每个文档生成优化后的副本，再用当前配置的引擎（.env 中的 Windows 服务 / LibreOffice）
+分别转换原文件和副本各 --rounds 次，取中位数。转换本身不再做资源优化。
+
+运行（需要安装 Pillow 才会缩小图片）:
+    python benchmarks/bench_asset_optimizer.py 作业1.docx 课件.pptx --rounds 3
+    python benchmarks/bench_asset_optimizer.py samples/*.pptx --dpi 150
+"""
+
+import argparse
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def convert_seconds(converter, path: Path, workdir: Path, rounds: int) -> float:
+    """转换 rounds 次的中位耗时（每次转换一个新副本）"""
+    durations = []
+    for index in range(rounds):
+        run_dir = workdir / f"run_{path.parent.name}_{index}"
+        run_dir.mkdir()
+        copy = run_dir / path.name
+        shutil.copyfile(path, copy)
+        start = time.time()
+        converter.convert_to_pdf(str(copy))
+        durations.append(time.time() - start)
+        shutil.rmtree(run_dir, ignore_errors=True)
+    return statistics.median(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='转换前资源优化效果')
+    parser.add_argument('documents', nargs='+', help='docx/pptx/xlsx 文档')
+    parser.add_argument('--rounds', type=int, default=3, help='每个文件转换的次数')
+    parser.add_argument('--dpi', type=int, help='图片保留的分辨率（默认 ASSET_TARGET_DPI）')
+    parser.add_argument('--no-convert', action='store_true', help='只优化，不比较转换时间')
+    args = parser.parse_args()
+
+    from config import config
+    from asset_optimizer import AssetOptimizer, Image
+    from converter import DocumentConverter
+
+    if Image is None:
+        print("未安装 Pillow：只删除缩略图和未使用的部件，不缩小图片")
+    optimizer = AssetOptimizer(
+        enabled=True,
+        target_dpi=args.dpi or config.ASSET_TARGET_DPI,
+        min_size=0,
+        min_image_bytes=config.ASSET_MIN_IMAGE_KB * 1024,
+        jpeg_quality=config.ASSET_JPEG_QUALITY
+    )
+    converter = None
+    if not args.no_convert:
+        converter = DocumentConverter()
+        converter.asset_optimizer.enabled = False
+        converter.warm_up()
+
+    workdir = Path(tempfile.mkdtemp(prefix='bench_assets_'))
+    print(f"{'文档':<28}{'原大小':>10}{'优化后':>10}{'图片':>6}{'优化耗时':>10}{'原转换':>10}{'优化后转换':>12}{'节省':>10}")
+    try:
+        for index, document in enumerate(map(Path, args.documents)):
+            optimized_dir = workdir / f"optimized_{index}"
+            optimized_dir.mkdir()
+            optimized = optimized_dir / document.name
+            report = optimizer.optimize(document, optimized)
+            if report is None:
+                print(f"{document.name[:26]:<28}{document.stat().st_size / 1024:>8.0f}KB  （没有可优化的内容）")
+                continue
+            line = (f"{document.name[:26]:<28}{report.original_bytes / 1024:>8.0f}KB{report.optimized_bytes / 1024:>8.0f}KB"
+                    f"{report.images_resized:>6}{report.seconds:>9.2f}s")
+            if converter is not None:
+                original_dir = workdir / f"original_{index}"
+                original_dir.mkdir()
+                original = original_dir / document.name
+                shutil.copyfile(document, original)
+                try:
+                    before = convert_seconds(converter, original, workdir, args.rounds)
+                    after = convert_seconds(converter, optimized, workdir, args.rounds)
+                except Exception as e:
+                    print(f"{line}  转换失败: {str(e)}")
+                    continue
+                # 节省的时间扣除优化本身的耗时
+                line += f"{before:>9.2f}s{after:>11.2f}s{before - after - report.seconds:>9.2f}s"
+            print(line)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""
+集群模式（CLUSTER_NODES）的分片效果：在本机启动多个节点进程模拟多台主机
+
+1. 哈希环：随机文档哈希在各节点上的分布，以及增加/减少一个节点时改变负责节点的
+   文档比例（理想值分别为 1/(N+1) 和 1/N），并与 hash % N 取模分片对比
+2. 实际请求（不带 --ring-only 时）：启动 --nodes 个 gunicorn 进程（每个进程一个 worker，
+   各自独立的临时目录、结果缓存和上传目录，相当于不同的主机），每个文档上传 --repeat 次，
+   每次随机发给一个节点（nginx 轮询夹杂其他用户的请求时，同一用户的重传落在哪个节点
+   基本随机），再从各节点的 /metrics 统计实际转换次数。
+   先不启用集群（各节点各自缓存），再启用集群模式，对比重复转换的次数；集群模式下
+   另外把一个分块上传会话的各个分块轮流发给不同节点，检查会话请求的转发。
+   --asgi 时各节点以 asyncio 服务模式（asgi_app.py）运行。
+
+转换使用 .env 中的引擎配置（没有 LibreOffice 时可以把 LIBREOFFICE_PATH 指向一个
+假的 soffice 脚本）。不指定文档时生成 --documents 个内容不同的小 docx。
+
+运行:
+    python benchmarks/bench_cluster.py --nodes 3 --repeat 3
+    python benchmarks/bench_cluster.py 作业1.docx 作业2.docx 课件.pptx --nodes 4
+    python benchmarks/bench_cluster.py --nodes 3 --asgi
+    python benchmarks/bench_cluster.py --ring-only --nodes 5
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+CONTENT_TYPES = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                 '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                 '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                 '<Default Extension="xml" ContentType="application/xml"/>'
+                 '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-'
+                 'officedocument.wordprocessingml.document.main+xml"/></Types>')
+ROOT_RELS = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+             '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+             '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+             'officeDocument" Target="word/document.xml"/></Relationships>')
+
+
+def make_docx(path: Path, text: str):
+    document = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+                f'<w:p><w:r><w:t>{text}</w:t></w:r></w:p></w:body></w:document>')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('[Content_Types].xml', CONTENT_TYPES)
+        zf.writestr('_rels/.rels', ROOT_RELS)
+        zf.writestr('word/document.xml', document)
+
+
+def ring_report(count: int, vnodes: int, keys: int = 100000):
+    from cluster import HashRing
+
+    names = [f"node{index}" for index in range(1, count + 1)]
+    samples = [hashlib.sha256(str(index).encode()).hexdigest() for index in range(keys)]
+
+    def owners(ring):
+        return [ring.owner(key) for key in samples]
+
+    before = owners(HashRing(names, vnodes))
+    shares = [before.count(name) / keys * count for name in names]
+    added = owners(HashRing(names + [f"node{count + 1}"], vnodes))
+    removed = owners(HashRing(names[1:], vnodes))
+
+    def moved(a, b):
+        return sum(x != y for x, y in zip(a, b)) / keys * 100
+
+    def modulo(n):
+        return [int(key, 16) % n for key in samples]
+
+    print(f"哈希环: {count} 个节点 × {vnodes} 个虚拟节点，{keys} 个随机文档哈希")
+    print(f"  各节点负责的文档数 / 平均值: 最少 {min(shares):.2f}，最多 {max(shares):.2f}")
+    print(f"  增加1个节点: {moved(before, added):.1f}% 的文档换了负责节点"
+          f"（理想 {100 / (count + 1):.1f}%，取模分片 {moved(modulo(count), modulo(count + 1)):.1f}%）")
+    print(f"  减少1个节点: {moved(before, removed):.1f}% 的文档换了负责节点"
+          f"（理想 {100 / count:.1f}%）")
+
+
+def wait_healthy(url: str, process: subprocess.Popen, timeout: float = 60):
+    import requests
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"节点进程已退出: {url}")
+        try:
+            if requests.get(f"{url}/health", timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise TimeoutError(f"{timeout}秒内节点没有就绪: {url}")
+
+
+def start_nodes(count: int, base_port: int, workdir: Path, clustered: bool, asgi: bool = False) -> list:
+    """启动 count 个节点（各自独立的目录），返回 [(名称, URL, 进程)]"""
+    names = [f"node{index}" for index in range(1, count + 1)]
+    urls = [f"http://127.0.0.1:{base_port + index}" for index in range(count)]
+    spec = ','.join(f"{name}={url}" for name, url in zip(names, urls)) if clustered else ''
+    nodes = []
+    for name, url in zip(names, urls):
+        home = workdir / ('cluster' if clustered else 'standalone') / name
+        env = dict(os.environ)
+        env.update({
+            'HOST': '127.0.0.1', 'PORT': url.rsplit(':', 1)[1],
+            'GUNICORN_WORKERS': '1', 'GUNICORN_THREADS': '8',
+            'CLUSTER_NODE': name, 'CLUSTER_NODES': spec,
+            'TEMP_DIR': str(home / 'temp'), 'RESULT_CACHE_DIR': str(home / 'results'),
+            'UPLOAD_SESSION_DIR': str(home / 'uploads'), 'LIBREOFFICE_PROFILE_DIR': str(home / 'profiles'),
+            'MEDIA_CACHE_DIR': str(home / 'media'), 'TOKEN_STORE_DIR': str(home / 'tokens'),
+            'TRACE_EXPORT': '', 'PROFILE_CONTINUOUS_DIR': '',
+        })
+        (home / 'temp').mkdir(parents=True, exist_ok=True)
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py']
+        command += ['-k', 'uvicorn.workers.UvicornWorker', 'asgi_app:app'] if asgi else ['app:app']
+        process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        nodes.append((name, url, process))
+    try:
+        for _, url, process in nodes:
+            wait_healthy(url, process)
+    except Exception:
+        stop_nodes(nodes)
+        raise
+    return nodes
+
+
+def stop_nodes(nodes: list):
+    for _, _, process in nodes:
+        process.send_signal(signal.SIGTERM)
+    for _, _, process in nodes:
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def metric_total(url: str, name: str) -> float:
+    import requests
+
+    total = 0.0
+    for line in requests.get(f"{url}/metrics", timeout=10).text.splitlines():
+        if line.startswith(name + '{') or line.startswith(name + ' '):
+            total += float(line.rsplit(' ', 1)[1])
+    return total
+
+
+def run_requests(nodes: list, documents: list, repeat: int, seed: int = 1) -> dict:
+    """每个文档上传 repeat 次，每次随机发给一个节点（两种模式使用相同的随机序列）"""
+    import requests
+
+    rng = random.Random(seed)
+    durations = []
+    failures = 0
+    served_by = {}
+    for _ in range(repeat):
+        for document in documents:
+            _, url, _ = rng.choice(nodes)
+            start = time.time()
+            with open(document, 'rb') as f:
+                response = requests.post(f"{url}/api/convert", files={'file': (document.name, f)}, timeout=180)
+            durations.append(time.time() - start)
+            if response.status_code != 200:
+                failures += 1
+                continue
+            node = response.headers.get('X-Cluster-Node', url)
+            served_by.setdefault(document.name, set()).add(node)
+    conversions = {name: metric_total(url, 'conversion_attempts_total') for name, url, _ in nodes}
+    return {
+        'requests': len(durations),
+        'failures': failures,
+        'median': statistics.median(durations),
+        'conversions': conversions,
+        'owners': sum(len(names) for names in served_by.values()) / max(len(served_by), 1),
+    }
+
+
+def check_upload(nodes: list, document: Path) -> str:
+    """分块上传：创建会话和各个分块轮流发给不同节点"""
+    import requests
+
+    data = document.read_bytes()
+    chunk = max(1, len(data) // (len(nodes) + 1))
+    response = requests.post(f"{nodes[0][1]}/api/uploads", data={'filename': document.name, 'size': len(data)},
+                             timeout=30)
+    if response.status_code != 201:
+        return f"创建会话失败: {response.status_code} {response.text[:200]}"
+    path = response.json()['url']
+    offset = 0
+    turn = 1
+    while offset < len(data):
+        _, url, _ = nodes[turn % len(nodes)]
+        turn += 1
+        piece = data[offset:offset + chunk]
+        response = requests.patch(f"{url}{path}", data=piece, headers={'Upload-Offset': str(offset)}, timeout=180)
+        if response.status_code != 200:
+            return f"分块 {offset} 发给 {url} 失败: {response.status_code} {response.text[:200]}"
+        offset += len(piece)
+    if response.headers.get('Content-Type') != 'application/pdf':
+        return f"上传完成后没有返回PDF: {response.text[:200]}"
+    return f"成功（{turn - 1} 个分块轮流发给 {len(nodes)} 个节点，由 {response.headers.get('X-Cluster-Node')} 返回PDF）"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='集群模式分片效果')
+    parser.add_argument('documents', nargs='*', help='Office文档（默认生成小 docx）')
+    parser.add_argument('--nodes', type=int, default=3, help='节点数')
+    parser.add_argument('--repeat', type=int, default=3, help='每个文档上传的次数')
+    parser.add_argument('--documents', dest='generate', type=int, default=6, help='不指定文档时生成的文档数')
+    parser.add_argument('--vnodes', type=int, default=int(os.getenv('CLUSTER_VNODES', '160')))
+    parser.add_argument('--port', type=int, default=5300, help='第一个节点的端口')
+    parser.add_argument('--asgi', action='store_true', help='节点以 asyncio 服务模式运行')
+    parser.add_argument('--ring-only', action='store_true', help='只分析哈希环，不启动节点')
+    args = parser.parse_args()
+
+    ring_report(args.nodes, args.vnodes)
+    if args.ring_only:
+        return
+
+    workdir = Path(tempfile.mkdtemp(prefix='bench_cluster_'))
+    documents = [Path(path) for path in args.documents]
+    if not documents:
+        for index in range(args.generate):
+            path = workdir / f"homework_{index + 1}.docx"
+            make_docx(path, f"作业 {index + 1} {random.random()}")
+            documents.append(path)
+
+    print(f"\n{len(documents)} 个文档 × {args.repeat} 次上传，每次随机发给 {args.nodes} 个节点之一")
+    print(f"{'模式':<12}{'请求':>6}{'失败':>6}{'转换次数':>10}{'中位耗时':>10}  各节点转换次数")
+    for clustered in (False, True):
+        nodes = start_nodes(args.nodes, args.port, workdir, clustered, args.asgi)
+        try:
+            result = run_requests(nodes, documents, args.repeat)
+            label = '集群' if clustered else '各自缓存'
+            per_node = ', '.join(f"{name} {count:.0f}" for name, count in result['conversions'].items())
+            print(f"{label:<12}{result['requests']:>6}{result['failures']:>6}"
+                  f"{sum(result['conversions'].values()):>10.0f}{result['median']:>9.2f}s  {per_node}")
+            if clustered:
+                print(f"  每个文档由 {result['owners']:.1f} 个节点返回（1.0 表示每个文档只由负责节点处理）")
+                print(f"  分块上传: {check_upload(nodes, documents[0])}")
+        finally:
+            stop_nodes(nodes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+导出配置（profile）的耗时和PDF大小对比
+
+对每个文档、每个导出配置转换 --rounds 次，输出中位数：
+
+- windows: 直接请求 WINDOWS_CONVERTER_URL，COM 各阶段耗时取自响应头 Server-Timing
+- libreoffice: 本机 soffice（导出配置对应 partial_export.EXPORT_PROFILES 中的过滤器选项）
+
+运行:
+    python benchmarks/bench_export_profiles.py 作业.docx 课件.pptx 成绩.xlsx --rounds 3
+    python benchmarks/bench_export_profiles.py 课件.pptx --engine libreoffice
+"""
+
+import argparse
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def run_windows(url: str, document: Path, profile: str, output: Path) -> dict:
+    import requests
+    from windows_transport import parse_server_timing
+
+    start = time.time()
+    with open(document, 'rb') as f:
+        response = requests.post(f"{url.rstrip('/')}/convert",
+                                 files={'document': (document.name, f, 'application/octet-stream')},
+                                 data={'profile': profile}, timeout=600)
+    if response.status_code != 200:
+        raise RuntimeError(f"Windows服务返回 {response.status_code}: {response.text[:200]}")
+    output.write_bytes(response.content)
+    result = parse_server_timing(response.headers.get('Server-Timing'))
+    result['total'] = time.time() - start
+    return result
+
+
+def run_libreoffice(converter, document: Path, profile: str, output: Path) -> dict:
+    from partial_export import ExportOptions
+
+    start = time.time()
+    if not converter._run_libreoffice(document, output, options=ExportOptions(profile=profile),
+                                      timeout=converter.timeout):
+        raise RuntimeError("LibreOffice转换失败")
+    return {'total': time.time() - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='导出配置对比')
+    parser.add_argument('documents', nargs='+', help='Office文档')
+    parser.add_argument('--engine', choices=('windows', 'libreoffice'), default='windows')
+    parser.add_argument('--rounds', type=int, default=3, help='每个文档、每个配置转换的次数')
+    parser.add_argument('--url', help='Windows服务地址（默认 WINDOWS_CONVERTER_URL）')
+    args = parser.parse_args()
+
+    from config import config
+    from partial_export import EXPORT_PROFILES
+
+    converter = None
+    url = args.url or config.WINDOWS_CONVERTER_URL
+    if args.engine == 'libreoffice':
+        from converter import DocumentConverter
+        converter = DocumentConverter()
+        converter.warm_up()
+    elif not url:
+        parser.error("未配置 WINDOWS_CONVERTER_URL，请用 --url 指定")
+
+    workdir = Path(tempfile.mkdtemp(prefix='bench_profiles_'))
+    print(f"{'文档':<24}{'配置':<12}{'总耗时':>8}{'打开':>8}{'导出':>8}{'PDF大小':>10}")
+    try:
+        for document in map(Path, args.documents):
+            baseline = None
+            for profile in EXPORT_PROFILES:
+                samples = []
+                output = workdir / f"{document.stem}.pdf"
+                try:
+                    for _ in range(args.rounds):
+                        if converter is not None:
+                            # soffice 按输入文件名输出，每次使用新的副本
+                            copy = workdir / document.name
+                            shutil.copyfile(document, copy)
+                            samples.append(run_libreoffice(converter, copy, profile, output))
+                        else:
+                            samples.append(run_windows(url, document, profile, output))
+                except Exception as e:
+                    print(f"{document.name[:22]:<24}{profile:<12}失败: {str(e)}")
+                    continue
+                median = {key: statistics.median(sample.get(key, 0) for sample in samples) for key in samples[0]}
+                baseline = baseline or median['total']
+                phases = ''.join(f"{median[phase]:>7.2f}s" if phase in median else f"{'-':>8}"
+                                 for phase in ('open', 'export'))
+                line = (f"{document.name[:22]:<24}{profile:<12}{median['total']:>7.2f}s{phases}"
+                        f"{output.stat().st_size / 1024:>8.0f}KB  ({median['total'] / baseline * 100:.0f}%)")
+                print(line)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+LibreOffice 并发转换基准测试
+
+对同一个样例文档，在不同并发度下重复转换，输出吞吐量和相对单并发的扩展效率。
+使用独立配置目录池后，吞吐量应随并发度近似线性增长，直到达到CPU核数。
+
+运行（在容器内）:
+    python benchmarks/bench_libreoffice_concurrency.py sample.docx --jobs 16
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import config  # noqa: E402
+from converter import DocumentConverter  # noqa: E402
+
+
+def run_round(converter: DocumentConverter, sample: Path, workdir: Path, concurrency: int, jobs: int) -> float:
+    """以指定并发度转换 jobs 次，返回总耗时"""
+    inputs = []
+    for i in range(jobs):
+        job_dir = workdir / f"c{concurrency}_{i}"
+        job_dir.mkdir()
+        target = job_dir / f"input{sample.suffix}"
+        shutil.copy(sample, target)
+        inputs.append(target)
+
+    def convert(path: Path):
+        return converter._convert_via_libreoffice(path, path.with_suffix('.pdf'))
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(convert, inputs))
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LibreOffice并发转换基准测试')
+    parser.add_argument('sample', help='样例文档路径')
+    parser.add_argument('--jobs', type=int, default=16, help='每轮转换次数')
+    parser.add_argument('--max-concurrency', type=int, default=config.LIBREOFFICE_CONCURRENCY)
+    args = parser.parse_args()
+
+    sample = Path(args.sample)
+    converter = DocumentConverter()
+    # 预热放在计时之外
+    converter.libreoffice_pool.warm_up()
+
+    print(f"CPU核数: {os.cpu_count()}, 槽位数: {converter.libreoffice_pool.size}")
+    print(f"{'并发':>4} {'耗时(秒)':>10} {'吞吐(个/秒)':>12} {'扩展效率':>8}")
+
+    baseline = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for concurrency in range(1, args.max_concurrency + 1):
+            elapsed = run_round(converter, sample, Path(tmp), concurrency, args.jobs)
+            throughput = args.jobs / elapsed
+            baseline = baseline or throughput
+            efficiency = throughput / (baseline * concurrency)
+            print(f"{concurrency:>4} {elapsed:>10.2f} {throughput:>12.2f} {efficiency:>8.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+共享令牌桶限流的开销和跨进程准确性
+
+1. 单次检查的耗时：--processes 个进程（模拟 gunicorn worker）同时对不同的键调用
+   acquire()，统计每次调用的中位数和 p99
+2. 跨进程准确性：所有进程在 --seconds 秒内对同一个键连续请求，放行的总次数应为
+   burst + rate × 时长（各 worker 各自计数时为进程数倍）
+
+运行:
+    python benchmarks/bench_rate_limit.py --processes 4
+    python benchmarks/bench_rate_limit.py --processes 8 --rate 60 --burst 10 --seconds 5
+"""
+
+import argparse
+import multiprocessing
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def latency_worker(args):
+    from rate_limit import RateLimiter
+
+    store_dir, index, calls, keys = args
+    limiter = RateLimiter('bench', 1e9, 1000000, store_dir)
+    durations = []
+    for call in range(calls):
+        key = f"10.0.{index}.{call % keys}"
+        start = time.perf_counter()
+        limiter.acquire(key)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def hammer_worker(args):
+    from rate_limit import RateLimiter
+
+    store_dir, rate, burst, until = args
+    limiter = RateLimiter('shared', rate, burst, store_dir)
+    allowed = 0
+    while time.time() < until:
+        if limiter.acquire('user') == 0:
+            allowed += 1
+    return allowed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='共享令牌桶限流')
+    parser.add_argument('--processes', type=int, default=4, help='并发进程数')
+    parser.add_argument('--calls', type=int, default=20000, help='每个进程检查的次数')
+    parser.add_argument('--keys', type=int, default=500, help='每个进程使用的不同键数')
+    parser.add_argument('--rate', type=float, default=120, help='每分钟补充的令牌数')
+    parser.add_argument('--burst', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=3.0, help='准确性测试的时长')
+    args = parser.parse_args()
+
+    store_dir = tempfile.mkdtemp(prefix='bench_ratelimit_')
+    with multiprocessing.Pool(args.processes) as pool:
+        start = time.time()
+        results = pool.map(latency_worker, [(store_dir, index, args.calls, args.keys)
+                                            for index in range(args.processes)])
+        elapsed = time.time() - start
+        durations = sorted(duration for result in results for duration in result)
+        print(f"{args.processes} 个进程 × {args.calls} 次检查: "
+              f"中位数 {statistics.median(durations) * 1e6:.1f}µs，"
+              f"p99 {durations[int(len(durations) * 0.99)] * 1e6:.1f}µs，"
+              f"合计 {len(durations) / elapsed:.0f} 次/秒")
+
+        until = time.time() + args.seconds
+        allowed = sum(pool.map(hammer_worker, [(store_dir, args.rate, args.burst, until)] * args.processes))
+    expected = args.burst + args.rate / 60 * args.seconds
+    print(f"同一个键 {args.seconds:.0f} 秒: 放行 {allowed} 次，预期约 {expected:.0f} 次"
+          f"（各进程各自计数时约 {expected * args.processes:.0f} 次）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+企业微信流水线端到端吞吐基准测试
+
+启动一个本地企业微信API桩（模拟下载/上传的网络延迟），分别用
+“每个任务依次执行全部步骤”的旧模型和分阶段流水线处理同一批任务，
+对比总耗时和吞吐量。两种模型使用相同的转换并发度。
+
+运行:
+    python benchmarks/bench_wecom_pipeline.py --jobs 40 --net-delay 0.5 --convert-time 1.0
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+NET_DELAY = 0.5
+DOWNLOAD_COUNTER = itertools.count()
+
+
+class WeComStubHandler(BaseHTTPRequestHandler):
+    """模拟 qyapi.weixin.qq.com 的几个接口"""
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, data: dict):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith('/cgi-bin/gettoken'):
+            return self._json({'errcode': 0, 'access_token': 'stub-token', 'expires_in': 7200})
+        if self.path.startswith('/cgi-bin/media/get'):
+            time.sleep(NET_DELAY)
+            # 每次返回不同内容，避免命中素材缓存
+            body = f'stub document {next(DOWNLOAD_COUNTER)}'.encode() * 1024
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_error(404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        if self.path.startswith('/cgi-bin/media/upload'):
+            time.sleep(NET_DELAY)
+            return self._json({'errcode': 0, 'media_id': 'stub-media'})
+        if self.path.startswith('/cgi-bin/message/send'):
+            return self._json({'errcode': 0})
+        self.send_error(404)
+
+
+class FakeConverter:
+    """用固定耗时模拟转换，并限制同时转换的数量"""
+
+    def __init__(self, convert_time: float, slots: int):
+        self.convert_time = convert_time
+        self.slots = threading.Semaphore(slots)
+
+    def convert_to_pdf(self, input_file: str) -> str:
+        with self.slots:
+            time.sleep(self.convert_time)
+        output = str(Path(input_file).with_suffix('.pdf'))
+        Path(output).write_bytes(b'%PDF-1.4 stub')
+        return output
+
+    def cleanup_file(self, file_path: str):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def run_sequential(wecom_api, converter, jobs: int, threads: int) -> float:
+    """旧模型：每个线程依次执行下载、转换、上传、发送"""
+    from config import config
+
+    def process(i: int):
+        input_file = os.path.join(config.TEMP_DIR, f"seq_{i}.docx")
+        wecom_api.download_media('stub', input_file)
+        output_pdf = converter.convert_to_pdf(input_file)
+        media_id = wecom_api.upload_media(output_pdf, 'file')
+        wecom_api.send_file_message('user', media_id)
+        converter.cleanup_file(input_file)
+        converter.cleanup_file(output_pdf)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(process, range(jobs)))
+    return time.time() - start
+
+
+def run_pipeline(wecom_api, converter, jobs: int, io_workers: int, convert_workers: int) -> float:
+    from wecom_pipeline import WeComPipeline
+
+    pipeline = WeComPipeline(wecom_api, converter, io_workers=io_workers,
+                             convert_workers=convert_workers, queue_size=jobs)
+    start = time.time()
+    for _ in range(jobs):
+        pipeline.submit('user', 'stub', 'doc.docx')
+    for stage in pipeline.stages:
+        stage.queue.join()
+    return time.time() - start
+
+
+def main():
+    global NET_DELAY
+    parser = argparse.ArgumentParser(description='企业微信流水线吞吐基准测试')
+    parser.add_argument('--jobs', type=int, default=40)
+    parser.add_argument('--net-delay', type=float, default=0.5, help='下载/上传各自的模拟网络耗时（秒）')
+    parser.add_argument('--convert-time', type=float, default=1.0, help='单次转换耗时（秒）')
+    parser.add_argument('--convert-workers', type=int, default=2)
+    parser.add_argument('--io-workers', type=int, default=4)
+    args = parser.parse_args()
+    NET_DELAY = args.net_delay
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), WeComStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    temp_dir = tempfile.mkdtemp(prefix='wecom_bench_')
+    os.environ['WECOM_API_BASE'] = f"http://127.0.0.1:{server.server_port}"
+    os.environ['WECOM_AGENT_ID'] = '1'
+    os.environ['TEMP_DIR'] = temp_dir
+    os.environ['MEDIA_CACHE_DIR'] = os.path.join(temp_dir, 'media_cache')
+    os.environ['TOKEN_STORE_DIR'] = os.path.join(temp_dir, 'tokens')
+
+    from metrics import metrics
+    from wecom_api import WeComAPI
+
+    wecom_api = WeComAPI()
+    converter = FakeConverter(args.convert_time, args.convert_workers)
+
+    # 旧模型下每个线程同时占用一个“转换名额”和网络等待，线程数等于转换并发度
+    sequential = run_sequential(wecom_api, converter, args.jobs, args.convert_workers)
+    pipelined = run_pipeline(wecom_api, converter, args.jobs, args.io_workers, args.convert_workers)
+
+    print(f"任务数: {args.jobs}, 网络延迟: {args.net_delay}s x2, 转换耗时: {args.convert_time}s")
+    print(f"顺序执行: {sequential:.2f}s  ({args.jobs / sequential:.2f} 个/秒)")
+    print(f"分阶段流水线: {pipelined:.2f}s  ({args.jobs / pipelined:.2f} 个/秒)")
+    print()
+    for name, summary in sorted(metrics.snapshot()['summaries'].items()):
+        if name.startswith('wecom_pipeline'):
+            print(f"{name}: p50={summary['p50']:.3f}s p95={summary['p95']:.3f}s")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
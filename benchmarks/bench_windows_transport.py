@@ -0,0 +1,248 @@
+"""
+到 Windows 转换服务的传输基准测试：线上字节数和传输耗时
+
+在本机启动一个模拟的 Windows 服务（与 windows_converter_service.py 相同的压缩处理：
+DecompressMiddleware 解压请求体、按 Accept-Encoding 压缩返回的PDF、HTTP/1.1 持久连接），
+中间经过一个限速的TCP代理（模拟带宽有限的虚拟机链路），用 DocumentConverter 的
+Windows 客户端逐个发送转换请求，对比：
+
+- 不压缩 / gzip / zstd（安装了 zstandard 时）
+- 每次新建连接 / 持久连接（WINDOWS_KEEPALIVE，模拟服务需要安装 waitress）
+
+模拟服务不做转换，直接返回 --pdf 指定的文件；不指定文档和PDF时使用合成的数据
+（旧版 .doc 风格的 OLE 文件、未压缩文字流的PDF），压缩率与真实文件会有差异，
+可以用真实文件替换:
+    python benchmarks/bench_windows_transport.py
+    python benchmarks/bench_windows_transport.py --document 作业.doc --pdf 作业.pdf --rate-mbit 20 --jobs 10
+"""
+
+import argparse
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+WORDS = ('作业 练习 第一题 第二题 答案 解析 计算 填空 选择 判断 阅读 理解 写作 '
+         'the of and to in is that for it as with was on be by this are').split()
+
+
+def synthetic_text(size: int, seed: int) -> str:
+    rng = random.Random(seed)
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)
+
+
+def make_document(path: Path, size: int):
+    """旧版 .doc 风格：OLE 文件头 + UTF-16 文本 + 零填充的扇区"""
+    text = synthetic_text(size // 3, seed=1).encode('utf-16-le')
+    data = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1' + b'\x00' * 504 + text
+    data += b'\x00' * (-len(data) % 512 + 4096)
+    path.write_bytes(data[:max(size, 1024)])
+
+
+def make_pdf(path: Path, size: int):
+    """文字为主、内容流未压缩的PDF"""
+    parts = [b'%PDF-1.4\n']
+    page = 0
+    while sum(len(p) for p in parts) < size:
+        page += 1
+        lines = synthetic_text(3000, seed=page).encode('utf-8')
+        stream = b'BT /F1 10 Tf 50 800 Td (' + lines + b') Tj ET'
+        parts.append(f'{page} 0 obj\n<< /Length {len(stream)} >>\nstream\n'.encode() + stream + b'\nendstream\nendobj\n')
+    parts.append(b'trailer\n<< >>\n%%EOF\n')
+    path.write_bytes(b''.join(parts))
+
+
+class ThrottledProxy:
+    """限速的TCP代理：每个方向按 rate 字节/秒转发，并统计转发的字节数"""
+
+    def __init__(self, upstream_port: int, rate: float, latency: float):
+        self.upstream_port = upstream_port
+        self.rate = rate
+        self.latency = latency
+        self.sent = {'upload': 0, 'download': 0}
+        self.connections = 0
+        self._lock = threading.Lock()
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(64)
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def reset(self):
+        with self._lock:
+            self.sent = {'upload': 0, 'download': 0}
+            self.connections = 0
+
+    def _accept(self):
+        while True:
+            client, _ = self.listener.accept()
+            upstream = socket.create_connection(('127.0.0.1', self.upstream_port))
+            with self._lock:
+                self.connections += 1
+            threading.Thread(target=self._pump, args=(client, upstream, 'upload'), daemon=True).start()
+            threading.Thread(target=self._pump, args=(upstream, client, 'download'), daemon=True).start()
+
+    def _pump(self, src: socket.socket, dst: socket.socket, direction: str):
+        chunk_size = 16 * 1024
+        first = True
+        try:
+            while True:
+                data = src.recv(chunk_size)
+                if not data:
+                    break
+                if first and self.latency:
+                    time.sleep(self.latency)
+                first = False
+                time.sleep(len(data) / self.rate)
+                dst.sendall(data)
+                with self._lock:
+                    self.sent[direction] += len(data)
+        except OSError:
+            pass
+        finally:
+            for sock in (src, dst):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+def start_fake_service(pdf_path: Path) -> int:
+    """与 windows_converter_service.py 相同压缩处理的模拟服务，返回端口"""
+    from flask import Flask, request, send_file
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from http_compression import (
+        AVAILABLE_ENCODINGS, DecompressMiddleware, compress_file, negotiate, worth_compressing
+    )
+
+    app = Flask('fake_windows_service')
+    app.wsgi_app = DecompressMiddleware(app.wsgi_app, AVAILABLE_ENCODINGS)
+
+    @app.after_request
+    def advertise(response):
+        response.headers['Accept-Encoding'] = ', '.join(AVAILABLE_ENCODINGS)
+        return response
+
+    @app.route('/convert', methods=['POST'])
+    def convert():
+        document = request.files['document']
+        document.stream.read()
+        encoding = negotiate(request.headers.get('Accept-Encoding'), AVAILABLE_ENCODINGS)
+        if encoding and worth_compressing(str(pdf_path), 65536, encoding):
+            compressed = tempfile.NamedTemporaryFile(suffix='.compressed', delete=False)
+            compressed.close()
+            compress_file(str(pdf_path), compressed.name, encoding)
+            response = send_file(compressed.name, mimetype='application/pdf', conditional=False, etag=False)
+            response.headers['Content-Encoding'] = encoding
+            # 与 Windows 服务的 delete_after_sending 相同：直通的文件响应不会调用 call_on_close
+            response.direct_passthrough = False
+            response.call_on_close(lambda: os.remove(compressed.name))
+            return response
+        return send_file(str(pdf_path), mimetype='application/pdf')
+
+    try:
+        # 与 Windows 服务相同：有 waitress 时使用（支持持久连接）
+        from waitress.server import create_server
+    except ImportError:
+        print("未安装 waitress，模拟服务每个响应后关闭连接，持久连接模式不会复用连接")
+        WSGIRequestHandler.log_request = lambda *args, **kwargs: None
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server.server_port
+    server = create_server(app, host='127.0.0.1', port=0, threads=4)
+    threading.Thread(target=server.run, daemon=True).start()
+    return server.effective_port
+
+
+def run_mode(converter, proxy: ThrottledProxy, document: Path, jobs: int, encodings: list, keepalive: bool,
+             workdir: Path) -> dict:
+    from windows_transport import WindowsTransport
+
+    transport = WindowsTransport(encodings, min_size=65536, keepalive=keepalive, pool_size=1)
+    converter.windows_transport = transport
+    output = workdir / 'out.pdf'
+    # 预热一次：得知服务端支持的请求压缩格式（不计入结果）
+    converter._convert_via_windows(document, output, timeout=600)
+    if not keepalive:
+        transport.close()
+    proxy.reset()
+
+    start = time.time()
+    for _ in range(jobs):
+        if not converter._convert_via_windows(document, output, timeout=600):
+            raise RuntimeError("转换请求失败")
+    elapsed = time.time() - start
+    transport.close()
+    return {
+        'upload': proxy.sent['upload'] / jobs,
+        'download': proxy.sent['download'] / jobs,
+        'connections': proxy.connections,
+        'seconds': elapsed / jobs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Windows服务传输压缩/持久连接基准测试')
+    parser.add_argument('--document', help='上传的文档（默认合成的 .doc）')
+    parser.add_argument('--pdf', help='模拟服务返回的PDF（默认合成的文字PDF）')
+    parser.add_argument('--size-mb', type=float, default=4, help='合成文件的大小（MB）')
+    parser.add_argument('--rate-mbit', type=float, default=50, help='链路带宽（Mbit/s）')
+    parser.add_argument('--latency-ms', type=float, default=20, help='每个连接首包的额外延迟（毫秒，模拟建连开销）')
+    parser.add_argument('--jobs', type=int, default=5, help='每种模式的转换请求数')
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix='bench_transport_'))
+    for key, default in (('TEMP_DIR', 'temp'), ('LIBREOFFICE_PROFILE_DIR', 'profiles'),
+                         ('TRACE_EXPORT', ''), ('RESULT_CACHE_DIR', '')):
+        os.environ[key] = str(workdir / default) if default else ''
+
+    size = int(args.size_mb * 1024 * 1024)
+    document = Path(args.document) if args.document else workdir / 'homework.doc'
+    pdf = Path(args.pdf) if args.pdf else workdir / 'homework.pdf'
+    if not args.document:
+        make_document(document, size)
+    if not args.pdf:
+        make_pdf(pdf, size)
+
+    service_port = start_fake_service(pdf)
+    proxy = ThrottledProxy(service_port, rate=args.rate_mbit * 1024 * 1024 / 8, latency=args.latency_ms / 1000)
+
+    os.environ['WINDOWS_CONVERTER_URL'] = f'http://127.0.0.1:{proxy.port}'
+    from converter import DocumentConverter
+    from http_compression import AVAILABLE_ENCODINGS
+
+    converter = DocumentConverter()
+    converter.windows_url = os.environ['WINDOWS_CONVERTER_URL']
+
+    print(f"文档 {document.name}: {document.stat().st_size / 1024:.0f} KB，"
+          f"PDF {pdf.name}: {pdf.stat().st_size / 1024:.0f} KB，"
+          f"链路 {args.rate_mbit:g} Mbit/s，每种模式 {args.jobs} 次")
+    print(f"{'模式':<24}{'上传/次':>12}{'下载/次':>12}{'连接数':>8}{'耗时/次':>10}")
+    modes = [('不压缩', [])] + [(encoding, [encoding]) for encoding in AVAILABLE_ENCODINGS]
+    baseline = None
+    for name, encodings in modes:
+        for keepalive in (False, True):
+            result = run_mode(converter, proxy, document, args.jobs, encodings, keepalive, workdir)
+            baseline = baseline or result
+            label = f"{name} + {'持久连接' if keepalive else '新建连接'}"
+            print(f"{label:<24}{result['upload'] / 1024:>10.0f}KB{result['download'] / 1024:>10.0f}KB"
+                  f"{result['connections']:>8}{result['seconds']:>9.2f}s"
+                  f"  ({result['seconds'] / baseline['seconds'] * 100:.0f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+gunicorn worker 启动到处理首个请求的耗时基准测试
+
+启动只有1个 worker 的 gunicorn，反复 SIGKILL 该 worker（模拟 --timeout 回收），
+kill 之后立即发出一个请求并计时：监听 socket 由 master 持有，请求会在 backlog 中
+等待新 worker，因此测得的延迟 = 新 worker 启动 + 处理首个请求。
+
+首个请求使用 /debug/recent，它会用到转换器、企业微信客户端和流水线。
+
+运行（对比默认启动方式和 gunicorn.conf.py 的预加载）:
+    python benchmarks/bench_worker_boot.py --rounds 10
+    python benchmarks/bench_worker_boot.py --rounds 10 --config gunicorn.conf.py
+"""
+
+import argparse
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def children(pid: int) -> list:
+    """pid 的直接子进程（读取 /proc）"""
+    result = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            result.append(int(name))
+    return result
+
+
+def first_response(url: str, timeout: float = 60) -> float:
+    """请求直到成功返回，返回耗时"""
+    start = time.time()
+    while time.time() - start < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as resp:
+                resp.read()
+                return time.time() - start
+        except OSError:
+            time.sleep(0.01)
+    raise TimeoutError(f"{timeout}秒内没有响应: {url}")
+
+
+def wait_worker(master: int, old: int = None, timeout: float = 30) -> int:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        workers = [pid for pid in children(master) if pid != old]
+        if workers:
+            return workers[0]
+        time.sleep(0.01)
+    raise TimeoutError("没有等到新的 worker")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='gunicorn worker启动耗时基准测试')
+    parser.add_argument('--config', help='gunicorn 配置文件（如 gunicorn.conf.py），不指定时使用默认启动参数')
+    parser.add_argument('--rounds', type=int, default=10, help='kill worker 的次数')
+    parser.add_argument('--port', type=int, default=5099)
+    args = parser.parse_args()
+
+    url = f'http://127.0.0.1:{args.port}/debug/recent'
+    cmd = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{args.port}',
+           '--workers', '1', '--threads', '4', '--log-level', 'warning']
+    # 不指定配置时显式传空配置：gunicorn 默认会读取当前目录下的 gunicorn.conf.py
+    cmd += ['-c', args.config or os.devnull]
+    cmd.append('app:app')
+
+    master = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        cold = first_response(url)
+        worker = wait_worker(master.pid)
+        samples = []
+        for _ in range(args.rounds):
+            # 等上一个 worker 的后台预热完成，每轮从相同状态开始
+            time.sleep(1)
+            os.kill(worker, signal.SIGKILL)
+            samples.append(first_response(url))
+            worker = wait_worker(master.pid, old=worker)
+
+        print(f"配置: {args.config or '默认（无预加载）'}")
+        print(f"冷启动到首个响应: {cold * 1000:.0f}ms")
+        print(f"worker 重启到首个响应（{args.rounds}次）: "
+              f"中位数 {statistics.median(samples) * 1000:.0f}ms, "
+              f"最小 {min(samples) * 1000:.0f}ms, 最大 {max(samples) * 1000:.0f}ms")
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait(timeout=30)
+
+
+if __name__ == '__main__':
+    main()
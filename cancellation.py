@@ -0,0 +1,216 @@
+"""
+端到端取消
+
+iOS 用户退出快捷指令、或 nginx 的超时先到时，请求方已经不再等待结果，
+但转换仍会继续：在调度队列里占位、soffice 进程树继续消耗 CPU、Windows
+服务继续转换，最后生成一个没人下载的 PDF。这里提供取消信号在整条链路上的传递：
+
+- CancelToken: 兼容 threading.Event 的取消信号，置位时执行注册的回调
+  （唤醒排队中的线程、中止进行中的 HTTP 请求、通知对冲的两个引擎）
+- watch_request: 请求处理期间在后台检测客户端断开和截止时间到期，
+  发现后取消该请求的 Deadline
+- AbortableSession: 可以从其他线程中止的 requests 会话（关闭底层 socket）
+"""
+
+import select
+import socket
+import logging
+import threading
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 取消原因
+CANCEL_CLIENT_DISCONNECTED = 'client_disconnected'
+CANCEL_DEADLINE = 'deadline_exceeded'
+
+# 调用方为本次请求留出的秒数，Windows 服务据此放弃已经没有人等待的转换
+REQUEST_TIMEOUT_HEADER = 'X-Request-Timeout'
+
+
+class ConversionCancelled(Exception):
+    """转换被取消（对冲落败、客户端断开等）"""
+
+
+class CancelToken(threading.Event):
+    """
+    取消信号：在 threading.Event 的基础上支持置位回调
+
+    可以直接传给只调用 is_set()/wait() 的代码（如 soffice_runner.run_supervised）。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    def set(self):
+        with self._callbacks_lock:
+            if self.is_set():
+                return
+            super().set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"取消回调执行失败: {str(e)}")
+
+    @contextmanager
+    def on_set(self, callback):
+        """
+        在 with 块内注册置位回调（已置位时立即执行）
+
+        回调在调用 set() 的线程中执行，不能阻塞。
+        """
+        with self._callbacks_lock:
+            registered = not self.is_set()
+            if registered:
+                self._callbacks.append(callback)
+        if not registered:
+            callback()
+        try:
+            yield
+        finally:
+            with self._callbacks_lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+
+
+def client_socket(environ: dict):
+    """WSGI 请求对应的客户端 socket（gunicorn / Werkzeug 开发服务器），取不到时返回None"""
+    sock = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    return sock if isinstance(sock, socket.socket) else None
+
+
+def socket_closed(sock: socket.socket) -> bool:
+    """
+    对端是否已关闭连接（不消费缓冲区中的数据）
+
+    请求体已经读完，此时 socket 可读只可能是对端关闭（读到EOF）或连接被重置。
+    用 poll 而不是 select：select 不能处理大于等于 FD_SETSIZE（1024）的描述符，
+    并发连接多的 worker 里会抛 ValueError。
+    """
+    fd = sock.fileno()
+    if fd < 0:
+        return True  # 本端已经关闭
+    poller = select.poll()
+    poller.register(fd, select.POLLIN | select.POLLPRI)
+    events = poller.poll(0)
+    if not events:
+        return False
+    if events[0][1] & (select.POLLHUP | select.POLLERR):
+        return True
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True  # 连接被重置
+
+
+@contextmanager
+def watch_request(deadline, sock: socket.socket = None, interval: float = 0.5):
+    """
+    在 with 块内后台检测客户端断开和截止时间到期，发现后取消 deadline
+
+    nginx 在客户端断开时会关闭到上游的连接（proxy_ignore_client_abort off），
+    所以检测 gunicorn 这一侧的 socket 即可。
+
+    Args:
+        deadline: 本次请求的 Deadline
+        sock: 客户端 socket，为空时只检测截止时间
+        interval: 检测间隔秒数
+    """
+    stop = threading.Event()
+
+    def watch():
+        while not stop.wait(interval):
+            if deadline.cancelled:
+                return
+            if sock is not None and socket_closed(sock):
+                deadline.cancel(CANCEL_CLIENT_DISCONNECTED)
+                return
+            if deadline.expired:
+                deadline.cancel(CANCEL_DEADLINE)
+                return
+
+    watcher = threading.Thread(target=watch, name='request-watcher', daemon=True)
+    watcher.start()
+    try:
+        yield
+    finally:
+        stop.set()
+
+
+class _TrackingAdapter(HTTPAdapter):
+    """记录经手的连接，以便从其他线程关闭"""
+
+    def __init__(self):
+        super().__init__(max_retries=0)
+        self.connections = set()
+        self.aborted = False
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        pool = super().get_connection_with_tls_context(request, verify, proxies, cert)
+        self._track(pool)
+        return pool
+
+    def get_connection(self, url, proxies=None):
+        pool = super().get_connection(url, proxies)
+        self._track(pool)
+        return pool
+
+    def _track(self, pool):
+        # 连接池按需新建连接：包装 _new_conn 记录新建的连接
+        if getattr(pool, '_tracked_by', None) is self:
+            return
+        new_conn = pool._new_conn
+
+        def tracked_new_conn():
+            if self.aborted:
+                raise requests.exceptions.ConnectionError("请求已中止")
+            conn = new_conn()
+            # 复用的会话（持久连接）会不断新建连接，只保留仍然打开的
+            self.connections = {c for c in self.connections if getattr(c, 'sock', None) is not None}
+            self.connections.add(conn)
+            return conn
+
+        pool._new_conn = tracked_new_conn
+        pool._tracked_by = self
+
+
+class AbortableSession(requests.Session):
+    """
+    可以从其他线程中止的 requests 会话
+
+    abort() 关闭会话中所有连接的 socket，阻塞在上传或等待响应中的请求
+    立即以 ConnectionError 返回，对端（Windows 服务）随之看到连接断开。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._adapter = _TrackingAdapter()
+        self.mount('http://', self._adapter)
+        self.mount('https://', self._adapter)
+
+    @property
+    def aborted(self) -> bool:
+        return self._adapter.aborted
+
+    def abort(self):
+        self._adapter.aborted = True
+        for conn in list(self._adapter.connections):
+            sock = getattr(conn, 'sock', None)
+            if sock is None:
+                continue
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        metrics.inc('http_requests_aborted_total')
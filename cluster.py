@@ -0,0 +1,221 @@
+"""
+集群模式：按文档内容哈希在多个节点之间分片结果缓存和转换
+
+nginx 轮询把请求分给各节点时，如果每个节点各自缓存、各自转换，同一个文档会在
+多个节点上重复转换，缓存命中率随节点数下降。集群模式下每个节点都知道全部节点
+（CLUSTER_NODES），用一致性哈希为每个文档内容哈希选出唯一的负责节点：
+
+- 负责节点在本地查缓存、转换并缓存结果
+- 其他节点把转换请求（已保存的文档和参数）转发给负责节点，只带哈希的缓存查询
+  也转发，负责节点的响应原样流式返回给客户端
+- 断点续传会话的数据只在创建它的节点上：会话ID选用由本节点负责的值，
+  其他节点收到该会话的请求时按同样的哈希转发
+- 负责节点连不上时在本节点处理，之后 cooldown 秒内不再尝试该节点
+
+哈希环上每个节点有 vnodes 个虚拟节点，增减一个节点只改变约 1/N 的文档的负责节点。
+环上使用节点名称而不是地址，节点换地址不影响分片。转发的请求在 X-Cluster-Forwarded
+请求头中带上据以路由的键（文档哈希或会话ID），接收方对该键一律在本地处理，
+成员配置不一致时（滚动更新）也不会循环转发。
+"""
+
+import time
+import bisect
+import hashlib
+import logging
+import threading
+
+import requests
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 转发的请求带上据以路由的键；响应头标明处理请求的节点
+CLUSTER_FORWARDED_HEADER = 'X-Cluster-Forwarded'
+CLUSTER_NODE_HEADER = 'X-Cluster-Node'
+
+# 逐跳头部，代理时不转发
+HOP_BY_HOP_HEADERS = frozenset((
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailer', 'trailers', 'transfer-encoding', 'upgrade',
+))
+
+
+class PeerUnavailable(Exception):
+    """负责节点连接失败（已标记为暂时不可用）"""
+
+
+def parse_nodes(spec: str) -> dict:
+    """
+    解析 CLUSTER_NODES，如 "app1=http://app1:5000,app2=http://app2:5000"
+
+    Returns:
+        dict: 节点名称 -> 基础URL
+
+    Raises:
+        ValueError: 格式错误
+    """
+    nodes = {}
+    for item in (spec or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, url = item.partition('=')
+        name, url = name.strip(), url.strip().rstrip('/')
+        if not name or not url.startswith(('http://', 'https://')):
+            raise ValueError(f"CLUSTER_NODES 的格式应为 名称=http://地址:端口，逗号分隔: {item}")
+        nodes[name] = url
+    return nodes
+
+
+def _point(value: str) -> int:
+    return int.from_bytes(hashlib.sha256(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    一致性哈希环
+
+    Args:
+        nodes: 节点名称
+        vnodes: 每个节点的虚拟节点数，越多各节点分到的键越均匀
+    """
+
+    def __init__(self, nodes, vnodes: int = 160):
+        points = sorted((_point(f"{node}#{index}"), node) for node in set(nodes) for index in range(vnodes))
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key: str) -> str:
+        """负责 key 的节点（顺时针方向第一个虚拟节点），环为空时返回None"""
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _point(key)) % len(self._points)
+        return self._nodes[index]
+
+
+class Cluster:
+    """
+    本节点视角的集群成员和请求路由
+
+    Args:
+        node: 本节点名称（CLUSTER_NODE）
+        nodes: 全部节点（含本节点）名称 -> 基础URL，少于两个节点时不启用
+        vnodes: 每个节点的虚拟节点数
+        connect_timeout: 连接其他节点的超时（秒）
+        cooldown: 节点连接失败后暂停转发的时间（秒）
+
+    Raises:
+        ValueError: 启用集群时本节点不在节点列表中
+    """
+
+    def __init__(self, node: str, nodes: dict, vnodes: int = 160, connect_timeout: float = 3.0,
+                 cooldown: float = 10.0):
+        self.node = node
+        self.nodes = dict(nodes)
+        self.enabled = len(self.nodes) > 1
+        if self.enabled and node not in self.nodes:
+            raise ValueError(f"CLUSTER_NODE（{node}）必须是 CLUSTER_NODES 中的一个节点名称")
+        self.ring = HashRing(self.nodes, vnodes)
+        self.connect_timeout = connect_timeout
+        self.cooldown = cooldown
+        self._down_until = {}
+        self._lock = threading.Lock()
+        self._session = None
+
+    @property
+    def session(self) -> requests.Session:
+        # 首次使用时创建（gunicorn 预加载时在 fork 之后），节点之间复用连接
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = requests.Session()
+        return self._session
+
+    def owner(self, key: str) -> str:
+        """按哈希环负责 key 的节点（未启用集群时为本节点）"""
+        return self.ring.owner(key) if self.enabled else self.node
+
+    def is_local(self, key: str) -> bool:
+        return self.owner(key) == self.node
+
+    def route(self, key: str, headers=None, fallback: bool = True) -> str:
+        """
+        应该处理 key 的其他节点
+
+        Args:
+            key: 文档内容哈希或上传会话ID
+            headers: 当前请求的请求头，其他节点已按该键转发过的请求在本地处理
+            fallback: 负责节点暂时不可用时是否在本节点处理（返回None）；
+                数据只在负责节点上时（上传会话）应为 False
+
+        Returns:
+            str: 节点名称；本节点负责、未启用集群、请求已按该键转发过或（fallback 时）该节点暂时不可用时返回None
+        """
+        if not self.enabled or (headers is not None and headers.get(CLUSTER_FORWARDED_HEADER) == key):
+            return None
+        node = self.owner(key)
+        if node == self.node:
+            return None
+        if fallback and self.is_down(node):
+            metrics.inc('cluster_peer_skipped_total', node=node)
+            return None
+        return node
+
+    def url(self, node: str, path: str) -> str:
+        return self.nodes[node] + path
+
+    def is_down(self, node: str) -> bool:
+        with self._lock:
+            return self._down_until.get(node, 0) > time.time()
+
+    def mark_down(self, node: str, error: Exception):
+        with self._lock:
+            self._down_until[node] = time.time() + self.cooldown
+        logger.warning(f"集群节点 {node} 不可用，{self.cooldown:.0f}秒内在本节点处理其负责的请求: {str(error)}")
+
+    def mark_up(self, node: str):
+        with self._lock:
+            if self._down_until.pop(node, None) is not None:
+                logger.info(f"集群节点 {node} 已恢复")
+
+    def request(self, node: str, method: str, path: str, key: str, session: requests.Session = None,
+                read_timeout: float = None, headers: dict = None, **kwargs) -> requests.Response:
+        """
+        向其他节点发送请求（stream=True，调用方负责关闭响应）
+
+        Args:
+            key: 据以路由的键，对端对该键不再转发
+            session: 使用的会话（例如可中止的 AbortableSession），默认共享会话
+            read_timeout: 等待响应的超时（秒），None 表示不限
+
+        Raises:
+            PeerUnavailable: 连接失败（该节点在 cooldown 秒内不再被选中）
+            requests.exceptions.ConnectionError: 会话已被中止（请求被取消）
+        """
+        session = session or self.session
+        try:
+            response = session.request(method, self.url(node, path), headers=self.forward_headers(key, headers),
+                                       stream=True, timeout=(self.connect_timeout, read_timeout), **kwargs)
+        except requests.exceptions.ConnectionError as e:
+            if getattr(session, 'aborted', False):
+                raise
+            raise self.peer_failed(node, e) from e
+        self.mark_up(node)
+        return response
+
+    @staticmethod
+    def forward_headers(key: str, headers: dict = None) -> dict:
+        """转发请求的请求头：带上据以路由的键"""
+        return {**(headers or {}), CLUSTER_FORWARDED_HEADER: key}
+
+    def peer_failed(self, node: str, error: Exception) -> PeerUnavailable:
+        """记录连接失败（cooldown 秒内不再选中该节点），返回供调用方抛出的异常"""
+        self.mark_down(node, error)
+        metrics.inc('cluster_peer_errors_total', node=node)
+        return PeerUnavailable(f"集群节点 {node} 不可用: {str(error)}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            down = sorted(node for node, until in self._down_until.items() if until > time.time())
+        return {'node': self.node, 'nodes': sorted(self.nodes), 'down': down}
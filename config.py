@@ -15,19 +15,133 @@ class Config:
     WECOM_SECRET = os.getenv('WECOM_SECRET', '')
     WECOM_TOKEN = os.getenv('WECOM_TOKEN', '')
     WECOM_ENCODING_AES_KEY = os.getenv('WECOM_ENCODING_AES_KEY', '')
+    WECOM_API_BASE = os.getenv('WECOM_API_BASE', 'https://qyapi.weixin.qq.com')
+    # 文件处理流水线：网络I/O（下载/上传/发送）与转换分别使用独立的线程池
+    WECOM_IO_WORKERS = int(os.getenv('WECOM_IO_WORKERS', '4'))
+    WECOM_CONVERT_WORKERS = int(os.getenv('WECOM_CONVERT_WORKERS', '2'))
+    WECOM_QUEUE_SIZE = int(os.getenv('WECOM_QUEUE_SIZE', '50'))  # 每个阶段的最大排队数
+    # 已上传PDF的media_id缓存（临时素材3天有效），相同文档直接复用
+    MEDIA_CACHE_DIR = os.getenv('MEDIA_CACHE_DIR', '/app/media_cache')
+    
+    # access_token 共享存储（所有worker共用，后台提前刷新）
+    TOKEN_STORE_DIR = os.getenv('TOKEN_STORE_DIR', '/app/tokens')
+    TOKEN_REFRESH_MARGIN = int(os.getenv('TOKEN_REFRESH_MARGIN', '600'))  # 秒，距离过期不足该时间即刷新
     
     # 文件存储配置
     TEMP_DIR = os.getenv('TEMP_DIR', '/app/temp_files')
     MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
+    # /api/convert 转换结果缓存（按文档哈希+部分转换参数），重传的文档直接返回，设为空关闭
+    RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', '/app/result_cache')
+    RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', '86400'))  # 秒
+    RESULT_CACHE_MAX_MB = int(os.getenv('RESULT_CACHE_MAX_MB', '1024'))
+    # 断点续传上传（/api/uploads）：会话目录、无新分块后的保留时间、建议分块大小和单块上限
+    UPLOAD_SESSION_DIR = os.getenv('UPLOAD_SESSION_DIR', os.path.join(TEMP_DIR, 'uploads'))
+    UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', '21600'))  # 秒
+    UPLOAD_CHUNK_SIZE_MB = int(os.getenv('UPLOAD_CHUNK_SIZE_MB', '4'))
+    UPLOAD_MAX_CHUNK_MB = int(os.getenv('UPLOAD_MAX_CHUNK_MB', '16'))
+    # 集群模式：多个节点按文档哈希分片结果缓存和转换（见 cluster.py），少于两个节点时不启用
+    CLUSTER_NODE = os.getenv('CLUSTER_NODE', '')  # 本节点名称
+    CLUSTER_NODES = os.getenv('CLUSTER_NODES', '')  # 全部节点（含本节点），如 "app1=http://app1:5000,app2=http://app2:5000"
+    CLUSTER_VNODES = int(os.getenv('CLUSTER_VNODES', '160'))  # 每个节点在哈希环上的虚拟节点数
+    CLUSTER_CONNECT_TIMEOUT = float(os.getenv('CLUSTER_CONNECT_TIMEOUT', '3'))  # 秒
+    CLUSTER_PEER_COOLDOWN = float(os.getenv('CLUSTER_PEER_COOLDOWN', '10'))  # 秒，节点连接失败后在本节点处理的时间
+    # 限流（令牌桶，同一台机器上的 worker 共享）：每分钟补充的次数和允许连续发起的次数，次数设为0关闭
+    RATE_LIMIT_DIR = os.getenv('RATE_LIMIT_DIR', os.path.join(TEMP_DIR, 'ratelimit'))
+    RATE_LIMIT_API_PER_MINUTE = float(os.getenv('RATE_LIMIT_API_PER_MINUTE', '20'))  # /api/convert 和 /api/uploads，按客户端IP
+    RATE_LIMIT_API_BURST = int(os.getenv('RATE_LIMIT_API_BURST', '30'))
+    RATE_LIMIT_WECOM_PER_MINUTE = float(os.getenv('RATE_LIMIT_WECOM_PER_MINUTE', '6'))  # 企业微信文件消息，按用户
+    RATE_LIMIT_WECOM_BURST = int(os.getenv('RATE_LIMIT_WECOM_BURST', '10'))
     
     # LibreOffice配置（备用转换引擎）
     LIBREOFFICE_PATH = os.getenv('LIBREOFFICE_PATH', '/usr/bin/soffice')
     CONVERSION_TIMEOUT = int(os.getenv('CONVERSION_TIMEOUT', '30'))  # 秒
-    
+    # 每个并发槽位使用独立的用户配置目录，槽位数即LibreOffice最大并发数
+    LIBREOFFICE_PROFILE_DIR = os.getenv('LIBREOFFICE_PROFILE_DIR', '/app/lo_profiles')
+    LIBREOFFICE_CONCURRENCY = int(os.getenv('LIBREOFFICE_CONCURRENCY', str(os.cpu_count() or 1)))
+    # 批量模式：在时间窗口内收集多个文件，一次soffice调用全部转换
+    LIBREOFFICE_BATCH_ENABLED = os.getenv('LIBREOFFICE_BATCH_ENABLED', 'false').lower() == 'true'
+    LIBREOFFICE_BATCH_WINDOW_MS = int(os.getenv('LIBREOFFICE_BATCH_WINDOW_MS', '200'))  # 毫秒
+    LIBREOFFICE_BATCH_MAX_SIZE = int(os.getenv('LIBREOFFICE_BATCH_MAX_SIZE', '8'))
+    # 每次soffice运行的资源上限（rlimit，进程树中每个进程继承），0表示不限制
+    SOFFICE_CPU_LIMIT = int(os.getenv('SOFFICE_CPU_LIMIT', '120'))  # CPU秒
+    # RLIMIT_AS 限制的是地址空间而不是实际占用的内存（RSS）：soffice.bin 启动时
+    # 映射的共享库、字体缓存和预留的堆就有1GB以上，上限需要留足余量，只用来拦住
+    # 失控的分配；要按实际内存限制请使用容器的内存限制
+    SOFFICE_MEMORY_LIMIT_MB = int(os.getenv('SOFFICE_MEMORY_LIMIT_MB', '4096'))  # 地址空间MB
+
     # Windows转换服务配置（主转换引擎）
     WINDOWS_CONVERTER_URL = os.getenv('WINDOWS_CONVERTER_URL', '')
     WINDOWS_CONVERTER_ENABLED = os.getenv('WINDOWS_CONVERTER_ENABLED', 'false').lower() == 'true'
     WINDOWS_CONVERTER_TIMEOUT = int(os.getenv('WINDOWS_CONVERTER_TIMEOUT', '60'))  # 秒
+    # 传输压缩：auto（zstd/gzip，按本机安装的库）、off，或逗号分隔的格式；小于该字节数的文档不压缩上传
+    WINDOWS_COMPRESSION = os.getenv('WINDOWS_COMPRESSION', 'auto')
+    WINDOWS_COMPRESSION_MIN_SIZE = int(os.getenv('WINDOWS_COMPRESSION_MIN_SIZE', '65536'))
+    # 持久连接：多次转换复用到Windows服务的连接（Windows服务使用 waitress 时有效）
+    WINDOWS_KEEPALIVE = os.getenv('WINDOWS_KEEPALIVE', 'false').lower() == 'true'
+    
+    # 转换前资源优化：按显示尺寸缩小 docx/pptx/xlsx 中过大的图片（需要 Pillow），删除缩略图和未使用的部件
+    ASSET_OPTIMIZATION_ENABLED = os.getenv('ASSET_OPTIMIZATION_ENABLED', 'false').lower() == 'true'
+    ASSET_TARGET_DPI = int(os.getenv('ASSET_TARGET_DPI', '200'))  # 图片保留的打印分辨率
+    ASSET_MIN_DOC_SIZE_MB = float(os.getenv('ASSET_MIN_DOC_SIZE_MB', '1'))  # 小于该大小的文档不处理
+    ASSET_MIN_IMAGE_KB = int(os.getenv('ASSET_MIN_IMAGE_KB', '200'))  # 小于该大小的图片不处理
+    ASSET_JPEG_QUALITY = int(os.getenv('ASSET_JPEG_QUALITY', '85'))
+    
+    # 引擎路由配置
+    # static: 固定Windows优先；adaptive: 按各引擎最近耗时和成功率选择
+    ENGINE_ROUTING_POLICY = os.getenv('ENGINE_ROUTING_POLICY', 'static')
+    # 保真度规则，如 "doc:windows,docx:windows" 表示Word文档必须用Office转换
+    ENGINE_FIDELITY_RULES = os.getenv('ENGINE_FIDELITY_RULES', '')
+    # 严格模式下，保真度规则指定的引擎失败后不再降级到其他引擎
+    ENGINE_FIDELITY_STRICT = os.getenv('ENGINE_FIDELITY_STRICT', 'false').lower() == 'true'
+    # 静态覆盖，如 "xlsx:libreoffice|windows"，优先级高于路由策略
+    ENGINE_OVERRIDES = os.getenv('ENGINE_OVERRIDES', '')
+    ENGINE_STATS_WINDOW = int(os.getenv('ENGINE_STATS_WINDOW', '100'))  # 每个引擎/类型保留的样本数
+    ENGINE_MIN_SAMPLES = int(os.getenv('ENGINE_MIN_SAMPLES', '10'))
+    ENGINE_EXPLORE_RATE = float(os.getenv('ENGINE_EXPLORE_RATE', '0.05'))
+    
+    # 对冲模式：Windows超过其p95耗时仍未返回时，并行启动LibreOffice
+    HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', 'false').lower() == 'true'
+    HEDGE_PERCENT = float(os.getenv('HEDGE_PERCENT', '10'))  # 参与对冲的请求百分比
+    HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', '5'))  # 秒，对冲阈值下限
+    HEDGE_GRACE_PERIOD = float(os.getenv('HEDGE_GRACE_PERIOD', '2'))  # 秒，LibreOffice先完成后仍等待Windows的时间
+    HEDGE_MAX_INFLIGHT = int(os.getenv('HEDGE_MAX_INFLIGHT', str(max(1, LIBREOFFICE_CONCURRENCY // 2))))
+    
+    # 超时预算：按文件大小、页数和历史耗时为每次转换估算超时（关闭时使用上面的固定超时）
+    ADAPTIVE_TIMEOUT_ENABLED = os.getenv('ADAPTIVE_TIMEOUT_ENABLED', 'true').lower() == 'true'
+    TIMEOUT_BASE = float(os.getenv('TIMEOUT_BASE', '10'))  # 秒，基础时间
+    TIMEOUT_PER_MB = float(os.getenv('TIMEOUT_PER_MB', '3'))  # 秒/MB
+    TIMEOUT_PER_PAGE = float(os.getenv('TIMEOUT_PER_PAGE', '0.5'))  # 秒/页（幻灯片、工作表）
+    TIMEOUT_P95_FACTOR = float(os.getenv('TIMEOUT_P95_FACTOR', '2'))  # 历史p95耗时的倍数
+    TIMEOUT_FLOOR = float(os.getenv('TIMEOUT_FLOOR', '5'))  # 秒，单次尝试的最短超时
+    CONVERSION_TIMEOUT_MAX = float(os.getenv('CONVERSION_TIMEOUT_MAX', '100'))  # 秒，单次尝试的最长超时
+    # 端到端截止时间：整条降级链（Windows + LibreOffice）的总时限，需小于 nginx proxy_read_timeout(120s)
+    CONVERSION_DEADLINE = float(os.getenv('CONVERSION_DEADLINE', '110'))
+    
+    # 优先级调度：interactive（iOS快捷指令，用户在等待）优先于 background（企业微信，稍后推送）
+    CONVERSION_CONCURRENCY = int(os.getenv('CONVERSION_CONCURRENCY', str(LIBREOFFICE_CONCURRENCY)))  # 每个进程同时转换数
+    INTERACTIVE_RESERVED_SLOTS = int(os.getenv('INTERACTIVE_RESERVED_SLOTS', '1'))  # 只给交互请求用的槽位
+    PRIORITY_AGING_SECONDS = float(os.getenv('PRIORITY_AGING_SECONDS', '60'))  # 后台请求排队超过该时间后平等竞争
+    SLO_INTERACTIVE_SECONDS = float(os.getenv('SLO_INTERACTIVE_SECONDS', '30'))  # 延迟目标（排队+转换）
+    SLO_BACKGROUND_SECONDS = float(os.getenv('SLO_BACKGROUND_SECONDS', '300'))
+    # 后台请求（企业微信）的最长排队时间，取得槽位后转换仍受 CONVERSION_DEADLINE 限制；应不小于 SLO_BACKGROUND_SECONDS
+    BACKGROUND_QUEUE_TIMEOUT = float(os.getenv('BACKGROUND_QUEUE_TIMEOUT', '600'))
+    
+    # 链路追踪：JSONL文件路径或收集器URL（http://...），留空关闭
+    TRACE_EXPORT = os.getenv('TRACE_EXPORT', '/app/traces/spans.jsonl')
+    TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1.0'))
+    
+    # 调试接口（/debug/profile）令牌，留空时关闭
+    DEBUG_TOKEN = os.getenv('DEBUG_TOKEN', '')
+    PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.01'))  # 按需采样间隔（秒）
+    PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '60'))
+    # 持续低频采样：结果定期写入该目录，留空关闭
+    PROFILE_CONTINUOUS_DIR = os.getenv('PROFILE_CONTINUOUS_DIR', '')
+    PROFILE_CONTINUOUS_INTERVAL = float(os.getenv('PROFILE_CONTINUOUS_INTERVAL', '0.1'))
+    PROFILE_CONTINUOUS_PERIOD = float(os.getenv('PROFILE_CONTINUOUS_PERIOD', '300'))  # 每个文件覆盖的秒数
+    
+    # asyncio 服务模式（asgi_app.py）
+    ASGI_BLOCKING_THREADS = int(os.getenv('ASGI_BLOCKING_THREADS', '8'))  # 预检、哈希等阻塞文件操作的线程数
+    ASGI_WECOM_MAX_JOBS = int(os.getenv('ASGI_WECOM_MAX_JOBS', '200'))  # 同时处理的企业微信文件数
     
     # Flask配置
     DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
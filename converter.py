@@ -1,12 +1,36 @@
 import os
+import queue
+import random
+import shutil
 import subprocess
+import tempfile
+import time
 import logging
+import threading
 import requests
 from pathlib import Path
+from contextlib import contextmanager, nullcontext
 from config import config
+from libreoffice_pool import LibreOfficeProfilePool
+from libreoffice_batch import LibreOfficeBatcher
+from engine_router import (
+    ENGINE_WINDOWS, ENGINE_LIBREOFFICE, EngineStats, create_policy, parse_engine_rules
+)
+from metrics import metrics
+from preflight import PreflightResult, inspect_file
+from partial_export import ExportOptions, ExportOptionsError, restrict_workbook
+from deadline import Deadline, DeadlineExceeded, TimeoutPolicy
+from cancellation import AbortableSession, CancelToken, ConversionCancelled, REQUEST_TIMEOUT_HEADER
+from http_compression import parse_encodings
+from windows_transport import WindowsTransport
+from asset_optimizer import AssetOptimizer
+from soffice_runner import SofficeCancelled, run_supervised
+from scheduler import PriorityScheduler, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from tracing import tracer
 
 logger = logging.getLogger(__name__)
 
+
 class DocumentConverter:
     """Office文档转PDF转换器 - 支持Windows和LibreOffice双引擎"""
     
@@ -15,79 +39,397 @@ class DocumentConverter:
         self.temp_dir.mkdir(parents=True, exist_ok=True)
         self.libreoffice_path = config.LIBREOFFICE_PATH
         self.timeout = config.CONVERSION_TIMEOUT
+        # 每次soffice运行的资源上限（进程树共享）
+        self.soffice_cpu_limit = config.SOFFICE_CPU_LIMIT
+        self.soffice_memory_limit = config.SOFFICE_MEMORY_LIMIT_MB * 1024 * 1024
+        
+        # LibreOffice独立配置目录池（每个槽位一个soffice实例，支持真正并发）
+        self.libreoffice_pool = LibreOfficeProfilePool(
+            base_dir=config.LIBREOFFICE_PROFILE_DIR,
+            size=config.LIBREOFFICE_CONCURRENCY,
+            soffice_path=self.libreoffice_path
+        )
+        
+        # LibreOffice批量模式：短时间窗口内的多个文件合并为一次soffice调用
+        self.libreoffice_batcher = None
+        if config.LIBREOFFICE_BATCH_ENABLED:
+            self.libreoffice_batcher = LibreOfficeBatcher(
+                run_batch=self._run_libreoffice_batch,
+                window_ms=config.LIBREOFFICE_BATCH_WINDOW_MS,
+                max_size=config.LIBREOFFICE_BATCH_MAX_SIZE
+            )
         
         # Windows转换服务配置
         self.windows_enabled = config.WINDOWS_CONVERTER_ENABLED
         self.windows_url = config.WINDOWS_CONVERTER_URL
         self.windows_timeout = config.WINDOWS_CONVERTER_TIMEOUT
+        # 传输压缩和持久连接（进程内共享，协商结果也在进程内共享）
+        self.windows_transport = WindowsTransport(
+            parse_encodings(config.WINDOWS_COMPRESSION),
+            min_size=config.WINDOWS_COMPRESSION_MIN_SIZE,
+            keepalive=config.WINDOWS_KEEPALIVE,
+            pool_size=config.CONVERSION_CONCURRENCY
+        )
+        
+        # 转换前资源优化（缩小过大的图片，减少上传和渲染时间）
+        self.asset_optimizer = AssetOptimizer(
+            enabled=config.ASSET_OPTIMIZATION_ENABLED,
+            target_dpi=config.ASSET_TARGET_DPI,
+            min_size=int(config.ASSET_MIN_DOC_SIZE_MB * 1024 * 1024),
+            min_image_bytes=config.ASSET_MIN_IMAGE_KB * 1024,
+            jpeg_quality=config.ASSET_JPEG_QUALITY
+        )
+        
+        # 引擎路由策略（按文件类型统计各引擎耗时和成功率）
+        self.engine_stats = EngineStats(window=config.ENGINE_STATS_WINDOW)
+        self.router = create_policy(
+            config.ENGINE_ROUTING_POLICY,
+            stats=self.engine_stats,
+            fidelity_rules=parse_engine_rules(config.ENGINE_FIDELITY_RULES),
+            overrides=parse_engine_rules(config.ENGINE_OVERRIDES),
+            strict_fidelity=config.ENGINE_FIDELITY_STRICT,
+            min_samples=config.ENGINE_MIN_SAMPLES,
+            explore_rate=config.ENGINE_EXPLORE_RATE
+        )
+        
+        # 对冲模式：Windows慢于阈值时并行启动LibreOffice，取先完成者
+        self.hedge_enabled = config.HEDGE_ENABLED
+        self.hedge_percent = config.HEDGE_PERCENT
+        self.hedge_min_delay = config.HEDGE_MIN_DELAY
+        self.hedge_grace = config.HEDGE_GRACE_PERIOD
+        self._hedge_slots = threading.BoundedSemaphore(max(1, config.HEDGE_MAX_INFLIGHT))
+        
+        # 超时预算：按文件大小/页数/历史耗时估算每次尝试的超时，整条降级链共享一个截止时间
+        if config.ADAPTIVE_TIMEOUT_ENABLED:
+            caps = {ENGINE_WINDOWS: config.CONVERSION_TIMEOUT_MAX, ENGINE_LIBREOFFICE: config.CONVERSION_TIMEOUT_MAX}
+        else:
+            caps = {ENGINE_WINDOWS: self.windows_timeout, ENGINE_LIBREOFFICE: self.timeout}
+        self.timeout_policy = TimeoutPolicy(
+            self.engine_stats,
+            caps=caps,
+            adaptive=config.ADAPTIVE_TIMEOUT_ENABLED,
+            base=config.TIMEOUT_BASE,
+            per_mb=config.TIMEOUT_PER_MB,
+            per_page=config.TIMEOUT_PER_PAGE,
+            p95_factor=config.TIMEOUT_P95_FACTOR,
+            floor=config.TIMEOUT_FLOOR,
+            min_samples=config.ENGINE_MIN_SAMPLES
+        )
+        self.deadline_seconds = config.CONVERSION_DEADLINE
+        self.background_queue_timeout = config.BACKGROUND_QUEUE_TIMEOUT
+        
+        # 优先级调度：交互请求（iOS）优先并有预留槽位，后台请求（企业微信）排队老化后平等竞争
+        self.scheduler = PriorityScheduler(
+            capacity=config.CONVERSION_CONCURRENCY,
+            reserved=config.INTERACTIVE_RESERVED_SLOTS,
+            aging=config.PRIORITY_AGING_SECONDS,
+            slo={
+                PRIORITY_INTERACTIVE: config.SLO_INTERACTIVE_SECONDS,
+                PRIORITY_BACKGROUND: config.SLO_BACKGROUND_SECONDS,
+            }
+        )
         
-        logger.info(f"转换引擎配置: Windows={self.windows_enabled}, URL={self.windows_url}")
+        logger.info(f"转换引擎配置: Windows={self.windows_enabled}, URL={self.windows_url}, 路由={self.router.name}")
     
-    def convert_to_pdf(self, input_file_path: str) -> str:
+    def warm_up(self):
+        """后台预热LibreOffice配置目录（构造函数不启动线程，以便在fork之前预加载）"""
+        self.libreoffice_pool.warm_up_async()
+    
+    def convert_to_pdf(self, input_file_path: str, preflight: PreflightResult = None,
+                       options: ExportOptions = None, deadline: Deadline = None,
+                       priority: str = PRIORITY_INTERACTIVE) -> str:
         """
         将Office文档转换为PDF（智能选择转换引擎）
         
         Args:
             input_file_path: 输入文件路径
+            preflight: 调用方已做过的预检结果，为空时在这里预检
+            options: 部分转换参数（页码范围/工作表/打印区域），为空时转换全部内容
+            deadline: 端到端截止时间（如从请求到达开始计时），默认从现在起 CONVERSION_DEADLINE 秒；
+                后台请求默认最多排队 BACKGROUND_QUEUE_TIMEOUT 秒，取得槽位后才开始计算 CONVERSION_DEADLINE
+            priority: 调度优先级，interactive（用户在等待）或 background（结果稍后推送）
             
         Returns:
             str: 转换后的PDF文件路径
             
         Raises:
+            PreflightError: 文件未通过预检（过大、格式不支持、加密、损坏）
+            ExportOptionsError: 部分转换参数不适用于该文件类型，或可用的引擎都无法满足
+            DeadlineExceeded: 截止时间已到（排队或转换中），无法再尝试任何引擎
+            ConversionCancelled: deadline 被取消（客户端断开），排队或进行中的转换已终止
             Exception: 转换失败时抛出异常
         """
+        input_path, preflight, options, deadline = self.prepare(input_file_path, preflight, options, deadline,
+                                                                priority)
+        
+        # 输出PDF文件名
+        output_pdf = input_path.parent / f"{input_path.stem}.pdf"
+        ext = preflight.detected_ext
+        queue_timeout, cancel_event = self.queue_limits(deadline)
+        
+        with self.detected_type(input_path, ext) as input_path:
+            with tracer.span('convert', ext=ext, size=preflight.size, priority=priority):
+                queued_at = time.time()
+                try:
+                    with self.scheduler.slot(priority, timeout=queue_timeout, cancel_event=cancel_event):
+                        tracer.record('scheduler.wait', queued_at, time.time(), priority=priority)
+                        # 后台请求：排队时间不占用转换的截止时间
+                        deadline = deadline or Deadline(self.deadline_seconds)
+                        source = self.optimize_assets(input_path, ext, preflight.size)
+                        try:
+                            return self._convert_routed(source, output_pdf, ext, options, preflight, deadline)
+                        finally:
+                            self.discard_optimized(input_path, source)
+                except ConversionCancelled:
+                    # 因截止时间到期而取消时按超时处理
+                    if deadline is not None:
+                        deadline.raise_if_cancelled()
+                    raise
+    
+    def prepare(self, input_file_path: str, preflight: PreflightResult = None, options: ExportOptions = None,
+                deadline: Deadline = None, priority: str = PRIORITY_INTERACTIVE) -> tuple:
+        """
+        检查转换参数并补全默认值（同步和 asyncio 两种转换入口共用）
+        
+        Returns:
+            tuple: (输入路径, 预检结果, 部分转换参数或None, 截止时间)；
+                没有指定截止时间的后台请求截止时间为None，取得调度槽位后再创建
+        """
         input_path = Path(input_file_path)
         
         if not input_path.exists():
             raise FileNotFoundError(f"文件不存在: {input_file_path}")
         
-        # 检查文件类型
-        supported_extensions = ['.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx']
-        if input_path.suffix.lower() not in supported_extensions:
-            raise ValueError(f"不支持的文件类型: {input_path.suffix}")
+        # 预检：按真实格式识别文件类型，注定失败的文件不占用转换引擎
+        if preflight is None:
+            preflight = inspect_file(input_path)
         
-        # 输出PDF文件名
-        output_pdf = input_path.parent / f"{input_path.stem}.pdf"
+        if options is not None and options.is_empty:
+            options = None
+        if options is not None:
+            options.validate_for(preflight.detected_ext)
+        if deadline is None and priority != PRIORITY_BACKGROUND:
+            deadline = Deadline(self.deadline_seconds)
+        if deadline is not None:
+            deadline.raise_if_cancelled()
+        return input_path, preflight, options, deadline
+    
+    def queue_limits(self, deadline: Deadline) -> tuple:
+        """
+        调度排队的超时和取消信号
         
-        # 优先使用Windows转换服务
-        if self.windows_enabled and self.windows_url:
-            logger.info("尝试使用Windows转换服务...")
+        Returns:
+            tuple: (最长排队秒数, 取消信号)；没有截止时间的后台请求最多排队 BACKGROUND_QUEUE_TIMEOUT 秒
+        """
+        if deadline is None:
+            return self.background_queue_timeout, None
+        return deadline.remaining(), deadline.cancel_event
+    
+    @staticmethod
+    @contextmanager
+    def detected_type(input_path: Path, ext: str):
+        """扩展名与真实格式不符时按真实格式转换，结束后恢复原文件名（调用方负责清理）"""
+        original_path = input_path
+        if input_path.suffix.lower() != ext:
+            input_path = input_path.with_suffix(ext)
+            os.replace(original_path, input_path)
+        try:
+            yield input_path
+        finally:
+            if input_path != original_path and input_path.exists():
+                os.replace(input_path, original_path)
+    
+    def optimize_assets(self, input_path: Path, ext: str, size: int) -> Path:
+        """
+        转换前优化文档中的图片等资源（同步和 asyncio 两种转换入口共用，持有调度槽位时调用）
+        
+        Returns:
+            Path: 优化后的副本（与原文件同名，位于单独的临时目录），未优化时返回原路径
+        """
+        if not self.asset_optimizer.applies_to(ext, size):
+            return input_path
+        optimized_dir = Path(tempfile.mkdtemp(prefix='assets_', dir=self.temp_dir))
+        optimized_path = optimized_dir / input_path.name
+        with tracer.span('assets.optimize') as span:
+            report = self.asset_optimizer.optimize(input_path, optimized_path)
+            if report is not None:
+                span.set(saved_bytes=report.saved_bytes, images_resized=report.images_resized,
+                         parts_removed=len(report.parts_removed))
+        if report is None:
+            shutil.rmtree(optimized_dir, ignore_errors=True)
+            return input_path
+        return optimized_path
+    
+    @staticmethod
+    def discard_optimized(input_path: Path, source: Path):
+        """删除 optimize_assets 生成的副本"""
+        if source != input_path:
+            shutil.rmtree(source.parent, ignore_errors=True)
+    
+    def _convert_routed(self, input_path: Path, output_pdf: Path, ext: str, options: ExportOptions,
+                        preflight: PreflightResult, deadline: Deadline) -> str:
+        """按路由策略依次尝试各引擎，失败则降级到下一个"""
+        plan = self.plan_engines(ext, options)
+        budgets = self.timeout_policy.plan_budgets(plan, ext, preflight.size, preflight.hints)
+        if self._should_hedge(plan):
+            return self._convert_hedged(input_path, output_pdf, ext, options, budgets, deadline)
+        last_error = None
+        
+        for index, engine in enumerate(plan):
+            deadline.raise_if_cancelled()
+            # 预算与截止时间剩余取小，并为后续引擎留出时间
+            reserve = self.timeout_policy.reserve_for(budgets, plan[index + 1:], deadline)
             try:
-                result = self._convert_via_windows(input_path, output_pdf)
-                if result:
-                    logger.info("✅ Windows转换成功")
-                    return result
-                else:
-                    logger.warning("Windows转换失败，降级到LibreOffice")
+                timeout = self.timeout_policy.attempt_timeout(budgets[engine], deadline, reserve)
+            except DeadlineExceeded as e:
+                logger.error(f"{str(e)}，放弃剩余引擎: {plan[index:]}")
+                raise
+            logger.info(f"尝试使用{engine}转换...（超时 {timeout:.0f}秒，剩余 {deadline.remaining():.0f}秒）")
+            start = time.time()
+            try:
+                with tracer.span(f'engine.{engine}', timeout=round(timeout, 1)) as span:
+                    result = self._convert_with(engine, input_path, output_pdf, options, timeout, deadline.cancel_event)
+                    span.set(success=result is not None)
+            except ConversionCancelled:
+                result = None
             except Exception as e:
-                logger.error(f"Windows转换异常: {str(e)}，降级到LibreOffice")
+                logger.error(f"{engine}转换异常: {str(e)}")
+                result = None
+                last_error = e
+            
+            if deadline.cancelled:
+                # 被取消的尝试不计入引擎统计，结果没有人接收
+                self.record_wasted(engine, start)
+                if result:
+                    self.cleanup_file(result)
+                deadline.raise_if_cancelled()
+            self.router.record(engine, ext, result is not None, time.time() - start)
+            
+            if result:
+                logger.info(f"✅ {engine}转换成功")
+                return result
+            logger.warning(f"{engine}转换失败，尝试下一个引擎")
         
-        # 降级使用LibreOffice
-        logger.info("使用LibreOffice转换...")
-        return self._convert_via_libreoffice(input_path, output_pdf)
+        if last_error:
+            raise last_error
+        raise Exception("没有可用的转换引擎" if not plan else "转换失败")
     
-    def _convert_via_windows(self, input_path: Path, output_pdf: Path) -> str:
+    def plan_engines(self, ext: str, options: ExportOptions = None) -> list:
+        """
+        按路由策略排序的引擎中能满足部分转换参数的引擎
+        
+        Raises:
+            ExportOptionsError: 可用的引擎都无法满足（422），不转换整个文档冒充部分转换的结果
+        """
+        plan = self.router.plan(ext, self.available_engines())
+        if options is None or options.supported_by_libreoffice(ext):
+            return plan
+        supported = [engine for engine in plan if engine != ENGINE_LIBREOFFICE]
+        if not supported:
+            raise ExportOptionsError(f"当前只能使用LibreOffice转换，不支持在{ext}中选择工作表/打印区域，"
+                                     f"请另存为.xlsx后重试", status_code=422)
+        return supported
+    
+    def available_engines(self) -> list:
+        """当前配置下可用的转换引擎"""
+        engines = [ENGINE_LIBREOFFICE]
+        if self.windows_enabled and self.windows_url:
+            engines.insert(0, ENGINE_WINDOWS)
+        return engines
+    
+    @staticmethod
+    def record_wasted(engine: str, start: float):
+        """记录因取消而白做的转换工作"""
+        metrics.inc('conversion_cancelled_total', stage=engine)
+        metrics.observe('conversion_wasted_seconds', time.time() - start, engine=engine)
+    
+    def _convert_with(self, engine: str, input_path: Path, output_pdf: Path, options: ExportOptions = None,
+                      timeout: float = None, cancel_event: CancelToken = None) -> str:
+        """使用指定引擎转换，失败返回None或抛出异常"""
+        if engine == ENGINE_WINDOWS:
+            return self._convert_via_windows(input_path, output_pdf, cancel_event, options, timeout)
+        if engine == ENGINE_LIBREOFFICE:
+            return self._convert_via_libreoffice(input_path, output_pdf, options, timeout, cancel_event)
+        raise ValueError(f"未知的转换引擎: {engine}")
+    
+    def _convert_via_windows(self, input_path: Path, output_pdf: Path, cancel_event: CancelToken = None,
+                             options: ExportOptions = None, timeout: float = None) -> str:
         """
         通过Windows服务转换文档
         
         Args:
             input_path: 输入文件路径
             output_pdf: 输出PDF路径
+            cancel_event: 取消信号，置位后立即断开与Windows服务的连接（上传、等待转换或下载中）
+            options: 部分转换参数，作为表单字段转发
+            timeout: 超时秒数，默认 WINDOWS_CONVERTER_TIMEOUT
             
         Returns:
-            str: PDF文件路径，失败返回None
+            str: PDF文件路径，失败或被取消返回None
         """
-        try:
-            # 发送文件到Windows服务
-            with open(input_path, 'rb') as f:
-                files = {'document': (input_path.name, f, 'application/octet-stream')}
-                
-                response = requests.post(
+        timeout = timeout or self.windows_timeout
+        with self.windows_transport.session() as session:
+            try:
+                # 取消时关闭连接：上传或等待远端转换中的请求立即返回，Windows服务随之看到连接断开
+                with (cancel_event.on_set(session.abort) if cancel_event is not None else nullcontext()):
+                    return self._request_windows(session, input_path, output_pdf, cancel_event, options, timeout)
+            except requests.exceptions.Timeout:
+                logger.error(f"Windows服务超时(>{timeout:.0f}秒)")
+                return None
+            except requests.exceptions.ConnectionError:
+                if session.aborted:
+                    logger.info(f"Windows转换已取消，连接已断开: {input_path.name}")
+                    self.cleanup_file(str(output_pdf))
+                else:
+                    logger.error("无法连接到Windows服务")
+                return None
+            except Exception as e:
+                logger.error(f"Windows转换异常: {str(e)}")
+                return None
+    
+    def _request_windows(self, session: AbortableSession, input_path: Path, output_pdf: Path,
+                         cancel_event: CancelToken, options: ExportOptions, timeout: float) -> str:
+        transport = self.windows_transport
+        payload_size = input_path.stat().st_size
+        headers = {
+            **tracer.inject(),
+            REQUEST_TIMEOUT_HEADER: f"{timeout:.1f}",
+            'Accept-Encoding': transport.accept_encoding,
+        }
+        # 发送文件到Windows服务（windows.request 覆盖上传和远端转换，直到收到响应头；
+        # trace 通过 traceparent 请求头传给Windows服务，X-Request-Timeout 告诉服务本次
+        # 请求的时间预算，上传完已经超时的请求不再转换）
+        encoding = transport.request_encoding(input_path)
+        with tracer.span('windows.request', encoding=encoding or 'identity') as span:
+            if encoding:
+                # Windows服务声明过支持请求压缩：整个 multipart 请求体流式压缩
+                body, body_headers = transport.upload_body(input_path, options.to_form() if options else None,
+                                                           encoding)
+                response = session.post(
                     f"{self.windows_url}/convert",
-                    files=files,
-                    timeout=self.windows_timeout
+                    data=body,
+                    headers={**headers, **body_headers},
+                    timeout=timeout,
+                    stream=True
                 )
-            
+                wire_size = body.count
+            else:
+                with open(input_path, 'rb') as f:
+                    files = {'document': (input_path.name, f, 'application/octet-stream')}
+                    response = session.post(
+                        f"{self.windows_url}/convert",
+                        files=files,
+                        data=options.to_form() if options else None,
+                        headers=headers,
+                        timeout=timeout,
+                        stream=True
+                    )
+                wire_size = payload_size
+            transport.record('upload', wire_size, payload_size, encoding)
+            span.set(status_code=response.status_code, wire_bytes=wire_size, payload_bytes=payload_size)
+        transport.learn(response.headers)
+        
+        with response, tracer.span('windows.download') as span:
             # 检查响应状态
             if response.status_code != 200:
                 logger.error(f"Windows服务返回错误: {response.status_code}")
@@ -98,80 +440,366 @@ class DocumentConverter:
                     pass
                 return None
             
-            # 保存返回的PDF
+            # 保存返回的PDF（压缩的响应自动解压，边下载边检查取消信号）
+            pdf_size = 0
             with open(output_pdf, 'wb') as f:
-                f.write(response.content)
-            
-            if not output_pdf.exists():
-                logger.error("PDF文件保存失败")
-                return None
-            
-            logger.info(f"Windows转换成功: {output_pdf.name}")
-            return str(output_pdf)
-            
-        except requests.exceptions.Timeout:
-            logger.error(f"Windows服务超时(>{self.windows_timeout}秒)")
-            return None
-        except requests.exceptions.ConnectionError:
-            logger.error("无法连接到Windows服务")
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    if cancel_event is not None and cancel_event.is_set():
+                        break
+                    f.write(chunk)
+                    pdf_size += len(chunk)
+            response_encoding = response.headers.get('Content-Encoding')
+            transport.record('download', response.raw.tell(), pdf_size, response_encoding)
+            span.set(encoding=response_encoding or 'identity', wire_bytes=response.raw.tell(), payload_bytes=pdf_size)
+        
+        if cancel_event is not None and cancel_event.is_set():
+            logger.info(f"Windows转换已取消: {input_path.name}")
+            self.cleanup_file(str(output_pdf))
             return None
-        except Exception as e:
-            logger.error(f"Windows转换异常: {str(e)}")
+        
+        if not output_pdf.exists():
+            logger.error("PDF文件保存失败")
             return None
+        
+        profile, timings = transport.record_export(response.headers, input_path.suffix.lower(), pdf_size)
+        logger.info(f"Windows转换成功: {output_pdf.name}（导出配置 {profile}" +
+                    ''.join(f"，{phase} {seconds:.2f}秒" for phase, seconds in timings.items()) + "）")
+        return str(output_pdf)
+    
+    def _convert_hedged(self, input_path: Path, output_pdf: Path, ext: str, options: ExportOptions,
+                        budgets: dict, deadline: Deadline) -> str:
+        """
+        对冲转换：Windows超过阈值仍未返回时，同时启动LibreOffice
+        
+        先返回的成功结果胜出；LibreOffice先完成时，在宽限期内仍优先采用
+        Windows的结果（排版更准确）。落败的一方会被取消。
+        
+        Returns:
+            str: PDF文件路径
+            
+        Raises:
+            DeadlineExceeded: 截止时间已到
+            Exception: 两个引擎都失败时抛出异常
+        """
+        outputs = {
+            ENGINE_WINDOWS: output_pdf.with_name(f"{output_pdf.stem}.windows.pdf"),
+            ENGINE_LIBREOFFICE: output_pdf.with_name(f"{output_pdf.stem}.libreoffice.pdf"),
+        }
+        cancels = {engine: CancelToken() for engine in outputs}
+        finished = queue.Queue()
+        
+        # 对冲线程不继承请求线程的追踪上下文，显式传入父span
+        trace_context = tracer.current_context()
+        
+        def run(engine: str, timeout: float):
+            start = time.time()
+            result, error = None, None
+            try:
+                with tracer.span(f'engine.{engine}', parent=trace_context, hedged=True, timeout=round(timeout, 1)):
+                    if engine == ENGINE_WINDOWS:
+                        result = self._convert_via_windows(input_path, outputs[engine], cancels[engine], options, timeout)
+                    else:
+                        result = self._run_libreoffice(input_path, outputs[engine], cancels[engine], options, timeout)
+            except Exception as e:
+                error = e
+            # 被取消的一方耗时不具代表性，不计入统计；取消后才完成的输出直接丢弃
+            if cancels[engine].is_set():
+                if deadline.cancelled:
+                    self.record_wasted(engine, start)
+                if result:
+                    self.cleanup_file(result)
+            else:
+                self.router.record(engine, ext, result is not None, time.time() - start)
+            finished.put((engine, result, error))
+        
+        def launch(engine: str):
+            # 两个引擎并行运行，不需要为对方保留时间
+            timeout = self.timeout_policy.attempt_timeout(budgets[engine], deadline)
+            threading.Thread(target=run, args=(engine, timeout), name=f'hedge-{engine}', daemon=True).start()
+            running.add(engine)
+        
+        def cancel_all():
+            for cancel in cancels.values():
+                cancel.set()
+        
+        running = set()
+        hedge_slot = False
+        winner, last_error = None, None
+        
+        # 请求被取消（客户端断开/截止时间到期）时两个引擎一起取消
+        with deadline.cancel_event.on_set(cancel_all):
+            launch(ENGINE_WINDOWS)
+            delay = self._hedge_delay(ext)
+            try:
+                try:
+                    first = finished.get(timeout=delay)
+                except queue.Empty:
+                    first = None
+                    # 限制同时进行的对冲数量，避免放大LibreOffice负载
+                    hedge_slot = self._hedge_slots.acquire(blocking=False)
+                    if hedge_slot:
+                        logger.info(f"Windows超过{delay:.1f}秒未返回，启动LibreOffice对冲: {input_path.name}")
+                        metrics.inc('conversion_hedge_total', ext=ext, outcome='launched')
+                        launch(ENGINE_LIBREOFFICE)
+                    else:
+                        metrics.inc('conversion_hedge_total', ext=ext, outcome='throttled')
+                else:
+                    metrics.inc('conversion_hedge_total', ext=ext, outcome='not_needed')
+                
+                while running:
+                    engine, result, error = first or finished.get()
+                    first = None
+                    running.discard(engine)
+                    if deadline.cancelled:
+                        break
+                    
+                    if result is None:
+                        last_error = error or last_error
+                        # Windows直接失败且尚未对冲：按普通降级流程启动LibreOffice
+                        if engine == ENGINE_WINDOWS and ENGINE_LIBREOFFICE not in running and not hedge_slot:
+                            logger.warning("Windows转换失败，降级到LibreOffice")
+                            try:
+                                launch(ENGINE_LIBREOFFICE)
+                            except DeadlineExceeded as e:
+                                last_error = e
+                        continue
+                    
+                    winner = engine
+                    if engine == ENGINE_LIBREOFFICE and ENGINE_WINDOWS in running and self.hedge_grace > 0:
+                        try:
+                            other, other_result, _ = finished.get(timeout=self.hedge_grace)
+                            running.discard(other)
+                            if other_result:
+                                winner = other
+                        except queue.Empty:
+                            pass
+                    break
+            finally:
+                for engine in running:
+                    cancels[engine].set()
+                if hedge_slot:
+                    self._hedge_slots.release()
+        
+        # 被取消时胜出的结果也没有人接收
+        if deadline.cancelled:
+            winner = None
+        for engine, path in outputs.items():
+            if engine != winner:
+                self.cleanup_file(str(path))
+        deadline.raise_if_cancelled()
+        
+        if winner is None:
+            raise last_error or Exception("转换失败")
+        
+        metrics.inc('conversion_hedge_winner_total', ext=ext, engine=winner)
+        os.replace(outputs[winner], output_pdf)
+        logger.info(f"✅ {winner}转换成功（对冲模式）")
+        return str(output_pdf)
+    
+    def _should_hedge(self, plan: list) -> bool:
+        """只有Windows为首选、LibreOffice为兜底时才对冲，并按比例抽样"""
+        if not self.hedge_enabled or plan[:2] != [ENGINE_WINDOWS, ENGINE_LIBREOFFICE]:
+            return False
+        return random.random() * 100 < self.hedge_percent
     
-    def _convert_via_libreoffice(self, input_path: Path, output_pdf: Path) -> str:
+    def _hedge_delay(self, ext: str) -> float:
+        """对冲阈值：该类型Windows转换成功耗时的p95，不低于配置的最小值"""
+        summary = self.engine_stats.summary(ENGINE_WINDOWS, ext)
+        if summary['samples'] < config.ENGINE_MIN_SAMPLES:
+            return self.hedge_min_delay
+        return min(max(summary['p95'], self.hedge_min_delay), self.windows_timeout)
+    
+    def _convert_via_libreoffice(self, input_path: Path, output_pdf: Path, options: ExportOptions = None,
+                                 timeout: float = None, cancel_event: CancelToken = None) -> str:
         """
         通过LibreOffice转换文档（备用方案）
         
         Args:
             input_path: 输入文件路径
             output_pdf: 输出PDF路径
+            options: 部分转换参数
+            timeout: 超时秒数，默认 CONVERSION_TIMEOUT（批量模式下整批的超时不超过各文件中最短的剩余时间）
+            cancel_event: 取消信号，置位后放弃排队或终止soffice进程树
             
         Returns:
             str: PDF文件路径
             
         Raises:
+            ConversionCancelled: 被取消
             Exception: 转换失败时抛出异常
         """
         # 删除旧PDF
         if output_pdf.exists():
             os.remove(output_pdf)
         
+        # 批量模式：与同时等待的其他文件合并转换（部分转换的导出参数各不相同，单独转换）
+        if self.libreoffice_batcher and options is None:
+            return self.libreoffice_batcher.submit(input_path, output_pdf, timeout or self.timeout, cancel_event)
+        
+        return self._run_libreoffice(input_path, output_pdf, cancel_event, options, timeout)
+    
+    def _run_libreoffice(self, input_path: Path, output_pdf: Path, cancel_event: threading.Event = None,
+                         options: ExportOptions = None, timeout: float = None) -> str:
+        """单独调用一次soffice转换单个文件（排队等待槽位的时间也计入超时）"""
+        timeout = timeout or self.timeout
+        start = time.time()
+        # soffice固定输出为 <outdir>/<输入文件名>.pdf，目标路径不同时先输出到临时目录
+        default_name = output_pdf.name == f"{input_path.stem}.pdf"
+        outdir = output_pdf.parent if default_name else Path(tempfile.mkdtemp(prefix='lo_', dir=self.temp_dir))
+        produced = outdir / f"{input_path.stem}.pdf"
+        ext = input_path.suffix.lower()
+        target = options.libreoffice_target(ext) if options else 'pdf'
+        restricted_dir = None
+        
         try:
-            # 调用LibreOffice进行转换
-            cmd = [
-                self.libreoffice_path,
-                '--headless',
-                '--convert-to', 'pdf',
-                '--outdir', str(input_path.parent),
-                str(input_path)
-            ]
-            
-            logger.info(f"开始LibreOffice转换: {input_path.name}")
-            
-            result = subprocess.run(
-                cmd,
-                timeout=self.timeout,
-                capture_output=True,
-                text=True
-            )
+            # 选择工作表/打印区域：转换修改过 workbook.xml 的副本
+            if options and (options.sheets or options.print_area):
+                if not options.supported_by_libreoffice(ext):
+                    raise ExportOptionsError(f"LibreOffice不支持在{ext}中选择工作表/打印区域", status_code=422)
+                restricted_dir = Path(tempfile.mkdtemp(prefix='lo_part_', dir=self.temp_dir))
+                input_path = restrict_workbook(input_path, restricted_dir / input_path.name, options)
             
-            if result.returncode != 0:
-                logger.error(f"LibreOffice转换失败: {result.stderr}")
-                raise Exception(f"LibreOffice转换失败: {result.stderr}")
+            # 占用一个独立配置目录，避免多个soffice共用配置而互相阻塞
+            acquire_start = time.time()
+            with self.libreoffice_pool.acquire(timeout=timeout, cancel_event=cancel_event) as profile:
+                tracer.record('libreoffice.slot_wait', acquire_start, time.time(), slot=profile.index)
+                cmd = [
+                    self.libreoffice_path,
+                    profile.env_arg,
+                    '--headless',
+                    '--norestore',
+                    '--convert-to', target,
+                    '--outdir', str(outdir),
+                    str(input_path)
+                ]
+                
+                logger.info(f"开始LibreOffice转换: {input_path.name} (槽位 {profile.index})")
+                
+                returncode, stderr = self._run_soffice(cmd, max(1, timeout - (time.time() - start)), cancel_event)
             
-            if not output_pdf.exists():
+            if returncode != 0:
+                logger.error(f"LibreOffice转换失败: {stderr}")
+                raise Exception(f"LibreOffice转换失败: {stderr}")
+            
+            if not produced.exists():
                 raise Exception("PDF文件未生成")
             
+            if not default_name:
+                shutil.move(str(produced), str(output_pdf))
+            
             logger.info(f"LibreOffice转换成功: {output_pdf.name}")
             return str(output_pdf)
             
         except subprocess.TimeoutExpired:
             logger.error(f"LibreOffice转换超时: {input_path}")
-            raise Exception(f"转换超时(>{self.timeout}秒)")
+            raise Exception(f"转换超时(>{timeout:.0f}秒)")
+        except TimeoutError as e:
+            logger.error(f"LibreOffice转换排队超时: {input_path}")
+            raise Exception(str(e))
+        except ConversionCancelled:
+            logger.info(f"LibreOffice转换已取消: {input_path.name}")
+            raise
         except Exception as e:
             logger.error(f"LibreOffice转换异常: {str(e)}")
             raise
+        finally:
+            if not default_name:
+                shutil.rmtree(outdir, ignore_errors=True)
+            if restricted_dir:
+                shutil.rmtree(restricted_dir, ignore_errors=True)
+    
+    def _run_soffice(self, cmd: list, timeout: float, cancel_event: threading.Event = None, files: int = 1):
+        """
+        在独立进程组中运行soffice（带CPU/内存限制），超时或收到取消信号时终止整个进程树
+        
+        Args:
+            files: 本次转换的文件数，CPU时间上限按文件数放大
+        
+        Returns:
+            tuple: (returncode, stderr)
+        """
+        with tracer.span('soffice.run', files=files) as span:
+            try:
+                result = run_supervised(
+                    cmd, timeout, cancel_event,
+                    cpu_limit=self.soffice_cpu_limit * files,
+                    memory_limit=self.soffice_memory_limit
+                )
+            except SofficeCancelled:
+                raise ConversionCancelled("转换已取消")
+            span.set(returncode=result.returncode, cpu_seconds=round(result.cpu_seconds, 3), peak_rss=result.peak_rss)
+        return result.returncode, result.stderr
+    
+    def _run_libreoffice_batch(self, jobs: list, cancel_event: threading.Event = None):
+        """
+        一次soffice调用转换一批文件，并把输出分发给各个等待的调用方
+        
+        Args:
+            jobs: BatchJob列表，同一批内文件名（stem）互不相同
+            cancel_event: 同批文件都被调用方放弃时置位，放弃等待槽位或终止soffice进程树
+        """
+        batch_dir = Path(tempfile.mkdtemp(prefix='lo_batch_', dir=self.temp_dir))
+        # 整批的超时不超过其中任何一个文件剩余的尝试时间（保证调用方的截止时间）
+        batch_timeout = min(self.timeout * len(jobs), min(job.remaining() for job in jobs))
+        start = time.time()
+        crashed = False
+        retry_jobs = []
+        
+        try:
+            try:
+                if batch_timeout <= 0:
+                    raise subprocess.TimeoutExpired('soffice', 0)
+                with self.libreoffice_pool.acquire(timeout=batch_timeout, cancel_event=cancel_event) as profile:
+                    cmd = [
+                        self.libreoffice_path,
+                        profile.env_arg,
+                        '--headless',
+                        '--norestore',
+                        '--convert-to', 'pdf',
+                        '--outdir', str(batch_dir)
+                    ] + [str(job.input_path) for job in jobs]
+                    
+                    logger.info(f"开始LibreOffice批量转换: {len(jobs)} 个文件 (槽位 {profile.index})")
+                    
+                    returncode, stderr = self._run_soffice(cmd, max(1, batch_timeout - (time.time() - start)),
+                                                           cancel_event, files=len(jobs))
+                
+                if returncode != 0:
+                    logger.error(f"LibreOffice批量转换异常退出: {stderr}")
+                    crashed = True
+            except (subprocess.TimeoutExpired, TimeoutError):
+                logger.error(f"LibreOffice批量转换超时(>{batch_timeout:.0f}秒)")
+                crashed = True
+            except ConversionCancelled as e:
+                # 同批的调用方都已放弃：不分发、不重试
+                logger.info(f"LibreOffice批量转换已终止: {len(jobs)} 个文件的调用方都已放弃")
+                for job in jobs:
+                    job.set_error(e)
+                return
+            
+            for job in jobs:
+                produced = batch_dir / f"{job.input_path.stem}.pdf"
+                if produced.exists():
+                    shutil.move(str(produced), str(job.output_pdf))
+                    job.set_result(str(job.output_pdf))
+                elif crashed and len(jobs) > 1:
+                    retry_jobs.append(job)
+                else:
+                    job.set_error(Exception("PDF文件未生成"))
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+        
+        # 整批异常退出时，未生成PDF的文件逐个单独重试，避免一个坏文件拖垮整批；
+        # 已经没有剩余时间或已被取消的文件不再重试
+        for job in retry_jobs:
+            if job.abandoned or job.remaining() < 1:
+                job.set_error(Exception(f"转换超时(>{batch_timeout:.0f}秒)"))
+                continue
+            try:
+                job.set_result(self._run_libreoffice(job.input_path, job.output_pdf, job.cancel_event,
+                                                     timeout=job.remaining()))
+            except Exception as e:
+                job.set_error(e)
     
     def cleanup_file(self, file_path: str):
         """清理临时文件"""
@@ -0,0 +1,150 @@
+"""
+转换超时预算与端到端截止时间
+
+固定的 CONVERSION_TIMEOUT / WINDOWS_CONVERTER_TIMEOUT 对所有文件一视同仁：
+卡住的小文件要占满整个超时才释放槽位，页数多的大文件却可能被提前杀掉。
+这里按文件大小、类型、页数和该引擎的历史耗时为每次转换计算超时预算，
+并用一个贯穿整条降级链的截止时间约束所有尝试，保证 Windows + LibreOffice
+加起来不超过 nginx proxy_read_timeout 愿意等待的时间。
+
+Deadline 同时携带该请求的取消信号（见 cancellation.py）：客户端断开或截止
+时间到期时取消，排队、soffice 进程树和 Windows 请求随之终止。
+"""
+
+import time
+import logging
+import threading
+from metrics import metrics
+from cancellation import CancelToken, ConversionCancelled, CANCEL_DEADLINE
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(TimeoutError):
+    """端到端截止时间已到，剩余时间不足以再尝试任何引擎"""
+
+
+class Deadline:
+    """
+    端到端截止时间
+
+    Args:
+        seconds: 从现在起的可用秒数
+        started_at: 计时起点（默认现在），例如请求到达的时间
+    """
+
+    def __init__(self, seconds: float, started_at: float = None):
+        self.started_at = started_at or time.time()
+        self.expires_at = self.started_at + seconds
+        self.cancel_event = CancelToken()
+        self.cancel_reason = None
+        self._cancel_lock = threading.Lock()
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.time())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def elapsed(self) -> float:
+        return time.time() - self.started_at
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def cancel(self, reason: str):
+        """取消该请求的所有后续工作（只有第一次取消生效）"""
+        with self._cancel_lock:
+            if self.cancel_reason is not None:
+                return
+            self.cancel_reason = reason
+        logger.info(f"请求已取消[{reason}]: 已用时{self.elapsed():.1f}秒")
+        metrics.inc('request_cancelled_total', reason=reason)
+        self.cancel_event.set()
+
+    def raise_if_cancelled(self):
+        """
+        Raises:
+            DeadlineExceeded: 因截止时间到期被取消
+            ConversionCancelled: 因其他原因（如客户端断开）被取消
+        """
+        if not self.cancelled:
+            return
+        if self.cancel_reason == CANCEL_DEADLINE:
+            raise DeadlineExceeded(f"转换超时：已超过截止时间（已用时{self.elapsed():.0f}秒）")
+        raise ConversionCancelled(f"转换已取消: {self.cancel_reason}")
+
+
+class TimeoutPolicy:
+    """
+    按文档估算每个引擎的超时预算
+
+    预算 = max(静态估算, 历史p95 × 倍数)，限制在 [下限, 引擎上限] 之间：
+        静态估算 = 基础时间 + 每MB时间 × 大小 + 每页时间 × 页数（幻灯片数/工作表数）
+    历史样本不足时只用静态估算。
+
+    Args:
+        stats: EngineStats，提供各引擎/类型的历史耗时
+        caps: 引擎 -> 单次尝试的超时上限
+        adaptive: 为False时直接使用上限（即原来的固定超时）
+    """
+
+    def __init__(self, stats, caps: dict, adaptive: bool = True, base: float = 10, per_mb: float = 3,
+                 per_page: float = 0.5, p95_factor: float = 2, floor: float = 5, min_samples: int = 10):
+        self.stats = stats
+        self.caps = caps
+        self.adaptive = adaptive
+        self.base = base
+        self.per_mb = per_mb
+        self.per_page = per_page
+        self.p95_factor = p95_factor
+        self.floor = floor
+        self.min_samples = min_samples
+
+    def estimate(self, engine: str, ext: str, size: int = 0, hints: dict = None) -> float:
+        """单次尝试的超时预算（秒），未考虑截止时间"""
+        if not self.adaptive:
+            return self.caps[engine]
+        hints = hints or {}
+        units = hints.get('pages') or hints.get('slides') or hints.get('sheets') or 0
+        budget = self.base + self.per_mb * size / (1024 * 1024) + self.per_page * units
+
+        summary = self.stats.summary(engine, ext)
+        if summary['samples'] >= self.min_samples and summary['p95'] > 0:
+            budget = max(budget, summary['p95'] * self.p95_factor)
+
+        cap = self.caps.get(engine, budget)
+        return min(max(budget, self.floor), max(cap, self.floor))
+
+    def plan_budgets(self, plan: list, ext: str, size: int = 0, hints: dict = None) -> dict:
+        """整条降级链中每个引擎的预算"""
+        budgets = {engine: self.estimate(engine, ext, size, hints) for engine in plan}
+        for engine, budget in budgets.items():
+            metrics.observe('conversion_timeout_budget_seconds', budget, engine=engine, ext=ext)
+        return budgets
+
+    def reserve_for(self, budgets: dict, later: list, deadline: Deadline) -> float:
+        """为降级链中后续引擎保留的时间：它们的预算之和，最多占剩余时间的一半"""
+        if deadline is None or not later:
+            return 0
+        return min(sum(budgets[engine] for engine in later), deadline.remaining() / 2)
+
+    def attempt_timeout(self, budget: float, deadline: Deadline, reserve: float = 0) -> float:
+        """
+        本次尝试实际可用的超时：预算与截止时间剩余（扣除为后续引擎保留的时间）取小
+
+        Raises:
+            DeadlineExceeded: 剩余时间不足下限
+        """
+        if deadline is None:
+            return budget
+        available = deadline.remaining() - reserve
+        if available < self.floor:
+            # 不够给后续引擎留时间时，本次用完剩余时间也比直接放弃好
+            available = deadline.remaining()
+            if available < self.floor:
+                metrics.inc('conversion_deadline_exceeded_total')
+                raise DeadlineExceeded(f"转换超时：剩余处理时间不足（已用时{deadline.elapsed():.0f}秒）")
+        return min(budget, available)
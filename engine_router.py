@@ -0,0 +1,216 @@
+"""
+转换引擎路由策略
+
+根据文件类型、保真度规则和各引擎最近的耗时/成功率，
+决定一次转换依次尝试哪些引擎。
+
+规则配置格式（config.py / 环境变量）:
+    "docx:windows,doc:windows"            文件类型 -> 引擎
+    "xlsx:libreoffice|windows"            用 | 给出多个引擎的顺序
+"""
+
+import random
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from metrics import metrics, quantile
+
+logger = logging.getLogger(__name__)
+
+ENGINE_WINDOWS = 'windows'
+ENGINE_LIBREOFFICE = 'libreoffice'
+DEFAULT_ENGINE_ORDER = [ENGINE_WINDOWS, ENGINE_LIBREOFFICE]
+
+
+def parse_engine_rules(text: str) -> dict:
+    """
+    解析 "docx:windows,xlsx:libreoffice|windows" 格式的规则
+
+    Returns:
+        dict: {'.docx': ['windows'], '.xlsx': ['libreoffice', 'windows']}
+    """
+    rules = {}
+    for item in (text or '').split(','):
+        if ':' not in item:
+            continue
+        ext, engines = item.split(':', 1)
+        ext = ext.strip().lower()
+        if not ext.startswith('.'):
+            ext = '.' + ext
+        rules[ext] = [e.strip().lower() for e in engines.split('|') if e.strip()]
+    return rules
+
+
+class EngineStats:
+    """按 (引擎, 文件类型) 记录最近若干次转换的耗时和结果"""
+
+    def __init__(self, window: int = 100):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, engine: str, ext: str, success: bool, duration: float):
+        with self._lock:
+            samples = self._samples.get((engine, ext))
+            if samples is None:
+                samples = self._samples[(engine, ext)] = deque(maxlen=self.window)
+            samples.append((success, duration))
+
+    def summary(self, engine: str, ext: str) -> dict:
+        """
+        Returns:
+            dict: samples, success_rate, mean（全部样本平均耗时）, p95（成功样本）
+        """
+        with self._lock:
+            samples = list(self._samples.get((engine, ext), ()))
+        if not samples:
+            return {'samples': 0, 'success_rate': 0.0, 'mean': 0.0, 'p95': 0.0}
+        ok_durations = [d for s, d in samples if s]
+        return {
+            'samples': len(samples),
+            'success_rate': len(ok_durations) / len(samples),
+            'mean': sum(d for _, d in samples) / len(samples),
+            'p95': quantile(ok_durations, 0.95),
+        }
+
+
+class RoutingPolicy(ABC):
+    """
+    路由策略基类
+
+    子类实现 order()，给出候选引擎的尝试顺序；
+    保真度规则和静态覆盖在基类 plan() 中统一处理。
+    """
+
+    name = 'base'
+
+    def __init__(self, stats: EngineStats, fidelity_rules: dict = None,
+                 overrides: dict = None, strict_fidelity: bool = False):
+        self.stats = stats
+        self.fidelity_rules = fidelity_rules or {}
+        self.overrides = overrides or {}
+        self.strict_fidelity = strict_fidelity
+
+    def plan(self, ext: str, available: list) -> list:
+        """
+        返回本次转换依次尝试的引擎列表
+
+        Args:
+            ext: 小写文件扩展名（如 '.docx'）
+            available: 当前可用的引擎
+        """
+        ext = ext.lower()
+
+        # 静态覆盖优先级最高，按配置顺序原样使用
+        if ext in self.overrides:
+            plan = [e for e in self.overrides[ext] if e in available]
+            self._record_decision(ext, plan, 'override')
+            return plan
+
+        # 保真度规则：只有指定引擎满足要求，其余引擎仅作最后兜底（严格模式下不兜底）
+        required = [e for e in self.fidelity_rules.get(ext, []) if e in available]
+        if required:
+            plan = self.order(ext, required)
+            if not self.strict_fidelity:
+                plan += [e for e in self.order(ext, available) if e not in plan]
+            self._record_decision(ext, plan, 'fidelity')
+            return plan
+
+        plan = self.order(ext, list(available))
+        self._record_decision(ext, plan, self.name)
+        return plan
+
+    @abstractmethod
+    def order(self, ext: str, candidates: list) -> list:
+        """
+        给出候选引擎的尝试顺序
+
+        Args:
+            ext: 小写文件扩展名
+            candidates: 参与排序的引擎
+
+        Returns:
+            list: 排好序的引擎列表
+        """
+
+    def record(self, engine: str, ext: str, success: bool, duration: float):
+        """记录一次转换结果，供后续路由参考"""
+        self.stats.record(engine, ext, success, duration)
+        outcome = 'success' if success else 'failure'
+        metrics.inc('conversion_attempts_total', engine=engine, ext=ext, outcome=outcome)
+        metrics.observe('conversion_engine_seconds', duration, engine=engine, ext=ext, outcome=outcome)
+
+    def _record_decision(self, ext: str, plan: list, reason: str):
+        primary = plan[0] if plan else 'none'
+        metrics.inc('conversion_route_total', policy=self.name, ext=ext, engine=primary, reason=reason)
+        logger.info(f"路由决策[{self.name}/{reason}]: {ext} -> {' > '.join(plan) or '无可用引擎'}")
+
+
+class StaticPolicy(RoutingPolicy):
+    """固定顺序：Windows优先，LibreOffice兜底（与原有行为一致）"""
+
+    name = 'static'
+
+    def order(self, ext: str, candidates: list) -> list:
+        ranked = [e for e in DEFAULT_ENGINE_ORDER if e in candidates]
+        return ranked + [e for e in candidates if e not in ranked]
+
+
+class AdaptivePolicy(StaticPolicy):
+    """
+    按预期完成时间排序：平均耗时 / 成功率
+
+    样本不足时沿用静态顺序；并以 explore_rate 的概率把样本最少的引擎
+    排到最前，保证兜底引擎也能持续积累统计数据。
+    """
+
+    name = 'adaptive'
+
+    def __init__(self, stats: EngineStats, min_samples: int = 10, explore_rate: float = 0.05, **kwargs):
+        super().__init__(stats, **kwargs)
+        self.min_samples = min_samples
+        self.explore_rate = explore_rate
+
+    def expected_time(self, engine: str, ext: str):
+        summary = self.stats.summary(engine, ext)
+        if summary['samples'] < self.min_samples:
+            return None
+        return summary['mean'] / max(summary['success_rate'], 0.01)
+
+    def order(self, ext: str, candidates: list) -> list:
+        static = super().order(ext, candidates)
+        if len(static) < 2:
+            return static
+
+        if random.random() < self.explore_rate:
+            least = min(static, key=lambda e: self.stats.summary(e, ext)['samples'])
+            return [least] + [e for e in static if e != least]
+
+        expected = {e: self.expected_time(e, ext) for e in static}
+        if any(v is None for v in expected.values()):
+            return static
+        return sorted(static, key=lambda e: expected[e])
+
+
+POLICIES = {
+    StaticPolicy.name: StaticPolicy,
+    AdaptivePolicy.name: AdaptivePolicy,
+}
+
+
+def register_policy(policy_class):
+    """注册自定义路由策略，之后可通过 ENGINE_ROUTING_POLICY 按名称选择"""
+    POLICIES[policy_class.name] = policy_class
+    return policy_class
+
+
+def create_policy(name: str, stats: EngineStats = None, **kwargs) -> RoutingPolicy:
+    policy_class = POLICIES.get(name)
+    if policy_class is None:
+        logger.warning(f"未知的路由策略: {name}，使用static")
+        policy_class = StaticPolicy
+    if not issubclass(policy_class, AdaptivePolicy):
+        kwargs.pop('min_samples', None)
+        kwargs.pop('explore_rate', None)
+    return policy_class(stats or EngineStats(), **kwargs)
@@ -0,0 +1,30 @@
+"""
+gunicorn 配置
+
+    gunicorn -c gunicorn.conf.py app:app
+
+- preload_app: master 导入 app.py 并构造转换器/企业微信客户端（不启动任何线程），
+  fork 出来的 worker 直接共享，被 --timeout 回收后新 worker 不必重新导入和初始化
+- post_fork: 每个 worker 启动后立即在后台预热 LibreOffice 配置目录和 access_token，
+  不等首个请求
+"""
+
+import os
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('GUNICORN_WORKERS', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+
+def when_ready(server):
+    # 开始 fork worker 之前在 master 中构造服务实例（构造函数不启动线程，fork 安全）
+    if server.cfg.preload_app:
+        import services
+        services.preload()
+
+
+def post_fork(server, worker):
+    import services
+    services.warm_up()
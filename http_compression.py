@@ -0,0 +1,288 @@
+"""
+HTTP 请求/响应压缩（转换服务器 <-> Windows 转换服务）
+
+到Windows虚拟机的链路带宽有限，而旧版 .doc/.xls/.ppt 和文字为主的PDF压缩率很高：
+
+- 响应：调用方发送 Accept-Encoding，Windows服务按协商结果压缩PDF
+  （先压缩到文件、带 Content-Length 返回，连接可以复用；requests/urllib3、httpx 自动解压）
+- 请求：Windows服务在响应头 Accept-Encoding 中声明支持的请求压缩格式，
+  调用方得知后把 multipart 请求体整体流式压缩（Content-Encoding，分块传输），
+  服务端由 DecompressMiddleware 在 WSGI 层解压
+- 小文件和已经压缩过的内容（docx/xlsx/pptx 本身是zip、图片为主的PDF）
+  先压缩一段样本，压缩率不够时不压缩
+
+zstd 需要安装 zstandard 包，没有时只使用 gzip。
+本模块只依赖标准库（zstandard 可选），Windows服务部署时复制到同一目录。
+"""
+
+import io
+import os
+import zlib
+import uuid
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖
+    zstandard = None
+
+ENCODING_ZSTD = 'zstd'
+ENCODING_GZIP = 'gzip'
+
+# 本机支持的压缩格式（按优先级）
+AVAILABLE_ENCODINGS = ([ENCODING_ZSTD] if zstandard is not None else []) + [ENCODING_GZIP]
+
+# 压缩样本的大小和需要达到的压缩率（压缩后/压缩前）
+SAMPLE_SIZE = 256 * 1024
+MAX_SAMPLE_RATIO = 0.9
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def parse_encodings(value: str) -> list:
+    """
+    解析配置中的压缩格式
+
+    Args:
+        value: auto（本机支持的全部）、off，或逗号分隔的格式，如 "zstd,gzip"
+
+    Returns:
+        list: 本机支持的格式（按给定顺序）
+    """
+    value = (value or '').strip().lower()
+    if value in ('', 'off', 'none', 'false'):
+        return []
+    if value == 'auto':
+        return list(AVAILABLE_ENCODINGS)
+    return [item.strip() for item in value.split(',') if item.strip() in AVAILABLE_ENCODINGS]
+
+
+def parse_accept_encoding(header: str) -> set:
+    """Accept-Encoding 中接受的格式（q=0 的除外）"""
+    accepted = set()
+    for item in (header or '').split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name)
+    return accepted
+
+
+def negotiate(header: str, encodings: list) -> str:
+    """按 encodings 的优先级选出对方接受的格式，没有则返回None"""
+    accepted = parse_accept_encoding(header)
+    for encoding in encodings:
+        if encoding in accepted or '*' in accepted:
+            return encoding
+    return None
+
+
+def compressor(encoding: str):
+    """流式压缩器（compress(data) / flush()）"""
+    if encoding == ENCODING_GZIP:
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == ENCODING_ZSTD and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    raise ValueError(f"不支持的压缩格式: {encoding}")
+
+
+def decompressor(encoding: str):
+    """流式解压器（decompress(data)）"""
+    if encoding == ENCODING_GZIP:
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == ENCODING_ZSTD and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(f"不支持的压缩格式: {encoding}")
+
+
+def worth_compressing(path: str, min_size: int, encoding: str = ENCODING_GZIP) -> bool:
+    """文件不小于 min_size，且开头一段样本的压缩率足够高"""
+    try:
+        if os.path.getsize(path) < min_size:
+            return False
+        with open(path, 'rb') as f:
+            sample = f.read(SAMPLE_SIZE)
+    except OSError:
+        return False
+    c = compressor(encoding)
+    compressed = len(c.compress(sample)) + len(c.flush())
+    return compressed <= len(sample) * MAX_SAMPLE_RATIO
+
+
+def compress_chunks(chunks, encoding: str):
+    """流式压缩一个字节块迭代器，encoding 为空时原样输出"""
+    if not encoding:
+        yield from chunks
+        return
+    c = compressor(encoding)
+    for chunk in chunks:
+        data = c.compress(chunk)
+        if data:
+            yield data
+    tail = c.flush()
+    if tail:
+        yield tail
+
+
+def compress_file(src: str, dest: str, encoding: str) -> int:
+    """
+    压缩整个文件（响应需要 Content-Length 时使用，否则持久连接在分块响应后会被关闭）
+
+    Returns:
+        int: 压缩后的字节数
+    """
+    with open(dest, 'wb') as f:
+        for chunk in compress_chunks(file_chunks(open(src, 'rb')), encoding):
+            f.write(chunk)
+        return f.tell()
+
+
+def file_chunks(f, chunk_size: int = 256 * 1024):
+    """逐块读取已打开的文件（读完后关闭）"""
+    try:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            yield chunk
+    finally:
+        f.close()
+
+
+class MultipartBody:
+    """
+    流式生成的 multipart/form-data 请求体（一个文件字段加若干文本字段）
+
+    Args:
+        file_field: 文件字段名
+        path: 文件路径
+        filename: 上传的文件名
+        fields: 文本字段
+    """
+
+    def __init__(self, file_field: str, path: str, filename: str, fields: dict = None):
+        self.boundary = uuid.uuid4().hex
+        self.file_field = file_field
+        self.path = path
+        self.filename = filename
+        self.fields = fields or {}
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def _escape(self, value: str) -> str:
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\r', ' ').replace('\n', ' ')
+
+    def chunks(self, chunk_size: int = 256 * 1024):
+        for name, value in self.fields.items():
+            yield (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{self._escape(name)}"'
+                   f'\r\n\r\n{value}\r\n').encode('utf-8')
+        yield (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{self._escape(self.file_field)}"; '
+               f'filename="{self._escape(self.filename)}"\r\n'
+               f'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8')
+        yield from file_chunks(open(self.path, 'rb'), chunk_size)
+        yield f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+
+
+class _DecompressingReader(io.RawIOBase):
+    """
+    边读边解压的输入流
+
+    Args:
+        stream: 压缩的输入流
+        encoding: 压缩格式
+        limit: 压缩数据的字节数（Content-Length），为空时读到流结束
+    """
+
+    # 每次解压输出的上限（gzip），高压缩比的数据不会一次解压到内存中
+    MAX_OUTPUT = 1024 * 1024
+
+    def __init__(self, stream, encoding: str, limit: int = None, chunk_size: int = 64 * 1024):
+        self._stream = stream
+        self._decompressor = decompressor(encoding)
+        self._limited = encoding == ENCODING_GZIP
+        self._remaining = limit
+        self._chunk_size = chunk_size
+        self._tail = b''
+        self._buffer = b''
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def _read_raw(self) -> bytes:
+        size = self._chunk_size
+        if self._remaining is not None:
+            size = min(size, self._remaining)
+            if size <= 0:
+                return b''
+        data = self._stream.read(size)
+        if self._remaining is not None:
+            self._remaining -= len(data)
+        return data
+
+    def _fill(self):
+        data, self._tail = self._tail, b''
+        if not data:
+            data = self._read_raw()
+            if not data:
+                self._eof = True
+                return
+        if self._limited:
+            self._buffer = self._decompressor.decompress(data, self.MAX_OUTPUT)
+            self._tail = self._decompressor.unconsumed_tail
+        else:
+            self._buffer = self._decompressor.decompress(data)
+
+    def readinto(self, b) -> int:
+        while not self._buffer and not self._eof:
+            self._fill()
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+class DecompressMiddleware:
+    """
+    WSGI 中间件：解压 Content-Encoding 为 gzip/zstd 的请求体
+
+    解压后的长度未知：去掉 CONTENT_LENGTH 并设置 wsgi.input_terminated，
+    Werkzeug 读取时仍按 MAX_CONTENT_LENGTH 限制解压后的大小（防止压缩炸弹）。
+    不支持的 Content-Encoding 返回 415，响应头 Accept-Encoding 列出支持的格式。
+
+    Args:
+        app: WSGI 应用
+        encodings: 接受的请求压缩格式
+    """
+
+    def __init__(self, app, encodings: list = None):
+        self.app = app
+        self.encodings = AVAILABLE_ENCODINGS if encodings is None else encodings
+
+    def __call__(self, environ, start_response):
+        encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding and encoding != 'identity':
+            if encoding not in self.encodings:
+                start_response('415 Unsupported Media Type', [
+                    ('Content-Type', 'text/plain; charset=utf-8'),
+                    ('Accept-Encoding', ', '.join(self.encodings)),
+                ])
+                return [f'unsupported Content-Encoding: {encoding}'.encode('utf-8')]
+            limit = None
+            if not environ.get('wsgi.input_terminated') and environ.get('CONTENT_LENGTH', '').isdigit():
+                limit = int(environ['CONTENT_LENGTH'])
+            environ = dict(environ)
+            environ['wsgi.input'] = io.BufferedReader(
+                _DecompressingReader(environ['wsgi.input'], encoding, limit)
+            )
+            environ['wsgi.input_terminated'] = True
+            environ.pop('CONTENT_LENGTH', None)
+            environ.pop('HTTP_CONTENT_ENCODING', None)
+        return self.app(environ, start_response)
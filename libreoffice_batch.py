@@ -0,0 +1,182 @@
+"""
+LibreOffice 批量转换
+
+soffice --convert-to pdf 一次可以接收多个输入文件。多个请求同时等待
+LibreOffice 时，在一个很短的时间窗口内把它们收集起来，用一次 soffice
+调用全部转换，省去重复的进程启动和初始化开销。
+"""
+
+import time
+import logging
+import threading
+from pathlib import Path
+from metrics import metrics
+from cancellation import ConversionCancelled
+
+logger = logging.getLogger(__name__)
+
+
+class BatchJob:
+    """
+    批量转换中的单个文件
+
+    Args:
+        timeout: 该文件本次尝试的超时（秒，从提交时开始计算），批次的超时不超过其中最短的剩余时间
+        cancel_event: 调用方的取消信号
+    """
+
+    def __init__(self, input_path: Path, output_pdf: Path, timeout: float, cancel_event: threading.Event = None):
+        self.input_path = input_path
+        self.output_pdf = output_pdf
+        self.expires_at = time.time() + timeout
+        self.cancel_event = cancel_event
+        self.result = None
+        self.error = None
+        self.abandoned = False
+        # 发车后设置：同批的全部文件和批次的取消信号
+        self.batch = None
+        self.batch_cancel = None
+        self._done = threading.Event()
+
+    def abandon(self):
+        """
+        调用方放弃等待（持有批量器的锁时调用）
+
+        同批文件都已放弃时置位批次的取消信号，终止正在运行的 soffice 进程树。
+        """
+        self.abandoned = True
+        if self.batch is not None and all(job.abandoned for job in self.batch):
+            self.batch_cancel.set()
+
+    def set_result(self, result: str):
+        self.result = result
+        self._done.set()
+        if self.abandoned:
+            # 调用方已取消，没有人会取走这个PDF
+            Path(result).unlink(missing_ok=True)
+
+    def set_error(self, error: Exception):
+        self.error = error
+        self._done.set()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.time())
+
+    def wait(self) -> str:
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class LibreOfficeBatcher:
+    """
+    收集等待转换的文件并分批交给 run_batch 执行
+
+    run_batch(jobs, cancel_event) 负责转换并为每个 BatchJob 设置结果或异常，
+    单个文件失败不影响同批其他文件；cancel_event 在同批文件都被调用方放弃时置位。
+    """
+
+    def __init__(self, run_batch, window_ms: int = 200, max_size: int = 8):
+        self.run_batch = run_batch
+        self.window = window_ms / 1000.0
+        self.max_size = max(1, max_size)
+        self._pending = []
+        self._cond = threading.Condition()
+        self._collector = None
+
+    def submit(self, input_path: Path, output_pdf: Path, timeout: float,
+               cancel_event: threading.Event = None) -> str:
+        """
+        提交一个文件并阻塞等待它所在批次完成
+
+        Args:
+            timeout: 本次尝试的超时（秒），包括等待发车和批量转换
+            cancel_event: 取消信号。还在等待发车时直接移出队列；已经在转换中时
+                放弃等待（不影响同批其他文件），生成的PDF随后删除
+
+        Raises:
+            ConversionCancelled: 等待中被取消
+        """
+        job = BatchJob(input_path, output_pdf, timeout, cancel_event)
+        entry = (time.time(), job)
+        with self._cond:
+            self._ensure_collector()
+            self._pending.append(entry)
+            self._cond.notify()
+        if cancel_event is None:
+            return job.wait()
+
+        while not job._done.wait(0.2):
+            if not cancel_event.is_set():
+                continue
+            with self._cond:
+                queued = entry in self._pending
+                if queued:
+                    self._pending.remove(entry)
+                else:
+                    job.abandon()
+            if job.done and job.result:
+                # 放弃的同时批次刚好完成
+                Path(job.result).unlink(missing_ok=True)
+            metrics.inc('conversion_cancelled_total', stage='libreoffice_queue' if queued else 'libreoffice_batch')
+            raise ConversionCancelled("转换已取消")
+        return job.wait()
+
+    def _ensure_collector(self):
+        # 延迟到第一次提交时才启动，fork之后的worker也能正常工作
+        if self._collector is None or not self._collector.is_alive():
+            self._collector = threading.Thread(target=self._collect_loop, name='lo-batch-collector', daemon=True)
+            self._collector.start()
+
+    def _collect_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # 从最早的文件到达开始计时，窗口结束或攒满一批即发车
+                first_arrival = self._pending[0][0]
+                while len(self._pending) < self.max_size:
+                    remaining = first_arrival + self.window - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, cancel_event = self._take_batch()
+
+            logger.info(f"LibreOffice批量转换: {len(batch)} 个文件")
+            threading.Thread(target=self._run, args=(batch, cancel_event), daemon=True).start()
+
+    def _take_batch(self):
+        """取出一批文件（持有锁时调用），同名文件（输出会互相覆盖）留到下一批"""
+        batch, rest, stems = [], [], set()
+        for arrival, job in self._pending:
+            stem = job.input_path.stem
+            if len(batch) < self.max_size and stem not in stems:
+                batch.append(job)
+                stems.add(stem)
+            else:
+                rest.append((arrival, job))
+        self._pending = rest
+        cancel_event = threading.Event()
+        for job in batch:
+            job.batch = batch
+            job.batch_cancel = cancel_event
+        return batch, cancel_event
+
+    def _run(self, batch, cancel_event):
+        try:
+            self.run_batch(batch, cancel_event)
+        except Exception as e:
+            logger.error(f"LibreOffice批量转换异常: {str(e)}")
+            for job in batch:
+                if not job.done:
+                    job.set_error(e)
+        finally:
+            # 兜底：run_batch 漏掉的文件不能让调用方永远等待
+            for job in batch:
+                if not job.done:
+                    job.set_error(Exception("PDF文件未生成"))
@@ -0,0 +1,213 @@
+"""
+LibreOffice 用户配置目录池
+
+多个 soffice 进程共用同一个用户配置目录（默认 $HOME）时，后启动的进程会
+连接到已有实例、阻塞在配置锁上，或直接退出而不生成PDF，导致 LibreOffice
+实际并发度只有1。
+
+这里为每个并发槽位准备一个独立的配置目录，通过 -env:UserInstallation 传给
+soffice。槽位用文件锁（flock）占用，因此同一台机器上的多个 gunicorn worker
+共享同一组槽位，总并发度不会超过槽位数。
+"""
+
+import os
+import fcntl
+import shutil
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from soffice_runner import run_supervised
+from metrics import metrics
+from cancellation import ConversionCancelled
+
+logger = logging.getLogger(__name__)
+
+# 已完成首次初始化的标记文件
+WARM_MARKER = '.warmed'
+
+
+class LibreOfficeProfile:
+    """单个 LibreOffice 配置目录槽位"""
+
+    def __init__(self, index: int, path: Path):
+        self.index = index
+        self.path = path
+        self.lock_path = path.with_suffix('.lock')
+
+    @property
+    def uri(self) -> str:
+        """-env:UserInstallation 需要 file:// URI"""
+        return self.path.resolve().as_uri()
+
+    @property
+    def env_arg(self) -> str:
+        return f"-env:UserInstallation={self.uri}"
+
+    @property
+    def warmed(self) -> bool:
+        return (self.path / WARM_MARKER).exists()
+
+
+class LibreOfficeProfilePool:
+    """LibreOffice 配置目录池，每个槽位同一时间只允许一个 soffice 进程使用"""
+
+    def __init__(self, base_dir: str, size: int, soffice_path: str, warm_timeout: int = 120):
+        self.base_dir = Path(base_dir)
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self.size = max(1, size)
+        self.soffice_path = soffice_path
+        self.warm_timeout = warm_timeout
+        self.profiles = [
+            LibreOfficeProfile(i, self.base_dir / f"profile_{i}")
+            for i in range(self.size)
+        ]
+        # 进程内先用信号量排队，避免线程空转轮询文件锁
+        self._semaphore = threading.BoundedSemaphore(self.size)
+        self._warm_thread = None
+
+    def warm_up_async(self):
+        """后台预热所有配置目录，不阻塞启动"""
+        if self._warm_thread and self._warm_thread.is_alive():
+            return
+        self._warm_thread = threading.Thread(target=self.warm_up, name='lo-profile-warmup', daemon=True)
+        self._warm_thread.start()
+
+    def warm_up(self):
+        """创建并初始化所有配置目录（已初始化的直接跳过）"""
+        threads = [
+            threading.Thread(target=self._warm_profile, args=(profile,), daemon=True)
+            for profile in self.profiles
+            if not profile.warmed
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        logger.info(f"LibreOffice配置目录预热完成: {self.size} 个槽位, 目录 {self.base_dir}")
+
+    def _warm_profile(self, profile: LibreOfficeProfile):
+        lock_file = self._try_lock(profile, blocking=True)
+        try:
+            if profile.warmed:
+                return
+            self._initialize(profile)
+        finally:
+            self._unlock(lock_file)
+
+    def _initialize(self, profile: LibreOfficeProfile, attempts: int = 2) -> bool:
+        """
+        让 soffice 在该目录下完成首次启动初始化后立即退出
+
+        只有 soffice 正常退出并生成了 user/ 目录才标记为已预热；失败时清空
+        初始化了一半的目录并重试，仍失败时不标记，下次占用该槽位时再初始化。
+
+        Returns:
+            bool: 是否初始化成功
+        """
+        cmd = [
+            self.soffice_path,
+            profile.env_arg,
+            '--headless',
+            '--norestore',
+            '--terminate_after_init',
+        ]
+        for attempt in range(1, attempts + 1):
+            profile.path.mkdir(parents=True, exist_ok=True)
+            start = time.time()
+            try:
+                # 超时时连同派生的 soffice.bin 一起终止
+                result = run_supervised(cmd, timeout=self.warm_timeout)
+            except Exception as e:
+                error = str(e)
+            else:
+                if result.returncode == 0 and (profile.path / 'user').is_dir():
+                    (profile.path / WARM_MARKER).touch()
+                    logger.info(f"LibreOffice配置目录已预热 [{profile.index}]: {time.time() - start:.1f}秒")
+                    return True
+                error = f"退出码 {result.returncode}: {result.stderr.strip()[:500]}"
+            logger.warning(f"LibreOffice配置目录预热失败 [{profile.index}]（第{attempt}次）: {error}")
+            metrics.inc('libreoffice_profile_init_failures_total')
+            shutil.rmtree(profile.path / 'user', ignore_errors=True)
+        return False
+
+    @contextmanager
+    def acquire(self, timeout: float = None, cancel_event: threading.Event = None):
+        """
+        占用一个空闲的配置目录槽位
+
+        Args:
+            timeout: 最长等待秒数，None表示一直等待
+            cancel_event: 取消信号，置位后放弃等待
+
+        Yields:
+            LibreOfficeProfile: 被占用的槽位
+
+        Raises:
+            TimeoutError: 等待超时
+            ConversionCancelled: 等待中被取消
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        if not self._acquire_semaphore(deadline, cancel_event):
+            raise TimeoutError("等待LibreOffice转换槽位超时")
+        try:
+            profile, lock_file = self._lock_any(deadline, cancel_event)
+            try:
+                if not profile.warmed:
+                    self._initialize(profile)
+                yield profile
+            finally:
+                self._unlock(lock_file)
+        finally:
+            self._semaphore.release()
+
+    def _acquire_semaphore(self, deadline: float, cancel_event: threading.Event = None) -> bool:
+        """等待进程内的信号量；有取消信号时分段等待，以便及时放弃"""
+        if cancel_event is None:
+            return self._semaphore.acquire(timeout=None if deadline is None else max(0, deadline - time.time()))
+        while True:
+            if cancel_event.is_set():
+                metrics.inc('conversion_cancelled_total', stage='libreoffice_queue')
+                raise ConversionCancelled("转换已取消（等待LibreOffice槽位）")
+            wait = 0.2 if deadline is None else min(0.2, deadline - time.time())
+            if wait <= 0:
+                return False
+            if self._semaphore.acquire(timeout=wait):
+                return True
+
+    def _lock_any(self, deadline: float, cancel_event: threading.Event = None):
+        """轮询所有槽位，直到抢到一个（其他 worker 可能正在占用）"""
+        # 按进程号错开起始位置，减少多个 worker 争抢同一个槽位
+        offset = os.getpid() % self.size
+        delay = 0.01
+        while True:
+            for i in range(self.size):
+                profile = self.profiles[(offset + i) % self.size]
+                lock_file = self._try_lock(profile, blocking=False)
+                if lock_file is not None:
+                    return profile, lock_file
+            if deadline is not None and time.time() >= deadline:
+                raise TimeoutError("等待LibreOffice转换槽位超时")
+            if cancel_event is not None and cancel_event.is_set():
+                metrics.inc('conversion_cancelled_total', stage='libreoffice_queue')
+                raise ConversionCancelled("转换已取消（等待LibreOffice槽位）")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.2)
+
+    def _try_lock(self, profile: LibreOfficeProfile, blocking: bool):
+        lock_file = open(profile.lock_path, 'a')
+        try:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            fcntl.flock(lock_file, flags)
+            return lock_file
+        except BlockingIOError:
+            lock_file.close()
+            return None
+
+    @staticmethod
+    def _unlock(lock_file):
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            lock_file.close()
@@ -0,0 +1,90 @@
+"""
+企业微信临时素材缓存
+
+企业微信的临时素材在上传后3天内有效。同一份作业经常被全班家长转发，
+这里记录 文档内容哈希 -> media_id，重复的文档可以直接发送已上传的PDF，
+跳过转换和上传。
+
+缓存按文件存储（每个键一个JSON文件，原子替换写入），所有 worker 共享。
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# 企业微信临时素材有效期3天，提前1小时视为过期
+WECOM_MEDIA_LIFETIME = 3 * 24 * 3600
+MEDIA_EXPIRY_SAFETY = 3600
+
+
+def file_sha256(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaCache:
+    """内容哈希 -> media_id 的共享缓存"""
+
+    def __init__(self, cache_dir: str, ttl: int = WECOM_MEDIA_LIFETIME - MEDIA_EXPIRY_SAFETY):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self._last_prune = 0
+
+    def _path(self, content_hash: str) -> Path:
+        return self.cache_dir / f"{content_hash}.json"
+
+    def get(self, content_hash: str) -> str:
+        """返回仍然有效的 media_id，没有则返回None"""
+        path = self._path(content_hash)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() >= entry.get('expires_at', 0):
+            self.invalidate(content_hash)
+            return None
+        return entry.get('media_id')
+
+    def put(self, content_hash: str, media_id: str):
+        """记录刚上传的 media_id"""
+        path = self._path(content_hash)
+        tmp_path = path.with_suffix(f'.{os.getpid()}_{threading.get_ident()}.tmp')
+        entry = {'media_id': media_id, 'expires_at': time.time() + self.ttl}
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入素材缓存失败: {str(e)}")
+        self._maybe_prune()
+
+    def invalidate(self, content_hash: str):
+        try:
+            os.remove(self._path(content_hash))
+        except OSError:
+            pass
+
+    def _maybe_prune(self):
+        """每小时最多扫描一次，删除过期条目"""
+        now = time.time()
+        if now - self._last_prune < 3600:
+            return
+        self._last_prune = now
+        for path in self.cache_dir.glob('*.json'):
+            try:
+                if now - path.stat().st_mtime > self.ttl:
+                    path.unlink()
+            except OSError:
+                pass
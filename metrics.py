@@ -0,0 +1,118 @@
+"""
+进程内指标收集
+
+提供计数器、仪表盘和摘要（滑动窗口分位数）三种指标，
+通过 /metrics 以 Prometheus 文本格式导出。每个 gunicorn worker 各自统计，
+由抓取端按实例汇总。
+"""
+
+import threading
+from collections import deque
+
+# 摘要指标保留的最近样本数，用于计算分位数
+SUMMARY_WINDOW = 1024
+SUMMARY_QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: tuple, extra: dict = None) -> str:
+    items = list(key) + sorted((extra or {}).items())
+    if not items:
+        return ''
+    body = ','.join(f'{k}="{v}"' for k, v in items)
+    return '{' + body + '}'
+
+
+def quantile(values, q: float) -> float:
+    """计算分位数（最近邻法），空列表返回0"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(q * len(ordered)))
+    return ordered[index]
+
+
+class _Summary:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.window = deque(maxlen=SUMMARY_WINDOW)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.window.append(value)
+
+
+class Metrics:
+    """线程安全的指标注册表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._summaries = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """计数器加值"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """设置仪表盘当前值"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """记录一个样本（耗时、大小等）"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = _Summary()
+            summary.observe(value)
+
+    def snapshot(self) -> dict:
+        """返回所有指标的当前值，便于调试接口直接输出JSON"""
+        with self._lock:
+            return {
+                'counters': {self._flat(k): v for k, v in self._counters.items()},
+                'gauges': {self._flat(k): v for k, v in self._gauges.items()},
+                'summaries': {
+                    self._flat(k): {
+                        'count': s.count,
+                        'sum': round(s.total, 6),
+                        **{f'p{int(q * 100)}': quantile(s.window, q) for q in SUMMARY_QUANTILES}
+                    }
+                    for k, s in self._summaries.items()
+                },
+            }
+
+    def render_prometheus(self) -> str:
+        """导出为 Prometheus 文本格式"""
+        lines = []
+        with self._lock:
+            for (name, key), value in sorted(self._counters.items()):
+                lines.append(f'{name}{_format_labels(key)} {value}')
+            for (name, key), value in sorted(self._gauges.items()):
+                lines.append(f'{name}{_format_labels(key)} {value}')
+            for (name, key), s in sorted(self._summaries.items()):
+                window = list(s.window)
+                for q in SUMMARY_QUANTILES:
+                    lines.append(f'{name}{_format_labels(key, {"quantile": q})} {quantile(window, q)}')
+                lines.append(f'{name}_count{_format_labels(key)} {s.count}')
+                lines.append(f'{name}_sum{_format_labels(key)} {s.total}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _flat(key: tuple) -> str:
+        name, labels = key
+        return name + _format_labels(labels)
+
+
+metrics = Metrics()
@@ -0,0 +1,309 @@
+"""
+部分转换：页码范围、指定工作表、指定打印区域
+
+家长常常只需要老师发来的大表格中的一个工作表，或者长文档中的几页。
+这里解析 /api/convert 的可选参数，并转换成两个引擎各自的参数：
+
+- LibreOffice: PDF导出过滤器的 PageRange 选项；工作表和打印区域通过
+  修改 xlsx 副本的 workbook.xml 实现（隐藏未选中的工作表、写入 Print_Area）
+- Windows服务: 原样转发表单字段，由 COM 导出时处理
+
+参数格式:
+    pages       "1-3,5"            页码（PPT为幻灯片序号），从1开始
+    sheets      "成绩,2"           工作表名称或序号（从1开始），逗号分隔
+    print_area  "A1:H40"           只导出该区域（作用于选中的工作表，默认第一个）
+    profile     "fast_print"       导出配置（见 EXPORT_PROFILES），不指定时使用引擎的默认配置
+"""
+
+import re
+import json
+import shutil
+import zipfile
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# soffice --convert-to 中各文档类型对应的PDF导出过滤器
+PDF_EXPORT_FILTERS = {
+    '.doc': 'writer_pdf_Export',
+    '.docx': 'writer_pdf_Export',
+    '.xls': 'calc_pdf_Export',
+    '.xlsx': 'calc_pdf_Export',
+    '.ppt': 'impress_pdf_Export',
+    '.pptx': 'impress_pdf_Export',
+}
+
+SPREADSHEET_EXTENSIONS = ('.xls', '.xlsx')
+
+# 导出配置：Windows服务按同名配置调用 ExportAsFixedFormat；LibreOffice 使用这里的PDF导出过滤器选项
+#   standard    默认导出
+#   fast_print  最小文件：图片降到150DPI、JPEG质量75，不导出书签和结构标记
+EXPORT_PROFILES = {
+    'standard': {},
+    'fast_print': {
+        'ReduceImageResolution': {'type': 'boolean', 'value': 'true'},
+        'MaxImageResolution': {'type': 'long', 'value': '150'},
+        'Quality': {'type': 'long', 'value': '75'},
+        'ExportBookmarks': {'type': 'boolean', 'value': 'false'},
+        'UseTaggedPDF': {'type': 'boolean', 'value': 'false'},
+    },
+}
+
+MAX_PAGE_NUMBER = 100000
+CELL_RANGE_RE = re.compile(r'^\$?([A-Za-z]{1,3})\$?(\d{1,7})(?::\$?([A-Za-z]{1,3})\$?(\d{1,7}))?$')
+
+
+class ExportOptionsError(ValueError):
+    """
+    部分转换参数错误：格式错误、不适用于该文件，或可用的引擎无法满足
+
+    Args:
+        status_code: 对应的HTTP状态码（参数本身错误为400，引擎无法满足为422）
+    """
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def parse_page_ranges(text: str) -> list:
+    """
+    解析 "1-3,5" 格式的页码范围
+
+    Returns:
+        list: 排序合并后的 [(起始页, 结束页)]
+
+    Raises:
+        ExportOptionsError: 格式错误
+    """
+    ranges = []
+    for item in re.split(r'[,;，]', text or ''):
+        item = item.strip()
+        if not item:
+            continue
+        match = re.match(r'^(\d+)\s*(?:-\s*(\d+))?$', item)
+        if not match:
+            raise ExportOptionsError(f"页码格式错误: {item}")
+        start = int(match.group(1))
+        end = int(match.group(2) or start)
+        if start < 1 or end < start or end > MAX_PAGE_NUMBER:
+            raise ExportOptionsError(f"页码范围无效: {item}")
+        ranges.append((start, end))
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class ExportOptions:
+    """
+    部分转换参数
+
+    Attributes:
+        page_ranges: [(起始页, 结束页)]，为空表示全部页
+        sheets: 工作表名称或序号（int，从1开始）列表，为空表示全部工作表
+        print_area: 打印区域（如 "A1:H40"），为空表示沿用文档自身的设置
+        profile: 导出配置名称，为空表示引擎的默认配置
+    """
+
+    def __init__(self, page_ranges: list = None, sheets: list = None, print_area: str = None, profile: str = None):
+        self.page_ranges = page_ranges or []
+        self.sheets = sheets or []
+        self.print_area = print_area
+        self.profile = profile
+
+    @classmethod
+    def from_form(cls, form) -> 'ExportOptions':
+        """
+        从表单字段 pages / sheets / print_area / profile 解析
+
+        Raises:
+            ExportOptionsError: 参数格式错误
+        """
+        page_ranges = parse_page_ranges(form.get('pages', ''))
+
+        sheets = []
+        for item in re.split(r'[,，]', form.get('sheets', '') or ''):
+            item = item.strip()
+            if item:
+                sheets.append(int(item) if item.isdigit() else item)
+
+        print_area = (form.get('print_area') or '').strip() or None
+        if print_area:
+            match = CELL_RANGE_RE.match(print_area)
+            if not match:
+                raise ExportOptionsError(f"打印区域格式错误: {print_area}")
+            print_area = _absolute_range(match)
+
+        profile = (form.get('profile') or '').strip() or None
+        if profile is not None and profile not in EXPORT_PROFILES:
+            raise ExportOptionsError(f"未知的导出配置: {profile}（可选: {', '.join(EXPORT_PROFILES)}）")
+
+        return cls(page_ranges, sheets, print_area, profile)
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.page_ranges or self.sheets or self.print_area or self.profile)
+
+    @property
+    def pages_text(self) -> str:
+        """页码范围的规范写法，如 "1-3,5" """
+        return ','.join(str(s) if s == e else f"{s}-{e}" for s, e in self.page_ranges)
+
+    def validate_for(self, ext: str):
+        """工作表和打印区域只适用于表格"""
+        if (self.sheets or self.print_area) and ext not in SPREADSHEET_EXTENSIONS:
+            raise ExportOptionsError("只有Excel表格支持选择工作表和打印区域")
+
+    def supported_by_libreoffice(self, ext: str) -> bool:
+        """LibreOffice 只能在 xlsx 中选择工作表和打印区域（转换修改过 workbook.xml 的副本）"""
+        return not ((self.sheets or self.print_area) and ext != '.xlsx')
+
+    def to_form(self) -> dict:
+        """转发给Windows服务的表单字段"""
+        data = {}
+        if self.page_ranges:
+            data['pages'] = self.pages_text
+        if self.sheets:
+            data['sheets'] = ','.join(str(s) for s in self.sheets)
+        if self.print_area:
+            data['print_area'] = self.print_area
+        if self.profile:
+            data['profile'] = self.profile
+        return data
+
+    def libreoffice_target(self, ext: str) -> str:
+        """
+        soffice --convert-to 的目标参数
+
+        带页码范围或导出配置时使用 JSON 形式的过滤器选项（LibreOffice 7.4+）
+        """
+        filter_options = dict(EXPORT_PROFILES.get(self.profile) or {})
+        if self.page_ranges:
+            filter_options['PageRange'] = {'type': 'string', 'value': self.pages_text}
+        if not filter_options:
+            return 'pdf'
+        return f"pdf:{PDF_EXPORT_FILTERS[ext]}:{json.dumps(filter_options)}"
+
+    def to_dict(self) -> dict:
+        data = {'pages': self.pages_text, 'sheets': self.sheets, 'print_area': self.print_area}
+        if self.profile:
+            # 只在指定时加入，未指定导出配置的缓存键保持不变
+            data['profile'] = self.profile
+        return data
+
+
+def _absolute_range(match) -> str:
+    col1, row1, col2, row2 = match.groups()
+    first = f"${col1.upper()}${row1}"
+    if col2 is None:
+        return first
+    return f"{first}:${col2.upper()}${row2}"
+
+
+def _sheet_indexes(names: list, selected: list) -> list:
+    """把工作表名称/序号解析为从0开始的下标"""
+    indexes = []
+    for item in selected:
+        if isinstance(item, int):
+            if not 1 <= item <= len(names):
+                raise ExportOptionsError(f"工作表序号超出范围: {item}（共{len(names)}个）")
+            index = item - 1
+        elif item in names:
+            index = names.index(item)
+        else:
+            raise ExportOptionsError(f"找不到工作表: {item}")
+        if index not in indexes:
+            indexes.append(index)
+    return indexes
+
+
+def restrict_workbook(input_path: Path, output_path: Path, options: ExportOptions) -> Path:
+    """
+    生成只保留选中工作表/打印区域的 xlsx 副本（供 LibreOffice 导出）
+
+    未选中的工作表设为隐藏（导出PDF时跳过），打印区域写入 _xlnm.Print_Area，
+    其余部件原样复制。
+
+    Raises:
+        ExportOptionsError: 工作表不存在
+    """
+    with zipfile.ZipFile(input_path) as src:
+        workbook = src.read('xl/workbook.xml').decode('utf-8')
+        sheet_tags = re.findall(r'<(?:\w+:)?sheet\b[^>]*>', workbook)
+        names = [_xml_unescape(re.search(r'\bname="([^"]*)"', tag).group(1)) for tag in sheet_tags]
+
+        selected = _sheet_indexes(names, options.sheets) if options.sheets else []
+        visible = selected or [i for i, tag in enumerate(sheet_tags) if not _is_hidden(tag)][:1]
+
+        if options.sheets:
+            for index, tag in enumerate(sheet_tags):
+                new_tag = re.sub(r'\s+state="[^"]*"', '', tag)
+                if index not in selected:
+                    new_tag = re.sub(r'(/?>)$', r' state="hidden"\1', new_tag)
+                workbook = workbook.replace(tag, new_tag, 1)
+            # 活动工作表必须是可见的
+            workbook = re.sub(r'\bactiveTab="\d+"', f'activeTab="{selected[0]}"', workbook)
+            workbook = re.sub(r'\bfirstSheet="\d+"', f'firstSheet="{selected[0]}"', workbook)
+
+        if options.print_area:
+            workbook = _set_print_areas(workbook, names, visible, options.print_area)
+
+        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as dst:
+            for info in src.infolist():
+                if info.filename == 'xl/workbook.xml':
+                    dst.writestr(info, workbook.encode('utf-8'))
+                else:
+                    with src.open(info) as f_src, dst.open(info, 'w') as f_dst:
+                        shutil.copyfileobj(f_src, f_dst, 1024 * 1024)
+
+    logger.info(f"已生成部分导出副本: 工作表={[names[i] for i in visible]}, 打印区域={options.print_area}")
+    return output_path
+
+
+def _is_hidden(tag: str) -> bool:
+    return re.search(r'\bstate="(hidden|veryHidden)"', tag) is not None
+
+
+def _set_print_areas(workbook: str, names: list, indexes: list, cell_range: str) -> str:
+    """为指定工作表写入打印区域，替换原有设置"""
+    for index in indexes:
+        workbook = re.sub(
+            rf'<(\w+:)?definedName\b[^>]*name="_xlnm\.Print_Area"[^>]*localSheetId="{index}"[^>]*>.*?</(\w+:)?definedName>'
+            rf'|<(\w+:)?definedName\b[^>]*localSheetId="{index}"[^>]*name="_xlnm\.Print_Area"[^>]*>.*?</(\w+:)?definedName>',
+            '', workbook, flags=re.S
+        )
+
+    entries = ''.join(
+        f'<definedName name="_xlnm.Print_Area" localSheetId="{i}">{_quote_sheet(names[i])}!{cell_range}</definedName>'
+        for i in indexes
+    )
+
+    match = re.search(r'<(\w+:)?definedNames\s*/>|<(\w+:)?definedNames>', workbook)
+    if match and match.group(0).endswith('/>'):
+        prefix = match.group(1) or ''
+        return workbook.replace(match.group(0), f'<{prefix}definedNames>{entries}</{prefix}definedNames>', 1)
+    if match:
+        return workbook.replace(match.group(0), match.group(0) + entries, 1)
+    # 没有 definedNames 时插入到 </sheets> 之后（OOXML 规定的元素顺序）
+    match = re.search(r'</(\w+:)?sheets>', workbook)
+    prefix = match.group(1) or ''
+    return workbook.replace(match.group(0), f'{match.group(0)}<{prefix}definedNames>{entries}</{prefix}definedNames>', 1)
+
+
+def _quote_sheet(name: str) -> str:
+    return "'" + _xml_escape(name).replace("'", "''") + "'"
+
+
+def _xml_unescape(text: str) -> str:
+    return (text.replace('&lt;', '<').replace('&gt;', '>').replace('&quot;', '"')
+            .replace('&apos;', "'").replace('&amp;', '&'))
+
+
+def _xml_escape(text: str) -> str:
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
@@ -0,0 +1,336 @@
+"""
+转换前预检
+
+在调用任何转换引擎之前，用毫秒级的检查拦截注定失败的文件：
+- 流式保存时检查大小上限（MAX_FILE_SIZE）
+- 按文件头/OOXML包结构识别真实格式，而不是只看扩展名
+- 识别加密（设置了打开密码）的文档和 zip 炸弹
+- 顺带提取页数、工作表数、幻灯片数等复杂度提示，供路由和超时参考
+
+被改了扩展名的文件（如 .doc 实际是 docx）会按真实格式处理。
+"""
+
+import re
+import time
+import struct
+import hashlib
+import zipfile
+import zlib
+import logging
+from pathlib import Path
+from config import config
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = ['.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx']
+
+OLE_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+ZIP_MAGIC = b'PK\x03\x04'
+
+# OOXML 主文档部件 -> 扩展名
+OOXML_MAIN_PARTS = {
+    'word/document.xml': '.docx',
+    'xl/workbook.xml': '.xlsx',
+    'ppt/presentation.xml': '.pptx',
+}
+
+# OLE 复合文档中的流名称 -> 扩展名
+OLE_STREAMS = {
+    'worddocument': '.doc',
+    'workbook': '.xls',
+    'book': '.xls',
+    'powerpoint document': '.ppt',
+}
+
+# Office 可以直接打开、但无法从文件头细分类型的文本格式，沿用声明的扩展名
+TEXT_SIGNATURES = (b'{\\rtf', b'<?xml', b'<html', b'<!doctype html', b'mime-version:')
+
+# 解压后总大小上限、单个成员的压缩比上限、成员数上限
+MAX_UNCOMPRESSED_SIZE = 1024 * 1024 * 1024
+MAX_COMPRESSION_RATIO = 200
+MAX_ZIP_MEMBERS = 20000
+
+
+class PreflightError(ValueError):
+    """
+    预检未通过
+
+    Attributes:
+        reason: 机器可读的原因（too_large/unsupported/encrypted/corrupt/zip_bomb）
+        status_code: 建议返回的HTTP状态码
+    """
+
+    STATUS_CODES = {'too_large': 413}
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+        self.status_code = self.STATUS_CODES.get(reason, 422)
+
+
+class PreflightResult:
+    """预检结果"""
+
+    def __init__(self, path: Path, declared_ext: str, detected_ext: str, size: int):
+        self.path = path
+        self.declared_ext = declared_ext
+        self.detected_ext = detected_ext
+        self.size = size
+        self.hints = {}
+        self.elapsed = 0.0
+
+    @property
+    def renamed(self) -> bool:
+        """扩展名与真实格式不一致"""
+        return self.detected_ext != self.declared_ext
+
+    def to_dict(self) -> dict:
+        return {
+            'declared_ext': self.declared_ext,
+            'detected_ext': self.detected_ext,
+            'size': self.size,
+            'hints': self.hints,
+        }
+
+
+def save_stream(stream, dest_path: str, max_size: int = None, chunk_size: int = 1024 * 1024):
+    """
+    流式保存上传内容，超过大小上限立即中止
+
+    Returns:
+        tuple: (文件大小, SHA-256)
+
+    Raises:
+        PreflightError: 文件超过大小上限
+    """
+    max_size = max_size or config.MAX_FILE_SIZE
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(dest_path, 'wb') as f:
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                size += len(chunk)
+                if size > max_size:
+                    raise _reject('too_large', f"文件超过大小限制({max_size // (1024 * 1024)}MB)")
+                digest.update(chunk)
+                f.write(chunk)
+    except PreflightError:
+        Path(dest_path).unlink(missing_ok=True)
+        raise
+    return size, digest.hexdigest()
+
+
+def inspect_file(file_path: str, declared_ext: str = None, max_size: int = None) -> PreflightResult:
+    """
+    检查文件大小、真实格式、加密状态，并提取复杂度提示
+
+    Args:
+        file_path: 文件路径
+        declared_ext: 声明的扩展名，默认取文件名后缀
+        max_size: 大小上限，默认 config.MAX_FILE_SIZE
+
+    Returns:
+        PreflightResult: 预检结果
+
+    Raises:
+        PreflightError: 文件不能转换
+    """
+    start = time.time()
+    path = Path(file_path)
+    declared_ext = (declared_ext or path.suffix).lower()
+    max_size = max_size or config.MAX_FILE_SIZE
+
+    size = path.stat().st_size
+    if size > max_size:
+        raise _reject('too_large', f"文件超过大小限制({max_size // (1024 * 1024)}MB)")
+    if size == 0:
+        raise _reject('corrupt', "文件为空")
+
+    with open(path, 'rb') as f:
+        header = f.read(512)
+
+    hints = {}
+    if header.startswith(ZIP_MAGIC):
+        detected_ext = _inspect_ooxml(path, hints)
+    elif header.startswith(OLE_MAGIC):
+        detected_ext = _inspect_ole(path, hints)
+    elif header.lstrip(b'\xef\xbb\xbf \t\r\n').lower().startswith(TEXT_SIGNATURES) and declared_ext in SUPPORTED_EXTENSIONS:
+        detected_ext = declared_ext
+    else:
+        raise _reject('unsupported', f"无法识别的文件格式: {declared_ext or '未知'}")
+
+    result = PreflightResult(path, declared_ext, detected_ext, size)
+    result.hints = hints
+    result.elapsed = time.time() - start
+    metrics.observe('preflight_seconds', result.elapsed)
+    if result.renamed:
+        logger.info(f"文件扩展名与真实格式不符: {declared_ext} -> {detected_ext}")
+        metrics.inc('preflight_renamed_total', declared=declared_ext, detected=detected_ext)
+    return result
+
+
+def _reject(reason: str, message: str) -> PreflightError:
+    metrics.inc('preflight_rejections_total', reason=reason)
+    logger.warning(f"预检拒绝[{reason}]: {message}")
+    return PreflightError(message, reason)
+
+
+def _inspect_ooxml(path: Path, hints: dict) -> str:
+    """检查 OOXML 包：识别类型、拦截 zip 炸弹、读取页数等提示"""
+    try:
+        with zipfile.ZipFile(path) as zf:
+            infos = zf.infolist()
+            if len(infos) > MAX_ZIP_MEMBERS:
+                raise _reject('zip_bomb', "文档结构异常（包含的部件过多）")
+
+            total = 0
+            for info in infos:
+                total += info.file_size
+                ratio = info.file_size / max(info.compress_size, 1)
+                if ratio > MAX_COMPRESSION_RATIO and info.file_size > 10 * 1024 * 1024:
+                    raise _reject('zip_bomb', "文档结构异常（压缩比过高）")
+            if total > MAX_UNCOMPRESSED_SIZE:
+                raise _reject('zip_bomb', "文档结构异常（解压后过大）")
+
+            names = {info.filename for info in infos}
+            if '[Content_Types].xml' not in names:
+                raise _reject('unsupported', "不是有效的Office文档（缺少[Content_Types].xml）")
+
+            detected_ext = next((ext for part, ext in OOXML_MAIN_PARTS.items() if part in names), None)
+            if detected_ext is None:
+                raise _reject('unsupported', "不是Word/Excel/PPT文档")
+
+            _ooxml_hints(zf, names, detected_ext, hints)
+            return detected_ext
+    except (zipfile.BadZipFile, zlib.error, EOFError):
+        raise _reject('corrupt', "文件已损坏，无法打开")
+
+
+def _read_member(zf: zipfile.ZipFile, name: str, limit: int = 1024 * 1024) -> str:
+    with zf.open(name) as f:
+        return f.read(limit).decode('utf-8', errors='ignore')
+
+
+def _ooxml_hints(zf: zipfile.ZipFile, names: set, detected_ext: str, hints: dict):
+    """从 docProps/app.xml 和主文档部件中读取复杂度提示（只读少量元数据）"""
+    if 'docProps/app.xml' in names:
+        app_xml = _read_member(zf, 'docProps/app.xml')
+        for tag, key in (('Pages', 'pages'), ('Slides', 'slides'), ('Words', 'words')):
+            match = re.search(rf'<(?:\w+:)?{tag}>(\d+)<', app_xml)
+            if match:
+                hints[key] = int(match.group(1))
+
+    if detected_ext == '.xlsx':
+        workbook = _read_member(zf, 'xl/workbook.xml')
+        hints['sheets'] = len(re.findall(r'<(?:\w+:)?sheet\b', workbook))
+    elif detected_ext == '.pptx' and 'slides' not in hints:
+        hints['slides'] = sum(1 for n in names if re.match(r'ppt/slides/slide\d+\.xml$', n))
+
+    media = [n for n in names if '/media/' in n]
+    if media:
+        hints['media_files'] = len(media)
+
+
+def _inspect_ole(path: Path, hints: dict) -> str:
+    """检查 OLE 复合文档：区分 doc/xls/ppt，识别加密"""
+    try:
+        reader = _OleReader(path)
+        entries = reader.directory()
+    except Exception as e:
+        logger.debug(f"OLE目录解析失败: {str(e)}")
+        raise _reject('corrupt', "文件已损坏，无法打开")
+
+    names = {name.lower(): (start, size) for name, start, size in entries}
+
+    # 设置了打开密码的 docx/xlsx/pptx 会被包装成 OLE 文件
+    if 'encryptedpackage' in names or 'encryptioninfo' in names:
+        raise _reject('encrypted', "文档设置了打开密码，请取消密码后再发送")
+    if 'encryptedsummary' in names:
+        raise _reject('encrypted', "演示文稿设置了打开密码，请取消密码后再发送")
+
+    detected_ext = next((ext for stream, ext in OLE_STREAMS.items() if stream in names), None)
+    if detected_ext is None:
+        raise _reject('unsupported', "不是Word/Excel/PPT文档")
+
+    # 只检查存放在普通扇区中的流（小于 mini stream 阈值的流读取成本高，跳过）
+    if detected_ext == '.doc':
+        start, size = names['worddocument']
+        if size >= reader.mini_cutoff:
+            fib = reader.read_sector(start)
+            # FIB 偏移 0x0A 的标志位中 fEncrypted = 0x0100
+            if len(fib) >= 12 and struct.unpack_from('<H', fib, 0x0A)[0] & 0x0100:
+                raise _reject('encrypted', "文档设置了打开密码，请取消密码后再发送")
+    elif detected_ext == '.xls':
+        start, size = names['workbook' if 'workbook' in names else 'book']
+        if size >= reader.mini_cutoff and _biff_has_filepass(reader.read_sector(start)):
+            raise _reject('encrypted', "表格设置了打开密码，请取消密码后再发送")
+
+    return detected_ext
+
+
+def _biff_has_filepass(data: bytes) -> bool:
+    """BIFF 工作簿流开头（BOF之后）出现 FILEPASS(0x002F) 记录即表示已加密"""
+    offset = 0
+    while offset + 4 <= len(data):
+        record_type, length = struct.unpack_from('<HH', data, offset)
+        if record_type == 0x002F:
+            return True
+        # 加密标记只会出现在第一个子流的开头，遇到工作表信息即可停止
+        if record_type in (0x0085, 0x000A):
+            return False
+        offset += 4 + length
+    return False
+
+
+class _OleReader:
+    """只读取目录和流开头扇区的极简 OLE 复合文档解析器"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(512)
+        self.sector_size = 1 << struct.unpack_from('<H', header, 0x1E)[0]
+        self.first_dir_sector = struct.unpack_from('<I', header, 0x30)[0]
+        self.mini_cutoff = struct.unpack_from('<I', header, 0x38)[0]
+        num_fat_sectors = struct.unpack_from('<I', header, 0x2C)[0]
+        difat = struct.unpack_from('<109I', header, 0x4C)
+        self.fat_sectors = [s for s in difat[:num_fat_sectors] if s < 0xFFFFFFFA]
+        self._fat = None
+
+    def read_sector(self, sector: int) -> bytes:
+        with open(self.path, 'rb') as f:
+            f.seek((sector + 1) * self.sector_size)
+            return f.read(self.sector_size)
+
+    def _next_sector(self, sector: int) -> int:
+        if self._fat is None:
+            fat = []
+            for fat_sector in self.fat_sectors:
+                data = self.read_sector(fat_sector)
+                fat.extend(struct.unpack(f'<{len(data) // 4}I', data))
+            self._fat = fat
+        if sector >= len(self._fat):
+            return 0xFFFFFFFE
+        return self._fat[sector]
+
+    def directory(self) -> list:
+        """返回目录项 [(名称, 起始扇区, 大小)]"""
+        entries = []
+        sector = self.first_dir_sector
+        visited = set()
+        while sector < 0xFFFFFFFA and sector not in visited and len(visited) < 1024:
+            visited.add(sector)
+            data = self.read_sector(sector)
+            for offset in range(0, len(data) - 127, 128):
+                name_len = struct.unpack_from('<H', data, offset + 0x40)[0]
+                if not 2 <= name_len <= 64:
+                    continue
+                name = data[offset:offset + name_len - 2].decode('utf-16-le', errors='ignore')
+                start = struct.unpack_from('<I', data, offset + 0x74)[0]
+                size = struct.unpack_from('<I', data, offset + 0x78)[0]
+                entries.append((name, start, size))
+            sector = self._next_sector(sector)
+        if not entries:
+            raise ValueError("OLE目录为空")
+        return entries
@@ -0,0 +1,182 @@
+"""
+采样分析器
+
+有些延迟问题只在早高峰的真实流量下出现，本地无法复现。这里定时读取
+sys._current_frames()，统计当前进程所有线程的调用栈，输出
+flamegraph.pl / speedscope 可以直接读取的折叠栈格式（collapsed stacks）：
+
+    线程名;外层函数 (文件:行);...;内层函数 (文件:行) 采样次数
+
+- 按需采样：/debug/profile?seconds=N，采样 N 秒后返回结果
+- 持续采样（可选）：以较低频率常驻，每隔一段时间把结果写入磁盘，便于对比
+
+采样只读取帧对象，不插桩、不修改被采样线程，10ms 间隔下开销约为 1% 以内。
+只依赖标准库，Windows 服务部署时把本文件复制到同一目录即可。
+"""
+
+import os
+import sys
+import time
+import hmac
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilerBusy(Exception):
+    """已有按需采样在进行"""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _thread_names() -> dict:
+    return {thread.ident: thread.name for thread in threading.enumerate()}
+
+
+def sample_once(counter: Counter, skip: set = None):
+    """采样一次所有线程的调用栈，累加到 counter（键为折叠后的栈）"""
+    names = _thread_names()
+    for ident, frame in sys._current_frames().items():
+        if skip and ident in skip:
+            continue
+        stack = []
+        while frame is not None:
+            stack.append(_frame_label(frame))
+            frame = frame.f_back
+        stack.append(names.get(ident, f'thread-{ident}'))
+        counter[';'.join(reversed(stack))] += 1
+
+
+def render_collapsed(counter: Counter) -> str:
+    """折叠栈文本，按采样次数从多到少排列"""
+    return ''.join(f"{stack} {count}\n" for stack, count in counter.most_common())
+
+
+def _sample_for(seconds: float, interval: float, stop: threading.Event = None) -> Counter:
+    counter = Counter()
+    skip = {threading.get_ident()}
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        if stop is not None and stop.is_set():
+            break
+        sample_once(counter, skip)
+        time.sleep(interval)
+    return counter
+
+
+class SamplingProfiler:
+    """
+    按需采样（同一进程同时只允许一个采样）
+
+    Args:
+        interval: 采样间隔（秒）
+        max_seconds: 单次采样的最长时间
+    """
+
+    def __init__(self, interval: float = 0.01, max_seconds: float = 60):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+
+    def profile(self, seconds: float, interval: float = None) -> str:
+        """
+        在当前线程中采样 seconds 秒（本线程不计入结果）
+
+        Returns:
+            str: 折叠栈文本
+
+        Raises:
+            ProfilerBusy: 已有采样在进行
+        """
+        seconds = min(max(seconds, 0.1), self.max_seconds)
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("已有采样在进行，请稍后再试")
+        try:
+            start = time.time()
+            counter = _sample_for(seconds, max(interval or self.interval, 0.001))
+            logger.info(f"采样完成: {time.time() - start:.1f}秒, {sum(counter.values())} 个样本, pid {os.getpid()}")
+            return render_collapsed(counter)
+        finally:
+            self._lock.release()
+
+
+class ContinuousProfiler:
+    """
+    持续低频采样，每 period 秒把结果写入 directory/profile-<pid>-<时间>.folded
+
+    Args:
+        directory: 输出目录，为空时不启用
+        interval: 采样间隔（秒），持续模式应明显低于按需采样的频率
+        period: 每个文件覆盖的时间段（秒）
+        keep: 每个进程最多保留的文件数，超出时删除最旧的
+    """
+
+    def __init__(self, directory: str, interval: float = 0.1, period: float = 300, keep: int = 48):
+        self.directory = directory
+        self.interval = interval
+        self.period = period
+        self.keep = keep
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def ensure_started(self):
+        # 线程在首次使用时才启动，fork 出来的 worker 进程各自启动
+        if not self.enabled:
+            return
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name='continuous-profiler', daemon=True)
+            self._thread.start()
+            logger.info(f"持续采样已启动: 每{self.interval}秒采样, 每{self.period:.0f}秒写入 {self.directory}")
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            started = time.strftime('%Y%m%d-%H%M%S')
+            counter = _sample_for(self.period, self.interval, self._stop)
+            if not counter:
+                continue
+            try:
+                self._write(started, counter)
+            except OSError as e:
+                logger.warning(f"写入采样结果失败: {str(e)}")
+
+    def _write(self, started: str, counter: Counter):
+        pid = os.getpid()
+        path = os.path.join(self.directory, f"profile-{pid}-{started}.folded")
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(render_collapsed(counter))
+        os.replace(tmp_path, path)
+
+        prefix = f"profile-{pid}-"
+        files = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith(prefix) and name.endswith('.folded'))
+        for name in files[:-self.keep] if self.keep else []:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+def token_matches(expected: str, provided: str) -> bool:
+    """校验调试令牌（常量时间比较）；未配置令牌时一律拒绝"""
+    return bool(expected) and hmac.compare_digest(expected.encode('utf-8'), (provided or '').encode('utf-8'))
@@ -0,0 +1,161 @@
+"""
+令牌桶限流（同一台机器上的所有 worker 共享）
+
+一个快捷指令循环重试、或一个企业微信用户连续转发几十个文件，就能占满全部转换
+容量。这里按客户端IP、企业微信用户为每个键维护一个令牌桶：每次转换消耗一个令牌，
+令牌按 rate 匀速补充，最多攒 burst 个。
+
+桶的状态存放在共享文件的内存映射（mmap）中，所有 gunicorn worker 映射同一个
+文件，每次检查只在文件锁（flock）内读写一个槽位，不经过磁盘I/O，也不需要额外的
+服务。文件是固定大小的开放寻址哈希表：每个槽位记录键的哈希、剩余令牌数和更新
+时间；冲突时在相邻 PROBES 个槽位中查找，都被占用时替换最久没有更新的桶
+（长时间未请求的桶已经补满，替换不改变结果）。
+
+集群模式下每个节点各自限流（请求由 nginx 轮询分到各节点，在入口节点计数，
+转发给负责节点的请求不重复计数）。
+"""
+
+import os
+import mmap
+import time
+import fcntl
+import struct
+import hashlib
+import logging
+import ipaddress
+import threading
+from pathlib import Path
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 槽位：键的哈希（0 表示空槽位）、剩余令牌数、更新时间
+SLOT = struct.Struct('=Qdd')
+PROBES = 8
+
+
+def client_ip(remote_addr: str, headers) -> str:
+    """
+    客户端IP：直接连接来自内网（nginx 反向代理）时使用其设置的 X-Real-IP
+
+    直接暴露在公网时不信任请求头，避免客户端伪造IP绕过限流。
+    """
+    try:
+        address = ipaddress.ip_address(remote_addr or '')
+    except ValueError:
+        return remote_addr or ''
+    if address.is_private or address.is_loopback:
+        return headers.get('X-Real-IP') or remote_addr
+    return remote_addr
+
+
+class RateLimiter:
+    """
+    共享令牌桶
+
+    Args:
+        name: 限流范围名称（存储文件名和指标标签）
+        rate: 每分钟补充的令牌数，不大于0时不限流
+        burst: 桶容量（允许连续发起的请求数）
+        store_dir: 共享文件目录（同一台机器上的 worker 使用相同目录）
+        slots: 槽位数（同时跟踪的键数上限）
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, store_dir: str, slots: int = 4096):
+        self.name = name
+        self.rate = rate / 60.0
+        self.burst = float(max(burst, 1))
+        self.enabled = rate > 0
+        self.slots = slots
+        self.path = Path(store_dir) / f"{name}.buckets"
+        self._lock = threading.Lock()
+        self._pid = None
+        self._file = None
+        self._map = None
+
+    def acquire(self, key: str, cost: float = 1.0) -> float:
+        """
+        为 key 消耗 cost 个令牌
+
+        Returns:
+            float: 0 表示放行；否则为令牌不足时需要等待的秒数（本次不消耗令牌）
+        """
+        if not self.enabled or not key:
+            return 0.0
+        try:
+            wait = self._acquire(key, cost)
+        except OSError as e:
+            # 限流不可用时放行，不影响转换
+            logger.warning(f"限流存储不可用，本次放行: {str(e)}")
+            return 0.0
+        metrics.inc('rate_limit_total', scope=self.name, outcome='throttled' if wait else 'allowed')
+        if wait:
+            logger.info(f"请求过于频繁[{self.name}]: {key}，{wait:.0f}秒后可再次请求")
+        return wait
+
+    def _acquire(self, key: str, cost: float) -> float:
+        digest = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big') or 1
+        with self._lock:
+            buckets = self._mapping()
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                offset, tokens, updated = self._find(buckets, digest)
+                if updated is not None:
+                    tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+                if tokens >= cost:
+                    SLOT.pack_into(buckets, offset, digest, tokens - cost, now)
+                    return 0.0
+                SLOT.pack_into(buckets, offset, digest, tokens, now)
+                return (cost - tokens) / self.rate
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def _find(self, buckets: mmap.mmap, digest: int):
+        """
+        查找 digest 的槽位
+
+        Returns:
+            (偏移量, 令牌数, 更新时间)：新建的桶更新时间为None、令牌数为 burst
+        """
+        start = digest % self.slots
+        victim, oldest = None, None
+        for probe in range(PROBES):
+            offset = ((start + probe) % self.slots) * SLOT.size
+            slot_digest, tokens, updated = SLOT.unpack_from(buckets, offset)
+            if slot_digest == digest:
+                return offset, tokens, updated
+            if slot_digest == 0:
+                return offset, self.burst, None
+            if oldest is None or updated < oldest:
+                victim, oldest = offset, updated
+        return victim, self.burst, None
+
+    def _mapping(self) -> mmap.mmap:
+        # 按进程打开：flock 锁属于打开的文件，fork 前打开的文件在父子进程之间不互斥
+        if self._pid == os.getpid():
+            return self._map
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = self._file = None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        size = self.slots * SLOT.size
+        f = open(self.path, 'a+b')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.fstat(f.fileno()).st_size != size:
+                    # 新文件或槽位数改变：清空重建（桶都视为已补满）
+                    f.truncate(0)
+                    f.truncate(size)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            self._map = mmap.mmap(f.fileno(), size)
+        except BaseException:
+            f.close()
+            raise
+        self._file = f
+        self._pid = os.getpid()
+        return self._map
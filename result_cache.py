@@ -0,0 +1,191 @@
+"""
+转换结果缓存
+
+iOS 快捷指令在移动网络下拿不到响应时会重新上传同一个文件，每次都完整转换一遍。
+这里按 文档内容哈希 + 部分转换参数 缓存生成的PDF：
+
+- 重传的文档命中缓存，直接返回之前的PDF
+- 客户端可以先只带哈希查询（GET /api/convert?sha256=...），命中时不必再上传文件
+- 每个PDF记录自身内容的SHA-256，作为强 ETag，支持条件请求和断点续传（Range）
+
+缓存按文件存储（PDF + JSON元数据，原子替换写入），所有 worker 共享；
+超过有效期或总大小上限时删除最久未使用的条目。
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from media_cache import file_sha256
+
+logger = logging.getLogger(__name__)
+
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# 客户端提供 / 服务端返回文档SHA-256的请求头
+CONTENT_HASH_HEADER = 'X-Content-SHA256'
+
+
+def normalize_sha256(value: str) -> str:
+    """
+    校验并规范化客户端提供的SHA-256（不区分大小写）
+
+    Returns:
+        str: 64位小写十六进制，为空时返回None
+
+    Raises:
+        ValueError: 格式错误
+    """
+    value = (value or '').strip().lower()
+    if not value:
+        return None
+    if not SHA256_RE.match(value):
+        raise ValueError("sha256 必须是64位十六进制字符串")
+    return value
+
+
+def result_key(content_hash: str, options=None) -> str:
+    """缓存键：文档内容哈希，部分转换时再混入规范化后的参数"""
+    if options is None or options.is_empty:
+        return content_hash
+    params = json.dumps(options.to_dict(), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(f"{content_hash}\n{params}".encode('utf-8')).hexdigest()
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match 是否包含该 ETag（弱比较，支持 *）"""
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    candidates = [tag.strip() for tag in header.split(',')]
+    return any(tag.removeprefix('W/') == f'"{etag}"' for tag in candidates)
+
+
+class CachedResult:
+    """缓存中的一个PDF"""
+
+    def __init__(self, path: Path, etag: str, size: int):
+        self.path = path
+        self.etag = etag  # PDF内容的SHA-256
+        self.size = size
+
+
+class ResultCache:
+    """
+    (文档哈希, 部分转换参数) -> PDF 的共享磁盘缓存
+
+    Args:
+        cache_dir: 缓存目录，为空时关闭缓存
+        ttl: 条目有效期（秒）
+        max_bytes: 缓存PDF的总大小上限
+    """
+
+    def __init__(self, cache_dir: str, ttl: int = 24 * 3600, max_bytes: int = 1024 * 1024 * 1024):
+        self.enabled = bool(cache_dir)
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if self.enabled:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._last_prune = 0
+
+    def _paths(self, key: str) -> tuple:
+        return self.cache_dir / f"{key}.pdf", self.cache_dir / f"{key}.json"
+
+    def get(self, key: str) -> CachedResult:
+        """返回仍然有效的缓存结果，没有则返回None"""
+        if not self.enabled:
+            return None
+        pdf_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            size = pdf_path.stat().st_size
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get('created_at', 0) >= self.ttl or size != entry.get('size'):
+            self.invalidate(key)
+            return None
+        # 记录最近使用时间，按此淘汰
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+        return CachedResult(pdf_path, entry['etag'], size)
+
+    def put(self, key: str, pdf_file: str) -> CachedResult:
+        """
+        复制刚生成的PDF到缓存
+
+        Returns:
+            CachedResult: 缓存中的结果；写入失败时返回None（调用方直接返回原PDF）
+        """
+        if not self.enabled:
+            return None
+        pdf_path, meta_path = self._paths(key)
+        suffix = f'.{os.getpid()}_{threading.get_ident()}.tmp'
+        tmp_pdf = pdf_path.with_name(pdf_path.name + suffix)
+        tmp_meta = meta_path.with_name(meta_path.name + suffix)
+        try:
+            shutil.copyfile(pdf_file, tmp_pdf)
+            entry = {'etag': file_sha256(str(tmp_pdf)), 'size': tmp_pdf.stat().st_size, 'created_at': time.time()}
+            with open(tmp_meta, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            # 先替换PDF再替换元数据：读者看到的元数据总是对应已经就位的PDF
+            os.replace(tmp_pdf, pdf_path)
+            os.replace(tmp_meta, meta_path)
+        except OSError as e:
+            logger.warning(f"写入转换结果缓存失败: {str(e)}")
+            tmp_pdf.unlink(missing_ok=True)
+            tmp_meta.unlink(missing_ok=True)
+            return None
+        self._maybe_prune()
+        return CachedResult(pdf_path, entry['etag'], entry['size'])
+
+    def invalidate(self, key: str):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _maybe_prune(self, interval: float = 60):
+        """每分钟最多扫描一次：删除过期条目，总大小超限时从最久未使用的开始删除"""
+        now = time.time()
+        if now - self._last_prune < interval:
+            return
+        self._last_prune = now
+        # 写入中途退出的进程留下的临时文件
+        for tmp_path in self.cache_dir.glob('*.tmp'):
+            try:
+                if now - tmp_path.stat().st_mtime > 3600:
+                    tmp_path.unlink()
+            except OSError:
+                pass
+
+        entries = []
+        for meta_path in self.cache_dir.glob('*.json'):
+            pdf_path = meta_path.with_suffix('.pdf')
+            try:
+                used_at = meta_path.stat().st_mtime
+                size = pdf_path.stat().st_size
+            except OSError:
+                continue
+            entries.append((used_at, meta_path.stem, size))
+
+        total = sum(size for _, _, size in entries)
+        for used_at, key, size in sorted(entries):
+            try:
+                with open(self.cache_dir / f"{key}.json", 'r', encoding='utf-8') as f:
+                    expired = now - json.load(f).get('created_at', 0) >= self.ttl
+            except (OSError, ValueError):
+                expired = True
+            if expired or total > self.max_bytes:
+                self.invalidate(key)
+                total -= size
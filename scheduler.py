@@ -0,0 +1,286 @@
+"""
+转换优先级调度
+
+iOS 快捷指令的用户正盯着转圈等待 /api/convert 返回；企业微信用户已经收到
+"正在转换"的回复，PDF 稍后推送即可。两类请求按优先级共享转换容量：
+
+- interactive（交互）: 优先获得空闲槽位，并独占 reserved 个预留槽位
+- background（后台）: 只能使用非预留槽位；排队超过 aging 秒后与交互请求
+  按到达顺序平等竞争，保证不会被饿死
+
+调度在进程内进行（每个 gunicorn worker 一个调度器），跨进程的并发上限
+仍由 LibreOffice 配置目录池保证。线程（slot）和协程（async_slot）可以
+在同一个调度器中排队，按同样的规则分配槽位。请求被取消（客户端断开）时
+立即退出队列，不再占用排队位置。
+"""
+
+import time
+import asyncio
+import logging
+import itertools
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from metrics import metrics
+from deadline import DeadlineExceeded
+from cancellation import ConversionCancelled
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BACKGROUND = 'background'
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND)
+
+
+class _Ticket:
+    """一个等待中的转换请求"""
+
+    def __init__(self, priority: str, seq: int, loop: asyncio.AbstractEventLoop = None):
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = time.time()
+        # 协程排队者：所在的事件循环和当前等待的唤醒信号
+        self.loop = loop
+        self.wakeup = None
+
+
+def _set_wakeup(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class PriorityScheduler:
+    """
+    按优先级分配转换槽位
+
+    Args:
+        capacity: 同时进行的转换数
+        reserved: 只给交互请求使用的槽位数（至少给后台留一个槽位）
+        aging: 后台请求排队超过该秒数后与交互请求平等竞争
+        slo: 优先级 -> 延迟目标秒数（排队 + 转换），用于SLO达标率指标
+    """
+
+    def __init__(self, capacity: int, reserved: int = 1, aging: float = 60, slo: dict = None):
+        self.capacity = max(1, capacity)
+        self.reserved = min(max(0, reserved), self.capacity - 1)
+        self.aging = aging
+        self.slo = slo or {}
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._running = {priority: 0 for priority in PRIORITIES}
+        self._seq = itertools.count()
+
+    @contextmanager
+    def slot(self, priority: str = PRIORITY_INTERACTIVE, timeout: float = None, cancel_event=None):
+        """
+        占用一个转换槽位，退出时释放并记录延迟
+
+        Args:
+            priority: interactive 或 background
+            timeout: 最长排队秒数（通常是截止时间的剩余时间），None表示一直等待
+            cancel_event: 取消信号（CancelToken），置位后立即退出队列
+
+        Raises:
+            DeadlineExceeded: 排队超时
+            ConversionCancelled: 排队中被取消
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"未知的优先级: {priority}")
+
+        ticket = _Ticket(priority, next(self._seq))
+        try:
+            if cancel_event is not None:
+                # 取消时唤醒排队的线程，不必等到下一次定期检查
+                with cancel_event.on_set(self._wake):
+                    self._acquire(ticket, timeout, cancel_event)
+            else:
+                self._acquire(ticket, timeout)
+        except DeadlineExceeded:
+            # 排队超时同样计入延迟和SLO
+            self._record_latency(priority, time.time() - ticket.enqueued_at)
+            raise
+        self._record_wait(ticket)
+
+        try:
+            yield
+        finally:
+            self._release(ticket)
+            self._record_latency(priority, time.time() - ticket.enqueued_at)
+
+    @asynccontextmanager
+    async def async_slot(self, priority: str = PRIORITY_INTERACTIVE, timeout: float = None,
+                         recheck_interval: float = 1.0):
+        """
+        slot() 的 asyncio 版本：排队期间不占用线程
+
+        与线程排队者共用同一个等待队列和排序规则。每个协程等待自己的 Future，
+        槽位释放（可能在其他线程中）时只唤醒下一个轮到的协程；另外每
+        recheck_interval 秒重新检查一次（与线程排队者相同的兜底）。
+
+        Raises:
+            DeadlineExceeded: 排队超时
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"未知的优先级: {priority}")
+
+        ticket = _Ticket(priority, next(self._seq), asyncio.get_running_loop())
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            self._waiting.append(ticket)
+            self._report()
+        try:
+            while not self._try_grant(ticket):
+                wait = recheck_interval
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        metrics.inc('conversion_queue_timeout_total', priority=priority)
+                        raise DeadlineExceeded(f"转换排队超时(>{timeout:.0f}秒)")
+                    wait = min(wait, remaining)
+                await asyncio.wait([ticket.wakeup], timeout=wait)
+        except BaseException as e:
+            # 超时或协程被取消（客户端断开）：退出队列
+            with self._cond:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    self._notify()
+                    self._report()
+            if isinstance(e, DeadlineExceeded):
+                self._record_latency(priority, time.time() - ticket.enqueued_at)
+            elif isinstance(e, asyncio.CancelledError):
+                metrics.inc('conversion_cancelled_total', stage='queue')
+            raise
+        self._record_wait(ticket)
+
+        try:
+            yield
+        finally:
+            self._release(ticket)
+            self._record_latency(priority, time.time() - ticket.enqueued_at)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'capacity': self.capacity,
+                'reserved': self.reserved,
+                'running': dict(self._running),
+                'waiting': self._waiting_counts(),
+            }
+
+    def _acquire(self, ticket: _Ticket, timeout: float, cancel_event=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            self._waiting.append(ticket)
+            self._report()
+            try:
+                while self._next_ticket() is not ticket:
+                    if cancel_event is not None and cancel_event.is_set():
+                        metrics.inc('conversion_cancelled_total', stage='queue')
+                        raise ConversionCancelled("转换已取消（排队中）")
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            metrics.inc('conversion_queue_timeout_total', priority=ticket.priority)
+                            raise DeadlineExceeded(f"转换排队超时(>{timeout:.0f}秒)")
+                    # 后台请求的老化是随时间发生的，定期醒来重新评估
+                    self._cond.wait(min(remaining, 1.0) if remaining is not None else 1.0)
+            except BaseException:
+                self._waiting.remove(ticket)
+                # 自己放弃后，其他请求可能可以运行了
+                self._notify()
+                self._report()
+                raise
+            self._waiting.remove(ticket)
+            self._running[ticket.priority] += 1
+            self._report()
+            # 可能还有空闲槽位，让下一个请求重新评估
+            self._notify()
+
+    def _try_grant(self, ticket: _Ticket) -> bool:
+        """
+        轮到该协程时占用槽位并返回True（不等待）
+
+        没轮到时在同一次加锁内换上新的唤醒信号，之后的释放不会被漏掉。
+        """
+        with self._cond:
+            if self._next_ticket() is not ticket:
+                ticket.wakeup = ticket.loop.create_future()
+                return False
+            self._waiting.remove(ticket)
+            self._running[ticket.priority] += 1
+            self._report()
+            self._notify()
+            return True
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _release(self, ticket: _Ticket):
+        with self._cond:
+            self._running[ticket.priority] -= 1
+            self._report()
+            self._notify()
+
+    def _notify(self):
+        """
+        槽位或队列变化后唤醒排队者（调用方需持有锁）
+
+        线程排队者全部唤醒后各自重新评估；协程排队者只唤醒下一个轮到的，
+        它占用槽位后再唤醒下一个。
+        """
+        self._cond.notify_all()
+        ticket = self._next_ticket()
+        if ticket is None or ticket.wakeup is None:
+            return
+        try:
+            ticket.loop.call_soon_threadsafe(_set_wakeup, ticket.wakeup)
+        except RuntimeError:
+            pass  # 事件循环已关闭
+
+    def _eligible(self, ticket: _Ticket) -> bool:
+        """当前是否有该请求可以使用的空闲槽位"""
+        if sum(self._running.values()) >= self.capacity:
+            return False
+        if ticket.priority == PRIORITY_BACKGROUND:
+            return self._running[PRIORITY_BACKGROUND] < self.capacity - self.reserved
+        return True
+
+    def _rank(self, ticket: _Ticket, now: float) -> tuple:
+        """排序键：交互请求和已老化的后台请求在前，同级按到达顺序"""
+        aged = now - ticket.enqueued_at >= self.aging
+        level = 0 if ticket.priority == PRIORITY_INTERACTIVE or aged else 1
+        return level, ticket.seq
+
+    def _next_ticket(self):
+        """下一个应该获得槽位的请求（调用方需持有锁）"""
+        now = time.time()
+        eligible = [t for t in self._waiting if self._eligible(t)]
+        if not eligible:
+            return None
+        return min(eligible, key=lambda t: self._rank(t, now))
+
+    def _record_wait(self, ticket: _Ticket):
+        wait = time.time() - ticket.enqueued_at
+        metrics.observe('conversion_queue_wait_seconds', wait, priority=ticket.priority)
+        if wait > 1:
+            logger.info(f"转换排队 {wait:.1f}秒 [{ticket.priority}]")
+
+    def _record_latency(self, priority: str, latency: float):
+        metrics.observe('conversion_latency_seconds', latency, priority=priority)
+        target = self.slo.get(priority)
+        if target:
+            outcome = 'met' if latency <= target else 'missed'
+            metrics.inc('conversion_slo_total', priority=priority, outcome=outcome)
+
+    def _waiting_counts(self) -> dict:
+        waiting = {priority: 0 for priority in PRIORITIES}
+        for ticket in self._waiting:
+            waiting[ticket.priority] += 1
+        return waiting
+
+    def _report(self):
+        waiting = self._waiting_counts()
+        for priority in PRIORITIES:
+            metrics.set_gauge('conversion_queue_depth', waiting[priority], priority=priority)
+            metrics.set_gauge('conversion_running', self._running[priority], priority=priority)
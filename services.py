@@ -0,0 +1,173 @@
+"""
+进程级服务实例（转换器、结果缓存、上传会话、集群路由、限流、企业微信客户端、流水线）
+
+原先 app.py 在导入时就构造 DocumentConverter() 和 WeComAPI()，每个 gunicorn
+worker 启动时都要重新导入依赖、创建目录、解码AES密钥、启动预热线程，
+被 --timeout 回收后新 worker 要和线上请求抢资源。这里：
+
+- 实例在首次使用时才构造（线程安全），导入 app.py 不做任何昂贵的工作
+- 构造函数只创建对象和目录，不启动线程，因此可以在 gunicorn master 中
+  预加载（preload_app），fork 后各 worker 以写时复制的方式共享
+- 后台线程（LibreOffice配置目录预热、access_token 刷新）由 warm_up() 在
+  每个 worker 中单独启动：gunicorn.conf.py 的 post_fork 钩子调用，
+  未使用该配置时在首个请求时调用
+"""
+
+import os
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+_converter = None
+_wecom_api = None
+_wecom_pipeline = None
+_result_cache = None
+_upload_store = None
+_cluster = None
+_rate_limiters = {}
+_warmed_pid = None
+
+
+def get_converter():
+    """文档转换器（首次调用时构造）"""
+    global _converter
+    if _converter is None:
+        with _lock:
+            if _converter is None:
+                from converter import DocumentConverter
+                _converter = DocumentConverter()
+    return _converter
+
+
+def get_result_cache():
+    """/api/convert 转换结果缓存（首次调用时构造）"""
+    global _result_cache
+    if _result_cache is None:
+        with _lock:
+            if _result_cache is None:
+                from config import config
+                from result_cache import ResultCache
+                _result_cache = ResultCache(
+                    config.RESULT_CACHE_DIR,
+                    ttl=config.RESULT_CACHE_TTL,
+                    max_bytes=config.RESULT_CACHE_MAX_MB * 1024 * 1024
+                )
+    return _result_cache
+
+
+def get_upload_store():
+    """断点续传上传会话存储（首次调用时构造）"""
+    global _upload_store
+    if _upload_store is None:
+        with _lock:
+            if _upload_store is None:
+                from config import config
+                from upload_session import UploadSessionStore
+                _upload_store = UploadSessionStore(
+                    config.UPLOAD_SESSION_DIR,
+                    ttl=config.UPLOAD_SESSION_TTL,
+                    max_size=config.MAX_FILE_SIZE,
+                    max_chunk=config.UPLOAD_MAX_CHUNK_MB * 1024 * 1024
+                )
+    return _upload_store
+
+
+def get_cluster():
+    """集群成员和请求路由（首次调用时构造，未配置集群时 enabled 为 False）"""
+    global _cluster
+    if _cluster is None:
+        with _lock:
+            if _cluster is None:
+                from config import config
+                from cluster import Cluster, parse_nodes
+                _cluster = Cluster(
+                    config.CLUSTER_NODE,
+                    parse_nodes(config.CLUSTER_NODES),
+                    vnodes=config.CLUSTER_VNODES,
+                    connect_timeout=config.CLUSTER_CONNECT_TIMEOUT,
+                    cooldown=config.CLUSTER_PEER_COOLDOWN
+                )
+    return _cluster
+
+
+def get_rate_limiter(scope: str):
+    """
+    限流器（首次调用时构造）
+
+    Args:
+        scope: 'api'（/api/convert 和 /api/uploads，按客户端IP）或 'wecom'（企业微信文件消息，按用户）
+    """
+    limiter = _rate_limiters.get(scope)
+    if limiter is None:
+        with _lock:
+            limiter = _rate_limiters.get(scope)
+            if limiter is None:
+                from config import config
+                from rate_limit import RateLimiter
+                rate, burst = {
+                    'api': (config.RATE_LIMIT_API_PER_MINUTE, config.RATE_LIMIT_API_BURST),
+                    'wecom': (config.RATE_LIMIT_WECOM_PER_MINUTE, config.RATE_LIMIT_WECOM_BURST),
+                }[scope]
+                limiter = _rate_limiters[scope] = RateLimiter(scope, rate, burst, config.RATE_LIMIT_DIR)
+    return limiter
+
+
+def get_wecom_api():
+    """企业微信客户端（首次调用时构造）"""
+    global _wecom_api
+    if _wecom_api is None:
+        with _lock:
+            if _wecom_api is None:
+                from wecom_api import WeComAPI
+                _wecom_api = WeComAPI()
+    return _wecom_api
+
+
+def get_wecom_pipeline():
+    """企业微信文件处理流水线（首次调用时构造）"""
+    global _wecom_pipeline
+    if _wecom_pipeline is None:
+        with _lock:
+            if _wecom_pipeline is None:
+                from wecom_pipeline import WeComPipeline
+                _wecom_pipeline = WeComPipeline(get_wecom_api(), get_converter())
+    return _wecom_pipeline
+
+
+def preload():
+    """
+    构造所有服务实例（不启动线程）
+
+    在 gunicorn master 中调用，fork 出来的 worker 直接使用这些实例。
+    """
+    get_converter()
+    get_result_cache()
+    get_upload_store()
+    get_cluster()
+    get_rate_limiter('api')
+    get_rate_limiter('wecom')
+    get_wecom_api()
+    get_wecom_pipeline()
+
+
+def warm_up():
+    """
+    在当前进程中启动后台预热（每个进程只执行一次，不阻塞）
+
+    - LibreOffice 配置目录预热（已预热的目录跳过，多个 worker 通过文件锁协调）
+    - 企业微信 access_token 后台刷新线程（未配置企业微信时跳过）
+    """
+    global _warmed_pid
+    if _warmed_pid == os.getpid():
+        return
+    with _lock:
+        if _warmed_pid == os.getpid():
+            return
+        _warmed_pid = os.getpid()
+        get_converter().warm_up()
+        wecom_api = get_wecom_api()
+        if wecom_api.configured:
+            wecom_api.token_manager.start()
+    logger.info(f"worker {os.getpid()} 预热已启动")
@@ -0,0 +1,188 @@
+"""
+受监管的 soffice 进程运行器
+
+soffice 启动脚本会再派生 oosplash / soffice.bin，超时后只杀直接子进程时，
+孤儿 soffice.bin 会一直占用 CPU 和内存直到容器重启。这里：
+
+- 每次转换在独立的进程组（新会话）中启动，超时/取消时 killpg 整棵进程树，
+  正常退出后也清理残留的子孙进程
+- 用 rlimit 限制 CPU 时间和地址空间，单个异常文档拖不垮整台机器。不使用
+  preexec_fn（多线程进程 fork 后执行 Python 代码可能死锁）：有 util-linux 的
+  prlimit 命令时用它包装命令，限制在 exec 之前生效；没有时启动后立即对子进程
+  调用 prlimit(2)
+- 通过 os.wait4 取得 CPU 时间和峰值内存（RSS），写入监控指标
+"""
+
+import os
+import time
+import shutil
+import signal
+import logging
+import resource
+import tempfile
+import threading
+import subprocess
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+PRLIMIT = shutil.which('prlimit')
+
+
+class SofficeCancelled(Exception):
+    """运行中收到取消信号，进程树已被终止"""
+
+
+class SofficeResult:
+    """一次 soffice 运行的结果和资源占用"""
+
+    def __init__(self, returncode: int, stderr: str, duration: float, cpu_seconds: float, peak_rss: int):
+        self.returncode = returncode
+        self.stderr = stderr
+        self.duration = duration
+        self.cpu_seconds = cpu_seconds
+        self.peak_rss = peak_rss  # 字节
+
+    @property
+    def cpu_limited(self) -> bool:
+        """被 RLIMIT_CPU 终止（SIGXCPU/SIGKILL）"""
+        return self.returncode in (-signal.SIGXCPU, -signal.SIGKILL)
+
+
+def _cpu_limits(cpu_seconds: int) -> tuple:
+    # 软限制到达时收到 SIGXCPU，再超过5秒由内核直接 SIGKILL
+    return cpu_seconds, cpu_seconds + 5
+
+
+def _limit_command(cmd: list, cpu_seconds: int, memory_bytes: int) -> list:
+    """
+    用 prlimit 命令包装命令行
+
+    prlimit 设置好限制后 exec 目标命令（pid 不变），soffice 启动脚本派生的
+    oosplash / soffice.bin 都继承这些限制。没有 prlimit 命令时原样返回。
+    """
+    if PRLIMIT is None:
+        return cmd
+    options = []
+    if cpu_seconds:
+        options.append('--cpu=%d:%d' % _cpu_limits(cpu_seconds))
+    if memory_bytes:
+        options.append(f'--as={memory_bytes}:{memory_bytes}')
+    if not options:
+        return cmd
+    return [PRLIMIT, *options, '--', *cmd]
+
+
+def _limit_process(pid: int, cpu_seconds: int, memory_bytes: int):
+    """
+    启动后对子进程设置 rlimit（没有 prlimit 命令时的退路）
+
+    只有之后派生的子孙进程继承限制：soffice 启动脚本在设置之前就派生了
+    soffice.bin 时不受限制（启动脚本需要几毫秒，实际很少发生）。
+    """
+    try:
+        if cpu_seconds:
+            resource.prlimit(pid, resource.RLIMIT_CPU, _cpu_limits(cpu_seconds))
+        if memory_bytes:
+            resource.prlimit(pid, resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+    except ProcessLookupError:
+        pass  # 已经退出
+    except OSError as e:
+        logger.warning(f"无法设置soffice资源限制: {str(e)}")
+
+
+def _kill_tree(pgid: int):
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def run_supervised(cmd: list, timeout: float, cancel_event: threading.Event = None,
+                   cpu_limit: int = 0, memory_limit: int = 0, poll_interval: float = 0.2) -> SofficeResult:
+    """
+    在独立进程组中运行命令，超时或取消时终止整个进程树
+
+    Args:
+        cmd: 命令行
+        timeout: 超时秒数
+        cancel_event: 取消信号
+        cpu_limit: CPU时间上限（秒），0表示不限制
+        memory_limit: 地址空间（RLIMIT_AS）上限（字节），0表示不限制
+
+    Returns:
+        SofficeResult: 退出码、stderr、耗时、CPU时间、峰值RSS
+
+    Raises:
+        subprocess.TimeoutExpired: 超时（进程树已终止）
+        SofficeCancelled: 被取消（进程树已终止）
+    """
+    start = time.time()
+    # stderr 写入临时文件而不是管道：由 wait4 回收子进程，不需要额外线程读取管道
+    with tempfile.TemporaryFile() as stderr_file:
+        wrapped = _limit_command(cmd, cpu_limit, memory_limit)
+        process = subprocess.Popen(
+            wrapped,
+            stdout=subprocess.DEVNULL,
+            stderr=stderr_file,
+            start_new_session=True,
+        )
+        if wrapped is cmd:
+            _limit_process(process.pid, cpu_limit, memory_limit)
+        pgid = process.pid  # 新会话的进程组号等于子进程pid
+        killed = None
+
+        try:
+            while True:
+                pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+                if pid:
+                    break
+                if cancel_event is not None and cancel_event.is_set():
+                    killed = 'cancelled'
+                elif time.time() - start >= timeout:
+                    killed = 'timeout'
+                if killed:
+                    _kill_tree(pgid)
+                    _, status, rusage = os.wait4(process.pid, 0)
+                    break
+                time.sleep(poll_interval)
+        finally:
+            # 直接子进程退出后，进程组里可能还有残留的 soffice.bin
+            _kill_tree(pgid)
+
+        process.returncode = os.waitstatus_to_exitcode(status)
+        stderr_file.seek(0)
+        stderr = stderr_file.read().decode('utf-8', errors='replace')
+
+    # wait4 的 rusage 只统计直接子进程和它自己 wait 回收过的子孙进程：ru_maxrss
+    # 是其中单个进程的最大RSS（Linux 上以 KB 为单位，不是整棵树的总和），被
+    # killpg 杀死后由 init 回收的孤儿进程不计入，CPU 时间同理
+    result = SofficeResult(
+        returncode=process.returncode,
+        stderr=stderr,
+        duration=time.time() - start,
+        cpu_seconds=rusage.ru_utime + rusage.ru_stime,
+        peak_rss=rusage.ru_maxrss * 1024,
+    )
+    metrics.observe('soffice_cpu_seconds', result.cpu_seconds)
+    metrics.observe('soffice_peak_rss_bytes', result.peak_rss)
+
+    if killed is None and cpu_limit and result.cpu_limited:
+        killed = 'cpu_limit'
+    if killed:
+        metrics.inc('soffice_killed_total', reason=killed)
+        logger.warning(
+            f"soffice进程树已终止[{killed}]: 耗时 {result.duration:.1f}秒, "
+            f"CPU {result.cpu_seconds:.1f}秒, 峰值内存 {result.peak_rss // (1024 * 1024)}MB"
+        )
+    else:
+        logger.info(
+            f"soffice退出码 {result.returncode}: 耗时 {result.duration:.1f}秒, "
+            f"CPU {result.cpu_seconds:.1f}秒, 峰值内存 {result.peak_rss // (1024 * 1024)}MB"
+        )
+
+    if killed == 'cancelled':
+        raise SofficeCancelled("转换已取消")
+    if killed == 'timeout':
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    return result
@@ -0,0 +1,176 @@
+"""
+临时文件回收
+
+Windows 上文件仍被打开时（Office 还没释放输入文件、响应还在发送PDF）删除会失败。
+这里用一个后台线程统一回收：
+
+- discard(): 立即尝试删除，失败的文件加入待删除队列，由后台线程按退避间隔重试
+- 启动时以及之后每隔 sweep_interval 秒，删除目录中超过 max_age 秒的残留文件
+  （进程崩溃、强制重启时来不及删除的文件），只处理 prefixes 开头的文件
+- stats(): 目录占用和待删除数量，供健康检查使用
+
+只依赖标准库，Windows 服务部署时把本文件复制到同一目录即可。
+"""
+
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class TempReaper:
+    """
+    单个后台线程回收临时文件
+
+    Args:
+        directory: 临时文件目录
+        prefixes: 按时间清理时只处理这些前缀开头的文件（目录中可能还有追踪数据等其他文件）
+        max_age: 残留文件的最长保留时间（秒）
+        sweep_interval: 按时间清理的间隔（秒）
+        retry_delay: 删除失败后首次重试的等待时间（秒），之后每次翻倍，最长 max_retry_delay
+    """
+
+    def __init__(self, directory: str, prefixes: tuple = ('input_', 'output_'), max_age: float = 3600,
+                 sweep_interval: float = 600, retry_delay: float = 1.0, max_retry_delay: float = 60.0):
+        self.directory = str(directory)
+        self.prefixes = tuple(prefixes)
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.removed = 0
+        self.swept = 0
+        self._pending = {}  # 路径 -> (下次重试时间, 当前等待时间)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+
+    def ensure_started(self):
+        # 线程在首次使用时才启动，启动后先清理一次残留文件
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._loop, name='temp-reaper', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def discard(self, *paths):
+        """删除文件，被占用而删除失败的交给后台线程重试"""
+        failed = [str(path) for path in paths if not self._remove(str(path))]
+        if not failed:
+            return
+        now = time.time()
+        with self._lock:
+            for path in failed:
+                if path not in self._pending:
+                    self._pending[path] = (now + self.retry_delay, self.retry_delay)
+        self.ensure_started()
+        self._wakeup.set()
+
+    def sweep(self, max_age: float = None) -> int:
+        """删除超过 max_age 秒未修改的残留文件（待删除队列中的除外），返回删除的文件数"""
+        max_age = self.max_age if max_age is None else max_age
+        cutoff = time.time() - max_age
+        removed = 0
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError as e:
+            logger.warning(f"读取临时目录失败: {str(e)}")
+            return 0
+        with self._lock:
+            pending = set(self._pending)
+        for entry in entries:
+            if not entry.name.startswith(self.prefixes) or entry.path in pending:
+                continue
+            try:
+                if not entry.is_file() or entry.stat().st_mtime > cutoff:
+                    continue
+            except OSError:
+                continue
+            if self._remove(entry.path):
+                removed += 1
+            else:
+                self.discard(entry.path)
+        if removed:
+            self.swept += removed
+            logger.info(f"已清理 {removed} 个残留临时文件（超过 {max_age:.0f} 秒）")
+        return removed
+
+    def stats(self) -> dict:
+        """临时目录占用和回收情况"""
+        files = 0
+        size = 0
+        oldest = None
+        try:
+            for entry in os.scandir(self.directory):
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files += 1
+                size += stat.st_size
+                oldest = stat.st_mtime if oldest is None else min(oldest, stat.st_mtime)
+        except OSError:
+            pass
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'directory': self.directory,
+            'files': files,
+            'bytes': size,
+            'oldest_seconds': round(time.time() - oldest, 1) if oldest is not None else 0,
+            'pending_deletes': pending,
+            'removed': self.removed,
+            'swept': self.swept,
+        }
+
+    def _remove(self, path: str) -> bool:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return True
+        except OSError:
+            # Windows 上文件被其他句柄打开时删除失败（PermissionError）
+            return False
+        self.removed += 1
+        return True
+
+    def _retry_pending(self):
+        now = time.time()
+        with self._lock:
+            due = [(path, delay) for path, (retry_at, delay) in self._pending.items() if retry_at <= now]
+        for path, delay in due:
+            removed = self._remove(path)
+            with self._lock:
+                if removed:
+                    self._pending.pop(path, None)
+                else:
+                    delay = min(delay * 2, self.max_retry_delay)
+                    self._pending[path] = (now + delay, delay)
+            if not removed and delay == self.max_retry_delay:
+                logger.warning(f"临时文件仍被占用，稍后重试: {path}")
+
+    def _next_wait(self, next_sweep: float) -> float:
+        with self._lock:
+            retry_at = min((retry_at for retry_at, _ in self._pending.values()), default=next_sweep)
+        return max(0.0, min(retry_at, next_sweep) - time.time())
+
+    def _loop(self):
+        next_sweep = time.time()
+        while not self._stop.is_set():
+            if time.time() >= next_sweep:
+                self.sweep()
+                next_sweep = time.time() + self.sweep_interval
+            self._retry_pending()
+            self._wakeup.wait(self._next_wait(next_sweep))
+            self._wakeup.clear()
@@ -0,0 +1,232 @@
+"""
+跨进程共享的 access_token 管理
+
+每个 gunicorn worker 各自缓存 token 时，每个进程都要单独请求一次 gettoken，
+过期后的第一个请求还要在锁内同步等待刷新。这里把 token 存在共享文件中
+（写临时文件后 os.replace 原子替换），用文件锁保证同一时间只有一个进程
+去刷新，并由后台线程在过期前主动刷新，请求路径只在冷启动时阻塞。
+"""
+
+import os
+import json
+import time
+import fcntl
+import random
+import logging
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# 表示 access_token 无效或已过期的错误码（企业微信/公众号通用）
+INVALID_TOKEN_ERRCODES = {40001, 40014, 42001}
+
+# 距离真正过期不足该秒数的 token 不再使用
+EXPIRY_SAFETY = 60
+
+
+def is_token_error(data: dict) -> bool:
+    """接口返回的错误是否由 access_token 无效引起"""
+    return isinstance(data, dict) and data.get('errcode') in INVALID_TOKEN_ERRCODES
+
+
+def request_with_token(session, token_manager, method: str, url: str, params: dict = None, **kwargs):
+    """
+    带 access_token 的接口请求（企业微信/公众号通用）
+
+    接口返回 token 无效（40001/40014/42001）时刷新一次 token 并重试，
+    刷新结果由所有 worker 共享，避免集体重复刷新。
+
+    Args:
+        session: 发送请求的 requests.Session（或 requests 模块）
+        token_manager: SharedTokenManager
+        method: HTTP 方法
+        url: 接口地址，access_token 加在查询参数中
+        params: 其他查询参数
+        **kwargs: 传给 session.request；上传的文件重试前回到开头
+
+    Returns:
+        requests.Response
+    """
+    access_token = token_manager.get_token()
+
+    for attempt in range(2):
+        response = session.request(
+            method, url, params={**(params or {}), 'access_token': access_token}, **kwargs
+        )
+        if attempt == 0 and 'application/json' in response.headers.get('Content-Type', ''):
+            try:
+                data = response.json()
+            except ValueError:
+                data = None
+            if is_token_error(data):
+                response.close()
+                access_token = token_manager.invalidate(access_token)
+                # 上传的文件需要从头重新发送
+                for file_obj in (kwargs.get('files') or {}).values():
+                    if hasattr(file_obj, 'seek'):
+                        file_obj.seek(0)
+                continue
+        return response
+
+
+class SharedTokenManager:
+    """
+    共享 access_token 管理器
+
+    Args:
+        name: 存储文件名（同一应用的所有 worker 使用相同名称）
+        fetch_token: 请求新 token 的函数，返回 (access_token, expires_in)
+        store_dir: 共享存储目录
+        refresh_margin: 距离过期不足该秒数时后台提前刷新
+    """
+
+    def __init__(self, name: str, fetch_token, store_dir: str, refresh_margin: int = 600):
+        self.name = name
+        self.fetch_token = fetch_token
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.store_path = self.store_dir / f"{name}.json"
+        self.lock_path = self.store_dir / f"{name}.lock"
+        self.refresh_margin = refresh_margin
+
+        self._token = None
+        self._expires_at = 0
+        self._lifetime = 0
+        self._lock = threading.Lock()
+        self._refresher = None
+
+    def get_token(self) -> str:
+        """获取可用的 token，只有冷启动（没有任何可用 token）时才会阻塞"""
+        self._ensure_refresher()
+        if self._usable():
+            return self._token
+
+        # 其他 worker 可能已经刷新过
+        self._load()
+        if self._usable():
+            return self._token
+
+        with self._lock:
+            with self._file_lock():
+                self._load()
+                if not self._usable():
+                    self._refresh()
+        return self._token
+
+    def start(self):
+        """提前启动后台刷新线程（worker 启动时预取 token，不阻塞）"""
+        self._ensure_refresher()
+
+    def invalidate(self, bad_token: str) -> str:
+        """
+        接口返回 token 无效时调用：只刷新一次，其他进程/线程复用刷新结果
+
+        Returns:
+            str: 新的 token
+        """
+        with self._lock:
+            with self._file_lock():
+                self._load()
+                if self._token == bad_token or not self._usable():
+                    logger.warning(f"[{self.name}] access_token 已失效，重新获取")
+                    self._refresh()
+        return self._token
+
+    def _usable(self) -> bool:
+        return bool(self._token) and time.time() < self._expires_at - EXPIRY_SAFETY
+
+    def _load(self):
+        """从共享文件读取 token"""
+        try:
+            with open(self.store_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._token = data['access_token']
+            self._expires_at = data['expires_at']
+            self._lifetime = data.get('expires_in', 0)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _refresh(self):
+        """请求新 token 并原子写入共享文件（调用方需持有文件锁）"""
+        access_token, expires_in = self.fetch_token()
+        expires_at = time.time() + expires_in
+        tmp_path = self.store_path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'access_token': access_token, 'expires_at': expires_at, 'expires_in': expires_in}, f)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, self.store_path)
+        self._token = access_token
+        self._expires_at = expires_at
+        self._lifetime = expires_in
+        logger.info(f"[{self.name}] access_token 已刷新，{int(expires_in)}秒后过期")
+
+    def _file_lock(self, blocking: bool = True):
+        return _FileLock(self.lock_path, blocking)
+
+    def _ensure_refresher(self):
+        # 首次使用时才启动后台线程（fork之后的worker各自启动）
+        if self._refresher is None or not self._refresher.is_alive():
+            with self._lock:
+                if self._refresher is None or not self._refresher.is_alive():
+                    self._refresher = threading.Thread(
+                        target=self._refresh_loop, name=f'{self.name}-refresher', daemon=True
+                    )
+                    self._refresher.start()
+
+    def _margin(self) -> float:
+        # 有效期很短时最多提前一半有效期刷新，避免反复刷新
+        if self._lifetime:
+            return min(self.refresh_margin, self._lifetime / 2)
+        return self.refresh_margin
+
+    def _refresh_loop(self):
+        while True:
+            self._load()
+            remaining = self._expires_at - time.time()
+            margin = self._margin()
+            if self._token and remaining > margin:
+                # 加一点随机抖动，避免所有 worker 同时醒来
+                time.sleep(remaining - margin + random.uniform(0, min(30, margin / 4)))
+                continue
+            try:
+                with self._lock:
+                    with self._file_lock(blocking=False) as locked:
+                        if locked:
+                            self._load()
+                            if not self._token or self._expires_at - time.time() <= self._margin():
+                                self._refresh()
+                if not locked:
+                    # 其他 worker 正在刷新，稍后直接读取结果
+                    time.sleep(1)
+            except Exception as e:
+                logger.error(f"[{self.name}] 后台刷新 access_token 失败: {str(e)}")
+                time.sleep(30)
+
+
+class _FileLock:
+    """基于 flock 的跨进程锁，非阻塞模式下 __enter__ 返回是否加锁成功"""
+
+    def __init__(self, path: Path, blocking: bool = True):
+        self.path = path
+        self.blocking = blocking
+        self._file = None
+        self.locked = False
+
+    def __enter__(self) -> bool:
+        self._file = open(self.path, 'a')
+        flags = fcntl.LOCK_EX if self.blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(self._file, flags)
+            self.locked = True
+        except BlockingIOError:
+            self.locked = False
+        return self.locked
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self.locked:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+        return False
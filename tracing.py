@@ -0,0 +1,327 @@
+"""
+轻量级分布式追踪
+
+转换变慢时，需要知道时间花在了哪里：nginx 上传、Flask 落盘、到 Windows 虚拟机
+的网络、COM Documents.Open / 导出 / 关闭，还是回传 PDF。这里提供基于 span 的追踪：
+
+- 入口（api_convert / wecom_handler）生成 trace id，各阶段记录 span
+- 通过 W3C traceparent 请求头传给 windows_converter_service.py，两边的 span
+  属于同一条 trace
+- span 由后台线程批量写入本地 JSONL 文件，或 POST 到收集器
+
+只依赖标准库，Windows 服务部署时把本文件复制到同一目录即可。
+记录一个 span 只是几次属性赋值和一次非阻塞入队，可以在生产环境常开；
+队列满时直接丢弃，不会阻塞请求。
+"""
+
+import os
+import json
+import time
+import queue
+import random
+import logging
+import threading
+import contextvars
+import urllib.request
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_HEADER = 'traceparent'
+TRACE_ID_HEADER = 'X-Trace-Id'
+
+_current = contextvars.ContextVar('current_span', default=None)
+
+
+class SpanContext:
+    """可跨线程/进程传递的 span 标识"""
+
+    __slots__ = ('trace_id', 'span_id', 'sampled')
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool = True):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    def to_traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    @classmethod
+    def from_traceparent(cls, value: str):
+        """解析 traceparent 请求头，格式错误返回None"""
+        parts = (value or '').strip().split('-')
+        if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+            return None
+        try:
+            int(parts[1], 16), int(parts[2], 16)
+            sampled = bool(int(parts[3], 16) & 1)
+        except ValueError:
+            return None
+        return cls(parts[1], parts[2], sampled)
+
+
+class Span:
+    """一段计时区间"""
+
+    __slots__ = ('context', 'parent_id', 'name', 'service', 'start', 'end', 'attributes', 'status')
+
+    def __init__(self, name: str, context: SpanContext, parent_id: str, service: str, attributes: dict):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.service = service
+        self.start = time.time()
+        self.end = None
+        self.attributes = attributes
+        self.status = 'ok'
+
+    @property
+    def trace_id(self) -> str:
+        return self.context.trace_id
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {
+            'trace_id': self.context.trace_id,
+            'span_id': self.context.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'service': self.service,
+            'start': self.start,
+            'duration_ms': round((self.end - self.start) * 1000, 3),
+            'status': self.status,
+            'attributes': self.attributes,
+        }
+
+
+class _NoopSpan:
+    """未采样的 trace：保持上下文以便继续传播，但不记录"""
+
+    __slots__ = ('context',)
+
+    def __init__(self, context: SpanContext):
+        self.context = context
+
+    @property
+    def trace_id(self) -> str:
+        return self.context.trace_id
+
+    def set(self, **attributes):
+        pass
+
+
+class NullExporter:
+    def export(self, span: Span):
+        pass
+
+
+class _BatchExporter(ABC):
+    """后台线程批量导出，export() 只做非阻塞入队；子类实现 write()"""
+
+    def __init__(self, max_queue: int = 10000, flush_interval: float = 1.0):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(span.to_dict())
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_thread(self):
+        # 首次使用时才启动，fork 出来的 worker 进程各自启动
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._loop, name='trace-exporter', daemon=True)
+                    self._thread.start()
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self.flush_interval
+            while len(batch) < 500:
+                try:
+                    batch.append(self._queue.get(timeout=max(0, deadline - time.time())))
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception as e:
+                logger.warning(f"导出追踪数据失败: {str(e)}")
+
+    @abstractmethod
+    def write(self, batch: list):
+        """在导出线程中写出一批 span（字典列表），异常由调用方记录"""
+
+
+class FileExporter(_BatchExporter):
+    """写入 JSONL 文件（每行一个 span），超过大小上限时轮转为 .1"""
+
+    def __init__(self, path: str, max_bytes: int = 100 * 1024 * 1024, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def write(self, batch: list):
+        data = ''.join(json.dumps(span, ensure_ascii=False) + '\n' for span in batch)
+        try:
+            if os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, self.path + '.1')
+        except OSError:
+            pass
+        # 无缓冲追加写入：每批一次 write 系统调用，多个 worker 进程共用一个文件时行不会交错
+        with open(self.path, 'ab', buffering=0) as f:
+            f.write(data.encode('utf-8'))
+
+
+class HttpExporter(_BatchExporter):
+    """以 JSON 数组 POST 到收集器"""
+
+    def __init__(self, url: str, timeout: float = 5, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.timeout = timeout
+
+    def write(self, batch: list):
+        body = json.dumps(batch, ensure_ascii=False).encode('utf-8')
+        req = urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            resp.read()
+
+
+def create_exporter(target: str):
+    """
+    按配置创建导出器
+
+    Args:
+        target: 空 -> 不导出；http(s)://... -> 收集器；其他 -> JSONL 文件路径
+    """
+    if not target:
+        return NullExporter()
+    if target.startswith(('http://', 'https://')):
+        return HttpExporter(target)
+    return FileExporter(target)
+
+
+class Tracer:
+    """
+    追踪器
+
+    Args:
+        service: 服务名（写入每个 span）
+        exporter: span 导出器
+        sample_rate: 新 trace 的采样比例（0~1），上游传入的 trace 沿用上游的决定
+    """
+
+    def __init__(self, service: str, exporter=None, sample_rate: float = 1.0):
+        self.service = service
+        self.exporter = exporter or NullExporter()
+        self.sample_rate = sample_rate
+
+    def configure(self, service: str = None, exporter=None, sample_rate: float = None):
+        """启动时按配置设置服务名、导出器和采样比例"""
+        if service is not None:
+            self.service = service
+        if exporter is not None:
+            self.exporter = exporter
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+
+    @contextmanager
+    def span(self, name: str, parent: SpanContext = None, **attributes):
+        """
+        记录一个 span；没有父 span 时开始新的 trace
+
+        Args:
+            name: span 名称
+            parent: 显式指定的父 span（跨线程、跨进程时使用），默认取当前上下文
+        """
+        if parent is None:
+            current = _current.get()
+            parent = current.context if current is not None else None
+
+        if parent is None:
+            context = SpanContext(_new_id(16), _new_id(8), random.random() < self.sample_rate)
+            parent_id = None
+        else:
+            context = SpanContext(parent.trace_id, _new_id(8), parent.sampled)
+            parent_id = parent.span_id
+
+        span = Span(name, context, parent_id, self.service, attributes) if context.sampled else _NoopSpan(context)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            if isinstance(span, Span):
+                span.status = 'error'
+                span.attributes['error'] = str(e)[:200]
+            raise
+        finally:
+            _current.reset(token)
+            if isinstance(span, Span):
+                span.end = time.time()
+                self.exporter.export(span)
+
+    def record(self, name: str, start: float, end: float, parent: SpanContext = None, **attributes):
+        """补记一段已经结束的区间（如 nginx 接收上传的时间）"""
+        if parent is None:
+            current = _current.get()
+            parent = current.context if current is not None else None
+        if parent is None or not parent.sampled:
+            return
+        span = Span(name, SpanContext(parent.trace_id, _new_id(8)), parent.span_id, self.service, attributes)
+        span.start = start
+        span.end = end
+        self.exporter.export(span)
+
+    @staticmethod
+    def current_context():
+        """当前 span 的上下文（用于交给其他线程继续追踪），没有时返回None"""
+        current = _current.get()
+        return current.context if current is not None else None
+
+    @staticmethod
+    def inject(headers: dict = None) -> dict:
+        """把当前 trace 写入请求头"""
+        headers = dict(headers or {})
+        current = _current.get()
+        if current is not None:
+            headers[TRACEPARENT_HEADER] = current.context.to_traceparent()
+        return headers
+
+    @staticmethod
+    def extract(headers):
+        """从请求头读取上游 trace，没有时返回None"""
+        return SpanContext.from_traceparent(headers.get(TRACEPARENT_HEADER, ''))
+
+
+def record_proxy_timing(headers):
+    """
+    根据 nginx 设置的 X-Request-Start / X-Request-Time 请求头（见 nginx.conf）
+    在当前 span 下补记 nginx.receive（接收请求体）和 proxy.forward（转发到开始处理）
+    """
+    try:
+        forwarded_at = float(headers.get('X-Request-Start', '').lstrip('t='))
+        receive_time = float(headers.get('X-Request-Time', ''))
+    except ValueError:
+        return
+    tracer.record('nginx.receive', forwarded_at - receive_time, forwarded_at)
+    # 从 nginx 转发到 worker 开始处理（含 gunicorn 排队）
+    tracer.record('proxy.forward', forwarded_at, time.time())
+
+
+def _new_id(num_bytes: int) -> str:
+    return os.urandom(num_bytes).hex()
+
+
+# 全局追踪器，默认不导出，由入口（app.py / windows_converter_service.py）配置
+tracer = Tracer('office-converter')
@@ -0,0 +1,336 @@
+"""
+断点续传上传
+
+4G 网络下上传几十MB的PPT经常中途断开，快捷指令只能从头重新上传。
+这里提供分块上传会话：
+
+1. POST /api/uploads 创建会话（声明文件名、总大小和部分转换参数），返回 upload_id
+2. PATCH /api/uploads/<upload_id> 按偏移量（Upload-Offset 请求头）依次上传分块
+3. 断开后 HEAD/GET /api/uploads/<upload_id> 查询服务器已收到的字节数，从该位置续传
+4. 最后一个分块到达后自动开始转换，该请求直接返回PDF
+
+分块按顺序追加到会话目录中的数据文件，会话的元数据是旁边的JSON文件，
+所有 worker 共享；同一会话的写入和转换分别用文件锁互斥。转换失败（超时、客户端断开等）
+时数据保留，重新发送一个空的最后分块即可重试；转换成功后删除数据，
+只保留文档哈希，之后的重试直接返回结果缓存中的PDF。
+超过有效期没有新分块的会话被删除。
+"""
+
+import os
+import re
+import json
+import time
+import fcntl
+import shutil
+import secrets
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+# 分块的起始偏移量（与 tus 协议同名）
+UPLOAD_OFFSET_HEADER = 'Upload-Offset'
+
+# 创建会话时保存的表单字段（部分转换参数、导出配置和客户端提供的哈希）
+SESSION_FIELDS = ('pages', 'sheets', 'print_area', 'profile', 'sha256')
+
+
+class UploadError(ValueError):
+    """
+    分块上传请求无效
+
+    Attributes:
+        reason: 机器可读的原因（not_found/offset_mismatch/too_large/busy/invalid）
+        status_code: 建议返回的HTTP状态码
+        offset: 服务器已收到的字节数（便于客户端续传），未知时为None
+    """
+
+    STATUS_CODES = {'not_found': 404, 'offset_mismatch': 409, 'busy': 409, 'too_large': 413}
+
+    def __init__(self, message: str, reason: str, offset: int = None):
+        super().__init__(message)
+        self.reason = reason
+        self.status_code = self.STATUS_CODES.get(reason, 400)
+        self.offset = offset
+
+    def to_dict(self) -> dict:
+        data = {'error': str(self), 'reason': self.reason}
+        if self.offset is not None:
+            data['offset'] = self.offset
+        return data
+
+
+class UploadSession:
+    """一个上传会话"""
+
+    def __init__(self, upload_id: str, data_path: Path, entry: dict):
+        self.upload_id = upload_id
+        self.data_path = data_path
+        self.filename = entry['filename']
+        self.size = entry['size']
+        self.fields = entry.get('fields', {})
+        self.created_at = entry.get('created_at', 0)
+        # 转换成功后记录文档哈希，数据文件已删除
+        self.content_hash = entry.get('content_hash')
+
+    @property
+    def complete(self) -> bool:
+        return self.content_hash is not None
+
+    @property
+    def offset(self) -> int:
+        """服务器已收到的字节数"""
+        if self.complete:
+            return self.size
+        try:
+            return self.data_path.stat().st_size
+        except OSError:
+            return 0
+
+    def to_dict(self) -> dict:
+        data = {
+            'upload_id': self.upload_id,
+            'filename': self.filename,
+            'size': self.size,
+            'offset': self.offset,
+            'complete': self.complete,
+        }
+        if self.content_hash:
+            data['sha256'] = self.content_hash
+        return data
+
+
+class ChunkWriter:
+    """向会话数据文件追加一个分块（持有该会话的写锁）"""
+
+    def __init__(self, session: UploadSession, f, offset: int, max_chunk: int):
+        self.session = session
+        self._file = f
+        self._max_chunk = max_chunk
+        self.offset = offset  # 写入该分块后服务器已收到的字节数
+        self.written = 0
+
+    def write(self, data: bytes):
+        """
+        Raises:
+            UploadError: 分块超过单块上限或超出声明的文件大小
+        """
+        self.written += len(data)
+        if self.written > self._max_chunk:
+            raise UploadError(f"分块超过大小限制({self._max_chunk // (1024 * 1024)}MB)", 'too_large')
+        if self.offset + len(data) > self.session.size:
+            raise UploadError("上传的数据超过声明的文件大小", 'invalid', offset=self.offset)
+        self._file.write(data)
+        self.offset += len(data)
+
+
+class UploadSessionStore:
+    """
+    上传会话的共享磁盘存储
+
+    Args:
+        upload_dir: 会话目录
+        ttl: 会话在没有新分块后保留的秒数
+        max_size: 单个文件的大小上限
+        max_chunk: 单个分块的大小上限
+    """
+
+    def __init__(self, upload_dir: str, ttl: int = 6 * 3600, max_size: int = 100 * 1024 * 1024,
+                 max_chunk: int = 16 * 1024 * 1024):
+        self.upload_dir = Path(upload_dir)
+        self.upload_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_chunk = max_chunk
+        self._last_prune = 0
+
+    def _paths(self, upload_id: str) -> tuple:
+        return self.upload_dir / f"{upload_id}.part", self.upload_dir / f"{upload_id}.json"
+
+    def create(self, filename: str, size: int, fields: dict = None, owns=None) -> UploadSession:
+        """
+        创建会话
+
+        Args:
+            filename: 原始文件名
+            size: 文件总大小（字节）
+            fields: 部分转换参数等表单字段
+            owns: 可选，判断会话ID是否由本节点负责（集群模式下只选用这样的ID，
+                其他节点按同样的规则转发该会话的请求）
+
+        Raises:
+            UploadError: 文件大小无效或超过上限
+        """
+        if size <= 0:
+            raise UploadError("文件大小必须大于0", 'invalid')
+        if size > self.max_size:
+            raise UploadError(f"文件超过大小限制({self.max_size // (1024 * 1024)}MB)", 'too_large')
+        self._maybe_prune()
+
+        upload_id = secrets.token_hex(16)
+        while owns is not None and not owns(upload_id):
+            upload_id = secrets.token_hex(16)
+        data_path, meta_path = self._paths(upload_id)
+        entry = {
+            'filename': filename,
+            'size': size,
+            'fields': {key: value for key, value in (fields or {}).items() if key in SESSION_FIELDS and value},
+            'created_at': time.time(),
+        }
+        data_path.touch()
+        self._write_meta(meta_path, entry)
+        metrics.inc('upload_sessions_total', outcome='created')
+        logger.info(f"创建上传会话: {upload_id}, {filename}, {size} 字节")
+        return UploadSession(upload_id, data_path, entry)
+
+    def get(self, upload_id: str) -> UploadSession:
+        """
+        Raises:
+            UploadError: 会话不存在或已过期
+        """
+        if not UPLOAD_ID_RE.match(upload_id or ''):
+            raise UploadError("上传会话不存在", 'not_found')
+        self._maybe_prune()
+        data_path, meta_path = self._paths(upload_id)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            raise UploadError("上传会话不存在或已过期", 'not_found')
+        if self._expired(data_path, meta_path):
+            self.delete(upload_id, outcome='expired')
+            raise UploadError("上传会话不存在或已过期", 'not_found')
+        return UploadSession(upload_id, data_path, entry)
+
+    @contextmanager
+    def append(self, upload_id: str, offset: int):
+        """
+        在 with 块内向会话追加从 offset 开始的分块
+
+        偏移量必须等于服务器已收到的字节数；同一会话同时只能有一个写入。
+        with 块内抛出异常时已写入的部分仍然保留，客户端查询偏移量后续传。
+
+        Yields:
+            ChunkWriter
+
+        Raises:
+            UploadError: 会话不存在、已完成、偏移量不符或正在被其他请求写入
+        """
+        session = self.get(upload_id)
+        if session.complete:
+            raise UploadError("文件已上传完成", 'offset_mismatch', offset=session.size)
+        with open(session.data_path, 'ab') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadError("该上传会话正在接收其他分块", 'busy', offset=session.offset)
+            current = f.seek(0, os.SEEK_END)
+            if offset != current:
+                raise UploadError(f"偏移量不符: 服务器已收到 {current} 字节", 'offset_mismatch', offset=current)
+            writer = ChunkWriter(session, f, current, self.max_chunk)
+            try:
+                yield writer
+            finally:
+                f.flush()
+                metrics.inc('upload_chunk_bytes_total', writer.written)
+        metrics.inc('upload_chunks_total')
+
+    @contextmanager
+    def converting(self, upload_id: str):
+        """
+        在 with 块内持有会话的转换锁
+
+        空的最后分块重试或重复提交可能在前一次转换进行中到达，同一会话同时只转换一次。
+        锁是元数据文件上的 flock：完成时 finish() 替换元数据文件，之后到达的请求锁住
+        的是新文件，但重新读取的会话已经完成，不会再次转换。
+
+        Yields:
+            UploadSession: 加锁后重新读取的会话（可能刚被其他请求转换完成）
+
+        Raises:
+            UploadError: 会话不存在，或正在被其他请求转换（busy）
+        """
+        _, meta_path = self._paths(upload_id)
+        try:
+            f = open(meta_path, 'rb')
+        except OSError:
+            raise UploadError("上传会话不存在或已过期", 'not_found')
+        with f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadError("该上传会话正在转换", 'busy')
+            yield self.get(upload_id)
+
+    def link_data(self, session: UploadSession, dest_path: str):
+        """把已收齐的数据放到转换用的临时路径（硬链接，跨文件系统时复制），会话数据保留以便重试"""
+        try:
+            os.link(session.data_path, dest_path)
+        except OSError:
+            shutil.copyfile(session.data_path, dest_path)
+
+    def finish(self, session: UploadSession, content_hash: str):
+        """转换成功：删除数据，只保留文档哈希供之后的重试查询结果缓存"""
+        data_path, meta_path = self._paths(session.upload_id)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            entry['content_hash'] = content_hash
+            self._write_meta(meta_path, entry)
+        except (OSError, ValueError) as e:
+            logger.warning(f"更新上传会话失败: {str(e)}")
+        data_path.unlink(missing_ok=True)
+        session.content_hash = content_hash
+        metrics.inc('upload_sessions_total', outcome='completed')
+        logger.info(f"上传会话完成: {session.upload_id}")
+
+    def delete(self, upload_id: str, outcome: str = 'aborted'):
+        data_path, meta_path = self._paths(upload_id)
+        removed = False
+        for path in (data_path, meta_path):
+            try:
+                os.remove(path)
+                removed = True
+            except OSError:
+                pass
+        if removed:
+            metrics.inc('upload_sessions_total', outcome=outcome)
+            logger.info(f"删除上传会话[{outcome}]: {upload_id}")
+
+    def _write_meta(self, meta_path: Path, entry: dict):
+        tmp_path = meta_path.with_name(f"{meta_path.name}.{os.getpid()}_{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, meta_path)
+
+    def _expired(self, data_path: Path, meta_path: Path) -> bool:
+        """最后一个分块（或创建、完成）之后超过有效期"""
+        try:
+            last_active = max(path.stat().st_mtime for path in (data_path, meta_path) if path.exists())
+        except (OSError, ValueError):
+            return True
+        return time.time() - last_active >= self.ttl
+
+    def _maybe_prune(self, interval: float = 60):
+        """每分钟最多扫描一次，删除过期的会话"""
+        now = time.time()
+        if now - self._last_prune < interval:
+            return
+        self._last_prune = now
+        for meta_path in self.upload_dir.glob('*.json'):
+            data_path = meta_path.with_suffix('.part')
+            if self._expired(data_path, meta_path):
+                self.delete(meta_path.stem, outcome='expired')
+        # 没有元数据的数据文件（创建会话中途退出）和写入中途退出留下的临时文件
+        for path in list(self.upload_dir.glob('*.part')) + list(self.upload_dir.glob('*.tmp')):
+            try:
+                if not path.with_suffix('.json').exists() and now - path.stat().st_mtime >= self.ttl:
+                    path.unlink()
+            except OSError:
+                pass
@@ -1,8 +1,7 @@
 import requests
-import time
 import logging
-import threading
 from config import config
+from token_store import SharedTokenManager, request_with_token
 
 logger = logging.getLogger(__name__)
 
@@ -12,54 +11,57 @@ class WeChatAPI:
     def __init__(self):
         self.app_id = config.WECHAT_APP_ID
         self.app_secret = config.WECHAT_APP_SECRET
-        self.access_token = None
-        self.token_expires_at = 0
-        self._token_lock = threading.Lock()
+        
+        # access_token 由所有worker共享，后台提前刷新
+        self.token_manager = SharedTokenManager(
+            name=f"wechat_{self.app_id}",
+            fetch_token=self._fetch_access_token,
+            store_dir=config.TOKEN_STORE_DIR,
+            refresh_margin=config.TOKEN_REFRESH_MARGIN
+        )
     
     def get_access_token(self) -> str:
         """
-        获取access_token，带缓存机制和线程安全
+        获取access_token（跨worker共享缓存）
         
         Returns:
             str: access_token
         """
-        # 先检查缓存（无锁快速路径）
-        if self.access_token and time.time() < self.token_expires_at:
-            return self.access_token
+        return self.token_manager.get_token()
+    
+    def _fetch_access_token(self):
+        """
+        请求新的access_token
         
-        # 需要刷新token时加锁
-        with self._token_lock:
-            # 双重检查，避免重复请求
-            if self.access_token and time.time() < self.token_expires_at:
-                return self.access_token
-            
-            # 请求新的access_token
-            url = "https://api.weixin.qq.com/cgi-bin/token"
-            params = {
-                'grant_type': 'client_credential',
-                'appid': self.app_id,
-                'secret': self.app_secret
-            }
+        Returns:
+            tuple: (access_token, expires_in)
+        """
+        url = "https://api.weixin.qq.com/cgi-bin/token"
+        params = {
+            'grant_type': 'client_credential',
+            'appid': self.app_id,
+            'secret': self.app_secret
+        }
+        
+        try:
+            response = requests.get(url, params=params, timeout=10)
+            response.raise_for_status()
+            data = response.json()
             
-            try:
-                response = requests.get(url, params=params, timeout=10)
-                response.raise_for_status()
-                data = response.json()
-                
-                if 'access_token' not in data:
-                    error_msg = data.get('errmsg', '未知错误')
-                    raise Exception(f"获取access_token失败: {error_msg}")
-                
-                self.access_token = data['access_token']
-                # 提前5分钟过期，避免边界问题
-                self.token_expires_at = time.time() + data['expires_in'] - 300
-                
-                logger.info("成功获取access_token")
-                return self.access_token
-                
-            except Exception as e:
-                logger.error(f"获取access_token异常: {str(e)}")
-                raise
+            if 'access_token' not in data:
+                error_msg = data.get('errmsg', '未知错误')
+                raise Exception(f"获取access_token失败: {error_msg}")
+            
+            logger.info("成功获取access_token")
+            return data['access_token'], data['expires_in']
+            
+        except Exception as e:
+            logger.error(f"获取access_token异常: {str(e)}")
+            raise
+    
+    def _request(self, method: str, url: str, params: dict = None, **kwargs):
+        """带access_token的接口请求，token无效时刷新一次并重试（见 token_store.request_with_token）"""
+        return request_with_token(requests, self.token_manager, method, url, params, **kwargs)
     
     def download_media(self, media_id: str, save_path: str) -> str:
         """
@@ -72,15 +74,13 @@ class WeChatAPI:
         Returns:
             str: 保存的文件路径
         """
-        access_token = self.get_access_token()
         url = "https://api.weixin.qq.com/cgi-bin/media/get"
         params = {
-            'access_token': access_token,
             'media_id': media_id
         }
         
         try:
-            response = requests.get(url, params=params, timeout=30, stream=True)
+            response = self._request('GET', url, params=params, timeout=30, stream=True)
             response.raise_for_status()
             
             # 检查是否是错误响应
@@ -112,17 +112,15 @@ class WeChatAPI:
         Returns:
             str: media_id
         """
-        access_token = self.get_access_token()
         url = "https://api.weixin.qq.com/cgi-bin/media/upload"
         params = {
-            'access_token': access_token,
             'type': media_type
         }
         
         try:
             with open(file_path, 'rb') as f:
                 files = {'media': f}
-                response = requests.post(url, params=params, files=files, timeout=60)
+                response = self._request('POST', url, params=params, files=files, timeout=60)
                 response.raise_for_status()
                 data = response.json()
             
@@ -151,8 +149,7 @@ class WeChatAPI:
         Returns:
             bool: 是否发送成功
         """
-        access_token = self.get_access_token()
-        url = f"https://api.weixin.qq.com/cgi-bin/message/custom/send?access_token={access_token}"
+        url = "https://api.weixin.qq.com/cgi-bin/message/custom/send"
         
         data = {
             "touser": to_user,
@@ -163,7 +160,7 @@ class WeChatAPI:
         }
         
         try:
-            response = requests.post(url, json=data, timeout=10)
+            response = self._request('POST', url, json=data, timeout=10)
             response.raise_for_status()
             result = response.json()
             
@@ -190,8 +187,7 @@ class WeChatAPI:
         Returns:
             bool: 是否发送成功
         """
-        access_token = self.get_access_token()
-        url = f"https://api.weixin.qq.com/cgi-bin/message/custom/send?access_token={access_token}"
+        url = "https://api.weixin.qq.com/cgi-bin/message/custom/send"
         
         data = {
             "touser": to_user,
@@ -202,7 +198,7 @@ class WeChatAPI:
         }
         
         try:
-            response = requests.post(url, json=data, timeout=10)
+            response = self._request('POST', url, json=data, timeout=10)
             response.raise_for_status()
             result = response.json()
             
@@ -14,10 +14,11 @@ import time
 import struct
 import socket
 import logging
-import threading
 import requests
 from Crypto.Cipher import AES
 from config import config
+from token_store import SharedTokenManager, request_with_token
+from preflight import PreflightError, save_stream
 
 logger = logging.getLogger(__name__)
 
@@ -125,9 +126,15 @@ class WeComAPI:
         self.corp_id = config.WECOM_CORP_ID
         self.agent_id = config.WECOM_AGENT_ID
         self.secret = config.WECOM_SECRET
-        self.access_token = None
-        self.token_expires_at = 0
-        self._token_lock = threading.Lock()
+        self.api_base = config.WECOM_API_BASE.rstrip('/')
+        
+        # access_token 由所有worker共享，后台提前刷新
+        self.token_manager = SharedTokenManager(
+            name=f"wecom_{self.corp_id}_{self.agent_id}",
+            fetch_token=self._fetch_access_token,
+            store_dir=config.TOKEN_STORE_DIR,
+            refresh_margin=config.TOKEN_REFRESH_MARGIN
+        )
         
         # 消息加解密工具
         self.crypto = WXBizMsgCrypt(
@@ -136,50 +143,60 @@ class WeComAPI:
             corp_id=self.corp_id
         )
     
+    @property
+    def configured(self) -> bool:
+        """是否配置了企业微信应用凭据"""
+        return bool(self.corp_id and self.secret)
+    
     def get_access_token(self) -> str:
-        """获取access_token，带缓存机制和线程安全"""
-        if self.access_token and time.time() < self.token_expires_at:
-            return self.access_token
+        """获取access_token（跨worker共享缓存）"""
+        return self.token_manager.get_token()
+    
+    def _fetch_access_token(self):
+        """请求新的access_token，返回 (access_token, expires_in)"""
+        url = f"{self.api_base}/cgi-bin/gettoken"
+        params = {
+            'corpid': self.corp_id,
+            'corpsecret': self.secret
+        }
         
-        with self._token_lock:
-            if self.access_token and time.time() < self.token_expires_at:
-                return self.access_token
+        try:
+            response = requests.get(url, params=params, timeout=10)
+            response.raise_for_status()
+            data = response.json()
             
-            url = "https://qyapi.weixin.qq.com/cgi-bin/gettoken"
-            params = {
-                'corpid': self.corp_id,
-                'corpsecret': self.secret
-            }
+            if data.get('errcode', 0) != 0:
+                raise Exception(f"获取access_token失败: {data.get('errmsg')}")
             
-            try:
-                response = requests.get(url, params=params, timeout=10)
-                response.raise_for_status()
-                data = response.json()
-                
-                if data.get('errcode', 0) != 0:
-                    raise Exception(f"获取access_token失败: {data.get('errmsg')}")
-                
-                self.access_token = data['access_token']
-                self.token_expires_at = time.time() + data['expires_in'] - 300
-                
-                logger.info("成功获取企业微信access_token")
-                return self.access_token
-                
-            except Exception as e:
-                logger.error(f"获取access_token异常: {str(e)}")
-                raise
+            logger.info("成功获取企业微信access_token")
+            return data['access_token'], data['expires_in']
+            
+        except Exception as e:
+            logger.error(f"获取access_token异常: {str(e)}")
+            raise
+    
+    def _request(self, method: str, path: str, params: dict = None, **kwargs):
+        """带access_token的接口请求，token无效时刷新一次并重试（见 token_store.request_with_token）"""
+        return request_with_token(requests, self.token_manager, method, f"{self.api_base}{path}", params, **kwargs)
     
-    def download_media(self, media_id: str, save_path: str) -> str:
-        """下载媒体文件"""
-        access_token = self.get_access_token()
-        url = "https://qyapi.weixin.qq.com/cgi-bin/media/get"
+    def download_media(self, media_id: str, save_path: str, max_size: int = None) -> str:
+        """
+        下载媒体文件
+        
+        Args:
+            media_id: 媒体文件ID
+            save_path: 保存路径
+            max_size: 大小上限，默认 config.MAX_FILE_SIZE，超过时中止下载
+        
+        Raises:
+            PreflightError: 文件超过大小上限
+        """
         params = {
-            'access_token': access_token,
             'media_id': media_id
         }
         
         try:
-            response = requests.get(url, params=params, timeout=60, stream=True)
+            response = self._request('GET', '/cgi-bin/media/get', params=params, timeout=60, stream=True)
             
             # 检查是否是错误响应
             content_type = response.headers.get('Content-Type', '')
@@ -187,10 +204,16 @@ class WeComAPI:
                 error_data = response.json()
                 raise Exception(f"下载失败: {error_data.get('errmsg', '未知错误')}")
             
-            # 保存文件
-            with open(save_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+            # 声明的长度已超过上限时不再下载
+            max_size = max_size or config.MAX_FILE_SIZE
+            content_length = int(response.headers.get('Content-Length') or 0)
+            if content_length > max_size:
+                response.close()
+                raise PreflightError(f"文件超过大小限制({max_size // (1024 * 1024)}MB)", 'too_large')
+            
+            # 流式保存，边下载边检查大小
+            response.raw.decode_content = True
+            save_stream(response.raw, save_path, max_size=max_size)
             
             logger.info(f"文件下载成功: {save_path}")
             return save_path
@@ -201,17 +224,14 @@ class WeComAPI:
     
     def upload_media(self, file_path: str, media_type: str = 'file') -> str:
         """上传临时素材"""
-        access_token = self.get_access_token()
-        url = "https://qyapi.weixin.qq.com/cgi-bin/media/upload"
         params = {
-            'access_token': access_token,
             'type': media_type
         }
         
         try:
             with open(file_path, 'rb') as f:
                 files = {'media': f}
-                response = requests.post(url, params=params, files=files, timeout=120)
+                response = self._request('POST', '/cgi-bin/media/upload', params=params, files=files, timeout=120)
                 response.raise_for_status()
                 data = response.json()
             
@@ -228,9 +248,6 @@ class WeComAPI:
     
     def send_file_message(self, to_user: str, media_id: str) -> bool:
         """发送文件消息"""
-        access_token = self.get_access_token()
-        url = f"https://qyapi.weixin.qq.com/cgi-bin/message/send?access_token={access_token}"
-        
         data = {
             "touser": to_user,
             "msgtype": "file",
@@ -241,7 +258,7 @@ class WeComAPI:
         }
         
         try:
-            response = requests.post(url, json=data, timeout=10)
+            response = self._request('POST', '/cgi-bin/message/send', json=data, timeout=10)
             response.raise_for_status()
             result = response.json()
             
@@ -258,9 +275,6 @@ class WeComAPI:
     
     def send_text_message(self, to_user: str, content: str) -> bool:
         """发送文本消息"""
-        access_token = self.get_access_token()
-        url = f"https://qyapi.weixin.qq.com/cgi-bin/message/send?access_token={access_token}"
-        
         data = {
             "touser": to_user,
             "msgtype": "text",
@@ -271,7 +285,7 @@ class WeComAPI:
         }
         
         try:
-            response = requests.post(url, json=data, timeout=10)
+            response = self._request('POST', '/cgi-bin/message/send', json=data, timeout=10)
             response.raise_for_status()
             result = response.json()
             
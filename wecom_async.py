@@ -0,0 +1,295 @@
+"""
+企业微信 API 与文件处理流水线（asyncio 版本）
+
+同步流水线（wecom_pipeline.py）用固定数量的线程执行下载、转换、上传，
+线程大部分时间阻塞在 qyapi.weixin.qq.com 的网络请求上。asyncio 模式下：
+
+- 下载/上传/发送消息使用 httpx 异步请求，等待网络期间不占线程
+- 哈希、预检等阻塞的文件操作交给有界线程池
+- 转换通过 AsyncConverter 按后台优先级排队
+
+每个文件一个协程，同时处理的文件数上限为 max_jobs，超出时回复用户稍后再发。
+access_token 仍由 WeComAPI 的共享 token 管理器提供（跨 worker 共享、后台刷新）。
+"""
+
+import os
+import time
+import asyncio
+import logging
+from pathlib import Path
+
+import httpx
+
+from config import config
+from metrics import metrics
+from media_cache import MediaCache, file_sha256
+from preflight import PreflightError, inspect_file
+from scheduler import PRIORITY_BACKGROUND
+from token_store import is_token_error
+from tracing import tracer
+from async_converter import run_blocking
+from wecom_pipeline import PipelineJob, ERROR_HINT
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncWeComAPI:
+    """
+    企业微信 API 的异步客户端
+
+    Args:
+        api: 同步的 WeComAPI（提供凭据、共享 token 管理器和消息加解密）
+        executor: 运行阻塞操作（冷启动时获取 token）的线程池
+    """
+
+    def __init__(self, api, executor):
+        self.api = api
+        self.executor = executor
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=60)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _send(self, method: str, path: str, params: dict = None, stream: bool = False, **kwargs):
+        """
+        带access_token的接口请求
+
+        接口返回token无效时刷新一次token并重试（与 WeComAPI._request 相同）。
+        """
+        url = f"{self.api.api_base}{path}"
+        access_token = await run_blocking(self.executor, self.api.get_access_token)
+
+        for attempt in range(2):
+            # 上传的文件需要从头发送
+            for file_obj in (kwargs.get('files') or {}).values():
+                if hasattr(file_obj, 'seek'):
+                    file_obj.seek(0)
+            request = self.client.build_request(
+                method, url, params={**(params or {}), 'access_token': access_token}, **kwargs
+            )
+            response = await self.client.send(request, stream=stream)
+            if attempt == 0 and 'application/json' in response.headers.get('Content-Type', ''):
+                await response.aread()
+                try:
+                    data = response.json()
+                except ValueError:
+                    data = None
+                if is_token_error(data):
+                    await response.aclose()
+                    access_token = await run_blocking(
+                        self.executor, self.api.token_manager.invalidate, access_token
+                    )
+                    continue
+            return response
+
+    async def download_media(self, media_id: str, save_path: str, max_size: int = None) -> str:
+        """
+        流式下载媒体文件，边下载边检查大小
+
+        Raises:
+            PreflightError: 文件超过大小上限
+        """
+        max_size = max_size or config.MAX_FILE_SIZE
+        too_large = PreflightError(f"文件超过大小限制({max_size // (1024 * 1024)}MB)", 'too_large')
+        response = await self._send('GET', '/cgi-bin/media/get', params={'media_id': media_id}, stream=True)
+        try:
+            if 'application/json' in response.headers.get('Content-Type', ''):
+                await response.aread()
+                raise Exception(f"下载失败: {response.json().get('errmsg', '未知错误')}")
+
+            if int(response.headers.get('Content-Length') or 0) > max_size:
+                raise too_large
+
+            size = 0
+            try:
+                with open(save_path, 'wb') as f:
+                    async for chunk in response.aiter_bytes(1024 * 1024):
+                        size += len(chunk)
+                        if size > max_size:
+                            raise too_large
+                        f.write(chunk)
+            except PreflightError:
+                Path(save_path).unlink(missing_ok=True)
+                raise
+        except Exception as e:
+            logger.error(f"下载媒体文件异常: {str(e)}")
+            raise
+        finally:
+            await response.aclose()
+
+        logger.info(f"文件下载成功: {save_path}")
+        return save_path
+
+    async def upload_media(self, file_path: str, media_type: str = 'file') -> str:
+        """上传临时素材"""
+        with open(file_path, 'rb') as f:
+            response = await self._send(
+                'POST', '/cgi-bin/media/upload', params={'type': media_type},
+                files={'media': f}, timeout=120
+            )
+            response.raise_for_status()
+            data = response.json()
+
+        if data.get('errcode', 0) != 0:
+            raise Exception(f"上传失败: {data.get('errmsg', '未知错误')}")
+
+        media_id = data['media_id']
+        logger.info(f"文件上传成功: {media_id}")
+        return media_id
+
+    async def _send_message(self, data: dict) -> bool:
+        try:
+            response = await self._send('POST', '/cgi-bin/message/send', json=data, timeout=10)
+            response.raise_for_status()
+            result = response.json()
+        except Exception as e:
+            logger.error(f"发送消息异常: {str(e)}")
+            return False
+
+        if result.get('errcode', 0) != 0:
+            logger.error(f"发送消息失败: {result.get('errmsg')}")
+            return False
+        logger.info(f"{data['msgtype']}消息发送成功: to={data['touser']}")
+        return True
+
+    async def send_file_message(self, to_user: str, media_id: str) -> bool:
+        """发送文件消息"""
+        return await self._send_message({
+            "touser": to_user,
+            "msgtype": "file",
+            "agentid": int(self.api.agent_id),
+            "file": {"media_id": media_id}
+        })
+
+    async def send_text_message(self, to_user: str, content: str) -> bool:
+        """发送文本消息"""
+        return await self._send_message({
+            "touser": to_user,
+            "msgtype": "text",
+            "agentid": int(self.api.agent_id),
+            "text": {"content": content}
+        })
+
+
+class AsyncWeComPipeline:
+    """
+    每个文件一个协程：下载 -> 转换 -> 上传 -> 发送
+
+    Args:
+        wecom_api: AsyncWeComAPI
+        converter: AsyncConverter
+        executor: 运行哈希、预检等阻塞文件操作的线程池
+        max_jobs: 同时处理的文件数上限
+    """
+
+    def __init__(self, wecom_api: AsyncWeComAPI, converter, executor, max_jobs: int = None,
+                 media_cache: MediaCache = None):
+        self.wecom_api = wecom_api
+        self.converter = converter
+        self.executor = executor
+        self.max_jobs = max_jobs or config.ASGI_WECOM_MAX_JOBS
+        self.media_cache = media_cache or MediaCache(config.MEDIA_CACHE_DIR)
+        self._tasks = set()
+
+    def submit(self, from_user: str, media_id: str, file_name: str) -> bool:
+        """
+        提交一个文件处理任务（需要在事件循环中调用，不阻塞）
+
+        Returns:
+            bool: 处理中的文件数已达上限时返回False
+        """
+        if len(self._tasks) >= self.max_jobs:
+            metrics.inc('wecom_pipeline_jobs_total', stage='submit', outcome='rejected')
+            return False
+        job = PipelineJob(from_user, media_id, file_name)
+        task = asyncio.get_running_loop().create_task(self._process(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._job_done)
+        metrics.set_gauge('wecom_async_jobs', len(self._tasks))
+        metrics.inc('wecom_pipeline_jobs_total', stage='submit', outcome='accepted')
+        return True
+
+    def stats(self) -> dict:
+        return {'running': len(self._tasks), 'max_jobs': self.max_jobs}
+
+    def _job_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        metrics.set_gauge('wecom_async_jobs', len(self._tasks))
+
+    async def _process(self, job: PipelineJob):
+        stage = 'download'
+        try:
+            with tracer.span('wecom.download', parent=job.trace_context):
+                await self._download(job)
+            metrics.inc('wecom_pipeline_jobs_total', stage='download', outcome='success')
+
+            # 同一文档的PDF已上传过且素材仍有效：跳过转换和上传，直接发送
+            job.cached_media_id = await run_blocking(self.executor, self.media_cache.get, job.content_hash)
+            if job.cached_media_id:
+                metrics.inc('wecom_media_cache_total', outcome='hit')
+                if await self.wecom_api.send_file_message(job.from_user, job.cached_media_id):
+                    metrics.inc('wecom_pipeline_jobs_total', stage='deliver', outcome='success')
+                    metrics.observe('wecom_pipeline_total_seconds', time.time() - job.created_at)
+                    return
+                # 缓存的素材可能已失效：丢弃缓存，重新转换并上传
+                logger.warning(f"缓存的media_id发送失败，重新转换: {job.cached_media_id}")
+                metrics.inc('wecom_media_cache_total', outcome='stale')
+                await run_blocking(self.executor, self.media_cache.invalidate, job.content_hash)
+            else:
+                metrics.inc('wecom_media_cache_total', outcome='miss')
+
+            stage = 'convert'
+            with tracer.span('wecom.convert', parent=job.trace_context):
+                # 用户已收到"正在转换"的回复，结果稍后推送：按后台优先级调度
+                job.output_pdf = await self.converter.convert_to_pdf(
+                    job.input_file, preflight=job.preflight, priority=PRIORITY_BACKGROUND
+                )
+            metrics.inc('wecom_pipeline_jobs_total', stage='convert', outcome='success')
+
+            stage = 'deliver'
+            with tracer.span('wecom.deliver', parent=job.trace_context):
+                success = await self._deliver(job)
+            metrics.inc('wecom_pipeline_jobs_total', stage='deliver', outcome='success' if success else 'failure')
+            metrics.observe('wecom_pipeline_total_seconds', time.time() - job.created_at)
+        except Exception as e:
+            logger.error(f"处理文档失败[{stage}]: {str(e)}")
+            outcome = 'rejected' if isinstance(e, PreflightError) else 'failure'
+            metrics.inc('wecom_pipeline_jobs_total', stage=stage, outcome=outcome)
+            await self.wecom_api.send_text_message(job.from_user, f"❌ 转换失败: {str(e)}{ERROR_HINT}")
+        finally:
+            self._cleanup(job)
+
+    async def _download(self, job: PipelineJob):
+        file_ext = Path(job.file_name).suffix or '.docx'  # 默认扩展名
+        timestamp_ms = int(time.time() * 1000)
+        job.input_file = os.path.join(config.TEMP_DIR, f"input_{timestamp_ms}_{id(job)}{file_ext}")
+        await self.wecom_api.download_media(job.media_id, job.input_file, max_size=config.MAX_FILE_SIZE)
+        job.content_hash = await run_blocking(self.executor, file_sha256, job.input_file)
+        # 加密/损坏/伪装的文件不进入转换队列
+        job.preflight = await run_blocking(self.executor, inspect_file, job.input_file)
+
+    async def _deliver(self, job: PipelineJob) -> bool:
+        """上传PDF到企业微信并发送给用户"""
+        pdf_media_id = await self.wecom_api.upload_media(job.output_pdf, 'file')
+        if job.content_hash:
+            await run_blocking(self.executor, self.media_cache.put, job.content_hash, pdf_media_id)
+        success = await self.wecom_api.send_file_message(job.from_user, pdf_media_id)
+        if not success:
+            await self.wecom_api.send_text_message(job.from_user, "⚠️ PDF生成成功但发送失败，请稍后重试。")
+        return success
+
+    def _cleanup(self, job: PipelineJob):
+        if job.input_file:
+            self.converter.converter.cleanup_file(job.input_file)
+            job.input_file = None
+        if job.output_pdf:
+            self.converter.converter.cleanup_file(job.output_pdf)
+            job.output_pdf = None
@@ -0,0 +1,193 @@
+"""
+企业微信回调消息处理
+
+Flask（app.py）和 asyncio（asgi_app.py）两种服务模式共用：解密回调消息、
+去重、按消息类型生成被动回复，文件消息交给调用方提供的 submit 函数处理。
+这里只做CPU上的解密和XML解析，不发起任何网络请求。
+"""
+
+import math
+import time
+import logging
+import xml.etree.ElementTree as ET
+
+logger = logging.getLogger(__name__)
+
+# 用于防止重复处理的消息缓存
+processed_messages = {}
+MESSAGE_CACHE_TTL = 60  # 缓存60秒
+
+
+def cleanup_message_cache():
+    """清理过期的消息缓存"""
+    current_time = time.time()
+    expired_keys = [
+        k for k, v in processed_messages.items() 
+        if current_time - v > MESSAGE_CACHE_TTL
+    ]
+    for key in expired_keys:
+        del processed_messages[key]
+
+
+def create_text_response(to_user: str, from_user: str, content: str) -> str:
+    """创建文本消息回复XML（明文，需要后续加密）"""
+    return f"""<xml>
+<ToUserName><![CDATA[{to_user}]]></ToUserName>
+<FromUserName><![CDATA[{from_user}]]></FromUserName>
+<CreateTime>{int(time.time())}</CreateTime>
+<MsgType><![CDATA[text]]></MsgType>
+<Content><![CDATA[{content}]]></Content>
+</xml>"""
+
+
+def throttled_text(wait: float) -> str:
+    """被限流时的回复（文件不会转换，需要用户稍后重新发送）"""
+    wait_text = f"{math.ceil(wait)}秒" if wait < 60 else f"{math.ceil(wait / 60)}分钟"
+    return f"⏳ 您发送文件太频繁了，这个文件没有转换\n请{wait_text}后重新发送"
+
+
+def handle_message(wecom_api, body: bytes, msg_signature: str, timestamp: str, nonce: str, submit,
+                   throttle=None) -> str:
+    """
+    处理一条回调消息（POST）
+    
+    Args:
+        wecom_api: 提供 crypto 的企业微信客户端
+        body: 原始请求体（加密的XML）
+        submit: submit(from_user, media_id, file_name) -> bool，提交文件转换任务，队列满时返回False
+        throttle: 可选，throttle(from_user) -> float，按用户限流，返回需要等待的秒数（0 表示放行）
+    
+    Returns:
+        str: 加密后的被动回复XML，无需回复时返回 'success'
+    """
+    try:
+        xml_data = body.decode('utf-8')
+        
+        # 解析外层XML获取加密内容
+        root = ET.fromstring(xml_data)
+        encrypt_elem = root.find('Encrypt')
+        if encrypt_elem is None:
+            logger.error("[ERROR] 消息中没有Encrypt字段")
+            return 'success'
+        
+        encrypt_msg = encrypt_elem.text
+        
+        # 解密消息
+        decrypted_xml = wecom_api.crypto.decrypt_message(msg_signature, timestamp, nonce, encrypt_msg)
+        
+        # ========== 关键：记录解密后的完整XML ==========
+        logger.info(f"[DEBUG] 解密后完整XML:\n{decrypted_xml}")
+        
+        # 解析解密后的XML
+        msg_root = ET.fromstring(decrypted_xml)
+        
+        # 获取消息类型
+        msg_type_elem = msg_root.find('MsgType')
+        msg_type = msg_type_elem.text if msg_type_elem is not None else 'unknown'
+        
+        logger.info(f"[DEBUG] >>>>>> 消息类型: {msg_type} <<<<<<")
+        
+        from_user = msg_root.find('FromUserName').text  # 用户的userid
+        to_user = msg_root.find('ToUserName').text      # 企业的corpid
+        msg_id = msg_root.find('MsgId')
+        msg_id = msg_id.text if msg_id is not None else str(time.time())
+        
+        logger.info(f"[DEBUG] FromUser={from_user}, ToUser={to_user}, MsgId={msg_id}")
+        
+        # 清理过期缓存
+        cleanup_message_cache()
+        
+        # 检查是否重复消息
+        if msg_id in processed_messages:
+            logger.info(f"[SKIP] 跳过重复消息: {msg_id}")
+            return 'success'
+        
+        # 标记消息已处理
+        processed_messages[msg_id] = time.time()
+        
+        # ========== 处理文件消息 ==========
+        if msg_type == 'file':
+            logger.info("[FILE] 检测到文件类型消息，开始处理...")
+            
+            media_id = msg_root.find('MediaId').text
+            
+            # 企业微信file消息可能用不同的字段名：FileName 或 Title
+            file_name = None
+            for field_name in ['FileName', 'Title', 'Name']:
+                elem = msg_root.find(field_name)
+                if elem is not None and elem.text:
+                    file_name = elem.text
+                    logger.info(f"[FILE] 从字段 {field_name} 获取文件名: {file_name}")
+                    break
+            
+            if not file_name:
+                file_name = 'document.docx'
+                logger.info(f"[FILE] 未找到文件名字段，使用默认: {file_name}")
+            
+            logger.info(f"[FILE] 收到文件: {file_name}, MediaId: {media_id}")
+            
+            # 发送过于频繁的用户立即收到提示，不进入流水线排队
+            wait = throttle(from_user) if throttle else 0
+            # 提交到处理流水线（由于企业微信要求5秒内回复，转换结果通过应用消息接口异步发送）
+            if wait:
+                reply_text = throttled_text(wait)
+            elif submit(from_user, media_id, file_name):
+                reply_text = "📄 正在转换您的文档，请稍候...\n预计需要5-15秒"
+            else:
+                reply_text = "⏳ 当前排队文件较多，请稍后再发送"
+            
+            # 创建回复消息
+            reply_msg = create_text_response(from_user, to_user, reply_text)
+            # 加密回复
+            encrypted_reply = wecom_api.crypto.encrypt_message(reply_msg, nonce, timestamp)
+            logger.info("[FILE] 已返回处理中提示，任务已加入流水线")
+            return encrypted_reply
+        
+        # ========== 处理文本消息 ==========
+        elif msg_type == 'text':
+            content = msg_root.find('Content').text or ''
+            logger.info(f"[TEXT] 收到文本消息: {content}")
+            
+            if content.strip() in ['帮助', 'help', '?', '？', 'h']:
+                help_text = """📄 作业排版助手使用说明
+
+1️⃣ 直接发送Word/Excel/PPT文件
+2️⃣ 等待5-15秒，自动收到PDF
+3️⃣ 转发PDF给打印机
+
+✅ 支持格式: Word, Excel, PowerPoint
+⏱️ 转换时间: 通常5-15秒
+📱 完美还原Windows排版！"""
+                reply_msg = create_text_response(from_user, to_user, help_text)
+            else:
+                reply_msg = create_text_response(
+                    from_user, to_user, 
+                    "请发送Word/Excel文件，我会帮您转换为PDF 📄\n\n发送「帮助」查看使用说明"
+                )
+            
+            encrypted_reply = wecom_api.crypto.encrypt_message(reply_msg, nonce, timestamp)
+            return encrypted_reply
+        
+        # ========== 处理图片消息（添加日志） ==========
+        elif msg_type == 'image':
+            logger.info(f"[IMAGE] 收到图片消息，MediaId: {msg_root.find('MediaId').text if msg_root.find('MediaId') is not None else 'N/A'}")
+            reply_msg = create_text_response(
+                from_user, to_user, 
+                "请发送Word或Excel文件，我会帮您转换为PDF 📄\n\n（暂不支持图片转换）"
+            )
+            encrypted_reply = wecom_api.crypto.encrypt_message(reply_msg, nonce, timestamp)
+            return encrypted_reply
+        
+        # ========== 其他消息类型 ==========
+        else:
+            logger.info(f"[OTHER] 收到其他类型消息: {msg_type}")
+            reply_msg = create_text_response(
+                from_user, to_user, 
+                "请发送Word或Excel文件，我会帮您转换为PDF 📄"
+            )
+            encrypted_reply = wecom_api.crypto.encrypt_message(reply_msg, nonce, timestamp)
+            return encrypted_reply
+            
+    except Exception as e:
+        logger.error(f"[ERROR] 处理消息异常: {str(e)}", exc_info=True)
+        return 'success'
@@ -0,0 +1,256 @@
+"""
+企业微信文件处理流水线
+
+原先每个文件一个线程，依次执行 下载 -> 转换 -> 上传 -> 发送，线程有一半
+时间阻塞在 qyapi.weixin.qq.com 的网络请求上。这里拆成三个阶段：
+
+    download（网络I/O线程池）-> convert（转换线程池）-> deliver（网络I/O线程池）
+
+阶段之间用有界队列连接，转换线程只做转换，不会被网络请求占住。
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+from pathlib import Path
+from config import config
+from metrics import metrics
+from media_cache import MediaCache, file_sha256
+from preflight import PreflightError, inspect_file
+from scheduler import PRIORITY_BACKGROUND
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+ERROR_HINT = "\n\n支持格式: Word(.doc/.docx), Excel(.xls/.xlsx), PPT(.ppt/.pptx)"
+
+
+class PipelineJob:
+    """流水线中的一个文件处理任务"""
+
+    def __init__(self, from_user: str, media_id: str, file_name: str):
+        self.from_user = from_user
+        self.media_id = media_id
+        self.file_name = file_name
+        self.input_file = None
+        self.output_pdf = None
+        self.content_hash = None
+        self.preflight = None
+        self.cached_media_id = None
+        self.error = None
+        self.created_at = time.time()
+        self.enqueued_at = self.created_at
+        # 提交时（回调请求中）的追踪上下文，各阶段的 span 都挂在它下面
+        self.trace_context = tracer.current_context()
+
+
+class Stage:
+    """流水线阶段：一个有界队列 + 固定数量的工作线程"""
+
+    def __init__(self, name: str, handler, workers: int, maxsize: int):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.busy = 0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        # 线程在首次使用时才启动，fork出来的worker进程也能正常工作
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._work, name=f'wecom-{self.name}-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def put(self, job: PipelineJob, block: bool = True) -> bool:
+        job.enqueued_at = time.time()
+        try:
+            self.queue.put(job, block=block)
+        except queue.Full:
+            return False
+        self._report()
+        return True
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            start = time.time()
+            metrics.observe('wecom_pipeline_wait_seconds', start - job.enqueued_at, stage=self.name)
+            tracer.record(f'wecom.queue.{self.name}', job.enqueued_at, start, parent=job.trace_context)
+            self._set_busy(+1)
+            try:
+                with tracer.span(f'wecom.{self.name}', parent=job.trace_context):
+                    self.handler(job)
+            except Exception as e:
+                logger.error(f"流水线阶段[{self.name}]未处理的异常: {str(e)}", exc_info=True)
+            finally:
+                metrics.observe('wecom_pipeline_stage_seconds', time.time() - start, stage=self.name)
+                self._set_busy(-1)
+                self.queue.task_done()
+
+    def _set_busy(self, delta: int):
+        with self._lock:
+            self.busy += delta
+        self._report()
+
+    def _report(self):
+        metrics.set_gauge('wecom_pipeline_queue_depth', self.queue.qsize(), stage=self.name)
+        metrics.set_gauge('wecom_pipeline_busy_workers', self.busy, stage=self.name)
+
+    def stats(self) -> dict:
+        return {
+            'queued': self.queue.qsize(),
+            'busy': self.busy,
+            'workers': self.workers,
+        }
+
+
+class WeComPipeline:
+    """企业微信文件处理流水线：下载 -> 转换 -> 上传并发送"""
+
+    def __init__(self, wecom_api, converter, io_workers: int = None,
+                 convert_workers: int = None, queue_size: int = None, media_cache: MediaCache = None):
+        self.wecom_api = wecom_api
+        self.converter = converter
+        self.media_cache = media_cache or MediaCache(config.MEDIA_CACHE_DIR)
+        io_workers = io_workers or config.WECOM_IO_WORKERS
+        convert_workers = convert_workers or config.WECOM_CONVERT_WORKERS
+        queue_size = queue_size or config.WECOM_QUEUE_SIZE
+
+        self.download_stage = Stage('download', self._download, io_workers, queue_size)
+        self.convert_stage = Stage('convert', self._convert, convert_workers, queue_size)
+        self.deliver_stage = Stage('deliver', self._deliver, io_workers, queue_size)
+        self.stages = [self.download_stage, self.convert_stage, self.deliver_stage]
+
+    def submit(self, from_user: str, media_id: str, file_name: str) -> bool:
+        """
+        提交一个文件处理任务（不阻塞，供回调接口在5秒内返回）
+
+        Returns:
+            bool: 队列已满时返回False
+        """
+        for stage in self.stages:
+            stage.start()
+        job = PipelineJob(from_user, media_id, file_name)
+        accepted = self.download_stage.put(job, block=False)
+        metrics.inc('wecom_pipeline_jobs_total', stage='submit', outcome='accepted' if accepted else 'rejected')
+        return accepted
+
+    def stats(self) -> dict:
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    def _download(self, job: PipelineJob):
+        try:
+            # 确定文件扩展名
+            file_ext = Path(job.file_name).suffix
+            if not file_ext:
+                file_ext = '.docx'  # 默认扩展名
+
+            timestamp_ms = int(time.time() * 1000)
+            job.input_file = os.path.join(
+                config.TEMP_DIR, f"input_{timestamp_ms}_{threading.get_ident()}{file_ext}"
+            )
+            self.wecom_api.download_media(job.media_id, job.input_file, max_size=config.MAX_FILE_SIZE)
+            job.content_hash = file_sha256(job.input_file)
+            # 预检在下载线程完成，加密/损坏/伪装的文件不进入转换队列
+            job.preflight = inspect_file(job.input_file)
+        except Exception as e:
+            self._fail(job, 'download', e)
+            return
+        metrics.inc('wecom_pipeline_jobs_total', stage='download', outcome='success')
+
+        # 同一文档的PDF已上传过且素材仍有效：跳过转换和上传，直接发送
+        job.cached_media_id = self.media_cache.get(job.content_hash)
+        if job.cached_media_id:
+            metrics.inc('wecom_media_cache_total', outcome='hit')
+            self.deliver_stage.put(job)
+            return
+        metrics.inc('wecom_media_cache_total', outcome='miss')
+
+        # 转换队列满时在这里等待（背压），不丢弃已下载的文件
+        self.convert_stage.put(job)
+
+    def _convert(self, job: PipelineJob):
+        try:
+            # 用户已收到"正在转换"的回复，结果稍后推送：按后台优先级调度
+            job.output_pdf = self.converter.convert_to_pdf(
+                job.input_file, preflight=job.preflight, priority=PRIORITY_BACKGROUND
+            )
+        except Exception as e:
+            self._fail(job, 'convert', e)
+            return
+        metrics.inc('wecom_pipeline_jobs_total', stage='convert', outcome='success')
+        self.deliver_stage.put(job)
+
+    def _deliver(self, job: PipelineJob):
+        requeued = False
+        try:
+            if job.error is not None:
+                self._send_error(job)
+                return
+
+            if job.cached_media_id:
+                if self.wecom_api.send_file_message(job.from_user, job.cached_media_id):
+                    metrics.inc('wecom_pipeline_jobs_total', stage='deliver', outcome='success')
+                    metrics.observe('wecom_pipeline_total_seconds', time.time() - job.created_at)
+                    return
+                # 缓存的素材可能已失效：丢弃缓存，回到转换阶段重新生成并上传
+                logger.warning(f"缓存的media_id发送失败，重新转换: {job.cached_media_id}")
+                metrics.inc('wecom_media_cache_total', outcome='stale')
+                self.media_cache.invalidate(job.content_hash)
+                job.cached_media_id = None
+                # 不阻塞等待转换队列，避免与转换线程互相等待
+                if not self.convert_stage.put(job, block=False):
+                    raise Exception("当前排队文件较多，请稍后再发送")
+                requeued = True
+                return
+
+            # 上传PDF到企业微信并发送给用户
+            pdf_media_id = self.wecom_api.upload_media(job.output_pdf, 'file')
+            if job.content_hash:
+                self.media_cache.put(job.content_hash, pdf_media_id)
+            success = self.wecom_api.send_file_message(job.from_user, pdf_media_id)
+
+            if not success:
+                self.wecom_api.send_text_message(
+                    job.from_user,
+                    "⚠️ PDF生成成功但发送失败，请稍后重试。"
+                )
+            metrics.inc('wecom_pipeline_jobs_total', stage='deliver', outcome='success' if success else 'failure')
+            metrics.observe('wecom_pipeline_total_seconds', time.time() - job.created_at)
+        except Exception as e:
+            logger.error(f"处理文档失败: {str(e)}")
+            metrics.inc('wecom_pipeline_jobs_total', stage='deliver', outcome='failure')
+            job.error = e
+            self._send_error(job)
+        finally:
+            if not requeued:
+                self._cleanup(job)
+
+    def _fail(self, job: PipelineJob, stage: str, error: Exception):
+        """某个阶段失败：错误通知交给网络I/O线程发送，不占用转换线程"""
+        logger.error(f"处理文档失败[{stage}]: {str(error)}")
+        outcome = 'rejected' if isinstance(error, PreflightError) else 'failure'
+        metrics.inc('wecom_pipeline_jobs_total', stage=stage, outcome=outcome)
+        job.error = error
+        self.deliver_stage.put(job)
+
+    def _send_error(self, job: PipelineJob):
+        try:
+            self.wecom_api.send_text_message(job.from_user, f"❌ 转换失败: {str(job.error)}{ERROR_HINT}")
+        finally:
+            self._cleanup(job)
+
+    def _cleanup(self, job: PipelineJob):
+        # 清理临时文件
+        if job.input_file:
+            self.converter.cleanup_file(job.input_file)
+            job.input_file = None
+        if job.output_pdf:
+            self.converter.cleanup_file(job.output_pdf)
+            job.output_pdf = None
@@ -15,6 +15,10 @@ Windows文档转换服务 - 使用Microsoft Office或WPS Office COM自动化
 
 安装:
     pip install flask pywin32
+    pip install zstandard  # 可选，支持 zstd 压缩（否则只用 gzip）
+    pip install waitress   # 可选，支持持久连接（否则使用 Flask 开发服务器，每个请求新建连接）
+    并把 tracing.py、profiler.py、http_compression.py、temp_reaper.py 复制到本文件所在目录
+    （请求追踪、采样分析、传输压缩和临时文件回收，只依赖标准库）
 
 运行:
     python windows_converter_service.py
@@ -24,11 +28,20 @@ from flask import Flask, request, send_file, jsonify
 import win32com.client
 import pythoncom
 import os
+import re
 import logging
 import tempfile
+import threading
 import time
+from contextlib import contextmanager
 from pathlib import Path
 from werkzeug.utils import secure_filename
+from tracing import tracer, create_exporter, TRACE_ID_HEADER
+from profiler import SamplingProfiler, ContinuousProfiler, ProfilerBusy, token_matches
+from http_compression import (
+    DecompressMiddleware, compress_file, negotiate, parse_encodings, worth_compressing
+)
+from temp_reaper import TempReaper
 
 # 配置日志
 logging.basicConfig(
@@ -44,12 +57,122 @@ app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB
 TEMP_DIR = Path(tempfile.gettempdir()) / 'office_converter'
 TEMP_DIR.mkdir(exist_ok=True)
 
+# 临时文件回收：响应发送完立即删除，被占用的文件由后台线程重试；
+# 超过 TEMP_MAX_AGE 秒的残留文件（进程崩溃等）在启动时和之后定期清理
+reaper = TempReaper(TEMP_DIR, max_age=float(os.getenv('TEMP_MAX_AGE', '3600')))
+
+# 传输压缩：auto（zstd/gzip）、off，或逗号分隔的格式；小于 COMPRESSION_MIN_SIZE 字节的PDF不压缩。
+# 同样的格式也接受压缩的请求体（Content-Encoding），并在响应头 Accept-Encoding 中声明
+COMPRESSION_ENCODINGS = parse_encodings(os.getenv('COMPRESSION', 'auto'))
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '65536'))
+app.wsgi_app = DecompressMiddleware(app.wsgi_app, COMPRESSION_ENCODINGS)
+
+# 追踪数据导出位置：JSONL 文件路径或收集器 URL，设为空关闭
+TRACE_EXPORT = os.getenv('TRACE_EXPORT', str(TEMP_DIR / 'traces.jsonl'))
+tracer.configure(service='windows-converter', exporter=create_exporter(TRACE_EXPORT))
+
+# 采样分析：/debug/profile 需要 X-Debug-Token 与 DEBUG_TOKEN 一致（未设置时关闭）；
+# PROFILE_CONTINUOUS_DIR 非空时持续低频采样并定期写入该目录
+DEBUG_TOKEN = os.getenv('DEBUG_TOKEN', '')
+profiler = SamplingProfiler(max_seconds=60)
+continuous_profiler = ContinuousProfiler(os.getenv('PROFILE_CONTINUOUS_DIR', ''))
+
 # 支持的文件类型
 WORD_EXTENSIONS = ['.doc', '.docx']
 EXCEL_EXTENSIONS = ['.xls', '.xlsx']
 POWERPOINT_EXTENSIONS = ['.ppt', '.pptx']
 SUPPORTED_EXTENSIONS = WORD_EXTENSIONS + EXCEL_EXTENSIONS + POWERPOINT_EXTENSIONS
 
+# COM 常量
+WD_EXPORT_FORMAT_PDF = 17
+WD_EXPORT_ALL_DOCUMENT = 0
+WD_EXPORT_FROM_TO = 3
+WD_EXPORT_OPTIMIZE_FOR_PRINT = 0
+WD_EXPORT_OPTIMIZE_FOR_ON_SCREEN = 1
+WD_EXPORT_CREATE_NO_BOOKMARKS = 0
+WD_EXPORT_CREATE_HEADING_BOOKMARKS = 1
+XL_TYPE_PDF = 0
+XL_QUALITY_STANDARD = 0
+XL_QUALITY_MINIMUM = 1
+XL_SHEET_HIDDEN = 0
+XL_SHEET_VISIBLE = -1
+PP_FIXED_FORMAT_TYPE_PDF = 2
+PP_FIXED_FORMAT_INTENT_SCREEN = 1
+PP_FIXED_FORMAT_INTENT_PRINT = 2
+PP_SAVE_AS_PDF = 32
+
+# 导出配置（表单字段 profile 选择，默认 EXPORT_PROFILE）:
+#   standard    与原先 SaveAs 导出的内容一致：打印质量、文档属性、结构标记、标题书签
+#   fast_print  最小文件、不导出文档属性/结构标记/书签，只读打开且不修复（不弹出修复提示）
+EXPORT_PROFILES = {
+    'standard': {'minimum_size': False, 'doc_props': True, 'structure_tags': True, 'bookmarks': True,
+                 'read_only': False},
+    'fast_print': {'minimum_size': True, 'doc_props': False, 'structure_tags': False, 'bookmarks': False,
+                   'read_only': True},
+}
+DEFAULT_EXPORT_PROFILE = os.getenv('EXPORT_PROFILE', 'standard')
+if DEFAULT_EXPORT_PROFILE not in EXPORT_PROFILES:
+    raise ValueError(f"EXPORT_PROFILE 必须是 {', '.join(EXPORT_PROFILES)} 之一")
+
+
+def parse_export_options(form, file_ext: str) -> dict:
+    """
+    解析部分转换参数（pages / sheets / print_area）和导出配置（profile）
+
+    Word/Excel 的 ExportAsFixedFormat 只支持一个连续的页码范围，
+    多段范围返回错误，由调用方降级到 LibreOffice。
+
+    Raises:
+        ValueError: 参数错误或当前引擎不支持
+    """
+    options = {}
+
+    ranges = []
+    for item in re.split(r'[,;，]', form.get('pages', '') or ''):
+        item = item.strip()
+        if not item:
+            continue
+        match = re.match(r'^(\d+)\s*(?:-\s*(\d+))?$', item)
+        if not match or int(match.group(1)) < 1 or int(match.group(2) or match.group(1)) < int(match.group(1)):
+            raise ValueError(f"页码格式错误: {item}")
+        ranges.append((int(match.group(1)), int(match.group(2) or match.group(1))))
+    if ranges:
+        if file_ext not in POWERPOINT_EXTENSIONS and len(ranges) > 1:
+            raise ValueError("Word/Excel只支持一个连续的页码范围")
+        options['pages'] = sorted(ranges)
+
+    sheets = [s.strip() for s in re.split(r'[,，]', form.get('sheets', '') or '') if s.strip()]
+    print_area = (form.get('print_area') or '').strip()
+    if (sheets or print_area) and file_ext not in EXCEL_EXTENSIONS:
+        raise ValueError("只有Excel表格支持选择工作表和打印区域")
+    if sheets:
+        options['sheets'] = [int(s) if s.isdigit() else s for s in sheets]
+    if print_area:
+        options['print_area'] = print_area
+
+    profile = (form.get('profile') or '').strip() or DEFAULT_EXPORT_PROFILE
+    if profile not in EXPORT_PROFILES:
+        raise ValueError(f"未知的导出配置: {profile}")
+    options['profile'] = profile
+
+    return options
+
+
+def export_profile(options: dict) -> dict:
+    return EXPORT_PROFILES[(options or {}).get('profile') or DEFAULT_EXPORT_PROFILE]
+
+
+@contextmanager
+def com_phase(name: str, timings: dict = None):
+    """COM 调用的一个阶段：记录 span，并把耗时累加到 timings（响应头 Server-Timing）"""
+    started = time.time()
+    try:
+        with tracer.span(f'com.{name}') as span:
+            yield span
+    finally:
+        if timings is not None:
+            timings[name] = timings.get(name, 0) + time.time() - started
+
 def get_word_application():
     """获取Word或WPS文字应用程序实例"""
     # 优先尝试 MS Word，然后是 WPS 文字
@@ -67,8 +190,8 @@ def get_word_application():
     raise Exception("未找到可用的Word/WPS文字处理应用")
 
 
-def convert_word_to_pdf(input_path: str, output_path: str) -> bool:
-    """使用Word或WPS文字COM转换为PDF"""
+def convert_word_to_pdf(input_path: str, output_path: str, options: dict = None, timings: dict = None) -> bool:
+    """使用Word或WPS文字COM转换为PDF（options['pages'] 为单个连续页码范围，options['profile'] 为导出配置）"""
     word = None
     doc = None
     progid = None
@@ -78,17 +201,49 @@ def convert_word_to_pdf(input_path: str, output_path: str) -> bool:
         pythoncom.CoInitialize()
         
         # 获取可用的Word应用
-        word, progid = get_word_application()
+        with com_phase('dispatch', timings) as span:
+            word, progid = get_word_application()
+            span.set(progid=progid)
         word.Visible = False
         word.DisplayAlerts = 0  # 禁用警告对话框
+        profile = export_profile(options)
         
         # 打开文档
         logger.info(f"使用 {progid} 打开文档: {input_path}")
-        doc = word.Documents.Open(input_path)
+        with com_phase('open', timings):
+            if profile['read_only']:
+                doc = word.Documents.Open(
+                    input_path, ConfirmConversions=False, ReadOnly=True, AddToRecentFiles=False,
+                    Visible=False, OpenAndRepair=False, NoEncodingDialog=True
+                )
+            else:
+                doc = word.Documents.Open(input_path)
         
-        # 导出为PDF (wdFormatPDF = 17, WPS也使用相同的值)
+        # 导出为PDF (wdExportFormatPDF = 17, WPS也使用相同的值)
         logger.info(f"导出PDF: {output_path}")
-        doc.SaveAs(output_path, FileFormat=17)
+        pages = (options or {}).get('pages')
+        page_range = {'Range': WD_EXPORT_FROM_TO, 'From': pages[0][0], 'To': pages[0][1]} if pages else {
+            'Range': WD_EXPORT_ALL_DOCUMENT}
+        with com_phase('export', timings):
+            try:
+                doc.ExportAsFixedFormat(
+                    OutputFileName=output_path, ExportFormat=WD_EXPORT_FORMAT_PDF, OpenAfterExport=False,
+                    OptimizeFor=(WD_EXPORT_OPTIMIZE_FOR_ON_SCREEN if profile['minimum_size']
+                                 else WD_EXPORT_OPTIMIZE_FOR_PRINT),
+                    IncludeDocProps=profile['doc_props'],
+                    CreateBookmarks=(WD_EXPORT_CREATE_HEADING_BOOKMARKS if profile['bookmarks']
+                                     else WD_EXPORT_CREATE_NO_BOOKMARKS),
+                    DocStructureTags=profile['structure_tags'],
+                    **page_range
+                )
+            except Exception as e:
+                # 部分 WPS 版本不支持全部导出参数：退回原先的导出方式
+                logger.warning(f"按导出配置导出失败，使用默认设置: {str(e)}")
+                if pages:
+                    doc.ExportAsFixedFormat(OutputFileName=output_path, ExportFormat=WD_EXPORT_FORMAT_PDF,
+                                            **page_range)
+                else:
+                    doc.SaveAs(output_path, FileFormat=WD_EXPORT_FORMAT_PDF)
         
         logger.info(f"{progid} 转换成功")
         return True
@@ -100,10 +255,11 @@ def convert_word_to_pdf(input_path: str, output_path: str) -> bool:
     finally:
         # 清理资源
         try:
-            if doc:
-                doc.Close(SaveChanges=False)
-            if word:
-                word.Quit()
+            with com_phase('close', timings):
+                if doc:
+                    doc.Close(SaveChanges=False)
+                if word:
+                    word.Quit()
         except:
             pass
         pythoncom.CoUninitialize()
@@ -125,8 +281,16 @@ def get_excel_application():
     raise Exception("未找到可用的Excel/WPS表格应用")
 
 
-def convert_excel_to_pdf(input_path: str, output_path: str) -> bool:
-    """使用Excel或WPS表格COM转换为PDF"""
+def convert_excel_to_pdf(input_path: str, output_path: str, options: dict = None, timings: dict = None) -> bool:
+    """
+    使用Excel或WPS表格COM转换为PDF
+
+    options:
+        sheets: 只导出这些工作表（名称或从1开始的序号），其余工作表临时隐藏
+        print_area: 为导出的工作表设置打印区域
+        pages: 单个连续页码范围
+        profile: 导出配置
+    """
     excel = None
     workbook = None
     progid = None
@@ -134,16 +298,57 @@ def convert_excel_to_pdf(input_path: str, output_path: str) -> bool:
     try:
         pythoncom.CoInitialize()
         
-        excel, progid = get_excel_application()
+        with com_phase('dispatch', timings) as span:
+            excel, progid = get_excel_application()
+            span.set(progid=progid)
         excel.Visible = False
         excel.DisplayAlerts = False
+        profile = export_profile(options)
         
         logger.info(f"使用 {progid} 打开文档: {input_path}")
-        workbook = excel.Workbooks.Open(input_path)
+        with com_phase('open', timings):
+            if profile['read_only']:
+                # 不更新外部链接、忽略“建议只读”、不进入修复模式（xlNormalLoad = 0）
+                workbook = excel.Workbooks.Open(
+                    input_path, UpdateLinks=0, ReadOnly=True, IgnoreReadOnlyRecommended=True,
+                    AddToMru=False, CorruptLoad=0
+                )
+            else:
+                workbook = excel.Workbooks.Open(input_path)
+        
+        options = options or {}
+        selected = [workbook.Worksheets(s) for s in options.get('sheets', [])]
+        if selected:
+            # 先显示选中的工作表，再隐藏其余的（工作簿至少要有一个可见工作表）
+            names = {sheet.Name for sheet in selected}
+            for sheet in selected:
+                sheet.Visible = True
+            for sheet in workbook.Worksheets:
+                if sheet.Name not in names:
+                    sheet.Visible = XL_SHEET_HIDDEN
+        
+        if options.get('print_area'):
+            # 未选择工作表时作用于第一个可见的工作表
+            targets = selected or [next(s for s in workbook.Worksheets if s.Visible == XL_SHEET_VISIBLE)]
+            for sheet in targets:
+                sheet.PageSetup.PrintArea = options['print_area']
         
         # 导出为PDF (xlTypePDF = 0, WPS也使用相同的值)
+        # 修改只在内存中生效，关闭时不保存
         logger.info(f"导出PDF: {output_path}")
-        workbook.ExportAsFixedFormat(0, output_path)
+        pages = options.get('pages')
+        page_range = {'From': pages[0][0], 'To': pages[0][1]} if pages else {}
+        with com_phase('export', timings):
+            try:
+                workbook.ExportAsFixedFormat(
+                    XL_TYPE_PDF, output_path,
+                    Quality=XL_QUALITY_MINIMUM if profile['minimum_size'] else XL_QUALITY_STANDARD,
+                    IncludeDocProperties=profile['doc_props'], IgnorePrintAreas=False, OpenAfterPublish=False,
+                    **page_range
+                )
+            except Exception as e:
+                logger.warning(f"按导出配置导出失败，使用默认设置: {str(e)}")
+                workbook.ExportAsFixedFormat(XL_TYPE_PDF, output_path, **page_range)
         
         logger.info(f"{progid} 转换成功")
         return True
@@ -154,10 +359,11 @@ def convert_excel_to_pdf(input_path: str, output_path: str) -> bool:
         
     finally:
         try:
-            if workbook:
-                workbook.Close(SaveChanges=False)
-            if excel:
-                excel.Quit()
+            with com_phase('close', timings):
+                if workbook:
+                    workbook.Close(SaveChanges=False)
+                if excel:
+                    excel.Quit()
         except:
             pass
         pythoncom.CoUninitialize()
@@ -179,8 +385,8 @@ def get_powerpoint_application():
     raise Exception("未找到可用的PowerPoint/WPS演示应用")
 
 
-def convert_powerpoint_to_pdf(input_path: str, output_path: str) -> bool:
-    """使用PowerPoint或WPS演示COM转换为PDF"""
+def convert_powerpoint_to_pdf(input_path: str, output_path: str, options: dict = None, timings: dict = None) -> bool:
+    """使用PowerPoint或WPS演示COM转换为PDF（options['pages'] 为要保留的幻灯片范围，options['profile'] 为导出配置）"""
     powerpoint = None
     presentation = None
     progid = None
@@ -188,14 +394,39 @@ def convert_powerpoint_to_pdf(input_path: str, output_path: str) -> bool:
     try:
         pythoncom.CoInitialize()
         
-        powerpoint, progid = get_powerpoint_application()
+        with com_phase('dispatch', timings) as span:
+            powerpoint, progid = get_powerpoint_application()
+            span.set(progid=progid)
+        profile = export_profile(options)
         
         logger.info(f"使用 {progid} 打开文档: {input_path}")
-        presentation = powerpoint.Presentations.Open(input_path, WithWindow=False)
+        with com_phase('open', timings):
+            # 只读打开时仍可在内存中删除幻灯片（关闭时不保存）
+            presentation = powerpoint.Presentations.Open(input_path, ReadOnly=profile['read_only'], WithWindow=False)
+        
+        # 只导出选中的幻灯片：从后往前删除其余幻灯片（不保存原文件）
+        pages = (options or {}).get('pages')
+        if pages:
+            for index in range(presentation.Slides.Count, 0, -1):
+                if not any(start <= index <= end for start, end in pages):
+                    presentation.Slides(index).Delete()
+            if presentation.Slides.Count == 0:
+                raise Exception("选择的幻灯片范围超出了演示文稿的页数")
         
-        # 导出为PDF (ppSaveAsPDF = 32, WPS也使用相同的值)
+        # 导出为PDF (ppFixedFormatTypePDF = 2；退回时用 ppSaveAsPDF = 32, WPS也使用相同的值)
         logger.info(f"导出PDF: {output_path}")
-        presentation.SaveAs(output_path, 32)
+        with com_phase('export', timings):
+            try:
+                presentation.ExportAsFixedFormat(
+                    output_path, PP_FIXED_FORMAT_TYPE_PDF,
+                    Intent=PP_FIXED_FORMAT_INTENT_SCREEN if profile['minimum_size'] else PP_FIXED_FORMAT_INTENT_PRINT,
+                    PrintHiddenSlides=False,
+                    IncludeDocProperties=profile['doc_props'],
+                    DocStructureTags=profile['structure_tags']
+                )
+            except Exception as e:
+                logger.warning(f"按导出配置导出失败，使用默认设置: {str(e)}")
+                presentation.SaveAs(output_path, PP_SAVE_AS_PDF)
         
         logger.info(f"{progid} 转换成功")
         return True
@@ -206,10 +437,11 @@ def convert_powerpoint_to_pdf(input_path: str, output_path: str) -> bool:
         
     finally:
         try:
-            if presentation:
-                presentation.Close()
-            if powerpoint:
-                powerpoint.Quit()
+            with com_phase('close', timings):
+                if presentation:
+                    presentation.Close()
+                if powerpoint:
+                    powerpoint.Quit()
         except:
             pass
         pythoncom.CoUninitialize()
@@ -271,9 +503,46 @@ def health_check():
         'service': 'windows-office-converter',
         'version': '1.1.0',
         'available_apps': available_apps,
-        'supported_extensions': SUPPORTED_EXTENSIONS
+        'supported_extensions': SUPPORTED_EXTENSIONS,
+        'export_profiles': list(EXPORT_PROFILES),
+        'default_export_profile': DEFAULT_EXPORT_PROFILE,
+        'temp': reaper.stats(),
+        'threads': threading.active_count()
     })
 
+@app.before_request
+def start_background_threads():
+    continuous_profiler.ensure_started()
+    reaper.ensure_started()
+
+
+@app.after_request
+def advertise_request_encodings(response):
+    # 告诉调用方可以压缩请求体
+    if COMPRESSION_ENCODINGS:
+        response.headers['Accept-Encoding'] = ', '.join(COMPRESSION_ENCODINGS)
+    return response
+
+
+@app.route('/debug/profile', methods=['GET'])
+def debug_profile():
+    """采样本进程所有线程 seconds 秒，返回折叠栈（可直接生成火焰图）"""
+    if not token_matches(DEBUG_TOKEN, request.headers.get('X-Debug-Token')):
+        return jsonify({'error': 'forbidden'}), 403
+    try:
+        seconds = float(request.args.get('seconds', '10'))
+    except ValueError:
+        return jsonify({'error': 'seconds 必须是数字'}), 400
+    try:
+        collapsed = profiler.profile(seconds)
+    except ProfilerBusy as e:
+        return jsonify({'error': str(e)}), 409
+    return collapsed, 200, {
+        'Content-Type': 'text/plain; charset=utf-8',
+        'Content-Disposition': f'attachment; filename=windows-profile-{os.getpid()}.folded',
+    }
+
+
 @app.route('/convert', methods=['POST'])
 def convert_document():
     """
@@ -282,16 +551,78 @@ def convert_document():
     请求:
         - 文件作为 multipart/form-data 上传
         - 字段名: 'document'
+        - 可选字段: 'pages'、'sheets'、'print_area'（部分转换）
+        - 可选字段: 'profile'（导出配置: standard / fast_print，默认 EXPORT_PROFILE）
+        - 可选请求头: traceparent（调用方的trace，本服务的span挂在其下）
+        - 可选请求头: X-Request-Timeout（调用方愿意等待的秒数，上传完已超时则不再转换）
     
     响应:
         - 成功: PDF文件 (application/pdf)
         - 失败: JSON错误信息
+        - 响应头 X-Trace-Id
+        - 成功时响应头 X-Export-Profile（使用的导出配置）和 Server-Timing（COM 各阶段耗时）
     """
-    # 检查文件
-    if 'document' not in request.files:
+    with tracer.span('windows.convert', parent=tracer.extract(request.headers)) as span:
+        response = app.make_response(_convert_document())
+        span.set(status_code=response.status_code)
+    response.headers[TRACE_ID_HEADER] = span.trace_id
+    return response
+
+
+def request_expired(started_at: float) -> bool:
+    """调用方为本次请求留出的时间（X-Request-Timeout 秒）是否已经用完"""
+    try:
+        budget = float(request.headers.get('X-Request-Timeout', ''))
+    except ValueError:
+        return False
+    return time.time() - started_at >= budget
+
+
+def delete_after_sending(response, *paths):
+    """
+    响应发送完（或调用方中途断开）、PDF文件句柄关闭后再删除 paths
+
+    send_file 的响应默认直接交给服务器的 wsgi.file_wrapper，不会调用 call_on_close
+    注册的函数；关闭直通后由 Werkzeug 迭代文件并在结束时调用。Content-Length 不变，
+    持久连接不受影响。
+    """
+    response.direct_passthrough = False
+    response.call_on_close(lambda: reaper.discard(*paths))
+    return response
+
+
+def compressed_pdf(output_path: Path, compressed_path: Path, download_name: str, encoding: str):
+    """
+    返回压缩后的PDF（Content-Encoding）
+
+    先压缩到文件再发送：带 Content-Length 的响应之后连接可以复用，
+    长度未知的分块响应发送完后服务器会关闭连接。
+    """
+    with tracer.span('response.compress', encoding=encoding) as span:
+        size = compress_file(str(output_path), str(compressed_path), encoding)
+        span.set(pdf_bytes=output_path.stat().st_size, compressed_bytes=size)
+    response = send_file(
+        str(compressed_path),
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=download_name,
+        conditional=False,
+        etag=False
+    )
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def _convert_document():
+    started_at = time.time()
+    # 检查文件（首次访问 request.files 时解析并落盘 multipart 请求体）
+    with tracer.span('upload.parse'):
+        files = request.files
+    if 'document' not in files:
         return jsonify({'error': '没有文件上传'}), 400
     
-    file = request.files['document']
+    file = files['document']
     
     if file.filename == '':
         return jsonify({'error': '文件名为空'}), 400
@@ -306,25 +637,40 @@ def convert_document():
             'supported': SUPPORTED_EXTENSIONS
         }), 400
     
+    # 部分转换参数（不支持时返回422，调用方会降级到LibreOffice）
+    try:
+        options = parse_export_options(request.form, file_ext)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 422
+    
     # 生成临时文件路径
     timestamp = int(time.time() * 1000)
     input_path = TEMP_DIR / f"input_{timestamp}{file_ext}"
     output_path = TEMP_DIR / f"output_{timestamp}.pdf"
+    compressed_path = TEMP_DIR / f"output_{timestamp}.pdf.compressed"
+    response = None
     
     try:
         # 保存上传的文件
         logger.info(f"接收文件: {filename} ({file_ext})")
-        file.save(str(input_path))
+        with tracer.span('upload.save'):
+            file.save(str(input_path))
+        
+        # 上传太慢、调用方已经放弃等待：COM 转换无法中途停止，干脆不启动
+        if request_expired(started_at):
+            logger.warning(f"请求已超过调用方的等待时间，跳过转换: {filename}")
+            return jsonify({'error': '请求已超时，未转换'}), 504
         
         # 根据文件类型选择转换方法
         success = False
+        timings = {}
         
         if file_ext in WORD_EXTENSIONS:
-            success = convert_word_to_pdf(str(input_path), str(output_path))
+            success = convert_word_to_pdf(str(input_path), str(output_path), options, timings)
         elif file_ext in EXCEL_EXTENSIONS:
-            success = convert_excel_to_pdf(str(input_path), str(output_path))
+            success = convert_excel_to_pdf(str(input_path), str(output_path), options, timings)
         elif file_ext in POWERPOINT_EXTENSIONS:
-            success = convert_powerpoint_to_pdf(str(input_path), str(output_path))
+            success = convert_powerpoint_to_pdf(str(input_path), str(output_path), options, timings)
         
         if not success:
             return jsonify({'error': '转换失败'}), 500
@@ -332,43 +678,60 @@ def convert_document():
         if not output_path.exists():
             return jsonify({'error': 'PDF文件未生成'}), 500
         
-        # 返回PDF文件
-        return send_file(
-            str(output_path),
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f"{Path(filename).stem}.pdf"
+        # 返回PDF文件（调用方接受压缩且PDF压缩率足够时压缩）
+        download_name = f"{Path(filename).stem}.pdf"
+        encoding = negotiate(request.headers.get('Accept-Encoding'), COMPRESSION_ENCODINGS)
+        if encoding and worth_compressing(str(output_path), COMPRESSION_MIN_SIZE, encoding):
+            response = compressed_pdf(output_path, compressed_path, download_name, encoding)
+        else:
+            response = send_file(
+                str(output_path),
+                mimetype='application/pdf',
+                as_attachment=True,
+                download_name=download_name
+            )
+        response.headers['X-Export-Profile'] = options['profile']
+        response.headers['Server-Timing'] = ', '.join(
+            f"{name};dur={seconds * 1000:.0f}" for name, seconds in timings.items()
         )
+        return response
         
     except Exception as e:
         logger.error(f"转换异常: {str(e)}", exc_info=True)
         return jsonify({'error': f'服务器错误: {str(e)}'}), 500
         
     finally:
-        # 清理临时文件（延迟删除，确保响应完成）
-        def cleanup():
-            time.sleep(5)
-            try:
-                if input_path.exists():
-                    os.remove(input_path)
-                if output_path.exists():
-                    os.remove(output_path)
-            except:
-                pass
-        
-        import threading
-        threading.Thread(target=cleanup, daemon=True).start()
+        # 输入文件转换完即可删除；PDF 在响应发送完（或调用方断开）关闭文件后删除
+        reaper.discard(input_path)
+        if response is not None:
+            delete_after_sending(response, output_path, compressed_path)
+        else:
+            reaper.discard(output_path, compressed_path)
 
 if __name__ == '__main__':
     logger.info("=" * 60)
     logger.info("Windows Office 转换服务启动")
     logger.info("监听端口: 8080")
     logger.info("临时目录: " + str(TEMP_DIR))
+    logger.info(f"传输压缩: {', '.join(COMPRESSION_ENCODINGS) or '关闭'}")
+    logger.info(f"默认导出配置: {DEFAULT_EXPORT_PROFILE}")
     logger.info("=" * 60)
+    reaper.ensure_started()
     
-    app.run(
-        host='0.0.0.0',
-        port=8080,
-        debug=False,
-        threaded=True
-    )
+    try:
+        # waitress 支持 HTTP/1.1 持久连接，调用方（WINDOWS_KEEPALIVE）可以在一个连接上
+        # 依次发送多个转换请求；Flask 自带的开发服务器每个响应后都会关闭连接
+        from waitress import serve
+    except ImportError:
+        serve = None
+    
+    if serve is not None:
+        logger.info("使用 waitress（支持持久连接）")
+        serve(app, host='0.0.0.0', port=8080, threads=int(os.getenv('THREADS', '8')))
+    else:
+        app.run(
+            host='0.0.0.0',
+            port=8080,
+            debug=False,
+            threaded=True
+        )
@@ -0,0 +1,163 @@
+"""
+到 Windows 转换服务的传输层
+
+原先每次转换新建一个 requests 会话（新的TCP连接），以未压缩的 multipart 上传文档、
+未压缩地下载PDF。这里集中管理：
+
+- 压缩协商（http_compression.py）：请求带 Accept-Encoding 接收压缩的PDF；
+  Windows服务在响应头 Accept-Encoding 中声明支持请求压缩后，之后的上传整体压缩
+- 持久连接（WINDOWS_KEEPALIVE）：空闲的会话放回池中，后续转换复用已建立的连接；
+  每个会话同时只处理一个请求，取消时中止的只是该请求自己的连接
+- 按方向统计线上字节数和原始字节数（windows_transfer_*_bytes_total）
+- 按导出配置统计Windows服务返回的 COM 各阶段耗时（Server-Timing）和PDF大小
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+
+from cancellation import AbortableSession
+from http_compression import MultipartBody, compress_chunks, parse_accept_encoding, worth_compressing
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def parse_server_timing(header: str) -> dict:
+    """解析 Server-Timing 响应头，如 "open;dur=812, export;dur=2310" -> {'open': 0.812, 'export': 2.31}"""
+    timings = {}
+    for item in (header or '').split(','):
+        name, *params = [part.strip() for part in item.split(';')]
+        for param in params:
+            key, _, value = param.partition('=')
+            if name and key == 'dur':
+                try:
+                    timings[name] = float(value) / 1000
+                except ValueError:
+                    pass
+    return timings
+
+
+class CountingIterator:
+    """统计经过的字节数"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        chunk = next(self._chunks)
+        self.count += len(chunk)
+        return chunk
+
+
+class WindowsTransport:
+    """
+    Args:
+        encodings: 本端支持的压缩格式（按优先级），为空时不压缩
+        min_size: 小于该字节数的文档不压缩
+        keepalive: 复用连接
+        pool_size: 最多保留的空闲会话数
+    """
+
+    def __init__(self, encodings: list, min_size: int = 64 * 1024, keepalive: bool = False, pool_size: int = 4):
+        self.encodings = list(encodings)
+        self.min_size = min_size
+        self.keepalive = keepalive
+        self.pool_size = pool_size
+        # Windows服务声明支持的请求压缩格式（从响应头得知，之前未知）
+        self.request_encodings = []
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @property
+    def accept_encoding(self) -> str:
+        return ', '.join(self.encodings) or 'identity'
+
+    def learn(self, headers):
+        """记录Windows服务在响应头 Accept-Encoding 中声明的请求压缩格式"""
+        advertised = parse_accept_encoding(headers.get('Accept-Encoding'))
+        encodings = [encoding for encoding in self.encodings if encoding in advertised]
+        if encodings != self.request_encodings:
+            logger.info(f"Windows服务接受的请求压缩格式: {encodings or '无'}")
+            self.request_encodings = encodings
+
+    def request_encoding(self, input_path) -> str:
+        """本次上传使用的压缩格式（对方不支持、文件太小或压缩率不够时为None）"""
+        if not self.request_encodings:
+            return None
+        encoding = self.request_encodings[0]
+        return encoding if worth_compressing(str(input_path), self.min_size, encoding) else None
+
+    def upload_body(self, input_path, fields: dict, encoding: str):
+        """
+        压缩的 multipart 请求体
+
+        Returns:
+            tuple: (字节块迭代器（统计线上字节数）, 请求头)
+        """
+        body = MultipartBody('document', str(input_path), input_path.name, fields)
+        chunks = CountingIterator(compress_chunks(body.chunks(), encoding))
+        return chunks, {'Content-Type': body.content_type, 'Content-Encoding': encoding}
+
+    def record(self, direction: str, wire_bytes: int, payload_bytes: int, encoding: str = None):
+        """统计线上字节数（压缩后）和原始字节数"""
+        metrics.inc('windows_transfer_bytes_total', wire_bytes, direction=direction, encoding=encoding or 'identity')
+        metrics.inc('windows_transfer_payload_bytes_total', payload_bytes, direction=direction)
+
+    def record_export(self, headers, ext: str, pdf_bytes: int) -> tuple:
+        """
+        记录Windows服务使用的导出配置、COM 各阶段耗时和PDF大小（按配置对比）
+
+        Returns:
+            tuple: (导出配置, {阶段: 秒})
+        """
+        profile = headers.get('X-Export-Profile') or 'unknown'
+        timings = parse_server_timing(headers.get('Server-Timing'))
+        for phase, seconds in timings.items():
+            metrics.observe('windows_export_seconds', seconds, profile=profile, ext=ext, phase=phase)
+        metrics.observe('windows_pdf_bytes', pdf_bytes, profile=profile, ext=ext)
+        return profile, timings
+
+    @contextmanager
+    def session(self):
+        """
+        取出一个会话（持久连接模式下复用空闲会话），with 块结束后放回
+
+        被中止（abort）的会话连接已关闭，不再放回。
+        """
+        session = None
+        if self.keepalive:
+            with self._lock:
+                while self._idle and session is None:
+                    candidate = self._idle.pop()
+                    if candidate.aborted:
+                        candidate.close()
+                    else:
+                        session = candidate
+        reused = session is not None
+        if session is None:
+            session = AbortableSession()
+        metrics.inc('windows_sessions_total', reused=str(reused).lower())
+        try:
+            yield session
+        finally:
+            self._release(session)
+
+    def _release(self, session: AbortableSession):
+        if self.keepalive and not session.aborted:
+            with self._lock:
+                if len(self._idle) < self.pool_size:
+                    self._idle.append(session)
+                    return
+        session.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for session in idle:
+            session.close()
+